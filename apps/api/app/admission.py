@@ -0,0 +1,207 @@
+"""Admission control: shed load with 429 before the database and renderers degrade.
+
+Requests are classed by method. Reads (GET/HEAD) are cheap, so they get a
+generous in-flight cap and are never queued. Writes render XML, allocate
+sequences and hold a database connection for the whole request, so only a
+few run at once. Further writes wait in a short FIFO queue, and a write is
+refused outright when the queue is full, when it waited too long, or when
+the database pool is nearly exhausted, which keeps connections free for
+reads. Refused requests get 429 with a Retry-After estimated from the
+recent write service time.
+
+Long polls (GET /events with `wait`) and profile captures are reads that
+hold their slot for seconds, so they get their own cap and cannot starve
+ordinary reads. Health checks and the long-lived event stream bypass
+admission.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Deque, Optional
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+from . import database
+from .config import settings
+
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+EXEMPT_PATHS = frozenset({"/healthz", "/events/stream"})
+LONG_POLL_PATHS = frozenset({"/admin/profile"})
+
+
+def pool_saturation(engine) -> float:
+    """Share of the engine's connection pool in use; 0 for pools without a fixed capacity"""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout") or not hasattr(pool, "size"):
+        return 0.0
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    if max_overflow < 0:
+        return 0.0
+    return pool.checkedout() / max(pool.size() + max_overflow, 1)
+
+
+def database_pressure() -> float:
+    """Highest pool saturation across the directory database and every shard engine in use"""
+    from .sharding import get_shard_router  # sharding imports this module
+    return max(pool_saturation(engine) for engine in (database.engine, *get_shard_router().engines))
+
+
+def is_long_poll(scope) -> bool:
+    if scope["path"] in LONG_POLL_PATHS:
+        return True
+    if scope["path"] != "/events":
+        return False
+    wait = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("wait", ["0"])[-1]
+    return wait not in ("", "0")
+
+
+class AdmissionController:
+    def __init__(self, max_reads: int, max_writes: int, max_queued_writes: int, queue_timeout: float,
+                 pool_threshold: float = 1.0, pressure: Callable[[], float] = lambda: 0.0,
+                 clock: Callable[[], float] = time.monotonic, max_long_polls: int = 64):
+        self.max_reads = max_reads
+        self.max_long_polls = max_long_polls
+        self.max_writes = max_writes
+        self.max_queued_writes = max_queued_writes
+        self.queue_timeout = queue_timeout
+        self.pool_threshold = pool_threshold
+        self.pressure = pressure
+        self.clock = clock
+        self.reads = 0
+        self.long_polls = 0
+        self.writes = 0
+        self.write_seconds = 0.1  # Moving average of a write's service time
+        self.shed_reads = 0
+        self.shed_writes = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued_writes(self) -> int:
+        return len(self._waiters)
+
+    def try_read(self) -> bool:
+        if self.reads >= self.max_reads:
+            self.shed_reads += 1
+            return False
+        self.reads += 1
+        return True
+
+    def release_read(self) -> None:
+        self.reads -= 1
+
+    def try_long_poll(self) -> bool:
+        if self.long_polls >= self.max_long_polls:
+            self.shed_reads += 1
+            return False
+        self.long_polls += 1
+        return True
+
+    def release_long_poll(self) -> None:
+        self.long_polls -= 1
+
+    async def acquire_write(self) -> bool:
+        """Take a write slot, waiting in line if needed; False when the write should be shed"""
+        if self.pressure() >= self.pool_threshold:
+            self.shed_writes += 1
+            return False
+        if self.writes < self.max_writes and not self._waiters:
+            self.writes += 1
+            return True
+        if len(self._waiters) >= self.max_queued_writes:
+            self.shed_writes += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # release_write hands its slot over by resolving the waiter
+            await asyncio.wait_for(waiter, self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.shed_writes += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release_write()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release_write(self, elapsed: Optional[float] = None) -> None:
+        if elapsed is not None:
+            self.write_seconds += 0.2 * (elapsed - self.write_seconds)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.writes -= 1
+
+    def retry_after(self) -> int:
+        """Seconds until the current write backlog should have drained"""
+        backlog = self.writes + len(self._waiters) + 1
+        return max(1, math.ceil(self.write_seconds * backlog / max(self.max_writes, 1)))
+
+
+@lru_cache
+def get_admission_controller() -> Optional[AdmissionController]:
+    if not settings.admission_enabled:
+        return None
+    return AdmissionController(
+        max_reads=settings.admission_max_inflight_reads,
+        max_writes=settings.admission_max_inflight_writes,
+        max_queued_writes=settings.admission_max_queued_writes,
+        queue_timeout=settings.admission_queue_timeout_seconds,
+        pool_threshold=settings.admission_db_pool_threshold,
+        pressure=database_pressure,
+        max_long_polls=settings.admission_max_long_polls,
+    )
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the process-wide AdmissionController"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        controller = get_admission_controller()
+        if scope["type"] != "http" or controller is None or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] in READ_METHODS:
+            if is_long_poll(scope):
+                acquire, release = controller.try_long_poll, controller.release_long_poll
+            else:
+                acquire, release = controller.try_read, controller.release_read
+            if not acquire():
+                await self._shed(controller, scope, receive, send)
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                release()
+            return
+
+        if not await controller.acquire_write():
+            await self._shed(controller, scope, receive, send)
+            return
+        start = controller.clock()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release_write(controller.clock() - start)
+
+    @staticmethod
+    async def _shed(controller: AdmissionController, scope, receive, send) -> None:
+        response = JSONResponse(
+            {"detail": "Server is busy, retry later"},
+            status_code=429,
+            headers={"Retry-After": str(controller.retry_after())},
+        )
+        await response(scope, receive, send)
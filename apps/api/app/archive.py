@@ -0,0 +1,150 @@
+"""Moves invoices past the retention window into compressed cold storage.
+
+Each batch is written to the blob store as gzip-compressed JSON lines, one
+object per tenant and issue month, and indexed in archived_invoices so an
+archived invoice can still be fetched by id. What the invoices contributed
+to the VAT rollups is kept in archived_vat_rollups, so rebuilding the
+rollups does not lose it.
+"""
+import argparse
+import gzip
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pydantic_core import to_json
+from sqlalchemy.orm import Session, selectinload
+
+from .config import settings
+from .invoice_cache import invalidate_on_commit
+from .models import ArchivedInvoice, Invoice, InvoiceSearch, InvoiceStatus, WebhookEvent
+from .replicas import mark_written
+from .reports import retain_archived_rollups
+
+# Invoices still waiting for a gateway outcome stay in the hot table
+NON_ARCHIVABLE_STATUSES = (InvoiceStatus.SUBMITTED,)
+
+# Records carry the resolved party data, not the party ids or the legacy inline columns
+_INVOICE_COLUMNS = tuple(
+    column.key for column in Invoice.__mapper__.column_attrs
+    if column.key not in ("supplier_id", "customer_id", "legacy_supplier_data", "legacy_customer_data")
+) + ("supplier_data", "customer_data")
+_EVENT_COLUMNS = tuple(column.key for column in WebhookEvent.__table__.columns)
+
+
+def archive_record(invoice: Invoice) -> dict:
+    record = {name: getattr(invoice, name) for name in _INVOICE_COLUMNS}
+    record["webhook_events"] = [
+        {name: getattr(event, name) for name in _EVENT_COLUMNS}
+        for event in invoice.webhook_events
+    ]
+    return record
+
+
+def archive_key(tenant_id: int, issue_date: datetime, first_id: int, last_id: int) -> str:
+    return (
+        f"archive/invoices/tenant={tenant_id}/{issue_date:%Y-%m}/"
+        f"invoices-{first_id}-{last_id}.jsonl.gz"
+    )
+
+
+def retention_cutoff(retention_days: Optional[int] = None) -> datetime:
+    days = settings.invoice_retention_days if retention_days is None else retention_days
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+def archive_invoices(db: Session, store, cutoff: datetime, batch_size: Optional[int] = None) -> int:
+    """Archive every invoice issued before `cutoff`, one committed batch at a time"""
+    batch_size = batch_size or settings.archive_batch_size
+    archived = 0
+
+    while True:
+        batch = db.query(Invoice).options(
+            selectinload(Invoice.webhook_events), selectinload(Invoice.supplier), selectinload(Invoice.customer)
+        ).filter(
+            Invoice.issue_date < cutoff,
+            Invoice.status.notin_(NON_ARCHIVABLE_STATUSES)
+        ).order_by(Invoice.id).limit(batch_size).all()
+        if not batch:
+            return archived
+
+        groups: Dict[Tuple[int, str], List[Invoice]] = defaultdict(list)
+        for invoice in batch:
+            groups[(invoice.tenant_id, f"{invoice.issue_date:%Y-%m}")].append(invoice)
+
+        for invoices in groups.values():
+            key = archive_key(invoices[0].tenant_id, invoices[0].issue_date, invoices[0].id, invoices[-1].id)
+            body = b"\n".join(to_json(archive_record(invoice)) for invoice in invoices)
+            # Written before the rows are deleted; a failed commit only leaves a
+            # duplicate object that the next run overwrites.
+            store.put(key, gzip.compress(body), content_type="application/gzip")
+            db.add_all(
+                ArchivedInvoice(
+                    id=invoice.id,
+                    tenant_id=invoice.tenant_id,
+                    issue_date=invoice.issue_date,
+                    object_key=key
+                )
+                for invoice in invoices
+            )
+
+        for invoice in batch:
+            retain_archived_rollups(db, invoice)
+
+        ids = [invoice.id for invoice in batch]
+        events = [event for invoice in batch for event in invoice.webhook_events]
+        db.query(WebhookEvent).filter(WebhookEvent.invoice_id.in_(ids)).delete(synchronize_session=False)
+        db.query(InvoiceSearch).filter(InvoiceSearch.id.in_(ids)).delete(synchronize_session=False)
+        db.query(Invoice).filter(Invoice.id.in_(ids)).delete(synchronize_session=False)
+        invalidate_on_commit(db, [(invoice.tenant_id, invoice.id) for invoice in batch])
+        mark_written(db, [invoice.tenant_id for invoice in batch])
+        # Detach the deleted rows so the commit does not try to refresh them
+        for instance in events + batch:
+            db.expunge(instance)
+        db.commit()
+        archived += len(batch)
+
+
+def load_archived_invoice(db: Session, store, tenant_id: int, invoice_id: int) -> Optional[dict]:
+    """Fetch an archived invoice record by id from cold storage"""
+    entry = db.query(ArchivedInvoice).filter(
+        ArchivedInvoice.id == invoice_id,
+        ArchivedInvoice.tenant_id == tenant_id
+    ).first()
+    if not entry:
+        return None
+
+    for line in gzip.decompress(store.get(entry.object_key)).splitlines():
+        record = json.loads(line)
+        if record["id"] == invoice_id:
+            return record
+    return None
+
+
+def main(argv=None):
+    from .partitioning import drop_empty_partitions, ensure_invoice_partitions
+    from .sharding import fan_out
+    from .storage import get_blob_store
+
+    parser = argparse.ArgumentParser(description="Archive invoices past the retention window")
+    parser.add_argument("--retention-days", type=int, default=settings.invoice_retention_days)
+    parser.add_argument("--batch-size", type=int, default=settings.archive_batch_size)
+    args = parser.parse_args(argv)
+
+    cutoff = retention_cutoff(args.retention_days)
+    store = get_blob_store()
+
+    def archive_database(db):
+        engine = db.get_bind()
+        ensure_invoice_partitions(engine)
+        archived = archive_invoices(db, store, cutoff, args.batch_size)
+        return archived, len(drop_empty_partitions(engine, cutoff.date()))
+
+    results = fan_out(archive_database).values()
+    print(f"Archived {sum(archived for archived, _ in results)} invoices issued before {cutoff:%Y-%m-%d}; "
+          f"dropped {sum(dropped for _, dropped in results)} partitions")
+
+
+if __name__ == "__main__":
+    main()
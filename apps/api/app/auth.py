@@ -1,33 +1,172 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+import hashlib
+import hmac
+import threading
+import time
 import uuid
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import event, or_
+from sqlalchemy.orm import Session, make_transient_to_detached
 from .database import get_db
-from .models import Tenant
+from .models import Tenant, ApiKey, TenantTokenVersion
 from .config import settings
+from .profiling import phase
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+API_KEY_PREFIX_LENGTH = 12  # "vat_" + 8 hex characters
+
+
+class TokenCache:
+    """Bounded LRU of verified JWT payloads keyed by token digest.
+
+    Entries are dropped once the token's own ``exp`` has passed, so a cached
+    payload is never served for longer than jwt.decode would accept it.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[bytes, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                return None
+            if payload["exp"] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, token: str, payload: dict) -> None:
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class TokenVersionCache:
+    """In-process copy of tenant_token_versions, reloaded every `ttl` seconds"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._versions: Dict[int, int] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def current(self, db: Session, tenant_id: int) -> int:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.refresh(db)
+        return self._versions.get(tenant_id, 0)
+
+    def refresh(self, db: Session) -> None:
+        rows = db.query(TenantTokenVersion.tenant_id, TenantTokenVersion.version).all()
+        with self._lock:
+            self._versions = dict(rows)
+            self._loaded_at = time.monotonic()
+
+    def set(self, tenant_id: int, version: int) -> None:
+        with self._lock:
+            self._versions[tenant_id] = version
+
+    def clear(self) -> None:
+        with self._lock:
+            self._versions = {}
+            self._loaded_at = None
+
+
+token_cache = TokenCache(settings.jwt_cache_size)
+token_versions = TokenVersionCache(settings.token_version_refresh_seconds)
+
 
 def create_api_key() -> str:
     """Generate a new API key with vat_ prefix"""
     return f"vat_{uuid.uuid4().hex}"
 
 
+def api_key_prefix(api_key: str) -> str:
+    return api_key[:API_KEY_PREFIX_LENGTH]
+
+
+def hash_api_key(api_key: str) -> str:
+    """Keyed HMAC-SHA256 digest of an API key.
+
+    API keys are high-entropy random tokens, so a fast keyed hash is enough
+    to protect them at rest; bcrypt would only add latency to every request.
+    """
+    return hmac.new(
+        settings.api_key_pepper.encode(), api_key.encode(), hashlib.sha256
+    ).hexdigest()
+
+
+def issue_api_key(db: Session, tenant: Tenant) -> str:
+    """Create and store a new key for the tenant, returning the plaintext once"""
+    api_key = create_api_key()
+    db.add(ApiKey(tenant_id=tenant.id, prefix=api_key_prefix(api_key), key_hash=hash_api_key(api_key)))
+    return api_key
+
+
+def rotate_api_key(db: Session, tenant: Tenant, overlap: timedelta) -> Tuple[str, datetime]:
+    """Issue a new key and let the tenant's current keys expire after `overlap`"""
+    expires_at = datetime.utcnow() + overlap
+    db.query(ApiKey).filter(
+        ApiKey.tenant_id == tenant.id,
+        or_(ApiKey.expires_at.is_(None), ApiKey.expires_at > expires_at)
+    ).update({ApiKey.expires_at: expires_at}, synchronize_session=False)
+    
+    return issue_api_key(db, tenant), expires_at
+
+
+def authenticate_api_key(db: Session, api_key: str) -> Optional[Tenant]:
+    """Resolve an active tenant from a hashed-at-rest API key"""
+    key_hash = hash_api_key(api_key)
+    candidates = db.query(ApiKey.key_hash, Tenant).join(Tenant).filter(
+        ApiKey.prefix == api_key_prefix(api_key),
+        or_(ApiKey.expires_at.is_(None), ApiKey.expires_at > datetime.utcnow()),
+        Tenant.is_active == True
+    ).all()
+    
+    for stored_hash, tenant in candidates:
+        if hmac.compare_digest(stored_hash, key_hash):
+            return tenant
+    return None
+
+
+# jose (which pulls in cryptography) and passlib are imported on first use,
+# not at import time; app.startup preloads jose before serving traffic.
+@lru_cache
+def password_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_context().verify(plain_password, hashed_password)
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_context().hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -38,9 +177,64 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def verify_token(token: str):
+def create_tenant_access_token(db: Session, tenant: Tenant, expires_delta: Optional[timedelta] = None):
+    """Issue a JWT carrying the claims needed to authenticate without a DB lookup"""
+    return create_access_token(
+        {
+            "sub": str(tenant.id),
+            "act": bool(tenant.is_active),
+            # From the database: a version cached before another process revoked would be accepted again
+            "kv": db.query(TenantTokenVersion.version).filter(TenantTokenVersion.tenant_id == tenant.id).scalar() or 0,
+        },
+        expires_delta or timedelta(minutes=settings.access_token_expire_minutes)
+    )
+
+
+def revoke_tenant_tokens(db: Session, tenant_id: int) -> int:
+    """Invalidate every JWT issued so far for the tenant by bumping its key version; caller commits"""
+    row = db.get(TenantTokenVersion, tenant_id)
+    if row is None:
+        row = TenantTokenVersion(tenant_id=tenant_id, version=0)
+        db.add(row)
+    row.version += 1
+    db.flush()
+    db.info.setdefault("revoked_token_versions", {})[tenant_id] = row.version
+    return row.version
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_revoked_token_versions(session):
+    for tenant_id, version in session.info.pop("revoked_token_versions", {}).items():
+        token_versions.set(tenant_id, version)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_revoked_token_versions(session):
+    session.info.pop("revoked_token_versions", None)
+
+
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if "exp" in payload:
+        token_cache.put(token, payload)
+    return payload
+
+
+def verify_token(token: str):
+    from jose import JWTError
+    try:
+        payload = decode_token(token)
         tenant_id = payload.get("sub")
         if tenant_id is None:
             raise HTTPException(
@@ -57,22 +251,43 @@ def verify_token(token: str):
         )
 
 
+def tenant_from_token(db: Session, token: str) -> Optional[Tenant]:
+    payload = decode_token(token)
+    tenant_id = payload.get("sub")
+    if tenant_id is None:
+        return None
+    
+    if "kv" not in payload:
+        # Tokens without stateless claims still need the tenant row
+        return db.query(Tenant).filter(Tenant.id == tenant_id, Tenant.is_active == True).first()
+    
+    tenant_id = int(tenant_id)
+    if payload.get("act") is not True or payload["kv"] < token_versions.current(db, tenant_id):
+        return None
+    
+    # Attach an unloaded Tenant identity; columns are only fetched if a handler reads them
+    tenant = Tenant(id=tenant_id, is_active=True)
+    make_transient_to_detached(tenant)
+    return db.merge(tenant, load=False)
+
+
 def get_current_tenant(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> Tenant:
+    with phase("auth"):
+        return _authenticate(db, credentials)
+
+
+def _authenticate(db: Session, credentials: HTTPAuthorizationCredentials) -> Tenant:
     try:
-        tenant_id = verify_token(credentials.credentials)
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id, Tenant.is_active == True).first()
+        tenant = tenant_from_token(db, credentials.credentials)
         if tenant:
             return tenant
     except HTTPException:
         pass
     
-    tenant = db.query(Tenant).filter(
-        Tenant.api_key == credentials.credentials,
-        Tenant.is_active == True
-    ).first()
+    tenant = authenticate_api_key(db, credentials.credentials)
     
     if not tenant:
         raise HTTPException(
@@ -82,3 +297,11 @@ def get_current_tenant(
         )
     
     return tenant
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Operator endpoints; they do not exist unless settings.admin_token is set"""
+    if settings.admin_token is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), settings.admin_token.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token")
@@ -0,0 +1,116 @@
+"""Canonical form of an invoice's line items, built once and shared.
+
+Totals, validation and every XML generator read the same parsed lines:
+amounts are Decimals, rates are normalized strings, free text is already
+XML-escaped, and the tax subtotals per VAT category and rate are grouped
+in one pass. Amounts follow the rest of the API: line_total is the net
+line amount.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from .reports import normalize_rate
+
+# EN 16931 VAT category codes (UNTDID 5305) a line item may name in tax_category
+VAT_CATEGORIES = {"S", "Z", "E", "AE", "K", "G", "O", "L", "M"}
+REVERSE_CHARGE_REASON = "Reverse charge"
+
+
+@dataclass(slots=True)
+class CanonicalLine:
+    description: str  # XML-escaped
+    quantity: Decimal
+    unit_price: Decimal
+    tax_rate: Decimal
+    rate: str  # Normalized tax rate, e.g. "5.5"
+    tax_amount: Decimal
+    line_total: Decimal
+    category: str  # VAT category code, see vat_category
+    exemption_reason: Optional[str] = None  # XML-escaped
+
+
+@dataclass(slots=True)
+class TaxSubtotal:
+    rate: str
+    taxable_amount: Decimal
+    tax_amount: Decimal
+    category: str = "S"
+    exemption_reason: Optional[str] = None  # XML-escaped; required for E and AE
+
+
+@dataclass(slots=True)
+class CanonicalInvoice:
+    lines: List[CanonicalLine]
+    tax_subtotals: List[TaxSubtotal]  # One per category and rate, in order of first appearance
+    subtotal: Decimal
+    tax_total: Decimal
+
+    @property
+    def total(self) -> Decimal:
+        return self.subtotal + self.tax_total
+
+
+def is_reverse_charge(supplier_vat_id: Optional[str], customer_vat_id: Optional[str]) -> bool:
+    """A business customer registered for VAT in another country than the supplier accounts for the VAT"""
+    if not supplier_vat_id or not customer_vat_id:
+        return False
+    return supplier_vat_id[:2].upper() != customer_vat_id[:2].upper()
+
+
+def vat_category(tax_rate: Decimal, category: Optional[str] = None, exemption_reason: Optional[str] = None,
+                 reverse_charge: bool = False) -> str:
+    """The line's VAT category: as given, else S for a positive rate and Z, E or AE for a zero rate (BR-S-05)"""
+    if category:
+        return category.upper()
+    if tax_rate > 0:
+        return "S"
+    if reverse_charge:
+        return "AE"
+    return "E" if exemption_reason else "Z"
+
+
+def canonicalize(line_items: Iterable[Mapping], reverse_charge: bool = False) -> CanonicalInvoice:
+    """Parse stored or submitted line item dicts into a CanonicalInvoice
+
+    `reverse_charge` marks zero-rated lines without a category of their
+    own as AE, see is_reverse_charge.
+    """
+    lines = []
+    subtotals: Dict[Tuple[str, str], TaxSubtotal] = {}
+    subtotal = tax_total = Decimal("0")
+    for item in line_items:
+        tax_rate = Decimal(str(item["tax_rate"]))
+        reason = item.get("tax_exemption_reason")
+        category = vat_category(tax_rate, item.get("tax_category"), reason, reverse_charge)
+        if category == "AE" and not reason:
+            reason = REVERSE_CHARGE_REASON
+        line = CanonicalLine(
+            description=escape(item["description"]),
+            quantity=Decimal(str(item["quantity"])),
+            unit_price=Decimal(str(item["unit_price"])),
+            tax_rate=tax_rate,
+            rate=normalize_rate(tax_rate),
+            tax_amount=Decimal(str(item["tax_amount"])),
+            line_total=Decimal(str(item["line_total"])),
+            category=category,
+            exemption_reason=escape(reason) if reason else None,
+        )
+        lines.append(line)
+        group = subtotals.get((line.category, line.rate))
+        if group is None:
+            group = subtotals[line.category, line.rate] = TaxSubtotal(
+                line.rate, Decimal("0"), Decimal("0"), line.category, line.exemption_reason
+            )
+        group.taxable_amount += line.line_total
+        group.tax_amount += line.tax_amount
+        subtotal += line.line_total
+        tax_total += line.tax_amount
+    return CanonicalInvoice(lines, list(subtotals.values()), subtotal, tax_total)
+
+
+def canonicalize_invoice(invoice) -> CanonicalInvoice:
+    """canonicalize an Invoice or invoice snapshot, with reverse charge decided from its parties"""
+    supplier, customer = invoice.supplier_data or {}, invoice.customer_data or {}
+    return canonicalize(invoice.line_items, is_reverse_charge(supplier.get("vat_id"), customer.get("vat_id")))
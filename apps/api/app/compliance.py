@@ -1,11 +1,17 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from decimal import Decimal
 from datetime import datetime
+from xml.sax.saxutils import escape
 from .schemas import InvoiceValidateRequest, ValidationResult
 from .models import Invoice
+from .canonical import VAT_CATEGORIES, CanonicalInvoice, canonicalize, canonicalize_invoice, is_reverse_charge
+from .facturx import generate_cii_xml
+from .parties import party_fragment
+from .sequences import to_base36
+from .vat_ids import vat_id_format_errors
 
 
-def validate_invoice_data(data: InvoiceValidateRequest) -> ValidationResult:
+def validate_invoice_data(data: InvoiceValidateRequest, canonical: Optional[CanonicalInvoice] = None) -> ValidationResult:
     """Validate invoice data against business rules"""
     errors = []
     warnings = []
@@ -16,18 +22,35 @@ def validate_invoice_data(data: InvoiceValidateRequest) -> ValidationResult:
     if data.country_code.value in ["IT", "DE"] and not data.customer.vat_id:
         errors.append(f"Customer VAT ID is required for {data.country_code.value}")
     
+    # Format and checksum only; registry existence checks go through app.vat_ids
+    for party, vat_id in (("Supplier", data.supplier.vat_id), ("Customer", data.customer.vat_id)):
+        if vat_id:
+            warnings.extend(f"{party} VAT ID: {error}" for error in vat_id_format_errors(vat_id))
+    
     if not data.line_items:
         errors.append("At least one line item is required")
     
-    for i, item in enumerate(data.line_items):
-        if Decimal(item.unit_price) <= 0:
+    if canonical is None:
+        canonical = canonicalize(data.line_items, is_reverse_charge(data.supplier.vat_id, data.customer.vat_id))
+    
+    for i, item in enumerate(canonical.lines):
+        if item.unit_price <= 0:
             errors.append(f"Line item {i+1}: Unit price must be positive")
         
         if item.quantity <= 0:
             errors.append(f"Line item {i+1}: Quantity must be positive")
         
-        expected_tax = Decimal(item.unit_price) * Decimal(str(item.quantity)) * Decimal(str(item.tax_rate)) / 100
-        if abs(expected_tax - Decimal(item.tax_amount)) > Decimal("0.01"):
+        if item.category not in VAT_CATEGORIES:
+            errors.append(f"Line item {i+1}: Unknown VAT category {item.category}")
+        elif item.category == "S" and item.tax_rate <= 0:
+            errors.append(f"Line item {i+1}: Standard rated VAT needs a rate above zero")
+        elif item.category in ("Z", "E", "AE") and item.tax_rate != 0:
+            errors.append(f"Line item {i+1}: VAT category {item.category} needs a zero rate")
+        elif item.category == "E" and not item.exemption_reason:
+            errors.append(f"Line item {i+1}: VAT exempt lines need a tax_exemption_reason")
+        
+        expected_tax = item.unit_price * item.quantity * item.tax_rate / 100
+        if abs(expected_tax - item.tax_amount) > Decimal("0.01"):
             warnings.append(f"Line item {i+1}: Tax amount calculation may be incorrect")
     
     return ValidationResult(
@@ -37,115 +60,119 @@ def validate_invoice_data(data: InvoiceValidateRequest) -> ValidationResult:
     )
 
 
-def generate_ubl_xml(invoice: Invoice) -> str:
-    """Generate UBL 2.1 compliant XML for the invoice"""
-    
-    ubl_template = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
-         xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
-         xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
-    
-    <cbc:CustomizationID>urn:cen.eu:en16931:2017#compliant#urn:fdc:peppol.eu:2017:poacc:billing:3.0</cbc:CustomizationID>
-    <cbc:ProfileID>urn:fdc:peppol.eu:2017:poacc:billing:01:1.0</cbc:ProfileID>
-    <cbc:ID>{invoice.invoice_number}</cbc:ID>
-    <cbc:IssueDate>{invoice.issue_date.strftime('%Y-%m-%d')}</cbc:IssueDate>
-    <cbc:InvoiceTypeCode>380</cbc:InvoiceTypeCode>
-    <cbc:DocumentCurrencyCode>{invoice.currency}</cbc:DocumentCurrencyCode>
-    
-    <!-- Supplier Party -->
-    <cac:AccountingSupplierParty>
+def _ubl_party(tag: str, party: dict) -> str:
+    fragment = f"""<cac:{tag}>
         <cac:Party>
             <cac:PartyName>
-                <cbc:Name>{invoice.supplier_data['name']}</cbc:Name>
+                <cbc:Name>{escape(party['name'])}</cbc:Name>
             </cac:PartyName>
             <cac:PostalAddress>
-                <cbc:StreetName>{invoice.supplier_data['address']}</cbc:StreetName>
-                <cbc:CityName>{invoice.supplier_data['city']}</cbc:CityName>
-                <cbc:PostalZone>{invoice.supplier_data['postal_code']}</cbc:PostalZone>
+                <cbc:StreetName>{escape(party['address'])}</cbc:StreetName>
+                <cbc:CityName>{escape(party['city'])}</cbc:CityName>
+                <cbc:PostalZone>{escape(party['postal_code'])}</cbc:PostalZone>
                 <cac:Country>
-                    <cbc:IdentificationCode>{invoice.supplier_data['country']}</cbc:IdentificationCode>
-                </cac:Country>
-            </cac:PostalAddress>
-            <cac:PartyTaxScheme>
-                <cbc:CompanyID>{invoice.supplier_data['vat_id']}</cbc:CompanyID>
-                <cac:TaxScheme>
-                    <cbc:ID>VAT</cbc:ID>
-                </cac:TaxScheme>
-            </cac:PartyTaxScheme>
-        </cac:Party>
-    </cac:AccountingSupplierParty>
-    
-    <!-- Customer Party -->
-    <cac:AccountingCustomerParty>
-        <cac:Party>
-            <cac:PartyName>
-                <cbc:Name>{invoice.customer_data['name']}</cbc:Name>
-            </cac:PartyName>
-            <cac:PostalAddress>
-                <cbc:StreetName>{invoice.customer_data['address']}</cbc:StreetName>
-                <cbc:CityName>{invoice.customer_data['city']}</cbc:CityName>
-                <cbc:PostalZone>{invoice.customer_data['postal_code']}</cbc:PostalZone>
-                <cac:Country>
-                    <cbc:IdentificationCode>{invoice.customer_data['country']}</cbc:IdentificationCode>
+                    <cbc:IdentificationCode>{escape(party['country'])}</cbc:IdentificationCode>
                 </cac:Country>
             </cac:PostalAddress>"""
     
-    if invoice.customer_data.get('vat_id'):
-        ubl_template += f"""
+    if party.get('vat_id'):
+        fragment += f"""
             <cac:PartyTaxScheme>
-                <cbc:CompanyID>{invoice.customer_data['vat_id']}</cbc:CompanyID>
+                <cbc:CompanyID>{escape(party['vat_id'])}</cbc:CompanyID>
                 <cac:TaxScheme>
                     <cbc:ID>VAT</cbc:ID>
                 </cac:TaxScheme>
             </cac:PartyTaxScheme>"""
     
-    ubl_template += """
+    return fragment + f"""
         </cac:Party>
-    </cac:AccountingCustomerParty>
+    </cac:{tag}>"""
+
+
+def _ubl_exemption_reason(subtotal) -> str:
+    if not subtotal.exemption_reason:
+        return ""
+    return f"""
+                <cbc:TaxExemptionReason>{subtotal.exemption_reason}</cbc:TaxExemptionReason>"""
+
+
+def generate_ubl_xml(invoice: Invoice, canonical: Optional[CanonicalInvoice] = None) -> str:
+    """Generate UBL 2.1 compliant XML for the invoice"""
+    canonical = canonical or canonicalize_invoice(invoice)
+    currency = escape(invoice.currency, {'"': "&quot;"})
+    
+    ubl_template = f"""<?xml version="1.0" encoding="UTF-8"?>
+<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+         xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+         xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
+    
+    <cbc:CustomizationID>urn:cen.eu:en16931:2017#compliant#urn:fdc:peppol.eu:2017:poacc:billing:3.0</cbc:CustomizationID>
+    <cbc:ProfileID>urn:fdc:peppol.eu:2017:poacc:billing:01:1.0</cbc:ProfileID>
+    <cbc:ID>{escape(invoice.invoice_number)}</cbc:ID>
+    <cbc:IssueDate>{invoice.issue_date.strftime('%Y-%m-%d')}</cbc:IssueDate>
+    <cbc:InvoiceTypeCode>380</cbc:InvoiceTypeCode>
+    <cbc:DocumentCurrencyCode>{currency}</cbc:DocumentCurrencyCode>
+    
+    <!-- Supplier Party -->
+    {party_fragment(invoice, "supplier", "ubl:AccountingSupplierParty",
+                    lambda party: _ubl_party("AccountingSupplierParty", party))}
+    
+    <!-- Customer Party -->
+    {party_fragment(invoice, "customer", "ubl:AccountingCustomerParty",
+                    lambda party: _ubl_party("AccountingCustomerParty", party))}
     
     <!-- Invoice Lines -->"""
     
-    for i, item in enumerate(invoice.line_items, 1):
+    for i, item in enumerate(canonical.lines, 1):
         ubl_template += f"""
     <cac:InvoiceLine>
         <cbc:ID>{i}</cbc:ID>
-        <cbc:InvoicedQuantity unitCode="C62">{item['quantity']}</cbc:InvoicedQuantity>
-        <cbc:LineExtensionAmount currencyID="{invoice.currency}">{item['line_total']}</cbc:LineExtensionAmount>
+        <cbc:InvoicedQuantity unitCode="C62">{item.quantity}</cbc:InvoicedQuantity>
+        <cbc:LineExtensionAmount currencyID="{currency}">{item.line_total}</cbc:LineExtensionAmount>
         <cac:Item>
-            <cbc:Description>{item['description']}</cbc:Description>
+            <cbc:Description>{item.description}</cbc:Description>
+            <cac:ClassifiedTaxCategory>
+                <cbc:ID>{item.category}</cbc:ID>
+                <cbc:Percent>{item.rate}</cbc:Percent>
+                <cac:TaxScheme>
+                    <cbc:ID>VAT</cbc:ID>
+                </cac:TaxScheme>
+            </cac:ClassifiedTaxCategory>
         </cac:Item>
         <cac:Price>
-            <cbc:PriceAmount currencyID="{invoice.currency}">{item['unit_price']}</cbc:PriceAmount>
+            <cbc:PriceAmount currencyID="{currency}">{item.unit_price}</cbc:PriceAmount>
         </cac:Price>
-        <cac:TaxTotal>
-            <cbc:TaxAmount currencyID="{invoice.currency}">{item['tax_amount']}</cbc:TaxAmount>
-            <cac:TaxSubtotal>
-                <cbc:TaxableAmount currencyID="{invoice.currency}">{item['line_total']}</cbc:TaxableAmount>
-                <cbc:TaxAmount currencyID="{invoice.currency}">{item['tax_amount']}</cbc:TaxAmount>
-                <cac:TaxCategory>
-                    <cbc:ID>S</cbc:ID>
-                    <cbc:Percent>{item['tax_rate']}</cbc:Percent>
-                    <cac:TaxScheme>
-                        <cbc:ID>VAT</cbc:ID>
-                    </cac:TaxScheme>
-                </cac:TaxCategory>
-            </cac:TaxSubtotal>
-        </cac:TaxTotal>
     </cac:InvoiceLine>"""
     
     ubl_template += f"""
     
     <!-- Tax Total -->
     <cac:TaxTotal>
-        <cbc:TaxAmount currencyID="{invoice.currency}">{invoice.tax_amount}</cbc:TaxAmount>
+        <cbc:TaxAmount currencyID="{currency}">{invoice.tax_amount}</cbc:TaxAmount>"""
+    
+    for subtotal in canonical.tax_subtotals:
+        ubl_template += f"""
+        <cac:TaxSubtotal>
+            <cbc:TaxableAmount currencyID="{currency}">{subtotal.taxable_amount}</cbc:TaxableAmount>
+            <cbc:TaxAmount currencyID="{currency}">{subtotal.tax_amount}</cbc:TaxAmount>
+            <cac:TaxCategory>
+                <cbc:ID>{subtotal.category}</cbc:ID>
+                <cbc:Percent>{subtotal.rate}</cbc:Percent>{_ubl_exemption_reason(subtotal)}
+                <cac:TaxScheme>
+                    <cbc:ID>VAT</cbc:ID>
+                </cac:TaxScheme>
+            </cac:TaxCategory>
+        </cac:TaxSubtotal>"""
+    
+    ubl_template += f"""
     </cac:TaxTotal>
     
     <!-- Legal Monetary Total -->
     <cac:LegalMonetaryTotal>
-        <cbc:LineExtensionAmount currencyID="{invoice.currency}">{invoice.subtotal}</cbc:LineExtensionAmount>
-        <cbc:TaxExclusiveAmount currencyID="{invoice.currency}">{invoice.subtotal}</cbc:TaxExclusiveAmount>
-        <cbc:TaxInclusiveAmount currencyID="{invoice.currency}">{invoice.total_amount}</cbc:TaxInclusiveAmount>
-        <cbc:PayableAmount currencyID="{invoice.currency}">{invoice.total_amount}</cbc:PayableAmount>
+        <cbc:LineExtensionAmount currencyID="{currency}">{invoice.subtotal}</cbc:LineExtensionAmount>
+        <cbc:TaxExclusiveAmount currencyID="{currency}">{invoice.subtotal}</cbc:TaxExclusiveAmount>
+        <cbc:TaxInclusiveAmount currencyID="{currency}">{invoice.total_amount}</cbc:TaxInclusiveAmount>
+        <cbc:PayableAmount currencyID="{currency}">{invoice.total_amount}</cbc:PayableAmount>
     </cac:LegalMonetaryTotal>
     
 </Invoice>"""
@@ -153,94 +180,111 @@ def generate_ubl_xml(invoice: Invoice) -> str:
     return ubl_template
 
 
-def generate_country_specific_xml(invoice: Invoice) -> str:
+def generate_country_specific_xml(invoice: Invoice, canonical: Optional[CanonicalInvoice] = None) -> str:
     """Generate country-specific XML format (FatturaPA, XRechnung, etc.)"""
     
     if invoice.country_code.value == "IT":
-        return generate_fatturapa_xml(invoice)
+        return generate_fatturapa_xml(invoice, canonical)
     elif invoice.country_code.value == "DE":
-        return generate_xrechnung_xml(invoice)
+        return generate_xrechnung_xml(invoice, canonical)
     elif invoice.country_code.value == "FR":
-        return generate_facturx_xml(invoice)
+        return generate_facturx_xml(invoice, canonical)
     else:
-        return generate_ubl_xml(invoice)
+        return generate_ubl_xml(invoice, canonical)
 
 
-def generate_fatturapa_xml(invoice: Invoice) -> str:
-    """Generate FatturaPA XML for Italy"""
-    fatturapa_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<p:FatturaElettronica xmlns:ds="http://www.w3.org/2000/09/xmldsig#" 
-                      xmlns:p="http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2" 
-                      xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" 
-                      versione="FPR12">
-    <FatturaElettronicaHeader>
-        <DatiTrasmissione>
-            <IdTrasmittente>
-                <IdCodice>{invoice.supplier_data['vat_id']}</IdCodice>
-                <IdPaese>IT</IdPaese>
-            </IdTrasmittente>
-            <ProgressivoInvio>1</ProgressivoInvio>
-            <FormatoTrasmissione>FPR12</FormatoTrasmissione>
-            <CodiceDestinatario>0000000</CodiceDestinatario>
-        </DatiTrasmissione>
-        <CedentePrestatore>
+def _fatturapa_supplier(party: dict) -> str:
+    return f"""<CedentePrestatore>
             <DatiAnagrafici>
                 <IdFiscaleIVA>
                     <IdPaese>IT</IdPaese>
-                    <IdCodice>{invoice.supplier_data['vat_id']}</IdCodice>
+                    <IdCodice>{escape(party['vat_id'])}</IdCodice>
                 </IdFiscaleIVA>
                 <Anagrafica>
-                    <Denominazione>{invoice.supplier_data['name']}</Denominazione>
+                    <Denominazione>{escape(party['name'])}</Denominazione>
                 </Anagrafica>
             </DatiAnagrafici>
             <Sede>
-                <Indirizzo>{invoice.supplier_data['address']}</Indirizzo>
-                <CAP>{invoice.supplier_data['postal_code']}</CAP>
-                <Comune>{invoice.supplier_data['city']}</Comune>
+                <Indirizzo>{escape(party['address'])}</Indirizzo>
+                <CAP>{escape(party['postal_code'])}</CAP>
+                <Comune>{escape(party['city'])}</Comune>
                 <Nazione>IT</Nazione>
             </Sede>
-        </CedentePrestatore>
-        <CessionarioCommittente>
+        </CedentePrestatore>"""
+
+
+def _fatturapa_customer(party: dict) -> str:
+    return f"""<CessionarioCommittente>
             <DatiAnagrafici>
                 <IdFiscaleIVA>
-                    <IdPaese>{invoice.customer_data['country']}</IdPaese>
-                    <IdCodice>{invoice.customer_data.get('vat_id', 'N/A')}</IdCodice>
+                    <IdPaese>{escape(party['country'])}</IdPaese>
+                    <IdCodice>{escape(party.get('vat_id') or 'N/A')}</IdCodice>
                 </IdFiscaleIVA>
                 <Anagrafica>
-                    <Denominazione>{invoice.customer_data['name']}</Denominazione>
+                    <Denominazione>{escape(party['name'])}</Denominazione>
                 </Anagrafica>
             </DatiAnagrafici>
             <Sede>
-                <Indirizzo>{invoice.customer_data['address']}</Indirizzo>
-                <CAP>{invoice.customer_data['postal_code']}</CAP>
-                <Comune>{invoice.customer_data['city']}</Comune>
-                <Nazione>{invoice.customer_data['country']}</Nazione>
+                <Indirizzo>{escape(party['address'])}</Indirizzo>
+                <CAP>{escape(party['postal_code'])}</CAP>
+                <Comune>{escape(party['city'])}</Comune>
+                <Nazione>{escape(party['country'])}</Nazione>
             </Sede>
-        </CessionarioCommittente>
+        </CessionarioCommittente>"""
+
+
+def generate_fatturapa_xml(invoice: Invoice, canonical: Optional[CanonicalInvoice] = None) -> str:
+    """Generate FatturaPA XML for Italy"""
+    canonical = canonical or canonicalize_invoice(invoice)
+    fatturapa_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+<p:FatturaElettronica xmlns:ds="http://www.w3.org/2000/09/xmldsig#" 
+                      xmlns:p="http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2" 
+                      xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" 
+                      versione="FPR12">
+    <FatturaElettronicaHeader>
+        <DatiTrasmissione>
+            <IdTrasmittente>
+                <IdCodice>{escape(invoice.supplier_data['vat_id'])}</IdCodice>
+                <IdPaese>IT</IdPaese>
+            </IdTrasmittente>
+            <ProgressivoInvio>{to_base36(invoice.transmission_number or invoice.id)}</ProgressivoInvio>
+            <FormatoTrasmissione>FPR12</FormatoTrasmissione>
+            <CodiceDestinatario>0000000</CodiceDestinatario>
+        </DatiTrasmissione>
+        {party_fragment(invoice, "supplier", "fatturapa:CedentePrestatore", _fatturapa_supplier)}
+        {party_fragment(invoice, "customer", "fatturapa:CessionarioCommittente", _fatturapa_customer)}
     </FatturaElettronicaHeader>
     <FatturaElettronicaBody>
         <DatiGenerali>
             <DatiGeneraliDocumento>
                 <TipoDocumento>TD01</TipoDocumento>
-                <Divisa>{invoice.currency}</Divisa>
+                <Divisa>{escape(invoice.currency)}</Divisa>
                 <Data>{invoice.issue_date.strftime('%Y-%m-%d')}</Data>
-                <Numero>{invoice.invoice_number}</Numero>
+                <Numero>{escape(invoice.invoice_number)}</Numero>
                 <ImportoTotaleDocumento>{invoice.total_amount}</ImportoTotaleDocumento>
             </DatiGeneraliDocumento>
         </DatiGenerali>
         <DatiBeniServizi>"""
     
-    for i, item in enumerate(invoice.line_items, 1):
+    for i, item in enumerate(canonical.lines, 1):
         fatturapa_xml += f"""
             <DettaglioLinee>
                 <NumeroLinea>{i}</NumeroLinea>
-                <Descrizione>{item['description']}</Descrizione>
-                <Quantita>{item['quantity']}</Quantita>
-                <PrezzoUnitario>{item['unit_price']}</PrezzoUnitario>
-                <PrezzoTotale>{item['line_total']}</PrezzoTotale>
-                <AliquotaIVA>{item['tax_rate']}</AliquotaIVA>
+                <Descrizione>{item.description}</Descrizione>
+                <Quantita>{item.quantity}</Quantita>
+                <PrezzoUnitario>{item.unit_price}</PrezzoUnitario>
+                <PrezzoTotale>{item.line_total}</PrezzoTotale>
+                <AliquotaIVA>{item.tax_rate:.2f}</AliquotaIVA>
             </DettaglioLinee>"""
     
+    for subtotal in canonical.tax_subtotals:
+        fatturapa_xml += f"""
+            <DatiRiepilogo>
+                <AliquotaIVA>{Decimal(subtotal.rate):.2f}</AliquotaIVA>
+                <ImponibileImporto>{subtotal.taxable_amount}</ImponibileImporto>
+                <Imposta>{subtotal.tax_amount}</Imposta>
+            </DatiRiepilogo>"""
+    
     fatturapa_xml += """
         </DatiBeniServizi>
     </FatturaElettronicaBody>
@@ -249,15 +293,15 @@ def generate_fatturapa_xml(invoice: Invoice) -> str:
     return fatturapa_xml
 
 
-def generate_xrechnung_xml(invoice: Invoice) -> str:
+def generate_xrechnung_xml(invoice: Invoice, canonical: Optional[CanonicalInvoice] = None) -> str:
     """Generate XRechnung XML for Germany (based on UBL)"""
-    ubl_xml = generate_ubl_xml(invoice)
+    ubl_xml = generate_ubl_xml(invoice, canonical)
     return ubl_xml.replace(
         "urn:cen.eu:en16931:2017#compliant#urn:fdc:peppol.eu:2017:poacc:billing:3.0",
         "urn:cen.eu:en16931:2017#compliant#urn:xoev-de:kosit:standard:xrechnung_2.0"
     )
 
 
-def generate_facturx_xml(invoice: Invoice) -> str:
-    """Generate Factur-X XML for France"""
-    return generate_ubl_xml(invoice)
+def generate_facturx_xml(invoice: Invoice, canonical: Optional[CanonicalInvoice] = None) -> str:
+    """Generate Factur-X (CII) XML for France"""
+    return generate_cii_xml(invoice, canonical)
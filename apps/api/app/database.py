@@ -12,6 +12,16 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Optional read-only replica for safe GET endpoints; see app.replicas
+read_engine = None
+ReadSessionLocal = None
+if settings.read_replica_url:
+    read_engine = create_engine(
+        settings.read_replica_url,
+        connect_args={"check_same_thread": False} if settings.read_replica_url.startswith("sqlite") else {}
+    )
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
 
 
@@ -21,3 +31,15 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_replica_db():
+    """Replica session, or None when no replica is configured"""
+    if ReadSessionLocal is None:
+        yield None
+        return
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,216 @@
+"""Detecting invoices a tenant has already sent under another external_id.
+
+An invoice's fingerprint hashes what identifies the business document to a
+gateway: supplier VAT ID, invoice number, issue date and total. It is stored
+on the invoice under the (tenant_id, fingerprint) index. A new invoice whose
+fingerprint matches a live invoice (anything not failed or rejected, which
+may legitimately be sent again) is still accepted, but with duplicate_of
+pointing at the earlier one, so the client hears about it before the
+gateway rejects it.
+
+Nearly every invoice is new, so each process keeps a Bloom filter of every
+fingerprint per tenant and only probes the index when the filter says
+"maybe". A tenant's filter is loaded from the index on a background thread
+after its first invoice; checks probe the index until it is ready. Filters
+take this process's inserts straight away and pick up other processes'
+inserts every duplicate_filter_refresh_seconds. A duplicate sent to two
+processes within that window can get past the filter; the gateway still
+rejects it, as before. At a 1% false-positive rate a filter costs about
+1.2 bytes per invoice, so ten million invoices take some 12 MB per process.
+"""
+import argparse
+import hashlib
+import math
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Invoice, InvoiceStatus
+from .sharding import fan_out
+from .vat_ids import normalize_vat_id
+
+# A resubmission of these is a fresh attempt, not a duplicate
+_RESENDABLE_STATUSES = (InvoiceStatus.FAILED, InvoiceStatus.REJECTED)
+
+
+def invoice_fingerprint(supplier_vat_id: str, invoice_number: str, issue_date: datetime, total: Decimal) -> str:
+    parts = (
+        normalize_vat_id(supplier_vat_id),
+        invoice_number.strip().upper(),
+        issue_date.date().isoformat(),
+        str(Decimal(total).quantize(Decimal("0.01"))),
+    )
+    return hashlib.blake2b("\x1f".join(parts).encode(), digest_size=16).hexdigest()
+
+
+class BloomFilter:
+    """Set membership with no false negatives and about `error_rate` false positives up to `capacity` items"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, fingerprint: str) -> Iterable[int]:
+        # The fingerprint is already a uniform hash; its halves seed double hashing
+        h1, h2 = int(fingerprint[:16], 16), int(fingerprint[16:], 16) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, fingerprint: str) -> None:
+        for position in self._positions(fingerprint):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(fingerprint))
+
+
+@dataclass
+class _TenantFilter:
+    bloom: BloomFilter
+    last_id: int  # Highest invoice id loaded from the database
+    loaded_at: float
+
+
+class DuplicateDetector:
+    def __init__(self, error_rate: float, refresh_seconds: float, background: bool = True,
+                 clock: Callable[[], float] = time.monotonic):
+        self.error_rate = error_rate
+        self.refresh_seconds = refresh_seconds
+        self.background = background  # Load filters on a thread instead of in the request
+        self.clock = clock
+        self._filters: Dict[int, _TenantFilter] = {}
+        self._loading: Set[int] = set()
+        self._lock = threading.Lock()
+        self.probes = 0  # Index lookups, i.e. filter hits and checks made before the filter was loaded
+
+    def find(self, db: Session, tenant_id: int, fingerprint: str) -> Optional[int]:
+        """Id of a live invoice of the tenant with this fingerprint, or None"""
+        loaded = self._filter(db, tenant_id)
+        if loaded is not None and fingerprint not in loaded.bloom:
+            return None
+        self.probes += 1
+        return db.scalar(
+            select(Invoice.id).where(
+                Invoice.tenant_id == tenant_id,
+                Invoice.fingerprint == fingerprint,
+                Invoice.status.not_in(_RESENDABLE_STATUSES),
+            ).order_by(Invoice.id).limit(1)
+        )
+
+    def add(self, tenant_id: int, fingerprint: str) -> None:
+        """Record an invoice this process just committed"""
+        with self._lock:
+            loaded = self._filters.get(tenant_id)
+            if loaded is not None:
+                loaded.bloom.add(fingerprint)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._filters.clear()
+
+    def _filter(self, db: Session, tenant_id: int) -> Optional[_TenantFilter]:
+        loaded = self._filters.get(tenant_id)
+        if loaded is None or loaded.bloom.count >= loaded.bloom.capacity:
+            # First use, or the filter is full and its false-positive rate climbing.
+            # A full filter keeps answering until its replacement is ready.
+            self._start_load(db, tenant_id)
+            loaded = self._filters.get(tenant_id)
+            if loaded is None:
+                return None
+        if self.clock() - loaded.loaded_at >= self.refresh_seconds:
+            rows = db.execute(self._query(tenant_id).where(Invoice.id > loaded.last_id)).all()
+            with self._lock:
+                for invoice_id, fingerprint in rows:
+                    loaded.bloom.add(fingerprint)
+                    loaded.last_id = max(loaded.last_id, invoice_id)
+                loaded.loaded_at = self.clock()
+        return loaded
+
+    def _start_load(self, db: Session, tenant_id: int) -> None:
+        with self._lock:
+            if tenant_id in self._loading:
+                return
+            self._loading.add(tenant_id)
+        if self.background:
+            threading.Thread(target=self._load_on_thread, args=(db.get_bind(), tenant_id), daemon=True).start()
+        else:
+            self._load(db, tenant_id)
+
+    def _load_on_thread(self, bind, tenant_id: int) -> None:
+        with Session(bind=bind) as db:
+            self._load(db, tenant_id)
+
+    def _load(self, db: Session, tenant_id: int) -> None:
+        try:
+            rows = db.execute(self._query(tenant_id)).all()
+            bloom = BloomFilter(max(1024, 2 * len(rows)), self.error_rate)  # Room to double before reloading
+            for _, fingerprint in rows:
+                bloom.add(fingerprint)
+            loaded = _TenantFilter(bloom, max((invoice_id for invoice_id, _ in rows), default=0), self.clock())
+            with self._lock:
+                self._filters[tenant_id] = loaded
+        finally:
+            with self._lock:
+                self._loading.discard(tenant_id)
+
+    @staticmethod
+    def _query(tenant_id: int):
+        return select(Invoice.id, Invoice.fingerprint).where(
+            Invoice.tenant_id == tenant_id, Invoice.fingerprint.is_not(None)
+        )
+
+
+@lru_cache
+def get_duplicate_detector() -> DuplicateDetector:
+    return DuplicateDetector(
+        settings.duplicate_filter_error_rate,
+        settings.duplicate_filter_refresh_seconds,
+        background=settings.duplicate_filter_load_in_background,
+    )
+
+
+def backfill_fingerprints(db: Session, batch_size: int = 1000) -> int:
+    """Fingerprint invoices stored before fingerprints existed; returns how many were updated"""
+    updated = after = 0
+    while True:
+        invoices = db.scalars(
+            select(Invoice).where(Invoice.id > after, Invoice.fingerprint.is_(None))
+            .order_by(Invoice.id).limit(batch_size)
+        ).all()
+        if not invoices:
+            return updated
+        for invoice in invoices:
+            vat_id = (invoice.supplier_data or {}).get("vat_id")
+            if vat_id:  # Without a supplier VAT ID there is nothing to match on
+                invoice.fingerprint = invoice_fingerprint(
+                    vat_id, invoice.invoice_number, invoice.issue_date, Decimal(invoice.total_amount)
+                )
+                updated += 1
+        after = invoices[-1].id
+        db.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Duplicate invoice detection")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backfill = commands.add_parser("backfill", help="Fingerprint invoices created before detection existed")
+    backfill.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    for name, updated in fan_out(lambda db: backfill_fingerprints(db, args.batch_size)).items():
+        print(f"{name}: {updated} invoices fingerprinted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""Per-tenant invoice status change feed backed by the webhook_events outbox.
+
+Status changes are written as WebhookEvent rows in the same transaction as
+the invoice update. A single poller per process reads new outbox rows and
+fans them out to in-memory subscriber queues, so SSE and long-poll clients
+never hold a database connection while they wait. A subscriber whose queue
+fills up is marked as lagging and catches up from the outbox.
+
+Event ids are the cursor, but they are allocated when a row is inserted,
+not when it commits. A transaction that commits after a later one would
+leave a gap that a reader has already moved past. Readers therefore stop
+below a gap in the newest ids until it fills or has stayed open for
+change_feed_commit_grace_seconds, after which it is taken to be a rollback.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Invoice, InvoiceStatus, WebhookEvent
+from .schemas import EventResponse, WebhookPayload
+
+
+def status_event_values(tenant_id: int, invoice_id: int, external_id: str, status: InvoiceStatus,
+                        data: Optional[dict] = None) -> dict:
+    """Column values for an outbox event; bulk paths insert these directly"""
+    payload = WebhookPayload(
+        event_type=f"invoice.{status.value}",
+        invoice_id=invoice_id,
+        external_id=external_id,
+        status=status,
+        timestamp=datetime.now(timezone.utc),
+        data=data or {}
+    )
+    return {
+        "tenant_id": tenant_id,
+        "invoice_id": invoice_id,
+        "event_type": payload.event_type,
+        "payload": payload.model_dump(mode="json"),
+    }
+
+
+def record_status_change(db: Session, invoice: Invoice, data: Optional[dict] = None) -> WebhookEvent:
+    """Add an outbox event for the invoice's current status; caller commits"""
+    event = WebhookEvent(**status_event_values(
+        invoice.tenant_id, invoice.id, invoice.external_id, invoice.status, data
+    ))
+    db.add(event)
+    return event
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventHorizon:
+    """The highest event id readers may advance past without skipping a late commit
+
+    Looks at the newest `scan` ids only: transactions still in flight hold
+    recent ids. Each gap is timed from when this process first saw it.
+    """
+
+    def __init__(self, grace: Callable[[], float] = lambda: settings.change_feed_commit_grace_seconds,
+                 clock: Callable[[], float] = time.monotonic, scan: int = 500):
+        self.grace = grace
+        self.clock = clock
+        self.scan = scan
+        self._gaps: Dict[Tuple[object, int], float] = {}  # (bind, id before the gap) -> first seen
+        self._lock = threading.Lock()
+
+    def safe_id(self, db: Session) -> int:
+        ids = db.scalars(select(WebhookEvent.id).order_by(WebhookEvent.id.desc()).limit(self.scan)).all()[::-1]
+        if not ids:
+            return 0
+        bind, now, grace = db.get_bind(), self.clock(), self.grace()
+        safe = ids[0]
+        with self._lock:
+            for previous, current in zip(ids, ids[1:]):
+                if current != previous + 1 and now - self._gaps.setdefault((bind, previous), now) < grace:
+                    break
+                safe = current
+            for key in [key for key in self._gaps if key[0] is bind and key[1] < ids[0]]:
+                del self._gaps[key]
+        return safe
+
+
+event_horizon = EventHorizon()
+
+
+def fetch_events(db: Session, tenant_id: int, after: int, limit: int = 100) -> List[WebhookEvent]:
+    return db.query(WebhookEvent).filter(
+        WebhookEvent.tenant_id == tenant_id,
+        WebhookEvent.id > after,
+        WebhookEvent.id <= event_horizon.safe_id(db)
+    ).order_by(WebhookEvent.id).limit(limit).all()
+
+
+class Subscription(asyncio.Queue):
+    """A subscriber's queue of live events; `lagging` once an event was dropped because it was full"""
+
+    def __init__(self, maxsize: int = 1000):
+        super().__init__(maxsize)
+        self.lagging = False
+
+
+class ChangeFeed:
+    """Fans new outbox rows out to subscribers through one shared poller
+
+    The poller follows every database it was started on, so tenants on
+    different shards share it.
+    """
+
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._last_ids: Dict[object, int] = {}  # Per bind
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def ensure_started(self, bind) -> None:
+        loop = asyncio.get_running_loop()
+        running = self._task is not None and not self._task.done() and self._task.get_loop() is loop
+        if running and bind in self._last_ids:
+            return
+        if not running:
+            self._last_ids = {}
+        # Set the starting point before any subscriber backfills, so no event falls in between
+        db = Session(bind=bind)
+        try:
+            self._last_ids[bind] = event_horizon.safe_id(db)
+        finally:
+            db.close()
+        if not running:
+            self._wakeup = asyncio.Event()
+            # Started from inside a request; a fresh context keeps its trace out of the poller
+            self._task = loop.create_task(self._run(), context=contextvars.Context())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, RuntimeError):
+                pass
+            self._task = None
+
+    def notify(self) -> None:
+        """Poll now instead of waiting for the next interval, e.g. after a local commit"""
+        if self._wakeup is not None and self._task is not None and not self._task.done():
+            self._task.get_loop().call_soon_threadsafe(self._wakeup.set)
+
+    def subscribe(self, tenant_id: int) -> Subscription:
+        queue = Subscription()
+        self._subscribers.setdefault(tenant_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, tenant_id: int, queue: Subscription) -> None:
+        queues = self._subscribers.get(tenant_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[tenant_id]
+
+    def _fetch_new(self, bind, after: int) -> list:
+        db = Session(bind=bind)
+        try:
+            events = db.query(WebhookEvent).filter(
+                WebhookEvent.id > after,
+                WebhookEvent.id <= event_horizon.safe_id(db)
+            ).order_by(WebhookEvent.id).limit(1000).all()
+            return [(event.tenant_id, EventResponse.model_validate(event)) for event in events]
+        finally:
+            db.close()
+
+    def _fetch_missed(self, bind, tenant_id: int, after: int) -> List[EventResponse]:
+        db = Session(bind=bind)
+        try:
+            missed: List[EventResponse] = []
+            while True:
+                page = fetch_events(db, tenant_id, missed[-1].id if missed else after, 1000)
+                missed.extend(EventResponse.model_validate(event) for event in page)
+                if len(page) < 1000:
+                    return missed
+        finally:
+            db.close()
+
+    async def missed_events(self, bind, tenant_id: int, after: int) -> List[EventResponse]:
+        """The tenant's events after `after`, read from the outbox for a lagging subscriber"""
+        return await asyncio.to_thread(self._fetch_missed, bind, tenant_id, after)
+
+    async def poll_once(self) -> int:
+        delivered = 0
+        for bind, after in list(self._last_ids.items()):
+            responses = await asyncio.to_thread(self._fetch_new, bind, after)
+            for tenant_id, response in responses:
+                for queue in self._subscribers.get(tenant_id, ()):
+                    if queue.full():
+                        queue.lagging = True  # Catches up from the outbox; see sse_events
+                    else:
+                        queue.put_nowait(response)
+                self._last_ids[bind] = response.id
+            delivered += len(responses)
+        return delivered
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.poll_once()
+            except Exception:
+                logger.exception("Change feed poll failed; retrying on the next tick")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+change_feed = ChangeFeed(settings.change_feed_poll_interval_seconds)
+
+
+def format_sse(event: EventResponse) -> bytes:
+    return (
+        f"id: {event.id}\nevent: {event.event_type}\ndata: {event.model_dump_json()}\n\n"
+    ).encode()
+
+
+async def sse_events(feed: ChangeFeed, tenant_id: int, queue: Subscription,
+                     backlog: List[EventResponse], cursor: int, heartbeat: float, bind=None):
+    """Server-sent event stream: the backlog after `cursor`, then live events
+
+    When the queue overflowed, the events it dropped are read again from the
+    outbox on `bind`.
+    """
+    try:
+        for event in backlog:
+            cursor = event.id
+            yield format_sse(event)
+        while True:
+            if queue.lagging:
+                queue.lagging = False  # Before reading, so drops during the read flag it again
+                for event in await feed.missed_events(bind, tenant_id, cursor):
+                    cursor = event.id
+                    yield format_sse(event)
+                continue
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            if event.id <= cursor:
+                continue  # Already sent as part of the backlog
+            cursor = event.id
+            yield format_sse(event)
+    finally:
+        feed.unsubscribe(tenant_id, queue)
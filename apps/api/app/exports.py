@@ -0,0 +1,130 @@
+"""Bulk invoice exports streamed from the database into the blob store.
+
+Rows are read with a server-side cursor (stream_results + yield_per) and
+written line by line through a gzip-compressed CSV spool file, so memory
+stays bounded by the fetch size regardless of how many lines are exported.
+"""
+import csv
+import gzip
+import io
+import tempfile
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional, Sequence
+
+from sqlalchemy import JSON, func
+from sqlalchemy.orm import Session, aliased
+
+from .config import settings
+from .models import ExportJob, ExportStatus, Invoice, Party
+
+EXPORT_HEADER = (
+    "invoice_id", "external_id", "invoice_number", "status", "country_code",
+    "issue_date", "due_date", "currency",
+    "supplier_name", "supplier_vat_id", "customer_name", "customer_vat_id",
+    "invoice_subtotal", "invoice_tax_amount", "invoice_total",
+    "line_number", "description", "quantity", "unit_price", "tax_rate", "line_tax_amount", "line_total",
+)
+
+_Supplier = aliased(Party)
+_Customer = aliased(Party)
+
+_EXPORT_COLUMNS = (
+    Invoice.id, Invoice.external_id, Invoice.invoice_number, Invoice.status, Invoice.country_code,
+    Invoice.issue_date, Invoice.due_date, Invoice.currency,
+    func.coalesce(_Supplier.data, Invoice.legacy_supplier_data, type_=JSON),
+    func.coalesce(_Customer.data, Invoice.legacy_customer_data, type_=JSON),
+    Invoice.subtotal, Invoice.tax_amount, Invoice.total_amount,
+    Invoice.line_items,
+)
+
+
+def export_key(job: ExportJob) -> str:
+    return f"exports/tenant={job.tenant_id}/export-{job.id}.csv.gz"
+
+
+def stream_invoice_rows(db: Session, job: ExportJob, fetch_size: Optional[int] = None) -> Iterator[Sequence]:
+    query = db.query(*_EXPORT_COLUMNS).select_from(Invoice).outerjoin(
+        _Supplier, Invoice.supplier_id == _Supplier.id
+    ).outerjoin(
+        _Customer, Invoice.customer_id == _Customer.id
+    ).filter(Invoice.tenant_id == job.tenant_id)
+    if job.issued_from:
+        query = query.filter(Invoice.issue_date >= job.issued_from)
+    if job.issued_to:
+        query = query.filter(Invoice.issue_date < job.issued_to)
+    return query.order_by(Invoice.id).execution_options(
+        stream_results=True,
+        yield_per=fetch_size or settings.export_fetch_size
+    )
+
+
+def export_lines(rows: Iterable[Sequence]) -> Iterator[tuple]:
+    """Flatten invoice rows into one CSV record per line item"""
+    for (invoice_id, external_id, number, status, country, issue_date, due_date, currency,
+         supplier, customer, subtotal, tax_amount, total, line_items) in rows:
+        header = (
+            invoice_id, external_id, number, status.value, country.value,
+            issue_date.isoformat(), due_date.isoformat() if due_date else "", currency,
+            supplier.get("name", ""), supplier.get("vat_id") or "",
+            customer.get("name", ""), customer.get("vat_id") or "",
+            subtotal, tax_amount, total,
+        )
+        for line_number, item in enumerate(line_items or (), 1):
+            yield header + (
+                line_number, item.get("description", ""), item.get("quantity", ""),
+                item.get("unit_price", ""), item.get("tax_rate", ""),
+                item.get("tax_amount", ""), item.get("line_total", ""),
+            )
+
+
+def write_csv_gz(lines: Iterable[tuple], fileobj) -> int:
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as compressed:
+        text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        writer.writerow(EXPORT_HEADER)
+        for line in lines:
+            writer.writerow(line)
+            count += 1
+        text.flush()
+        text.detach()
+    return count
+
+
+def run_export(db: Session, job_id: int, store, read_db: Optional[Session] = None) -> ExportJob:
+    """Stream a tenant's invoices and line items into a compressed CSV artifact
+
+    Rows are read through `read_db` when given, such as a replica session;
+    the job's own status is always kept on `db`.
+    """
+    job = db.get(ExportJob, job_id)
+    job.status = ExportStatus.RUNNING
+    db.commit()
+
+    try:
+        with tempfile.TemporaryFile() as spool:
+            job.row_count = write_csv_gz(export_lines(stream_invoice_rows(read_db or db, job)), spool)
+            spool.seek(0)
+            job.object_key = export_key(job)
+            store.put_file(job.object_key, spool, content_type="application/gzip")
+        job.status = ExportStatus.COMPLETED
+    except Exception as e:
+        db.rollback()
+        job.status = ExportStatus.FAILED
+        job.error_message = str(e)
+
+    job.completed_at = datetime.now(timezone.utc)
+    db.commit()
+    return job
+
+
+def run_export_job(bind, job_id: int, store, read_bind=None) -> None:
+    """Background entry point; opens its own sessions on the request's engines"""
+    db = Session(bind=bind)
+    read_db = Session(bind=read_bind) if read_bind is not None and read_bind is not bind else None
+    try:
+        run_export(db, job_id, store, read_db)
+    finally:
+        if read_db is not None:
+            read_db.close()
+        db.close()
@@ -0,0 +1,154 @@
+"""Factur-X / ZUGFeRD invoice data: UN/CEFACT CII XML at the EN 16931 profile.
+
+The XML built here is what app.pdf embeds as factur-x.xml in the PDF/A-3
+invoice. Amounts follow the rest of the API: line_total is the net line
+amount, and the invoice subtotal, tax and total are taken as stored.
+"""
+from decimal import Decimal
+from typing import Optional
+from xml.sax.saxutils import escape, quoteattr
+
+from .canonical import CanonicalInvoice, canonicalize_invoice
+from .parties import party_fragment
+
+EN16931_GUIDELINE = "urn:cen.eu:en16931:2017"
+
+_NAMESPACES = (
+    'xmlns:rsm="urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100" '
+    'xmlns:ram="urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100" '
+    'xmlns:qdt="urn:un:unece:uncefact:data:standard:QualifiedDataType:100" '
+    'xmlns:udt="urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100"'
+)
+
+
+def _date(value) -> str:
+    return f'<udt:DateTimeString format="102">{value:%Y%m%d}</udt:DateTimeString>'
+
+
+def _amount(value) -> str:
+    return str(Decimal(str(value)).quantize(Decimal("0.01")))
+
+
+def _country_id(party: dict, default: str) -> str:
+    """ISO 3166 code for a party; free-text country names fall back to the VAT prefix"""
+    country = (party.get("country") or "").strip()
+    if len(country) == 2 and country.isalpha():
+        return country.upper()
+    prefix = (party.get("vat_id") or "")[:2].upper()
+    if prefix.isalpha() and len(prefix) == 2:
+        return "GR" if prefix == "EL" else prefix
+    return default
+
+
+def _party(tag: str, party: dict, default_country: str) -> str:
+    vat_id = party.get("vat_id")
+    registration = (
+        f'<ram:SpecifiedTaxRegistration><ram:ID schemeID="VA">{escape(vat_id)}</ram:ID>'
+        f'</ram:SpecifiedTaxRegistration>'
+        if vat_id else ""
+    )
+    return (
+        f"<ram:{tag}>"
+        f"<ram:Name>{escape(party['name'])}</ram:Name>"
+        f"<ram:PostalTradeAddress>"
+        f"<ram:PostcodeCode>{escape(party['postal_code'])}</ram:PostcodeCode>"
+        f"<ram:LineOne>{escape(party['address'])}</ram:LineOne>"
+        f"<ram:CityName>{escape(party['city'])}</ram:CityName>"
+        f"<ram:CountryID>{_country_id(party, default_country)}</ram:CountryID>"
+        f"</ram:PostalTradeAddress>"
+        f"{registration}"
+        f"</ram:{tag}>"
+    )
+
+
+def generate_cii_xml(invoice, canonical: Optional[CanonicalInvoice] = None) -> str:
+    """Build Factur-X CII XML from an Invoice or an invoice snapshot with the same attributes"""
+    canonical = canonical or canonicalize_invoice(invoice)
+    country = invoice.country_code.value if hasattr(invoice.country_code, "value") else invoice.country_code
+    currency = quoteattr(invoice.currency)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f"<rsm:CrossIndustryInvoice {_NAMESPACES}>",
+        "<rsm:ExchangedDocumentContext>",
+        "<ram:GuidelineSpecifiedDocumentContextParameter>",
+        f"<ram:ID>{EN16931_GUIDELINE}</ram:ID>",
+        "</ram:GuidelineSpecifiedDocumentContextParameter>",
+        "</rsm:ExchangedDocumentContext>",
+        "<rsm:ExchangedDocument>",
+        f"<ram:ID>{escape(invoice.invoice_number)}</ram:ID>",
+        "<ram:TypeCode>380</ram:TypeCode>",
+        f"<ram:IssueDateTime>{_date(invoice.issue_date)}</ram:IssueDateTime>",
+        "</rsm:ExchangedDocument>",
+        "<rsm:SupplyChainTradeTransaction>",
+    ]
+
+    for number, item in enumerate(canonical.lines, 1):
+        parts.append(
+            "<ram:IncludedSupplyChainTradeLineItem>"
+            f"<ram:AssociatedDocumentLineDocument><ram:LineID>{number}</ram:LineID>"
+            "</ram:AssociatedDocumentLineDocument>"
+            f"<ram:SpecifiedTradeProduct><ram:Name>{item.description}</ram:Name>"
+            "</ram:SpecifiedTradeProduct>"
+            "<ram:SpecifiedLineTradeAgreement><ram:NetPriceProductTradePrice>"
+            f"<ram:ChargeAmount>{item.unit_price}</ram:ChargeAmount>"
+            "</ram:NetPriceProductTradePrice></ram:SpecifiedLineTradeAgreement>"
+            "<ram:SpecifiedLineTradeDelivery>"
+            f'<ram:BilledQuantity unitCode="C62">{item.quantity}</ram:BilledQuantity>'
+            "</ram:SpecifiedLineTradeDelivery>"
+            "<ram:SpecifiedLineTradeSettlement>"
+            "<ram:ApplicableTradeTax><ram:TypeCode>VAT</ram:TypeCode>"
+            f"<ram:CategoryCode>{item.category}</ram:CategoryCode>"
+            f"<ram:RateApplicablePercent>{item.rate}</ram:RateApplicablePercent>"
+            "</ram:ApplicableTradeTax>"
+            "<ram:SpecifiedTradeSettlementLineMonetarySummation>"
+            f"<ram:LineTotalAmount>{_amount(item.line_total)}</ram:LineTotalAmount>"
+            "</ram:SpecifiedTradeSettlementLineMonetarySummation>"
+            "</ram:SpecifiedLineTradeSettlement>"
+            "</ram:IncludedSupplyChainTradeLineItem>"
+        )
+
+    parts += [
+        "<ram:ApplicableHeaderTradeAgreement>",
+        party_fragment(invoice, "supplier", f"cii:SellerTradeParty:{country}",
+                       lambda party: _party("SellerTradeParty", party, country)),
+        party_fragment(invoice, "customer", f"cii:BuyerTradeParty:{country}",
+                       lambda party: _party("BuyerTradeParty", party, country)),
+        "</ram:ApplicableHeaderTradeAgreement>",
+        "<ram:ApplicableHeaderTradeDelivery/>",
+        "<ram:ApplicableHeaderTradeSettlement>",
+        f"<ram:InvoiceCurrencyCode>{escape(invoice.currency)}</ram:InvoiceCurrencyCode>",
+    ]
+    for subtotal in canonical.tax_subtotals:
+        reason = (
+            f"<ram:ExemptionReason>{subtotal.exemption_reason}</ram:ExemptionReason>"
+            if subtotal.exemption_reason else ""
+        )
+        parts.append(
+            "<ram:ApplicableTradeTax>"
+            f"<ram:CalculatedAmount>{_amount(subtotal.tax_amount)}</ram:CalculatedAmount>"
+            "<ram:TypeCode>VAT</ram:TypeCode>"
+            f"{reason}"
+            f"<ram:BasisAmount>{_amount(subtotal.taxable_amount)}</ram:BasisAmount>"
+            f"<ram:CategoryCode>{subtotal.category}</ram:CategoryCode>"
+            f"<ram:RateApplicablePercent>{subtotal.rate}</ram:RateApplicablePercent>"
+            "</ram:ApplicableTradeTax>"
+        )
+    if invoice.due_date:
+        parts.append(
+            "<ram:SpecifiedTradePaymentTerms>"
+            f"<ram:DueDateDateTime>{_date(invoice.due_date)}</ram:DueDateDateTime>"
+            "</ram:SpecifiedTradePaymentTerms>"
+        )
+    parts += [
+        "<ram:SpecifiedTradeSettlementHeaderMonetarySummation>",
+        f"<ram:LineTotalAmount>{_amount(invoice.subtotal)}</ram:LineTotalAmount>",
+        f"<ram:TaxBasisTotalAmount>{_amount(invoice.subtotal)}</ram:TaxBasisTotalAmount>",
+        f"<ram:TaxTotalAmount currencyID={currency}>{_amount(invoice.tax_amount)}</ram:TaxTotalAmount>",
+        f"<ram:GrandTotalAmount>{_amount(invoice.total_amount)}</ram:GrandTotalAmount>",
+        f"<ram:DuePayableAmount>{_amount(invoice.total_amount)}</ram:DuePayableAmount>",
+        "</ram:SpecifiedTradeSettlementHeaderMonetarySummation>",
+        "</ram:ApplicableHeaderTradeSettlement>",
+        "</rsm:SupplyChainTradeTransaction>",
+        "</rsm:CrossIndustryInvoice>",
+    ]
+    return "\n".join(parts)
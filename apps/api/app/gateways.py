@@ -0,0 +1,560 @@
+"""Submission of invoices to national e-invoicing gateways.
+
+Each country is served by a gateway adapter: SDI for Italy, Chorus Pro for
+France and a PEPPOL access point elsewhere. A GatewayClient wraps each
+adapter with a keep-alive connection pool, an adaptive concurrency limit
+that follows the gateway's observed latency and errors, a circuit breaker
+that fails fast while the gateway is down, and batching for gateways that
+accept several documents per call.
+"""
+import asyncio
+import base64
+import io
+import random
+import re
+import time
+import uuid
+import zipfile
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .canonical import CanonicalInvoice
+from .compliance import generate_country_specific_xml
+from .config import settings
+from .events import record_status_change
+from .models import Invoice, InvoiceStatus
+from .reports import update_invoice_rollups
+from .sequences import to_base36
+
+COUNTRY_GATEWAYS = {"IT": "sdi", "FR": "chorus_pro"}
+DEFAULT_GATEWAY = "peppol"
+
+
+class GatewayError(Exception):
+    """A submission failed; `retriable` is False when resending cannot help"""
+
+    def __init__(self, message: str, retriable: bool = True, response: Optional[dict] = None):
+        super().__init__(message)
+        self.retriable = retriable
+        self.response = response or {}
+
+
+class CircuitOpen(GatewayError):
+    pass
+
+
+@dataclass
+class GatewayDocument:
+    invoice_id: int
+    filename: str
+    content: bytes
+    sender_vat_id: Optional[str] = None
+    recipient_vat_id: Optional[str] = None
+
+
+@dataclass
+class SubmissionResult:
+    invoice_id: int
+    accepted: bool
+    submission_id: Optional[str] = None
+    response: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class AdaptiveLimit:
+    """AIMD concurrency limit driven by latency and errors.
+
+    The limit grows by one per `limit` fast successes and shrinks by
+    `backoff` on an error or when latency exceeds `tolerance` times the
+    best observed latency. A call that is still slow at the minimum limit
+    resets the baseline, since the gateway itself has become slower.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 64,
+                 tolerance: float = 2.0, backoff: float = 0.7):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.inflight = 0
+        self.baseline: Optional[float] = None
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        if not self._waiters and self.inflight < int(self.limit):
+            self.inflight += 1
+            return
+        # Queue in arrival order so no caller starves behind newcomers
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.inflight -= 1  # Granted just as we were cancelled
+                self._wake()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, latency: float, ok: bool) -> None:
+        self.update(latency, ok)
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(None)
+
+    def update(self, latency: float, ok: bool) -> None:
+        if ok and (self.baseline is None or latency < self.baseline):
+            self.baseline = latency
+        if ok and latency <= self.baseline * self.tolerance:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        elif ok and self.limit <= self.minimum:
+            self.baseline = latency  # Slow even when unloaded: the gateway itself got slower
+        else:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets one probe through
+    after `reset_timeout` seconds; the probe's outcome closes or reopens it"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            return True
+        return self.state == self.CLOSED
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a probe through; 0 unless open"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+
+    def release_probe(self) -> None:
+        """Give up a probe that ended without an answer; the next request probes instead"""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+
+
+class HttpGatewayAdapter:
+    """Base for gateways reached over HTTPS through a keep-alive connection pool"""
+
+    name = "http"
+    batch_size = 1
+
+    def __init__(self, base_url: str, api_key: Optional[str], timeout: float, pool_size: int,
+                 transport=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.transport = transport
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                headers={"Authorization": f"Bearer {self.api_key}"} if self.api_key else {},
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=60,
+                ),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def _post(self, path: str, payload: dict) -> dict:
+        import httpx
+        try:
+            response = await self.client.post(path, json=payload)
+        except httpx.HTTPError as e:
+            raise GatewayError(f"{self.name}: {e.__class__.__name__}: {e}")
+        if response.status_code == 429 or response.status_code >= 500:
+            raise GatewayError(f"{self.name} returned HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise GatewayError(f"{self.name} rejected the request with HTTP {response.status_code}",
+                               retriable=False, response={"body": response.text[:1000]})
+        return response.json()
+
+    async def submit_batch(self, documents: List[GatewayDocument]) -> List[SubmissionResult]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class SdiGateway(HttpGatewayAdapter):
+    """Italian Sistema di Interscambio, through an intermediary's HTTPS channel.
+
+    Several FatturaPA files can travel in one ZIP archive; the gateway
+    answers with one outcome per file name.
+    """
+
+    name = "sdi"
+
+    def __init__(self, *args, batch_size: int = 1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size
+
+    async def submit_batch(self, documents: List[GatewayDocument]) -> List[SubmissionResult]:
+        if len(documents) == 1:
+            filename, content = documents[0].filename, documents[0].content
+        else:
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+                for document in documents:
+                    archive.writestr(document.filename, document.content)
+            filename, content = f"batch-{uuid.uuid4().hex}.zip", buffer.getvalue()
+
+        data = await self._post("/invii", {"nomeFile": filename, "file": base64.b64encode(content).decode()})
+        outcomes = {outcome.get("nomeFile"): outcome for outcome in data.get("esiti", [])}
+        results = []
+        for document in documents:
+            outcome = outcomes.get(document.filename, {})
+            identifier = outcome.get("identificativoSdI")
+            results.append(SubmissionResult(
+                invoice_id=document.invoice_id,
+                accepted=identifier is not None,
+                submission_id=identifier,
+                response=outcome,
+                error=None if identifier else outcome.get("errore", "No outcome returned for file"),
+            ))
+        return results
+
+
+class ChorusProGateway(HttpGatewayAdapter):
+    """French Chorus Pro, one Factur-X flux per call"""
+
+    name = "chorus_pro"
+
+    async def submit_batch(self, documents: List[GatewayDocument]) -> List[SubmissionResult]:
+        results = []
+        for document in documents:
+            data = await self._post("/factures/v1/deposer/flux", {
+                "fichierFlux": base64.b64encode(document.content).decode(),
+                "nomFichier": document.filename,
+                "syntaxeFlux": "IN_DP_E2_CII_FACTURX",
+                "avecSignature": False,
+            })
+            accepted = data.get("codeRetour") == 0
+            results.append(SubmissionResult(
+                invoice_id=document.invoice_id,
+                accepted=accepted,
+                submission_id=str(data["numeroFluxDepot"]) if accepted else None,
+                response=data,
+                error=None if accepted else data.get("libelle", "Flux rejected"),
+            ))
+        return results
+
+
+class PeppolAccessPointGateway(HttpGatewayAdapter):
+    """Outbound PEPPOL BIS Billing 3.0 through an access point, one message per document"""
+
+    name = "peppol"
+
+    async def submit_batch(self, documents: List[GatewayDocument]) -> List[SubmissionResult]:
+        results = []
+        for document in documents:
+            data = await self._post("/outbound", {
+                "documentTypeId": "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2::Invoice",
+                "sender": document.sender_vat_id,
+                "receiver": document.recipient_vat_id,
+                "payload": base64.b64encode(document.content).decode(),
+            })
+            message_id = data.get("messageId")
+            results.append(SubmissionResult(
+                invoice_id=document.invoice_id,
+                accepted=message_id is not None,
+                submission_id=message_id,
+                response=data,
+                error=None if message_id else data.get("error", "Message rejected"),
+            ))
+        return results
+
+
+class FakeGateway:
+    """In-process stand-in for a gateway, for development, tests and benchmarks.
+
+    Each call takes `latency` seconds (plus up to `jitter`), and slows down
+    in proportion to overload once more than `capacity` calls are in
+    flight. A call fails as a whole with probability `failure_rate`, or
+    every call while `down` is set; each document is rejected with
+    probability `rejection_rate`.
+    """
+
+    def __init__(self, name: str = "fake", latency: float = 0.0, jitter: float = 0.0,
+                 failure_rate: float = 0.0, rejection_rate: float = 0.0,
+                 capacity: Optional[int] = None, batch_size: int = 1, seed: Optional[int] = None):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rejection_rate = rejection_rate
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.down = False
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.documents = 0
+        self.inflight = 0
+        self.peak_inflight = 0
+
+    async def submit_batch(self, documents: List[GatewayDocument]) -> List[SubmissionResult]:
+        self.calls += 1
+        self.inflight += 1
+        self.peak_inflight = max(self.peak_inflight, self.inflight)
+        try:
+            delay = self.latency + self.jitter * self.random.random()
+            if self.capacity and self.inflight > self.capacity:
+                delay *= self.inflight / self.capacity
+            if delay:
+                await asyncio.sleep(delay)
+            if self.down or self.random.random() < self.failure_rate:
+                raise GatewayError(f"{self.name} unavailable")
+        finally:
+            self.inflight -= 1
+
+        self.documents += len(documents)
+        results = []
+        for document in documents:
+            if self.random.random() < self.rejection_rate:
+                results.append(SubmissionResult(document.invoice_id, accepted=False,
+                                                response={"status": "rejected"}, error="Rejected by fake gateway"))
+            else:
+                submission_id = f"{self.name}-{uuid.uuid4().hex[:16]}"
+                results.append(SubmissionResult(document.invoice_id, accepted=True, submission_id=submission_id,
+                                                response={"status": "received", "id": submission_id}))
+        return results
+
+    async def close(self) -> None:
+        pass
+
+
+class GatewayClient:
+    """Adds concurrency control, a circuit breaker and batching to an adapter"""
+
+    def __init__(self, adapter, limit: AdaptiveLimit, breaker: CircuitBreaker, linger: float = 0.0):
+        self.adapter = adapter
+        self.limit = limit
+        self.breaker = breaker
+        self.linger = linger
+        self._pending: List[Tuple[GatewayDocument, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: set = set()
+
+    @property
+    def name(self) -> str:
+        return self.adapter.name
+
+    async def submit(self, document: GatewayDocument) -> SubmissionResult:
+        if not self.breaker.allow():
+            raise CircuitOpen(f"{self.name} circuit is open; not sending")
+        if self.adapter.batch_size <= 1:
+            return (await self._send([document]))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((document, future))
+        if len(self._pending) >= self.adapter.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.adapter.batch_size]
+            self._pending = self._pending[self.adapter.batch_size:]
+            task = asyncio.ensure_future(self._send_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _send_batch(self, batch: List[Tuple[GatewayDocument, asyncio.Future]]) -> None:
+        try:
+            results = await self._send([document for document, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        by_invoice = {result.invoice_id: result for result in results}
+        for document, future in batch:
+            if not future.done():
+                future.set_result(by_invoice[document.invoice_id])
+
+    async def _send(self, documents: List[GatewayDocument]) -> List[SubmissionResult]:
+        try:
+            await self.limit.acquire()
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+        started = time.monotonic()
+        ok = False
+        try:
+            results = await self.adapter.submit_batch(documents)
+            ok = True
+            self.breaker.record_success()
+            return results
+        except GatewayError as e:
+            if e.retriable:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()  # The gateway answered; only this request was bad
+            raise
+        except Exception as e:
+            self.breaker.record_failure()
+            raise GatewayError(f"{self.name}: {e}") from e
+        except BaseException:
+            self.breaker.release_probe()  # Cancelled before the gateway answered
+            raise
+        finally:
+            self.limit.release(time.monotonic() - started, ok)
+
+    async def close(self) -> None:
+        self._flush()
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        await self.adapter.close()
+
+
+class GatewayRegistry:
+    def __init__(self, clients: Dict[str, GatewayClient]):
+        self.clients = clients
+
+    def for_country(self, country_code: str) -> GatewayClient:
+        return self.clients[COUNTRY_GATEWAYS.get(country_code, DEFAULT_GATEWAY)]
+
+    async def close(self) -> None:
+        for client in self.clients.values():
+            await client.close()
+
+
+def _client(adapter) -> GatewayClient:
+    return GatewayClient(
+        adapter,
+        AdaptiveLimit(
+            initial=settings.gateway_initial_concurrency,
+            maximum=settings.gateway_max_concurrency,
+            tolerance=settings.gateway_latency_tolerance,
+        ),
+        CircuitBreaker(settings.gateway_breaker_failure_threshold, settings.gateway_breaker_reset_seconds),
+        linger=settings.gateway_batch_linger_ms / 1000,
+    )
+
+
+@lru_cache
+def get_gateway_registry() -> GatewayRegistry:
+    if settings.gateway_backend == "live":
+        common = dict(timeout=settings.gateway_timeout_seconds, pool_size=settings.gateway_pool_size)
+        adapters = [
+            SdiGateway(settings.sdi_base_url, settings.sdi_api_key, batch_size=settings.sdi_batch_size, **common),
+            ChorusProGateway(settings.chorus_pro_base_url, settings.chorus_pro_api_key, **common),
+            PeppolAccessPointGateway(settings.peppol_ap_base_url, settings.peppol_ap_api_key, **common),
+        ]
+    else:
+        adapters = [
+            FakeGateway(name, latency=settings.fake_gateway_latency_ms / 1000,
+                        failure_rate=settings.fake_gateway_failure_rate,
+                        batch_size=settings.sdi_batch_size if name == "sdi" else 1)
+            for name in ("sdi", "chorus_pro", "peppol")
+        ]
+    return GatewayRegistry({adapter.name: _client(adapter) for adapter in adapters})
+
+
+def build_document(invoice: Invoice, canonical: Optional[CanonicalInvoice] = None) -> GatewayDocument:
+    """The country's XML for an invoice, named the way its gateway expects"""
+    country = invoice.country_code.value
+    sender = invoice.supplier_data.get("vat_id")
+    if country == "IT":
+        # SDI file names: country code, sender ID and a five-character progressive
+        sender_id = re.sub(r"[^A-Z0-9]", "", (sender or "").upper())
+        if not sender_id.startswith("IT"):
+            sender_id = "IT" + sender_id
+        filename = f"{sender_id}_{to_base36(invoice.transmission_number or invoice.id, 5)}.xml"
+    else:
+        filename = re.sub(r"[^A-Za-z0-9._-]", "_", f"{invoice.invoice_number}-{invoice.id}") + ".xml"
+    return GatewayDocument(
+        invoice_id=invoice.id,
+        filename=filename,
+        content=generate_country_specific_xml(invoice, canonical).encode("utf-8"),
+        sender_vat_id=sender,
+        recipient_vat_id=invoice.customer_data.get("vat_id"),
+    )
+
+
+def record_submission(db: Session, invoice: Invoice, gateway: str, result: Optional[SubmissionResult] = None,
+                      error: Optional[GatewayError] = None) -> Invoice:
+    """Apply a gateway's answer, or the error that stood in for one, to the invoice; caller commits"""
+    if error is not None:
+        invoice.status = InvoiceStatus.FAILED
+        invoice.error_message = str(error)
+        invoice.gateway_response = {"gateway": gateway, "error": str(error), "retriable": error.retriable,
+                                    **error.response}
+    else:
+        invoice.gateway_response = {"gateway": gateway, **result.response}
+        if result.accepted:
+            invoice.status = InvoiceStatus.SUBMITTED
+            invoice.submission_id = result.submission_id
+            invoice.submitted_at = datetime.now(timezone.utc)
+            invoice.error_message = None
+        else:
+            invoice.status = InvoiceStatus.REJECTED
+            invoice.error_message = result.error
+    update_invoice_rollups(db, invoice)
+    record_status_change(db, invoice, {"gateway": gateway, "submission_id": invoice.submission_id})
+    return invoice
+
+
+async def submit_invoice(db: Session, invoice: Invoice, registry: GatewayRegistry,
+                         canonical: Optional[CanonicalInvoice] = None) -> Invoice:
+    """Send an invoice to its country's gateway and record the outcome; caller commits"""
+    client = registry.for_country(invoice.country_code.value)
+    try:
+        result = await client.submit(build_document(invoice, canonical))
+    except GatewayError as e:
+        return record_submission(db, invoice, client.name, error=e)
+    return record_submission(db, invoice, client.name, result)
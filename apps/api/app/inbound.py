@@ -0,0 +1,272 @@
+"""Streaming parser for inbound UBL, XRechnung and FatturaPA documents.
+
+Supplier invoices arrive as single XML files, FatturaPA batches with one
+FatturaElettronicaBody per invoice, or ZIP archives of either, and can run
+to hundreds of MB. Documents are read with lxml.iterparse and each invoice
+line, invoice body and attachment is removed from the tree as soon as it
+has been read, so memory follows the largest invoice header rather than
+the file. Every invoice is mapped to the dict shape of InvoiceCreate; the
+caller validates it and creates the invoice like any other.
+
+Archive members are parsed in spawned worker processes, inbound_parse_workers
+at a time, and results come back in archive order. A member that cannot be
+parsed is reported and the rest of the archive still goes through.
+"""
+import zipfile
+from collections import deque
+from decimal import Decimal, InvalidOperation
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Union
+
+# Matched on local names: producers disagree on namespacing FatturaPA's inner elements
+_UBL_INVOICE = "Invoice"
+_UBL_LINE = "InvoiceLine"
+_FPA_HEADER = "FatturaElettronicaHeader"
+_FPA_BODY = "FatturaElettronicaBody"
+_FPA_LINE = "DettaglioLinee"
+_ATTACHMENTS = ("AdditionalDocumentReference", "Allegati")  # Embedded base64 files, not needed here
+
+_TAGS = tuple(
+    f"{{*}}{name}" for name in (_UBL_INVOICE, _UBL_LINE, _FPA_HEADER, _FPA_BODY, _FPA_LINE, *_ATTACHMENTS)
+)
+_CENT = Decimal("0.01")
+
+
+class InboundDocumentError(ValueError):
+    """A document that is not well-formed XML or holds no invoice this parser knows"""
+
+
+class ParsedInvoice(NamedTuple):
+    document: str  # Archive member name; empty for a single uploaded document
+    index: int  # Position of the invoice within its document
+    data: Optional[dict]  # InvoiceCreate-shaped, not yet validated
+    error: Optional[str] = None
+
+
+def _local(element) -> str:
+    return element.tag.rpartition("}")[2]
+
+
+def _child(element, *path: str):
+    for name in path:
+        if element is None:
+            return None
+        # Comments and processing instructions have non-string tags
+        element = next((child for child in element if isinstance(child.tag, str) and _local(child) == name), None)
+    return element
+
+
+def _text(element, *path: str) -> Optional[str]:
+    found = _child(element, *path)
+    if found is None or found.text is None:
+        return None
+    return found.text.strip() or None
+
+
+def _drop(element) -> None:
+    """Free an element that has been read; its parent no longer refers to it"""
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        parent.remove(element)
+
+
+def _line(description: Optional[str], quantity: Optional[str], unit_price: Optional[str],
+          line_total: Optional[str], rate: Optional[str]) -> dict:
+    # Neither format states tax per line, so it is derived from the rate
+    try:
+        tax_amount = str((Decimal(line_total) * Decimal(rate) / 100).quantize(_CENT))
+    except (TypeError, InvalidOperation):
+        tax_amount = None
+    return {
+        "description": description or "",
+        "quantity": quantity if quantity is not None else "1",
+        "unit_price": unit_price,
+        "tax_rate": rate,
+        "tax_amount": tax_amount,
+        "line_total": line_total,
+    }
+
+
+def _ubl_party(party) -> dict:
+    party = _child(party, "Party")
+    return {
+        "name": _text(party, "PartyName", "Name") or _text(party, "PartyLegalEntity", "RegistrationName"),
+        "vat_id": _text(party, "PartyTaxScheme", "CompanyID"),
+        "address": _text(party, "PostalAddress", "StreetName"),
+        "city": _text(party, "PostalAddress", "CityName"),
+        "postal_code": _text(party, "PostalAddress", "PostalZone"),
+        "country": _text(party, "PostalAddress", "Country", "IdentificationCode"),
+        "email": _text(party, "Contact", "ElectronicMail"),
+        "phone": _text(party, "Contact", "Telephone"),
+    }
+
+
+def _ubl_line(line) -> dict:
+    item = _child(line, "Item")
+    return _line(
+        _text(item, "Description") or _text(item, "Name"),
+        _text(line, "InvoicedQuantity"),
+        _text(line, "Price", "PriceAmount"),
+        _text(line, "LineExtensionAmount"),
+        _text(item, "ClassifiedTaxCategory", "Percent"),
+    )
+
+
+def _ubl_invoice(root, lines: List[dict]) -> dict:
+    supplier = _ubl_party(_child(root, "AccountingSupplierParty"))
+    customization = _text(root, "CustomizationID") or ""
+    number = _text(root, "ID")
+    return {
+        "external_id": number,
+        # XRechnung is German by definition; plain UBL is filed in the supplier's country
+        "country_code": "DE" if "xrechnung" in customization else supplier["country"],
+        "invoice_number": number,
+        "issue_date": _text(root, "IssueDate"),
+        "due_date": _text(root, "DueDate"),
+        "currency": _text(root, "DocumentCurrencyCode") or "EUR",
+        "supplier": supplier,
+        "customer": _ubl_party(_child(root, "AccountingCustomerParty")),
+        "line_items": lines,
+    }
+
+
+def _fatturapa_party(party) -> dict:
+    details = _child(party, "DatiAnagrafici")
+    country, code = _text(details, "IdFiscaleIVA", "IdPaese"), _text(details, "IdFiscaleIVA", "IdCodice")
+    vat_id = None
+    if code and code != "N/A":
+        vat_id = code if country is None or code.startswith(country) else country + code
+    registry = _child(details, "Anagrafica")
+    name = _text(registry, "Denominazione") or " ".join(
+        part for part in (_text(registry, "Nome"), _text(registry, "Cognome")) if part
+    )
+    address = " ".join(
+        part for part in (_text(party, "Sede", "Indirizzo"), _text(party, "Sede", "NumeroCivico")) if part
+    )
+    return {
+        "name": name or None,
+        "vat_id": vat_id,
+        "address": address or None,
+        "city": _text(party, "Sede", "Comune"),
+        "postal_code": _text(party, "Sede", "CAP"),
+        "country": _text(party, "Sede", "Nazione"),
+        "email": _text(party, "Contatti", "Email"),
+    }
+
+
+def _fatturapa_line(line) -> dict:
+    return _line(
+        _text(line, "Descrizione"),
+        _text(line, "Quantita"),
+        _text(line, "PrezzoUnitario"),
+        _text(line, "PrezzoTotale"),
+        _text(line, "AliquotaIVA"),
+    )
+
+
+def _fatturapa_invoice(header: Dict[str, dict], body, lines: List[dict]) -> dict:
+    document = _child(body, "DatiGenerali", "DatiGeneraliDocumento")
+    number = _text(document, "Numero")
+    return {
+        "external_id": number,
+        "country_code": "IT",
+        "invoice_number": number,
+        "issue_date": _text(document, "Data"),
+        "due_date": _text(body, "DatiPagamento", "DettaglioPagamento", "DataScadenzaPagamento"),
+        "currency": _text(document, "Divisa") or "EUR",
+        "supplier": header.get("supplier"),
+        "customer": header.get("customer"),
+        "line_items": lines,
+    }
+
+
+def iter_document(source: Union[str, BinaryIO]) -> Iterator[dict]:
+    """Invoices of one XML document, in document order, as InvoiceCreate-shaped dicts"""
+    from lxml import etree
+
+    lines: List[dict] = []
+    header: Dict[str, dict] = {}
+    found = False
+    # Entities are never expanded; huge_tree only lifts libxml2's limit on single text nodes
+    events = etree.iterparse(source, events=("end",), tag=_TAGS, resolve_entities=False, no_network=True,
+                             huge_tree=True)
+    try:
+        for _, element in events:
+            name = _local(element)
+            if name == _UBL_LINE:
+                lines.append(_ubl_line(element))
+            elif name == _FPA_LINE:
+                lines.append(_fatturapa_line(element))
+            elif name == _UBL_INVOICE:
+                found = True
+                yield _ubl_invoice(element, lines)
+                lines = []
+            elif name == _FPA_HEADER:
+                header = {
+                    "supplier": _fatturapa_party(_child(element, "CedentePrestatore")),
+                    "customer": _fatturapa_party(_child(element, "CessionarioCommittente")),
+                }
+            elif name == _FPA_BODY:
+                found = True
+                yield _fatturapa_invoice(header, element, lines)
+                lines = []
+            _drop(element)
+    except etree.XMLSyntaxError as e:
+        raise InboundDocumentError(f"Malformed XML: {e}") from e
+    if not found:
+        raise InboundDocumentError("No UBL, XRechnung or FatturaPA invoice found")
+
+
+def parse_document(source: Union[str, BinaryIO], document: str = "") -> Iterator[ParsedInvoice]:
+    """iter_document with failures reported in place instead of raised"""
+    index = 0
+    try:
+        for data in iter_document(source):
+            yield ParsedInvoice(document, index, data)
+            index += 1
+    except InboundDocumentError as e:
+        yield ParsedInvoice(document, index, None, str(e))
+
+
+def parse_archive_member(path: str, member: str) -> List[ParsedInvoice]:
+    """Worker entry point: every invoice of one ZIP member"""
+    with zipfile.ZipFile(path) as archive, archive.open(member) as source:
+        return list(parse_document(source, member))
+
+
+def _members(path: str) -> List[str]:
+    with zipfile.ZipFile(path) as archive:
+        return [
+            info.filename for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+        ]
+
+
+def iter_upload(path: str, workers: int = 0) -> Iterator[ParsedInvoice]:
+    """Invoices of an uploaded XML document or ZIP archive of them, in order
+
+    Archive members are parsed by `workers` processes, at most two per
+    worker ahead of the consumer; with 0 they are parsed here, one by one.
+    """
+    if not zipfile.is_zipfile(path):
+        yield from parse_document(path)
+        return
+
+    members = _members(path)
+    if workers <= 0 or len(members) < 2:
+        for member in members:
+            with zipfile.ZipFile(path) as archive, archive.open(member) as source:
+                yield from parse_document(source, member)
+        return
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    # Forking a process with live threads and connections is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = deque()
+        for member in members:
+            pending.append(executor.submit(parse_archive_member, path, member))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
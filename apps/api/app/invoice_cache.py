@@ -0,0 +1,252 @@
+"""Cache of serialized GET /invoices/{id} responses.
+
+Integrations poll single invoices while they wait for a gateway outcome.
+Responses are cached as the exact JSON bytes served, with their ETag, keyed
+by tenant and invoice id. There are two layers: a small LRU in each process
+and, with invoice_cache_backend "redis", a Redis layer shared by all workers.
+
+Entries are invalidated whenever a session commits a change to an Invoice.
+Code that changes invoices without the ORM, such as receipt ingestion and
+the archive's bulk deletes, names the changed invoices with
+invalidate_on_commit. Local entries also expire after
+invoice_cache_local_ttl_seconds, which bounds how long a change committed
+by another process can go unseen there.
+
+A response loaded while an invalidation happened is served but not cached,
+so a slow read cannot put an older version back. Within a process, a
+generation counter detects the invalidation. Across workers, invalidation
+bumps a version kept next to each Redis entry, and a Lua script writes a
+loaded response only if the version is still the one read before loading.
+Responses are loaded from the primary, never a replica, for the same
+reason: a lagging replica would cache a status that has already changed.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Invoice
+
+Key = Tuple[int, int]  # (tenant_id, invoice_id)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def etag_for(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison; weak validators match too, as RFC 9110 asks for GET"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class RedisResponseStore:
+    """Shared layer in Redis; each value is the ETag, a newline and the body.
+
+    Next to each value is a version counter that invalidation increments.
+    It outlives the value by the value's TTL, so a loader that read the old
+    version cannot write the response back.
+    """
+
+    # KEYS: value, version. ARGV: version read before loading, value, TTL
+    SET_IF_CURRENT = """
+        if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then return 0 end
+        redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+        return 1
+    """
+    # KEYS: value and version pairs. ARGV: TTL of the versions
+    INVALIDATE = """
+        for i = 1, #KEYS, 2 do
+            redis.call('DEL', KEYS[i])
+            redis.call('INCR', KEYS[i + 1])
+            redis.call('EXPIRE', KEYS[i + 1], ARGV[1])
+        end
+        return #KEYS / 2
+    """
+
+    def __init__(self, url: str, prefix: str = "invoice:", client=None):
+        self.url = url
+        self.prefix = prefix
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def _key(self, key: Key) -> str:
+        return f"{self.prefix}{key[0]}:{key[1]}"
+
+    def _version_key(self, key: Key) -> str:
+        return f"{self.prefix}version:{key[0]}:{key[1]}"
+
+    def get(self, key: Key) -> Optional[CachedResponse]:
+        value = self.client.get(self._key(key))
+        if value is None:
+            return None
+        etag, _, body = value.partition(b"\n")
+        return CachedResponse(body, etag.decode())
+
+    def version(self, key: Key) -> str:
+        value = self.client.get(self._version_key(key))
+        return value.decode() if value is not None else "0"
+
+    def set(self, key: Key, entry: CachedResponse, ttl: int, version: str) -> bool:
+        """Store `entry` unless `key` was invalidated since `version` was read"""
+        return bool(self.client.eval(
+            self.SET_IF_CURRENT, 2, self._key(key), self._version_key(key),
+            version, entry.etag.encode() + b"\n" + entry.body, ttl,
+        ))
+
+    def delete(self, keys: Iterable[Key], ttl: int) -> None:
+        names = [name for key in keys for name in (self._key(key), self._version_key(key))]
+        if names:
+            self.client.eval(self.INVALIDATE, len(names), *names, ttl)
+
+
+class InvoiceResponseCache:
+    def __init__(self, maxsize: int, local_ttl: float, shared: Optional[RedisResponseStore] = None,
+                 shared_ttl: int = 300, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.local_ttl = local_ttl
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.clock = clock
+        self._entries: "OrderedDict[Key, Tuple[float, CachedResponse]]" = OrderedDict()
+        self._generation = 0  # Bumped by every invalidation
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.local_hits + self.shared_hits
+        return hits / (hits + self.misses) if hits + self.misses else 0.0
+
+    def get(self, key: Key) -> Optional[CachedResponse]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                expires_at, entry = item
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.local_hits += 1
+                    return entry
+                del self._entries[key]
+
+        if self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except Exception:
+                entry = None  # Redis trouble degrades to a database read
+            if entry is not None:
+                self.shared_hits += 1
+                self._put_local(key, entry)
+                return entry
+        self.misses += 1
+        return None
+
+    def load(self, key: Key, loader: Callable[[], Optional[bytes]]) -> Optional[CachedResponse]:
+        """The cached response for `key`, or render it with `loader` (None if not found) and cache it"""
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        generation = self._generation
+        version = None
+        if self.shared is not None:
+            try:
+                version = self.shared.version(key)
+            except Exception:
+                pass  # Not cached in Redis then, as there is nothing to check the write against
+        body = loader()
+        if body is None:
+            return None
+        entry = CachedResponse(body, etag_for(body))
+        if generation != self._generation:
+            return entry
+        if version is not None:
+            try:
+                if not self.shared.set(key, entry, self.shared_ttl, version):
+                    return entry  # Another worker invalidated it while it loaded
+            except Exception:
+                pass
+        self._put_local(key, entry)
+        return entry
+
+    def invalidate(self, keys: Iterable[Key]) -> None:
+        keys = list(keys)
+        if not keys:
+            return
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.shared is not None:
+            try:
+                self.shared.delete(keys, self.shared_ttl)
+            except Exception:
+                pass  # The shared TTL bounds how long the entry can outlive the change
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def _put_local(self, key: Key, entry: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = (self.clock() + self.local_ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+@lru_cache
+def get_invoice_cache() -> InvoiceResponseCache:
+    shared = RedisResponseStore(settings.redis_url) if settings.invoice_cache_backend == "redis" else None
+    return InvoiceResponseCache(
+        maxsize=settings.invoice_cache_size,
+        local_ttl=settings.invoice_cache_local_ttl_seconds,
+        shared=shared,
+        shared_ttl=settings.invoice_cache_ttl_seconds,
+    )
+
+
+def invalidate_on_commit(session: Session, keys: Iterable[Key]) -> None:
+    """Invalidate invoices changed by bulk or Core statements once `session` commits"""
+    session.info.setdefault("changed_invoices", set()).update(keys)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_invoices(session, flush_context):
+    changed = [(obj.tenant_id, obj.id) for obj in (*session.dirty, *session.deleted) if isinstance(obj, Invoice)]
+    if changed:
+        invalidate_on_commit(session, changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_invoices(session):
+    changed = session.info.pop("changed_invoices", None)
+    if changed:
+        get_invoice_cache().invalidate(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_invoices(session):
+    session.info.pop("changed_invoices", None)
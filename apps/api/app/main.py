@@ -1,27 +1,84 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, BackgroundTasks, Depends, Header, HTTPException, Query, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.openapi.utils import validation_error_definition, validation_error_response_definition
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import List
-import uuid
-from decimal import Decimal
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+import asyncio
+import hmac
+import tempfile
+import threading
 
-from .database import SessionLocal, engine, get_db
-from .models import Base, Tenant, Invoice, InvoiceStatus
+from .admission import AdmissionMiddleware
+from .database import SessionLocal, get_db
+from .replicas import get_read_db
+from .sharding import get_shard_sessions, get_tenant_db, shard_map
+from .models import Tenant, Invoice, InvoiceStatus, ExportJob, ExportStatus
 from .schemas import (
     InvoiceCreate, InvoiceResponse, InvoiceValidateRequest, 
-    ValidationResult, TenantCreate, TenantResponse
+    ValidationResult, TenantCreate, TenantResponse, ApiKeyRotateResponse, TokenResponse,
+    ExportCreate, ExportResponse, VatIdCheckResult, VatIdBulkRequest, VatIdBulkResponse,
+    VatReportLine, VatReportResponse, EventResponse, EventFeedResponse, ReceiptIngestResponse,
+    InvoiceImportError, InvoiceImportResponse, InvoiceSearchResponse, SlowRequestLog
 )
-from .auth import get_current_tenant
+from .auth import (
+    get_current_tenant, issue_api_key, rotate_api_key,
+    create_tenant_access_token, revoke_tenant_tokens, require_admin
+)
+from .config import settings
 from .compliance import validate_invoice_data, generate_ubl_xml
+from .canonical import canonicalize, is_reverse_charge
+from .duplicates import get_duplicate_detector, invoice_fingerprint
+from .serialization import (
+    FastJSONResponse, invoice_response_query, serialize_invoice_page, serialize_invoice_row, serialize_invoice_rows
+)
+from .archive import load_archived_invoice
+from .events import change_feed, fetch_events, record_status_change, sse_events
+from .exports import run_export_job
+from .gateways import get_gateway_registry
+from .inbound import iter_upload
+from .invoice_cache import etag_matches, get_invoice_cache
+from .parties import get_or_create_party
+from .profiling import (
+    ProfilerBusy, SlowRequestMiddleware, format_folded, get_profiler, get_slow_request_tracer, phase
+)
+from .receipts import ingest_receipt_stream
+from .rendering import RENDERABLE_STATUSES, get_pdf_renderer, pdf_key, render_invoice_job
+from .reports import apply_invoice_to_rollups, from_cents, update_invoice_rollups, vat_report
+from .retries import submit_with_retry
+from .search import MIN_TERM_LENGTH, search_invoices
+from .sequences import SEQUENCED_COUNTRIES, TRANSMISSION, get_sequence_allocator
+from .storage import get_blob_store, iter_blob
+from .startup import preload
+from .vat_ids import VatIdService, get_vat_id_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The schema is managed by Alembic migrations, not created at import time
+    await asyncio.to_thread(preload)
+    yield
+    await change_feed.stop()
+    await get_gateway_registry().close()
+    get_pdf_renderer().shutdown()
 
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="Vatevo API",
     description="Compliance-as-a-Service for EU e-invoicing",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Added first so it runs inside CORS and shed responses still carry CORS headers
+app.add_middleware(AdmissionMiddleware)
+# Outside admission, so time queued for a write slot shows in a slow request's total
+app.add_middleware(SlowRequestMiddleware)
+
 # Disable CORS. Do not remove this for full-stack development.
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +88,25 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+
+def openapi():
+    # POST /invoices parses its own body, so FastAPI registers neither the model nor its 422 response
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        invoice_create = InvoiceCreate.model_json_schema(ref_template="#/components/schemas/{model}")
+        invoice_create.pop("$defs", None)
+        schema["components"]["schemas"]["InvoiceCreate"] = invoice_create
+        schema["components"]["schemas"].setdefault("ValidationError", validation_error_definition)
+        schema["components"]["schemas"].setdefault("HTTPValidationError", validation_error_response_definition)
+        schema["paths"]["/invoices"]["post"]["responses"]["422"] = {
+            "description": "Validation Error",
+            "content": {"application/json": {"schema": {"$ref": "#/components/schemas/HTTPValidationError"}}},
+        }
+    return app.openapi_schema
+
+
+app.openapi = openapi
+
 @app.get("/healthz")
 async def healthz():
     return {"status": "ok", "service": "vatevo-api"}
@@ -39,37 +115,118 @@ async def healthz():
 @app.post("/tenants", response_model=TenantResponse)
 async def create_tenant(tenant_data: TenantCreate, db: Session = Depends(get_db)):
     """Create a new tenant with API key"""
-    api_key = f"vat_{uuid.uuid4().hex}"
-    
     tenant = Tenant(
         name=tenant_data.name,
-        api_key=api_key,
         webhook_url=tenant_data.webhook_url
     )
     
     db.add(tenant)
+    db.flush()
+    api_key = issue_api_key(db, tenant)
     db.commit()
     db.refresh(tenant)
     
-    return tenant
+    # The plaintext key is only ever returned here; it is stored hashed.
+    return TenantResponse(
+        id=tenant.id,
+        name=tenant.name,
+        api_key=api_key,
+        webhook_url=tenant.webhook_url,
+        is_active=tenant.is_active,
+        created_at=tenant.created_at
+    )
 
 
-@app.post("/invoices", response_model=InvoiceResponse)
-async def create_invoice(
-    invoice_data: InvoiceCreate,
+@app.post("/tenants/api-keys/rotate", response_model=ApiKeyRotateResponse)
+async def rotate_tenant_api_key(
+    overlap_hours: int = Query(settings.api_key_rotation_overlap_hours, ge=0,
+                               le=settings.api_key_rotation_max_overlap_hours),
     current_tenant: Tenant = Depends(get_current_tenant),
     db: Session = Depends(get_db)
 ):
-    """Create and optionally submit an invoice"""
+    """Issue a new API key; existing keys stay valid for the overlap window"""
+    api_key, expires_at = rotate_api_key(db, current_tenant, timedelta(hours=overlap_hours))
+    db.commit()
     
-    subtotal = Decimal("0")
-    tax_total = Decimal("0")
+    return ApiKeyRotateResponse(api_key=api_key, previous_keys_expire_at=expires_at)
+
+
+@app.post("/auth/token", response_model=TokenResponse)
+async def issue_access_token(
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_db)
+):
+    """Exchange an API key for a short-lived JWT"""
+    access_token = create_tenant_access_token(db, current_tenant)
+    return TokenResponse(
+        access_token=access_token,
+        expires_in=settings.access_token_expire_minutes * 60
+    )
+
+
+@app.post("/auth/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_access_tokens(
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_db)
+):
+    """Revoke every JWT issued so far for the current tenant"""
+    revoke_tenant_tokens(db, current_tenant.id)
+    db.commit()
+
+
+def _schedule_pdf(background_tasks: BackgroundTasks, db: Session, invoice: Invoice) -> None:
+    if settings.pdf_rendering_enabled and invoice.status in RENDERABLE_STATUSES:
+        background_tasks.add_task(
+            render_invoice_job, db.get_bind(), invoice.id, get_pdf_renderer(), get_blob_store()
+        )
+
+
+async def parse_invoice_create(request: Request) -> InvoiceCreate:
+    """Validate the request bytes in one pass, without building an intermediate JSON object tree"""
+    body = await request.body()
+    try:
+        with phase("validation"):
+            return InvoiceCreate.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        )
+
+
+@app.post("/invoices", response_model=InvoiceResponse, openapi_extra={"requestBody": {
+    "required": True,
+    "content": {"application/json": {"schema": {"$ref": "#/components/schemas/InvoiceCreate"}}},
+}})
+async def create_invoice(
+    background_tasks: BackgroundTasks,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    invoice_data: InvoiceCreate = Depends(parse_invoice_create),
+    db: Session = Depends(get_tenant_db)
+):
+    """Create and optionally submit an invoice"""
+    return await _create_invoice(background_tasks, current_tenant, invoice_data, db)
+
+
+async def _create_invoice(
+    background_tasks: BackgroundTasks,
+    current_tenant: Tenant,
+    invoice_data: InvoiceCreate,
+    db: Session
+) -> Invoice:
+    line_items = invoice_data.line_items
+    canonical = canonicalize(line_items, is_reverse_charge(invoice_data.supplier.vat_id, invoice_data.customer.vat_id))
     
-    for item in invoice_data.line_items:
-        subtotal += Decimal(item.line_total)
-        tax_total += Decimal(item.tax_amount)
+    transmission_number = None
+    if invoice_data.country_code.value in SEQUENCED_COUNTRIES:
+        transmission_number = get_sequence_allocator().next_value(
+            db, current_tenant.id, invoice_data.country_code, TRANSMISSION
+        )
     
-    total = subtotal + tax_total
+    # Reported, not refused: the client decides whether the earlier invoice is the one to keep
+    fingerprint = invoice_fingerprint(
+        invoice_data.supplier.vat_id, invoice_data.invoice_number, invoice_data.issue_date, canonical.total
+    )
+    duplicates = get_duplicate_detector()
     
     invoice = Invoice(
         external_id=invoice_data.external_id,
@@ -78,84 +235,213 @@ async def create_invoice(
         invoice_number=invoice_data.invoice_number,
         issue_date=invoice_data.issue_date,
         due_date=invoice_data.due_date,
-        subtotal=str(subtotal),
-        tax_amount=str(tax_total),
-        total_amount=str(total),
+        subtotal=str(canonical.subtotal),
+        tax_amount=str(canonical.tax_total),
+        total_amount=str(canonical.total),
         currency=invoice_data.currency,
-        supplier_data=invoice_data.supplier.dict(),
-        customer_data=invoice_data.customer.dict(),
-        line_items=[item.dict() for item in invoice_data.line_items],
+        supplier=get_or_create_party(db, current_tenant.id, invoice_data.supplier.model_dump()),
+        customer=get_or_create_party(db, current_tenant.id, invoice_data.customer.model_dump()),
+        line_items=line_items,
+        transmission_number=transmission_number,
+        fingerprint=fingerprint,
+        duplicate_of=duplicates.find(db, current_tenant.id, fingerprint),
         status=InvoiceStatus.DRAFT
     )
     
     db.add(invoice)
     db.commit()
     db.refresh(invoice)
+    duplicates.add(current_tenant.id, fingerprint)
     
     try:
-        ubl_xml = generate_ubl_xml(invoice)
+        with phase("render"):
+            ubl_xml = generate_ubl_xml(invoice, canonical)
         invoice.ubl_xml = ubl_xml
         invoice.status = InvoiceStatus.VALIDATED
         
-        if invoice_data.submit_immediately:
-            invoice.status = InvoiceStatus.SUBMITTED
-            
+        apply_invoice_to_rollups(db, invoice)
+        record_status_change(db, invoice)
         db.commit()
         db.refresh(invoice)
         
+        if invoice_data.submit_immediately:
+            await submit_with_retry(db, invoice, get_gateway_registry(), canonical)
+            db.commit()
+            db.refresh(invoice)
+        
     except Exception as e:
         invoice.status = InvoiceStatus.FAILED
         invoice.error_message = str(e)
+        update_invoice_rollups(db, invoice)
+        record_status_change(db, invoice)
         db.commit()
         db.refresh(invoice)
     
+    change_feed.notify()
+    _schedule_pdf(background_tasks, db, invoice)
     return invoice
 
 
-@app.get("/invoices/{invoice_id}", response_model=InvoiceResponse)
+@app.post("/invoices/import", response_model=InvoiceImportResponse, openapi_extra={"requestBody": {
+    "required": True,
+    "content": {
+        "application/xml": {"schema": {"type": "string", "format": "binary"}},
+        "application/zip": {"schema": {"type": "string", "format": "binary"}},
+    },
+}})
+async def import_invoices(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_tenant_db)
+):
+    """Create invoices from a UBL, XRechnung or FatturaPA document, or a ZIP archive of them"""
+    invoice_ids = []
+    errors = []
+    # Spooled to disk so neither the body nor its parse has to fit in memory
+    with tempfile.NamedTemporaryFile(prefix="vatevo-import-") as upload:
+        async for chunk in request.stream():
+            upload.write(chunk)
+        upload.flush()
+        
+        parsed_invoices = iter_upload(upload.name, settings.inbound_parse_workers)
+        try:
+            while (parsed := await asyncio.to_thread(next, parsed_invoices, None)) is not None:
+                if parsed.error is not None:
+                    errors.append(InvoiceImportError(
+                        document=parsed.document, index=parsed.index, errors=[parsed.error]
+                    ))
+                    continue
+                try:
+                    with phase("validation"):
+                        invoice_data = InvoiceCreate.model_validate(parsed.data)
+                except ValidationError as e:
+                    errors.append(InvoiceImportError(
+                        document=parsed.document, index=parsed.index,
+                        errors=[f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()]
+                    ))
+                    continue
+                invoice = await _create_invoice(background_tasks, current_tenant, invoice_data, db)
+                invoice_ids.append(invoice.id)
+        finally:
+            parsed_invoices.close()  # Stops archive workers if the request fails part way
+    
+    return InvoiceImportResponse(invoice_ids=invoice_ids, errors=errors)
+
+
+@app.get("/invoices/search", response_model=InvoiceSearchResponse, response_class=FastJSONResponse)
+async def search_invoice_index(
+    q: str = Query(..., min_length=MIN_TERM_LENGTH, max_length=200),
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_read_db)
+):
+    """Invoices whose number, party names or VAT IDs contain `q`, newest first"""
+    if len(q.strip()) < MIN_TERM_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Search terms need at least {MIN_TERM_LENGTH} characters"
+        )
+    
+    rows = search_invoices(db, current_tenant.id, q, cursor, limit + 1)
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return FastJSONResponse(serialize_invoice_page(rows[:limit], next_cursor))
+
+
+@app.get("/invoices/{invoice_id}", response_model=InvoiceResponse,
+         responses={304: {"description": "Unchanged since the ETag sent in If-None-Match"}})
 async def get_invoice(
     invoice_id: int,
     current_tenant: Tenant = Depends(get_current_tenant),
-    db: Session = Depends(get_db)
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_tenant_db)
 ):
     """Get invoice details"""
+    tenant_id = current_tenant.id
+    
+    # Read from the primary: what is loaded here is cached, and a lagging replica would cache a stale status
+    def render() -> Optional[bytes]:
+        row = invoice_response_query(db).filter(
+            Invoice.id == invoice_id,
+            Invoice.tenant_id == tenant_id
+        ).first()
+        if row is not None:
+            return serialize_invoice_row(row)
+        archived = load_archived_invoice(db, get_blob_store(), tenant_id, invoice_id)
+        return None if archived is None else InvoiceResponse.model_validate(archived).model_dump_json().encode()
+    
+    cached = get_invoice_cache().load((tenant_id, invoice_id), render)
+    if cached is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Invoice not found"
+        )
+    
+    # Clients may keep the body but must revalidate; status changes arrive without notice
+    headers = {"ETag": cached.etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
+
+
+@app.get("/invoices/{invoice_id}/pdf")
+async def download_invoice_pdf(
+    invoice_id: int,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_read_db)
+):
+    """Download the invoice's Factur-X PDF/A-3"""
     invoice = db.query(Invoice).filter(
         Invoice.id == invoice_id,
         Invoice.tenant_id == current_tenant.id
     ).first()
     
-    if not invoice:
+    if not invoice or not invoice.pdf_url:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Invoice not found"
+            detail="Invoice PDF not found"
         )
     
-    return invoice
+    return StreamingResponse(
+        iter_blob(get_blob_store(), pdf_key(invoice)),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'inline; filename="invoice-{invoice.id}.pdf"'}
+    )
 
 
-@app.get("/invoices", response_model=List[InvoiceResponse])
+@app.get("/invoices", response_model=List[InvoiceResponse], response_class=FastJSONResponse)
 async def list_invoices(
     skip: int = 0,
     limit: int = 100,
     status: InvoiceStatus = None,
+    issued_from: Optional[datetime] = None,
+    issued_to: Optional[datetime] = None,
     current_tenant: Tenant = Depends(get_current_tenant),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """List invoices for the current tenant"""
-    query = db.query(Invoice).filter(Invoice.tenant_id == current_tenant.id)
+    query = invoice_response_query(db).filter(Invoice.tenant_id == current_tenant.id)
     
     if status:
         query = query.filter(Invoice.status == status)
     
-    invoices = query.offset(skip).limit(limit).all()
-    return invoices
+    # Bounding issue_date lets PostgreSQL prune monthly invoice partitions
+    if issued_from:
+        query = query.filter(Invoice.issue_date >= issued_from)
+    if issued_to:
+        query = query.filter(Invoice.issue_date < issued_to)
+    
+    rows = query.offset(skip).limit(limit).all()
+    return FastJSONResponse(serialize_invoice_rows(rows))
 
 
 @app.post("/invoices/{invoice_id}/retry", response_model=InvoiceResponse)
 async def retry_invoice(
     invoice_id: int,
+    background_tasks: BackgroundTasks,
     current_tenant: Tenant = Depends(get_current_tenant),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_tenant_db)
 ):
     """Retry a failed invoice submission"""
     invoice = db.query(Invoice).filter(
@@ -176,20 +462,29 @@ async def retry_invoice(
         )
     
     try:
-        ubl_xml = generate_ubl_xml(invoice)
+        with phase("render"):
+            ubl_xml = generate_ubl_xml(invoice)
         invoice.ubl_xml = ubl_xml
         invoice.status = InvoiceStatus.VALIDATED
         invoice.error_message = None
+        invoice.retry_count = (invoice.retry_count or 0) + 1
+        invoice.next_attempt_at = None  # Taken over from the automatic schedule
         
+        apply_invoice_to_rollups(db, invoice)
+        record_status_change(db, invoice)
         db.commit()
         db.refresh(invoice)
         
     except Exception as e:
         invoice.status = InvoiceStatus.FAILED
         invoice.error_message = str(e)
+        update_invoice_rollups(db, invoice)
+        record_status_change(db, invoice)
         db.commit()
         db.refresh(invoice)
     
+    change_feed.notify()
+    _schedule_pdf(background_tasks, db, invoice)
     return invoice
 
 
@@ -200,10 +495,297 @@ async def validate_invoice(
 ):
     """Validate invoice data without creating an invoice"""
     try:
-        result = validate_invoice_data(validation_data)
-        return result
+        with phase("validation"):
+            return validate_invoice_data(validation_data)
     except Exception as e:
         return ValidationResult(
             valid=False,
             errors=[f"Validation error: {str(e)}"]
         )
+
+
+@app.get("/vat-ids/{vat_id}", response_model=VatIdCheckResult)
+async def verify_vat_id(
+    vat_id: str,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    vat_ids: VatIdService = Depends(get_vat_id_service)
+):
+    """Verify a VAT ID's format, checksum and registration"""
+    return await vat_ids.verify(vat_id)
+
+
+@app.post("/vat-ids/verify", response_model=VatIdBulkResponse)
+async def verify_vat_ids(
+    request: VatIdBulkRequest,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    vat_ids: VatIdService = Depends(get_vat_id_service)
+):
+    """Verify up to 1000 VAT IDs in one call"""
+    return VatIdBulkResponse(results=await vat_ids.verify_many(request.vat_ids))
+
+
+@app.get("/reports/vat", response_model=VatReportResponse)
+async def get_vat_report(
+    year: int,
+    quarter: Optional[int] = Query(None, ge=1, le=4),
+    month: Optional[int] = Query(None, ge=1, le=12),
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_read_db)
+):
+    """Taxable base and VAT per country and rate, for a year, quarter or month"""
+    if quarter and month:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Specify either quarter or month, not both"
+        )
+    
+    if month:
+        months = [month]
+    elif quarter:
+        months = list(range(quarter * 3 - 2, quarter * 3 + 1))
+    else:
+        months = list(range(1, 13))
+    
+    rows = vat_report(db, current_tenant.id, year, months)
+    return VatReportResponse(
+        year=year,
+        quarter=quarter,
+        month=month,
+        lines=[
+            VatReportLine(
+                country_code=country_code,
+                tax_rate=tax_rate,
+                currency=currency,
+                taxable_base=from_cents(taxable_cents),
+                tax_amount=from_cents(tax_cents),
+                invoice_count=invoice_count
+            )
+            for country_code, tax_rate, currency, taxable_cents, tax_cents, invoice_count in rows
+        ]
+    )
+
+
+@app.post("/gateways/{gateway}/receipts", response_model=ReceiptIngestResponse)
+async def ingest_gateway_receipts(
+    gateway: str,
+    request: Request,
+    x_gateway_token: str = Header(...),
+    db: Session = Depends(get_db),
+    shards: Dict[str, Session] = Depends(get_shard_sessions)
+):
+    """Apply ACK/NACK receipts pushed by a gateway as a JSON Lines body"""
+    if not hmac.compare_digest(x_gateway_token.encode(), settings.gateway_callback_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid gateway token")
+    if gateway not in get_gateway_registry().clients:
+        raise HTTPException(status_code=404, detail="Unknown gateway")
+    
+    stats = await ingest_receipt_stream(
+        db, request.stream(), gateway,
+        shards=shards, placement=lambda tenant_id: shard_map.lookup(db, tenant_id)
+    )
+    if stats.applied:
+        change_feed.notify()
+    if stats.deferred:
+        # The gateway redelivers the body; receipts applied this time are then ignored as replays
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Some receipts are for a tenant being moved, retry later",
+            headers={"Retry-After": str(settings.shard_map_refresh_seconds)}
+        )
+    return ReceiptIngestResponse(**vars(stats))
+
+
+@app.get("/events", response_model=EventFeedResponse)
+async def list_events(
+    after: int = 0,
+    wait: int = Query(0, ge=0, le=settings.change_feed_max_wait_seconds),
+    limit: int = Query(100, ge=1, le=1000),
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_tenant_db)
+):
+    """Invoice status changes after a cursor; with `wait`, long-poll until one arrives"""
+    tenant_id = current_tenant.id
+    queue = None
+    if wait:
+        change_feed.ensure_started(db.get_bind())
+        queue = change_feed.subscribe(tenant_id)
+    
+    try:
+        events = [EventResponse.model_validate(e) for e in fetch_events(db, tenant_id, after, limit)]
+        db.close()  # Release the connection before waiting
+        
+        if not events and queue is not None:
+            try:
+                events.append(await asyncio.wait_for(queue.get(), timeout=wait))
+                while not queue.empty() and len(events) < limit:
+                    events.append(queue.get_nowait())
+            except asyncio.TimeoutError:
+                pass
+            events = [event for event in events if event.id > after]
+    finally:
+        if queue is not None:
+            change_feed.unsubscribe(tenant_id, queue)
+    
+    return EventFeedResponse(
+        events=events,
+        next_cursor=events[-1].id if events else after
+    )
+
+
+@app.get("/events/stream")
+async def stream_events(
+    after: Optional[int] = None,
+    last_event_id: Optional[str] = Header(None),
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_tenant_db)
+):
+    """Server-sent events for invoice status changes, resumable via Last-Event-ID"""
+    tenant_id = current_tenant.id
+    if after is None:
+        after = int(last_event_id) if (last_event_id or "").isdigit() else 0
+    
+    bind = db.get_bind()
+    change_feed.ensure_started(bind)
+    queue = change_feed.subscribe(tenant_id)
+    backlog = []
+    try:
+        while True:
+            page = fetch_events(db, tenant_id, backlog[-1].id if backlog else after, 1000)
+            backlog.extend(EventResponse.model_validate(e) for e in page)
+            if len(page) < 1000:
+                break
+    except Exception:
+        change_feed.unsubscribe(tenant_id, queue)
+        raise
+    db.close()
+    
+    return StreamingResponse(
+        sse_events(change_feed, tenant_id, queue, backlog, after, settings.sse_heartbeat_seconds, bind),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _export_response(job: ExportJob) -> ExportResponse:
+    response = ExportResponse.model_validate(job)
+    if job.status == ExportStatus.COMPLETED:
+        response.download_url = f"/exports/{job.id}/download"
+    return response
+
+
+def _get_export(db: Session, export_id: int, tenant: Tenant) -> ExportJob:
+    job = db.query(ExportJob).filter(
+        ExportJob.id == export_id,
+        ExportJob.tenant_id == tenant.id
+    ).first()
+    
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Export not found"
+        )
+    
+    return job
+
+
+@app.post("/exports", response_model=ExportResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_export(
+    export_data: ExportCreate,
+    background_tasks: BackgroundTasks,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_tenant_db),
+    read_db: Session = Depends(get_read_db)
+):
+    """Start an export of all invoices and line items as compressed CSV"""
+    job = ExportJob(
+        tenant_id=current_tenant.id,
+        issued_from=export_data.issued_from,
+        issued_to=export_data.issued_to
+    )
+    
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    
+    # read_db was chosen before the job row was written, so the export itself does not pin the primary
+    background_tasks.add_task(run_export_job, db.get_bind(), job.id, get_blob_store(), read_db.get_bind())
+    return _export_response(job)
+
+
+@app.get("/exports/{export_id}", response_model=ExportResponse)
+async def get_export(
+    export_id: int,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_read_db)
+):
+    """Get export job status"""
+    return _export_response(_get_export(db, export_id, current_tenant))
+
+
+@app.get("/exports/{export_id}/download")
+async def download_export(
+    export_id: int,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_read_db)
+):
+    """Download a completed export artifact"""
+    job = _get_export(db, export_id, current_tenant)
+    
+    if job.status != ExportStatus.COMPLETED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Export is not completed"
+        )
+    
+    return StreamingResponse(
+        iter_blob(get_blob_store(), job.object_key),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="invoices-export-{job.id}.csv.gz"'}
+    )
+
+
+@app.get("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def capture_profile(
+    seconds: float = Query(10.0, gt=0, le=settings.profile_max_seconds),
+    interval_ms: float = Query(10.0, ge=1, le=1000)
+):
+    """Sample this worker's threads and its PDF workers; folded stacks for flamegraph.pl or speedscope"""
+    labels = {threading.get_ident(): "event-loop"}
+    try:
+        stacks = await asyncio.to_thread(get_profiler().capture, seconds, interval_ms / 1000, labels)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return PlainTextResponse(format_folded(stacks))
+
+
+def _slow_request_log() -> SlowRequestLog:
+    tracer = get_slow_request_tracer()
+    active = tracer.active
+    return SlowRequestLog(
+        tracing=active,
+        threshold_ms=tracer.threshold * 1000 if active else None,
+        requests=list(reversed(tracer.requests))
+    )
+
+
+@app.get("/admin/slow-requests", response_model=SlowRequestLog, dependencies=[Depends(require_admin)])
+async def list_slow_requests():
+    """Per-phase timings of this worker's recent requests over the tracing threshold"""
+    return _slow_request_log()
+
+
+@app.post("/admin/slow-requests/trace", response_model=SlowRequestLog, dependencies=[Depends(require_admin)])
+async def start_slow_request_tracing(
+    threshold_ms: float = Query(..., ge=0),
+    seconds: float = Query(300.0, gt=0, le=24 * 3600)
+):
+    """Trace requests slower than `threshold_ms` on this worker for the next `seconds`"""
+    get_slow_request_tracer().start(threshold_ms, seconds)
+    return _slow_request_log()
+
+
+@app.delete("/admin/slow-requests/trace", response_model=SlowRequestLog, dependencies=[Depends(require_admin)])
+async def stop_slow_request_tracing():
+    """Stop tracing; traces already recorded are kept"""
+    get_slow_request_tracer().stop()
+    return _slow_request_log()
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Enum, JSON
+from sqlalchemy import (
+    Column, Integer, BigInteger, String, DateTime, Text, Boolean, ForeignKey, Enum, JSON, Index, UniqueConstraint
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -24,19 +26,50 @@ class CountryCode(enum.Enum):
     AT = "AT"  # Austria
 
 
+class ExportStatus(enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
 class Tenant(Base):
     __tablename__ = "tenants"
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
-    api_key = Column(String(255), unique=True, index=True, nullable=False)
     webhook_url = Column(String(500), nullable=True)
     webhook_secret = Column(String(255), nullable=True)
     is_active = Column(Boolean, default=True)
+    shard = Column(String(64), nullable=True)  # Database holding the tenant's data, see app.sharding; NULL is the default
+    moving_to = Column(String(64), nullable=True)  # Set while the tenant is being moved; its writes are refused
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     invoices = relationship("Invoice", back_populates="tenant")
+    api_keys = relationship("ApiKey", back_populates="tenant")
+
+
+class ApiKey(Base):
+    __tablename__ = "api_keys"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    prefix = Column(String(16), index=True, nullable=False)  # Public lookup identifier, e.g. vat_1a2b3c4d
+    key_hash = Column(String(64), unique=True, nullable=False)  # HMAC-SHA256 of the full key with the server pepper
+    expires_at = Column(DateTime(timezone=True), nullable=True)  # Set when the key is rotated out
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    tenant = relationship("Tenant", back_populates="api_keys")
+
+
+class TenantTokenVersion(Base):
+    __tablename__ = "tenant_token_versions"
+    
+    # Only tenants that ever revoked their tokens have a row, so the table stays small
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 
 class Invoice(Base):
@@ -57,8 +90,12 @@ class Invoice(Base):
     total_amount = Column(String(20), nullable=False)
     currency = Column(String(3), default="EUR")
     
-    supplier_data = Column(JSON, nullable=False)  # Supplier/seller information
-    customer_data = Column(JSON, nullable=False)  # Customer/buyer information
+    # Supplier/seller and customer/buyer, shared across invoices through the parties table
+    supplier_id = Column(Integer, ForeignKey("parties.id"), nullable=True)
+    customer_id = Column(Integer, ForeignKey("parties.id"), nullable=True)
+    # Inline party JSON of invoices stored before the parties table, read when no party is linked
+    legacy_supplier_data = Column("supplier_data", JSON, nullable=True)
+    legacy_customer_data = Column("customer_data", JSON, nullable=True)
     
     line_items = Column(JSON, nullable=False)  # Array of invoice line items
     
@@ -66,10 +103,15 @@ class Invoice(Base):
     country_xml = Column(Text, nullable=True)  # Country-specific XML (FatturaPA, XRechnung, etc.)
     pdf_url = Column(String(500), nullable=True)  # S3 URL to PDF
     
-    submission_id = Column(String(255), nullable=True)  # Gateway submission ID
+    transmission_number = Column(BigInteger, nullable=True)  # Per-tenant progressive, e.g. ProgressivoInvio
+    submission_id = Column(String(255), nullable=True, index=True)  # Gateway submission ID; receipts match on it
     gateway_response = Column(JSON, nullable=True)  # ACK/NACK response
     error_message = Column(Text, nullable=True)
     retry_count = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True, index=True)  # Due time of the next automatic retry
+    vat_reported = Column(Boolean, default=False)  # Already counted in vat_rollups
+    fingerprint = Column(String(32), nullable=True)  # See app.duplicates; NULL if stored before detection
+    duplicate_of = Column(Integer, nullable=True)  # Earlier live invoice with the same fingerprint
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -77,12 +119,75 @@ class Invoice(Base):
     
     tenant = relationship("Tenant", back_populates="invoices")
     webhook_events = relationship("WebhookEvent", back_populates="invoice")
+    supplier = relationship("Party", foreign_keys=[supplier_id])
+    customer = relationship("Party", foreign_keys=[customer_id])
+    
+    @property
+    def supplier_data(self):
+        return self.supplier.data if self.supplier is not None else self.legacy_supplier_data
+    
+    @supplier_data.setter
+    def supplier_data(self, value):
+        self.legacy_supplier_data = value
+    
+    @property
+    def customer_data(self):
+        return self.customer.data if self.customer is not None else self.legacy_customer_data
+    
+    @customer_data.setter
+    def customer_data(self, value):
+        self.legacy_customer_data = value
+    
+    __table_args__ = (
+        # Range filters on issue_date also drive partition pruning on PostgreSQL
+        Index("ix_invoices_tenant_issue_date", "tenant_id", "issue_date"),
+        Index("ix_invoices_tenant_fingerprint", "tenant_id", "fingerprint"),
+        # Archived invoice ids must never be handed out again
+        {"sqlite_autoincrement": True},
+    )
+
+
+class Party(Base):
+    __tablename__ = "parties"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    content_hash = Column(String(64), nullable=False)  # SHA-256 of the canonical JSON of `data`
+    data = Column(JSON, nullable=False)  # Immutable; changed details are a new party
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "content_hash", name="uq_parties_tenant_hash"),
+    )
+
+
+class InvoiceSearch(Base):
+    __tablename__ = "invoice_search"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)  # Invoice.id
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    document = Column(Text, nullable=False)  # Lowercased number, party names and VAT IDs; see app.search
+    
+    __table_args__ = (
+        Index("ix_invoice_search_tenant_id_id", "tenant_id", "id"),
+    )
+
+
+class ArchivedInvoice(Base):
+    __tablename__ = "archived_invoices"
+    
+    id = Column(Integer, primary_key=True)  # Original Invoice.id
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False, index=True)
+    issue_date = Column(DateTime(timezone=True), nullable=False)
+    object_key = Column(String(500), nullable=False)  # Compressed JSONL batch in the blob store
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
 class WebhookEvent(Base):
     __tablename__ = "webhook_events"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True)  # Also the change feed cursor
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=True)
     invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False)
     event_type = Column(String(50), nullable=False)  # invoice.accepted, invoice.rejected, etc.
     payload = Column(JSON, nullable=False)
@@ -92,3 +197,79 @@ class WebhookEvent(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     invoice = relationship("Invoice", back_populates="webhook_events")
+    
+    __table_args__ = (
+        Index("ix_webhook_events_tenant_id_id", "tenant_id", "id"),
+    )
+
+
+class ExportJob(Base):
+    __tablename__ = "export_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False, index=True)
+    status = Column(Enum(ExportStatus), default=ExportStatus.PENDING)
+    format = Column(String(20), nullable=False, default="csv.gz")
+    issued_from = Column(DateTime(timezone=True), nullable=True)
+    issued_to = Column(DateTime(timezone=True), nullable=True)
+    
+    object_key = Column(String(500), nullable=True)  # Artifact in the blob store
+    row_count = Column(Integer, default=0)
+    error_message = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class DocumentSequence(Base):
+    __tablename__ = "document_sequences"
+    
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), primary_key=True)
+    country_code = Column(Enum(CountryCode), primary_key=True)
+    name = Column(String(50), primary_key=True)  # e.g. "transmission"
+    next_value = Column(BigInteger, nullable=False)  # First number not yet handed out or reserved
+
+
+class VatRollup(Base):
+    __tablename__ = "vat_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    country_code = Column(Enum(CountryCode), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    tax_rate = Column(String(10), nullable=False)  # Normalized decimal string, e.g. "22"
+    currency = Column(String(3), nullable=False)
+    
+    # Integer cents keep the incremental sums exact on every database
+    taxable_base_cents = Column(BigInteger, nullable=False, default=0)
+    tax_cents = Column(BigInteger, nullable=False, default=0)
+    invoice_count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        # Leading (tenant_id, year, month) also serves the report range query
+        UniqueConstraint("tenant_id", "year", "month", "country_code", "tax_rate", "currency",
+                         name="uq_vat_rollups_bucket"),
+    )
+
+
+class ArchivedVatRollup(Base):
+    __tablename__ = "archived_vat_rollups"
+    
+    # What archived invoices contributed to vat_rollups; rebuilds add it back
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    country_code = Column(Enum(CountryCode), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    tax_rate = Column(String(10), nullable=False)
+    currency = Column(String(3), nullable=False)
+    
+    taxable_base_cents = Column(BigInteger, nullable=False, default=0)
+    tax_cents = Column(BigInteger, nullable=False, default=0)
+    invoice_count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "year", "month", "country_code", "tax_rate", "currency",
+                         name="uq_archived_vat_rollups_bucket"),
+    )
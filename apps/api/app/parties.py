@@ -0,0 +1,99 @@
+"""Deduplicated invoice parties and their pre-rendered XML fragments.
+
+Suppliers and customers repeat across most of a tenant's invoices, so each
+distinct party is stored once in the parties table, keyed by a hash of its
+canonical JSON, and invoices reference it. A party row never changes: new
+details hash differently and become a new row, so older invoices keep the
+party exactly as it was when they were issued.
+
+Because the content hash identifies the data, the escaped XML fragment a
+format renders for a party can be cached by (hash, kind) and reused by
+every invoice that references it; rendering an invoice then only formats
+its header and lines.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Party
+
+
+def party_hash(data: dict) -> str:
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def get_or_create_party(db: Session, tenant_id: int, data: dict) -> Party:
+    """Return the tenant's party with exactly this data, inserting it on first use; caller commits"""
+    content_hash = party_hash(data)
+    party = db.query(Party).filter(Party.tenant_id == tenant_id, Party.content_hash == content_hash).first()
+    if party is not None:
+        return party
+
+    dialect = db.get_bind().dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        raise NotImplementedError(f"Parties are not supported on {dialect}")
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    # Concurrent requests may insert the same party; the loser reads the winner's row
+    db.execute(insert(Party.__table__).values(
+        tenant_id=tenant_id, content_hash=content_hash, data=data
+    ).on_conflict_do_nothing(index_elements=["tenant_id", "content_hash"]))
+    return db.query(Party).filter(Party.tenant_id == tenant_id, Party.content_hash == content_hash).one()
+
+
+class FragmentCache:
+    """Bounded LRU of rendered party fragments keyed by (content hash, kind)"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str], render: Callable[[], str]) -> str:
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+
+        fragment = render()
+        with self._lock:
+            self._entries[key] = fragment
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+fragment_cache = FragmentCache(settings.party_fragment_cache_size)
+
+
+def party_fragment(invoice, role: str, kind: str, render: Callable[[dict], str]) -> str:
+    """Render the invoice's `role` ("supplier" or "customer") party, cached when it is a stored party
+
+    `kind` names the format and anything else `render` depends on besides
+    the party data, e.g. "cii:SellerTradeParty:FR". Legacy invoices with
+    inline party JSON and plain snapshots are rendered every time.
+    """
+    party = getattr(invoice, role, None)
+    if not isinstance(party, Party):
+        return render(getattr(invoice, f"{role}_data"))
+    return fragment_cache.get((party.content_hash, kind), lambda: render(party.data))
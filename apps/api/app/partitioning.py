@@ -0,0 +1,127 @@
+"""Monthly range partitioning of the invoices table on PostgreSQL.
+
+Migration 0011 converts the table; these functions keep its monthly
+partitions ahead of new invoices and drop them once archival has emptied
+them. Invoices dated past the last monthly partition land in the default
+partition until their month is created, and are moved into it then. Other
+databases keep a plain invoices table and every function here is a no-op
+for them, so development and tests on SQLite are unaffected.
+"""
+import logging
+import re
+from datetime import date, datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+PARTITION_NAME = re.compile(r"^invoices_y(\d{4})m(\d{2})$")
+DEFAULT_PARTITION = "invoices_default"
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"invoices_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_ddl(month: date) -> str:
+    start = month_start(month)
+    end = add_months(start, 1)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF invoices "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+def is_partitioned(conn: Connection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('invoices')"
+    )).first() is not None
+
+
+def list_partitions(conn: Connection) -> List[date]:
+    rows = conn.execute(text(
+        "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'invoices'::regclass"
+    )).scalars()
+    months = []
+    for name in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def create_partition(conn: Connection, month: date) -> None:
+    """Create one monthly partition, moving its rows out of the default partition
+
+    PostgreSQL refuses a partition whose range matches rows already in the
+    default one, so the default is detached while the rows move. Run it in a
+    transaction: the default is attached again before it commits.
+    """
+    start = month_start(month)
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}).scalar() is None:
+        conn.execute(text(partition_ddl(start)))
+        return
+    bounds = {"start": start, "end": add_months(start, 1)}
+    in_month = "issue_date >= :start AND issue_date < :end"
+    conn.execute(text(f"ALTER TABLE invoices DETACH PARTITION {DEFAULT_PARTITION}"))
+    conn.execute(text(partition_ddl(start)))
+    conn.execute(text(f"INSERT INTO invoices SELECT * FROM {DEFAULT_PARTITION} WHERE {in_month}"), bounds)
+    conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_month}"), bounds)
+    conn.execute(text(f"ALTER TABLE invoices ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+
+def ensure_invoice_partitions(engine: Engine, months_ahead: int = 3, start: Optional[date] = None) -> List[str]:
+    """Create the missing monthly partitions from `start` (default: this month) up to `months_ahead`
+
+    Each month is created in its own transaction; one that fails is logged
+    and skipped so the others are still created.
+    """
+    created = []
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            return created
+        existing = set(list_partitions(conn))
+    first = month_start(start or datetime.now(timezone.utc).date())
+    for offset in range(months_ahead + 1):
+        month = add_months(first, offset)
+        if month in existing:
+            continue
+        try:
+            with engine.begin() as conn:
+                create_partition(conn, month)
+        except SQLAlchemyError:
+            logger.exception("Could not create invoice partition %s", partition_name(month))
+            continue
+        created.append(partition_name(month))
+    return created
+
+
+def drop_empty_partitions(engine: Engine, before: date) -> List[str]:
+    """Drop monthly partitions older than `before` once archival has emptied them"""
+    dropped = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return dropped
+        for month in list_partitions(conn):
+            if month >= month_start(before):
+                continue
+            name = partition_name(month)
+            if conn.execute(text(f"SELECT 1 FROM {name} LIMIT 1")).first() is None:
+                conn.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+    return dropped
+
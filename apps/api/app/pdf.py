@@ -0,0 +1,559 @@
+"""Minimal PDF/A-3b writer for invoices carrying an embedded Factur-X XML.
+
+Only what invoice rendering needs is implemented: a single TrueType font,
+embedded and subset to the glyphs in use (or the standard Courier font when
+none is configured), an sRGB output intent, XMP metadata and factur-x.xml as
+the associated file. The module uses the standard library only, so render
+workers can import it without loading the rest of the application.
+"""
+import hashlib
+import re
+import struct
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+FACTURX_FILENAME = "factur-x.xml"
+FACTURX_CONFORMANCE_LEVEL = "EN 16931"
+PRODUCER = "Vatevo"
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+
+_WINANSI_CODES = range(32, 256)
+
+
+def _checksum(data: bytes) -> int:
+    data += b"\0" * (-len(data) % 4)
+    return sum(struct.unpack(f">{len(data) // 4}I", data)) & 0xFFFFFFFF
+
+
+def _build_sfnt(tables: Dict[bytes, bytes]) -> bytes:
+    tags = sorted(tables)
+    entry_selector = len(tags).bit_length() - 1
+    search_range = (1 << entry_selector) * 16
+    header = struct.pack(">IHHHH", 0x00010000, len(tags), search_range, entry_selector,
+                         len(tags) * 16 - search_range)
+    offset = len(header) + 16 * len(tags)
+    directory, body = bytearray(), bytearray()
+    head_offset = 0
+    for tag in tags:
+        data = tables[tag]
+        if tag == b"head":
+            head_offset = offset + len(body)
+        directory += struct.pack(">4sIII", tag, _checksum(data), offset + len(body), len(data))
+        body += data + b"\0" * (-len(data) % 4)
+    font = bytearray(header + directory + body)
+    adjustment = (0xB1B0AFBA - _checksum(bytes(font))) & 0xFFFFFFFF
+    font[head_offset + 8:head_offset + 12] = struct.pack(">I", adjustment)
+    return bytes(font)
+
+
+def _glyph_components(glyph: bytes) -> Iterator[int]:
+    """Glyph ids referenced by a composite glyph"""
+    if len(glyph) < 10 or struct.unpack(">h", glyph[:2])[0] >= 0:
+        return
+    position = 10
+    while True:
+        flags, glyph_id = struct.unpack(">HH", glyph[position:position + 4])
+        yield glyph_id
+        position += 4 + (4 if flags & 0x0001 else 2)
+        if flags & 0x0008:
+            position += 2
+        elif flags & 0x0040:
+            position += 4
+        elif flags & 0x0080:
+            position += 8
+        if not flags & 0x0020:
+            return
+
+
+class TrueTypeFont:
+    """Metrics and a glyph subsetter for a TrueType font, parsed once per process"""
+
+    KEEP_TABLES = (b"OS/2", b"cmap", b"cvt ", b"fpgm", b"glyf", b"head",
+                   b"hhea", b"hmtx", b"loca", b"maxp", b"post", b"prep")
+
+    def __init__(self, data: bytes):
+        self.tables: Dict[bytes, bytes] = {}
+        for i in range(struct.unpack(">H", data[4:6])[0]):
+            tag, _, offset, length = struct.unpack(">4sIII", data[12 + 16 * i:28 + 16 * i])
+            self.tables[tag] = data[offset:offset + length]
+        if b"glyf" not in self.tables:
+            raise ValueError("Only TrueType-outline fonts can be embedded")
+
+        head = self.tables[b"head"]
+        self.units_per_em = struct.unpack(">H", head[18:20])[0]
+        self.bbox = [self._scale(v) for v in struct.unpack(">4h", head[36:44])]
+        self._long_loca = struct.unpack(">h", head[50:52])[0] == 1
+        hhea = self.tables[b"hhea"]
+        ascent, descent = struct.unpack(">hh", hhea[4:8])
+        self.ascent, self.descent = self._scale(ascent), self._scale(descent)
+        hmetrics = struct.unpack(">H", hhea[34:36])[0]
+        self.num_glyphs = struct.unpack(">H", self.tables[b"maxp"][4:6])[0]
+        self._advances = struct.unpack(f">{hmetrics * 2}H", self.tables[b"hmtx"][:hmetrics * 4])[::2]
+
+        self.cap_height = self.ascent
+        os2 = self.tables.get(b"OS/2")
+        if os2 and struct.unpack(">H", os2[:2])[0] >= 2 and len(os2) >= 90:
+            self.cap_height = self._scale(struct.unpack(">h", os2[88:90])[0])
+        post = self.tables.get(b"post")
+        self.italic_angle = struct.unpack(">i", post[4:8])[0] / 65536 if post else 0
+
+        self.name = self._postscript_name()
+        self._cmap = self._unicode_cmap()
+        self.glyph_ids = {code: self._cmap.get(ord(bytes([code]).decode("cp1252", "replace")), 0)
+                          for code in _WINANSI_CODES}
+        self.widths = {code: self._scale(self._advance(gid)) for code, gid in self.glyph_ids.items()}
+
+    @classmethod
+    def load(cls, path: str) -> "TrueTypeFont":
+        return cls(Path(path).read_bytes())
+
+    def _scale(self, value: int) -> int:
+        return round(value * 1000 / self.units_per_em)
+
+    def _advance(self, glyph_id: int) -> int:
+        return self._advances[min(glyph_id, len(self._advances) - 1)]
+
+    def _postscript_name(self) -> str:
+        table = self.tables.get(b"name", b"")
+        if len(table) >= 6:
+            count, strings = struct.unpack(">HH", table[2:6])
+            for i in range(count):
+                platform, _, _, name_id, length, offset = struct.unpack(">6H", table[6 + 12 * i:18 + 12 * i])
+                if name_id == 6:
+                    raw = table[strings + offset:strings + offset + length]
+                    name = raw.decode("utf-16-be" if platform in (0, 3) else "latin-1", "ignore")
+                    return re.sub(r"[^A-Za-z0-9-]", "", name) or "Embedded"
+        return "Embedded"
+
+    def _unicode_cmap(self) -> Dict[int, int]:
+        cmap = self.tables[b"cmap"]
+        for i in range(struct.unpack(">H", cmap[2:4])[0]):
+            platform, encoding, offset = struct.unpack(">HHI", cmap[4 + 8 * i:12 + 8 * i])
+            if (platform, encoding) in ((3, 1), (0, 3)) and struct.unpack(">H", cmap[offset:offset + 2])[0] == 4:
+                return self._parse_cmap_format4(cmap, offset)
+        raise ValueError("Font has no Unicode BMP cmap")
+
+    @staticmethod
+    def _parse_cmap_format4(cmap: bytes, offset: int) -> Dict[int, int]:
+        segments = struct.unpack(">H", cmap[offset + 6:offset + 8])[0] // 2
+        ends_at = offset + 14
+        starts_at = ends_at + 2 * segments + 2
+        deltas_at = starts_at + 2 * segments
+        ranges_at = deltas_at + 2 * segments
+        ends = struct.unpack(f">{segments}H", cmap[ends_at:starts_at - 2])
+        starts = struct.unpack(f">{segments}H", cmap[starts_at:deltas_at])
+        deltas = struct.unpack(f">{segments}h", cmap[deltas_at:ranges_at])
+        range_offsets = struct.unpack(f">{segments}H", cmap[ranges_at:ranges_at + 2 * segments])
+
+        mapping = {}
+        for i in range(segments):
+            for code in range(starts[i], min(ends[i], 0xFFFE) + 1):
+                if range_offsets[i] == 0:
+                    glyph_id = (code + deltas[i]) & 0xFFFF
+                else:
+                    position = ranges_at + 2 * i + range_offsets[i] + 2 * (code - starts[i])
+                    glyph_id = struct.unpack(">H", cmap[position:position + 2])[0]
+                    glyph_id = (glyph_id + deltas[i]) & 0xFFFF if glyph_id else 0
+                if glyph_id:
+                    mapping[code] = glyph_id
+        return mapping
+
+    def _loca(self) -> List[int]:
+        loca = self.tables[b"loca"]
+        if self._long_loca:
+            return list(struct.unpack(f">{self.num_glyphs + 1}I", loca[:4 * (self.num_glyphs + 1)]))
+        return [2 * v for v in struct.unpack(f">{self.num_glyphs + 1}H", loca[:2 * (self.num_glyphs + 1)])]
+
+    def subset(self, codes: Iterable[int]) -> bytes:
+        """A font program with outlines only for the given WinAnsi codes.
+
+        Glyph ids are kept so the font's cmap and metrics stay valid; unused
+        glyphs are emptied and layout tables (GSUB, GPOS, kern...) dropped.
+        """
+        loca, glyf = self._loca(), self.tables[b"glyf"]
+        keep = {0} | {self.glyph_ids.get(code, 0) for code in codes}
+        pending = list(keep)
+        while pending:
+            glyph_id = pending.pop()
+            for component in _glyph_components(glyf[loca[glyph_id]:loca[glyph_id + 1]]):
+                if component not in keep and component < self.num_glyphs:
+                    keep.add(component)
+                    pending.append(component)
+
+        new_glyf, new_loca = bytearray(), [0]
+        for glyph_id in range(self.num_glyphs):
+            if glyph_id in keep:
+                new_glyf += glyf[loca[glyph_id]:loca[glyph_id + 1]]
+                new_glyf += b"\0" * (-len(new_glyf) % 4)
+            new_loca.append(len(new_glyf))
+
+        tables = {tag: self.tables[tag] for tag in self.KEEP_TABLES if tag in self.tables}
+        tables[b"glyf"] = bytes(new_glyf)
+        tables[b"loca"] = struct.pack(f">{len(new_loca)}I", *new_loca)
+        head = bytearray(tables[b"head"])
+        head[50:52] = struct.pack(">h", 1)  # Long loca offsets
+        tables[b"head"] = bytes(head)
+        return _build_sfnt(tables)
+
+
+def srgb_icc_profile() -> bytes:
+    """A compact ICC v2 display profile for sRGB, used as the PDF/A output intent"""
+    def s15(value: float) -> bytes:
+        return struct.pack(">i", round(value * 65536))
+
+    def xyz(x: float, y: float, z: float) -> bytes:
+        return b"XYZ \0\0\0\0" + s15(x) + s15(y) + s15(z)
+
+    description = b"sRGB IEC61966-2.1\0"
+    gamma = b"curv\0\0\0\0" + struct.pack(">IH", 1, round(2.2 * 256)) + b"\0\0"
+    tags = [
+        (b"desc", b"desc\0\0\0\0" + struct.pack(">I", len(description)) + description + b"\0" * 78),
+        (b"cprt", b"text\0\0\0\0No copyright, use freely\0"),
+        (b"wtpt", xyz(0.9642, 1.0, 0.8249)),
+        (b"rXYZ", xyz(0.4361, 0.2225, 0.0139)),
+        (b"gXYZ", xyz(0.3851, 0.7169, 0.0971)),
+        (b"bXYZ", xyz(0.1431, 0.0606, 0.7141)),
+        (b"rTRC", gamma),
+        (b"gTRC", gamma),
+        (b"bTRC", gamma),
+    ]
+
+    offset = 128 + 4 + 12 * len(tags)
+    table, data = bytearray(struct.pack(">I", len(tags))), bytearray()
+    for signature, body in tags:
+        table += struct.pack(">4sII", signature, offset + len(data), len(body))
+        data += body + b"\0" * (-len(body) % 4)
+    size = offset + len(data)
+    header = (
+        struct.pack(">I", size) + b"\0\0\0\0" + struct.pack(">I", 0x02100000)
+        + b"mntrRGB XYZ " + struct.pack(">6H", 2024, 1, 1, 0, 0, 0) + b"acsp"
+        + b"\0" * 24 + struct.pack(">I", 0) + s15(0.9642) + s15(1.0) + s15(0.8249)
+        + b"\0" * 48
+    )
+    return header + bytes(table) + bytes(data)
+
+
+class PdfAssets:
+    """Font and colour profile shared by every PDF a process renders"""
+
+    def __init__(self, font: Optional[TrueTypeFont] = None):
+        self.font = font
+        self.icc_profile = zlib.compress(srgb_icc_profile())
+
+    @classmethod
+    def load(cls, font_path: Optional[str] = None) -> "PdfAssets":
+        return cls(TrueTypeFont.load(font_path) if font_path else None)
+
+    def text_width(self, encoded: bytes, size: float) -> float:
+        if self.font is None:
+            return len(encoded) * 600 * size / 1000  # Courier is monospaced
+        return sum(self.font.widths.get(code, 0) for code in encoded) * size / 1000
+
+
+def _pdf_bytes(value: bytes) -> bytes:
+    return value.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").replace(b"\r", b"\\r")
+
+
+def _text_string(value: str) -> str:
+    """Text string in UTF-16BE hex form, safe for any characters"""
+    return "<FEFF" + value.encode("utf-16-be").hex().upper() + ">"
+
+
+def _pdf_date(moment: datetime) -> str:
+    return moment.strftime("D:%Y%m%d%H%M%S+00'00'")
+
+
+def _xml_text(value: str) -> str:
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+class _Layout:
+    """Collects page content streams and the WinAnsi codes they use"""
+
+    def __init__(self, assets: PdfAssets):
+        self.assets = assets
+        self.pages: List[List[bytes]] = []
+        self.used_codes = set()
+        self.new_page()
+
+    def new_page(self) -> None:
+        self.ops = [b"0 0 0 rg 0 0 0 RG 0.5 w"]
+        self.pages.append(self.ops)
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def fit(self, text: str, size: float, width: float) -> bytes:
+        encoded = text.encode("cp1252", "replace")
+        if self.assets.text_width(encoded, size) <= width:
+            return encoded
+        while encoded and self.assets.text_width(encoded + b"...", size) > width:
+            encoded = encoded[:-1]
+        return encoded + b"..."
+
+    def text(self, x: float, y: float, text: str, size: float = 9, align: str = "left",
+             width: float = PAGE_WIDTH - 2 * MARGIN) -> None:
+        encoded = self.fit(text, size, width)
+        self.used_codes.update(encoded)
+        if align == "right":
+            x -= self.assets.text_width(encoded, size)
+        self.ops.append(b"BT /F1 %.1f Tf %.2f %.2f Td (%s) Tj ET" % (size, x, y, _pdf_bytes(encoded)))
+
+    def rule(self, y: float) -> None:
+        self.ops.append(b"%d %.2f m %d %.2f l S" % (MARGIN, y, PAGE_WIDTH - MARGIN, y))
+
+
+_COLUMNS = ((MARGIN, "Description", "left"), (330, "Qty", "right"), (410, "Unit price", "right"),
+            (465, "VAT %", "right"), (PAGE_WIDTH - MARGIN, "Net", "right"))
+
+
+def _table_header(layout: _Layout) -> None:
+    for x, title, align in _COLUMNS:
+        layout.text(x, layout.y, title, 9, align)
+    layout.rule(layout.y - 4)
+    layout.y -= 18
+
+
+def _party_block(layout: _Layout, x: float, y: float, title: str, party: dict) -> float:
+    lines = [party.get("name", ""), party.get("address", ""),
+             f"{party.get('postal_code', '')} {party.get('city', '')}".strip(), party.get("country", "")]
+    if party.get("vat_id"):
+        lines.append(f"VAT ID: {party['vat_id']}")
+    layout.text(x, y, title, 8)
+    for line in lines:
+        y -= 12
+        layout.text(x, y, line, 9, width=230)
+    return y
+
+
+def layout_invoice(invoice: dict, assets: PdfAssets) -> _Layout:
+    layout = _Layout(assets)
+    currency = invoice["currency"]
+    right = PAGE_WIDTH - MARGIN
+
+    layout.text(MARGIN, layout.y, "INVOICE", 18)
+    layout.text(right, layout.y, f"No. {invoice['invoice_number']}", 10, "right", 250)
+    layout.text(right, layout.y - 14, f"Issue date: {invoice['issue_date']:%Y-%m-%d}", 9, "right")
+    if invoice.get("due_date"):
+        layout.text(right, layout.y - 26, f"Due date: {invoice['due_date']:%Y-%m-%d}", 9, "right")
+
+    top = layout.y - 50
+    bottom = min(_party_block(layout, MARGIN, top, "FROM", invoice["supplier_data"]),
+                 _party_block(layout, 320, top, "BILL TO", invoice["customer_data"]))
+    layout.y = bottom - 36
+    _table_header(layout)
+
+    for item in invoice["line_items"]:
+        if layout.y < MARGIN + 40:
+            layout.new_page()
+            _table_header(layout)
+        layout.text(MARGIN, layout.y, str(item["description"]), 9, width=220)
+        layout.text(330, layout.y, str(item["quantity"]), 9, "right")
+        layout.text(410, layout.y, str(item["unit_price"]), 9, "right")
+        layout.text(465, layout.y, str(item["tax_rate"]), 9, "right")
+        layout.text(right, layout.y, str(item["line_total"]), 9, "right")
+        layout.y -= 14
+
+    if layout.y < MARGIN + 80:
+        layout.new_page()
+    layout.rule(layout.y + 6)
+    for label, amount, size in (("Subtotal", invoice["subtotal"], 9), ("VAT", invoice["tax_amount"], 9),
+                                (f"Total ({currency})", invoice["total_amount"], 11)):
+        layout.y -= 14
+        layout.text(410, layout.y, label, size, "right")
+        layout.text(right, layout.y, str(amount), size, "right")
+
+    for number, ops in enumerate(layout.pages, 1):
+        footer = f"Factur-X {FACTURX_CONFORMANCE_LEVEL} - structured invoice data is embedded as {FACTURX_FILENAME}"
+        layout.ops = ops
+        layout.text(MARGIN, MARGIN - 20, footer, 7)
+        layout.text(right, MARGIN - 20, f"Page {number} of {len(layout.pages)}", 7, "right")
+    return layout
+
+
+def _xmp_metadata(title: str, created: str) -> bytes:
+    fx_properties = "".join(
+        f'<rdf:li rdf:parseType="Resource"><pdfaProperty:name>{name}</pdfaProperty:name>'
+        f"<pdfaProperty:valueType>Text</pdfaProperty:valueType>"
+        f"<pdfaProperty:category>external</pdfaProperty:category>"
+        f"<pdfaProperty:description>{description}</pdfaProperty:description></rdf:li>"
+        for name, description in (
+            ("DocumentFileName", "Name of the embedded XML invoice file"),
+            ("DocumentType", "INVOICE"),
+            ("Version", "Version of the Factur-X XML schema"),
+            ("ConformanceLevel", "Conformance level of the embedded XML invoice"),
+        )
+    )
+    return f"""<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<rdf:Description rdf:about="" xmlns:pdfaid="http://www.aiim.org/pdfa/ns/id/">
+<pdfaid:part>3</pdfaid:part><pdfaid:conformance>B</pdfaid:conformance>
+</rdf:Description>
+<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:title><rdf:Alt><rdf:li xml:lang="x-default">{_xml_text(title)}</rdf:li></rdf:Alt></dc:title>
+</rdf:Description>
+<rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/">
+<xmp:CreatorTool>{PRODUCER}</xmp:CreatorTool><xmp:CreateDate>{created}</xmp:CreateDate><xmp:ModifyDate>{created}</xmp:ModifyDate>
+</rdf:Description>
+<rdf:Description rdf:about="" xmlns:pdf="http://ns.adobe.com/pdf/1.3/">
+<pdf:Producer>{PRODUCER}</pdf:Producer>
+</rdf:Description>
+<rdf:Description rdf:about="" xmlns:pdfaExtension="http://www.aiim.org/pdfa/ns/extension/" xmlns:pdfaSchema="http://www.aiim.org/pdfa/ns/schema#" xmlns:pdfaProperty="http://www.aiim.org/pdfa/ns/property#">
+<pdfaExtension:schemas><rdf:Bag><rdf:li rdf:parseType="Resource">
+<pdfaSchema:schema>Factur-X PDFA Extension Schema</pdfaSchema:schema>
+<pdfaSchema:namespaceURI>urn:factur-x:pdfa:CrossIndustryDocument:invoice:1p0#</pdfaSchema:namespaceURI>
+<pdfaSchema:prefix>fx</pdfaSchema:prefix>
+<pdfaSchema:property><rdf:Seq>{fx_properties}</rdf:Seq></pdfaSchema:property>
+</rdf:li></rdf:Bag></pdfaExtension:schemas>
+</rdf:Description>
+<rdf:Description rdf:about="" xmlns:fx="urn:factur-x:pdfa:CrossIndustryDocument:invoice:1p0#">
+<fx:DocumentType>INVOICE</fx:DocumentType><fx:DocumentFileName>{FACTURX_FILENAME}</fx:DocumentFileName>
+<fx:Version>1.0</fx:Version><fx:ConformanceLevel>{FACTURX_CONFORMANCE_LEVEL}</fx:ConformanceLevel>
+</rdf:Description>
+</rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>""".encode("utf-8")
+
+
+class _Document:
+    def __init__(self):
+        self.objects: List[Optional[bytes]] = []
+
+    def reserve(self) -> int:
+        self.objects.append(None)
+        return len(self.objects)
+
+    def add(self, body: bytes, number: Optional[int] = None) -> int:
+        if number is None:
+            number = self.reserve()
+        self.objects[number - 1] = body
+        return number
+
+    def stream(self, dictionary: str, data: bytes, compress: bool = True) -> int:
+        if compress:
+            data = zlib.compress(data)
+            dictionary += " /Filter /FlateDecode"
+        return self.add(f"<< {dictionary} /Length {len(data)} >>\nstream\n".encode() + data + b"\nendstream")
+
+    def serialize(self, root: int, info: int, document_id: str) -> bytes:
+        out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(self.objects, 1):
+            offsets.append(len(out))
+            out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.objects) + 1)
+        out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+        out += (
+            f"trailer\n<< /Size {len(self.objects) + 1} /Root {root} 0 R /Info {info} 0 R "
+            f"/ID [<{document_id}> <{document_id}>] >>\nstartxref\n{xref}\n%%EOF\n"
+        ).encode()
+        return bytes(out)
+
+
+def _font_object(document: _Document, assets: PdfAssets, used_codes: set) -> int:
+    font = assets.font
+    if font is None:
+        return document.add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>")
+
+    program = font.subset(used_codes)
+    tag = "".join(chr(65 + b % 26) for b in hashlib.md5(bytes(sorted(used_codes))).digest()[:6])
+    base_font = f"{tag}+{font.name}"
+    font_file = document.stream(f"/Length1 {len(program)}", program)
+    descriptor = document.add(
+        f"<< /Type /FontDescriptor /FontName /{base_font} /Flags 32 "
+        f"/FontBBox [{' '.join(map(str, font.bbox))}] /ItalicAngle {font.italic_angle:g} "
+        f"/Ascent {font.ascent} /Descent {font.descent} /CapHeight {font.cap_height} "
+        f"/StemV 80 /FontFile2 {font_file} 0 R >>".encode()
+    )
+    widths = " ".join(str(font.widths[code]) for code in _WINANSI_CODES)
+    return document.add(
+        f"<< /Type /Font /Subtype /TrueType /BaseFont /{base_font} /FirstChar 32 /LastChar 255 "
+        f"/Widths [{widths}] /Encoding /WinAnsiEncoding /FontDescriptor {descriptor} 0 R >>".encode()
+    )
+
+
+def render_invoice_pdf(invoice: dict, xml: bytes, assets: PdfAssets,
+                       created_at: Optional[datetime] = None) -> bytes:
+    """Render an invoice snapshot as PDF/A-3b with `xml` attached as factur-x.xml"""
+    created_at = (created_at or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    pdf_date = _pdf_date(created_at)
+    title = f"Invoice {invoice['invoice_number']}"
+    layout = layout_invoice(invoice, assets)
+
+    document = _Document()
+    catalog = document.reserve()
+    pages = document.reserve()
+    metadata = document.stream("/Type /Metadata /Subtype /XML",
+                               _xmp_metadata(title, created_at.strftime("%Y-%m-%dT%H:%M:%S+00:00")),
+                               compress=False)
+    profile = document.add(
+        f"<< /N 3 /Filter /FlateDecode /Length {len(assets.icc_profile)} >>\nstream\n".encode()
+        + assets.icc_profile + b"\nendstream"
+    )
+    embedded = document.stream(
+        f"/Type /EmbeddedFile /Subtype /text#2Fxml /Params << /Size {len(xml)} /ModDate ({pdf_date}) >>", xml
+    )
+    filespec = document.add(
+        f"<< /Type /Filespec /F ({FACTURX_FILENAME}) /UF {_text_string(FACTURX_FILENAME)} "
+        f"/Desc (Factur-X invoice) /AFRelationship /Data "
+        f"/EF << /F {embedded} 0 R /UF {embedded} 0 R >> >>".encode()
+    )
+    font = _font_object(document, assets, layout.used_codes)
+
+    kids = []
+    for ops in layout.pages:
+        contents = document.stream("", b"\n".join(ops))
+        kids.append(document.add(
+            f"<< /Type /Page /Parent {pages} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {contents} 0 R >>".encode()
+        ))
+    document.add(
+        f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>".encode(),
+        pages
+    )
+    document.add(
+        f"<< /Type /Catalog /Pages {pages} 0 R /Metadata {metadata} 0 R "
+        f"/OutputIntents [<< /Type /OutputIntent /S /GTS_PDFA1 "
+        f"/OutputConditionIdentifier (sRGB IEC61966-2.1) /Info (sRGB IEC61966-2.1) "
+        f"/DestOutputProfile {profile} 0 R >>] "
+        f"/Names << /EmbeddedFiles << /Names [({FACTURX_FILENAME}) {filespec} 0 R] >> >> "
+        f"/AF [{filespec} 0 R] /PageMode /UseAttachments >>".encode(),
+        catalog
+    )
+    info = document.add(
+        f"<< /Title {_text_string(title)} /Creator ({PRODUCER}) /Producer ({PRODUCER}) "
+        f"/CreationDate ({pdf_date}) /ModDate ({pdf_date}) >>".encode()
+    )
+    document_id = hashlib.md5(xml + pdf_date.encode()).hexdigest().upper()
+    return document.serialize(catalog, info, document_id)
+
+
+# Entry points for render worker processes (see app.rendering). They live here
+# so spawned workers import only this module, not the application.
+_worker_assets: Optional[PdfAssets] = None
+
+
+def init_worker(font_path: Optional[str] = None, memory_limit_mb: int = 0) -> None:
+    global _worker_assets
+    if memory_limit_mb:
+        import resource
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    _worker_assets = PdfAssets.load(font_path)
+
+
+def render_in_worker(invoice: dict, xml: bytes) -> bytes:
+    return render_invoice_pdf(invoice, xml, _worker_assets)
+
+
+def peak_rss_kb() -> int:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def worker_ready() -> bool:
+    return _worker_assets is not None
@@ -0,0 +1,348 @@
+"""Live profiling of a running API worker, driven from the /admin endpoints.
+
+Two tools, both idle until an operator switches them on:
+
+* A sampling profiler. For a fixed number of seconds a thread records the
+  stack of every other thread in the process at a fixed interval: the event
+  loop, the to_thread pool and, when PDFs render in-process, the renderer.
+  Rendering worker processes run their own sampler thread. It wakes four
+  times a second to check a deadline in shared memory and writes its stacks
+  to a file the API process merges. The result uses the folded format of
+  flamegraph.pl, speedscope and inferno, with one "frame;frame;... count"
+  line per distinct stack, rooted at the thread's name.
+
+* A slow-request tracer. While it is switched on, every request carries a
+  RequestTrace that code marks with phase("auth"), phase("validation") and
+  so on, while SQL and commits are timed through SQLAlchemy events. Requests
+  over the threshold keep their per-phase timings in a bounded log. Phases
+  count their own time only. SQL run during auth counts as db, and "other"
+  is time in no phase. When the tracer is off, the SQLAlchemy listeners are
+  removed, and phase() costs one context variable lookup.
+"""
+import glob
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Counter as CounterType, Deque, Dict, Iterable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .config import settings
+
+WORKER_POLL_SECONDS = 0.25  # How often an idle rendering worker checks for a profile request
+PHASES = ("auth", "db", "validation", "render", "commit")
+
+_NO_PHASE = nullcontext()
+
+
+class ProfilerBusy(RuntimeError):
+    """A profile is already being captured in this process"""
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def folded_stack(root: str, frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.append(root)
+    return ";".join(reversed(names))
+
+
+def sample_stacks(seconds: float, interval: float, labels: Optional[Dict[int, str]] = None,
+                  only: Optional[Iterable[int]] = None) -> CounterType[str]:
+    """Sample thread stacks of this process for `seconds`; the calling thread is left out
+
+    `labels` names threads by ident, e.g. the event loop's; others go by
+    their threading name. `only` restricts sampling to the given idents.
+    """
+    me = threading.get_ident()
+    only = None if only is None else set(only)
+    stacks: CounterType[str] = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()} | (labels or {})
+        for ident, frame in sys._current_frames().items():
+            if ident != me and (only is None or ident in only):
+                stacks[folded_stack(names.get(ident, f"thread-{ident}"), frame)] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def format_folded(stacks: CounterType[str]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def parse_folded(text: str) -> CounterType[str]:
+    stacks: CounterType[str] = Counter()
+    for line in text.splitlines():
+        stack, _, count = line.rpartition(" ")
+        if stack:
+            stacks[stack] += int(count)
+    return stacks
+
+
+class WorkerProfiling:
+    """Shared-memory switch for sampler threads in worker processes
+
+    Created in the parent and handed to each worker through its pool
+    initializer. `session` numbers each capture, so a worker samples it once
+    and files of different captures never mix.
+    """
+
+    def __init__(self, context, directory: str):
+        self.session = context.Value("i", 0, lock=False)
+        self.deadline = context.Value("d", 0.0, lock=False)  # time.time(); shared by all processes
+        self.interval = context.Value("d", 0.01, lock=False)
+        self.directory = directory
+
+    def request(self, seconds: float, interval: float) -> int:
+        self.interval.value = interval
+        self.deadline.value = time.time() + seconds
+        self.session.value += 1
+        return self.session.value
+
+    def collect(self, session: int) -> CounterType[str]:
+        stacks: CounterType[str] = Counter()
+        for path in glob.glob(os.path.join(self.directory, f"{session}-*.folded")):
+            with open(path) as f:
+                stacks.update(parse_folded(f.read()))
+            os.remove(path)
+        return stacks
+
+
+def start_worker_sampler(control: WorkerProfiling, label: str) -> None:
+    """Pool initializer step: sample this worker's main thread whenever the parent asks"""
+    threading.Thread(target=_worker_sampler, args=(control, label), name="profile-sampler", daemon=True).start()
+
+
+def _worker_sampler(control: WorkerProfiling, label: str) -> None:
+    main = threading.main_thread().ident
+    root = f"{label}-{os.getpid()}"
+    seen = control.session.value
+    while True:
+        time.sleep(WORKER_POLL_SECONDS)
+        session, remaining = control.session.value, control.deadline.value - time.time()
+        if session == seen or remaining <= 0:
+            continue
+        seen = session
+        stacks = sample_stacks(remaining, control.interval.value, {main: root}, only=[main])
+        path = os.path.join(control.directory, f"{session}-{os.getpid()}.folded")
+        with open(path + ".tmp", "w") as f:
+            f.write(format_folded(stacks))
+        os.replace(path + ".tmp", path)  # The parent never reads a half-written file
+
+
+class Profiler:
+    """Time-boxed sampling profiles of this process and its rendering workers, one at a time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.workers: Dict[str, WorkerProfiling] = {}  # Pools that run start_worker_sampler, by label
+
+    def capture(self, seconds: float, interval: float,
+                labels: Optional[Dict[int, str]] = None) -> CounterType[str]:
+        """Blocking; run it off the event loop so the loop is what gets sampled"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already being captured")
+        try:
+            sessions = {label: control.request(seconds, interval) for label, control in self.workers.items()}
+            stacks = sample_stacks(seconds, interval, labels)
+            if sessions:
+                time.sleep(WORKER_POLL_SECONDS + interval)  # Let workers write their files
+            for label, session in sessions.items():
+                stacks.update(self.workers[label].collect(session))
+            return stacks
+        finally:
+            self._lock.release()
+
+
+@lru_cache
+def get_profiler() -> Profiler:
+    return Profiler()
+
+
+class RequestTrace:
+    """Per-phase self time of one request"""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.phases: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self._stack: List[str] = []
+        self._mark = self.started
+
+    def enter(self, name: str) -> None:
+        now = self.clock()
+        if self._stack:
+            self.phases[self._stack[-1]] += now - self._mark
+        self._stack.append(name)
+        self._mark = now
+
+    def exit(self, name: str) -> None:
+        # Tolerates exits without an enter, e.g. a rollback after a failed flush
+        if not self._stack or self._stack[-1] != name:
+            return
+        now = self.clock()
+        self.phases[self._stack.pop()] += now - self._mark
+        self._mark = now
+
+    def finish(self) -> float:
+        while self._stack:
+            self.exit(self._stack[-1])
+        total = self.clock() - self.started
+        self.phases["other"] = max(total - sum(self.phases.values()), 0.0)
+        return total
+
+
+_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def phase(name: str):
+    """Context manager timing a phase of the current request; a no-op unless it is traced"""
+    trace = _trace.get()
+    if trace is None:
+        return _NO_PHASE
+    return _traced_phase(trace, name)
+
+
+@contextmanager
+def _traced_phase(trace: RequestTrace, name: str):
+    trace.enter(name)
+    try:
+        yield
+    finally:
+        trace.exit(name)
+
+
+def _enter(name: str):
+    def listener(*args, **kwargs):
+        trace = _trace.get()
+        if trace is not None:
+            trace.enter(name)
+    return listener
+
+
+def _exit(name: str):
+    def listener(*args, **kwargs):
+        trace = _trace.get()
+        if trace is not None:
+            trace.exit(name)
+    return listener
+
+
+# Only attached while tracing, so untraced SQL pays nothing
+_LISTENERS = (
+    (Engine, "before_cursor_execute", _enter("db")),
+    (Engine, "after_cursor_execute", _exit("db")),
+    (Engine, "handle_error", _exit("db")),
+    (Session, "before_commit", _enter("commit")),
+    (Session, "after_commit", _exit("commit")),
+    (Session, "after_rollback", _exit("commit")),
+)
+
+
+class SlowRequestTracer:
+    """Switchable, time-boxed tracing of requests slower than a threshold"""
+
+    def __init__(self, log_size: int, clock=time.monotonic):
+        self.clock = clock
+        self.threshold: Optional[float] = None  # Seconds
+        self.until: Optional[float] = None  # clock() value; None traces until switched off
+        self.requests: Deque[dict] = deque(maxlen=log_size)
+        self._listening = False
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        if self.threshold is None:
+            return False
+        if self.until is not None and self.clock() >= self.until:
+            self.stop()
+            return False
+        return True
+
+    def start(self, threshold_ms: float, seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self.threshold = threshold_ms / 1000
+            self.until = None if seconds is None else self.clock() + seconds
+            if not self._listening:
+                for target, name, listener in _LISTENERS:
+                    event.listen(target, name, listener)
+                self._listening = True
+
+    def stop(self) -> None:
+        with self._lock:
+            self.threshold = self.until = None
+            if self._listening:
+                for target, name, listener in _LISTENERS:
+                    event.remove(target, name, listener)
+                self._listening = False
+
+    def record(self, scope, status: Optional[int], trace: RequestTrace) -> None:
+        total = trace.finish()
+        threshold = self.threshold
+        if threshold is None or total < threshold:
+            return
+        self.requests.append({
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "at": datetime.now(timezone.utc),
+            "duration_ms": round(total * 1000, 3),
+            "phases_ms": {name: round(seconds * 1000, 3) for name, seconds in trace.phases.items()},
+        })
+
+
+@lru_cache
+def get_slow_request_tracer() -> SlowRequestTracer:
+    tracer = SlowRequestTracer(settings.slow_request_log_size)
+    if settings.slow_request_threshold_ms is not None:
+        tracer.start(settings.slow_request_threshold_ms)
+    return tracer
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware giving each request a RequestTrace while the tracer is on"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        tracer = get_slow_request_tracer()
+        if scope["type"] != "http" or not tracer.active:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        status = None
+        recorded = False
+
+        async def send_and_record(message):
+            # Recorded once the body is sent, so background tasks do not count
+            nonlocal status, recorded
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not recorded:
+                recorded = True
+                tracer.record(scope, status, trace)
+
+        token = _trace.set(trace)
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            _trace.reset(token)
+            if not recorded:
+                tracer.record(scope, status, trace)
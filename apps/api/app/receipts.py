@@ -0,0 +1,272 @@
+"""Bulk ingestion of gateway receipts (ACK/NACK).
+
+Receipts arrive as JSON Lines, from callback bodies or receipt files: one
+object per line with `submission_id`, `outcome` ("ack" or "nack") and
+optional `code`, `message`, `received_at` and `retriable`. A NACK marked
+retriable is scheduled for an automatic retry. Receipts are parsed one
+line at a time and applied in chunks. Each chunk finds its invoices with
+one query on the submission_id index, updates them with one executemany
+UPDATE and inserts their outbox events with one executemany INSERT, all
+in a single transaction per database. The UPDATE only touches invoices
+still submitted under the receipt's submission; if a concurrent writer
+settled one first, the chunk is rolled back and read again. With tenant
+shards, invoices not found in the default database are looked up on each
+shard in turn.
+"""
+import argparse
+import asyncio
+import gzip
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from pydantic_core import from_json
+from sqlalchemy import bindparam, or_
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .events import status_event_values
+from .invoice_cache import invalidate_on_commit
+from .models import Invoice, InvoiceStatus, WebhookEvent
+from .replicas import mark_written
+from .reports import withdraw_invoices_from_rollups
+from .retries import next_attempt_time
+
+OUTCOME_STATUSES = {"ack": InvoiceStatus.ACCEPTED, "nack": InvoiceStatus.REJECTED}
+
+Placement = Callable[[int], Tuple[Optional[str], Optional[str]]]
+
+# Only invoices still waiting for an outcome take a receipt; replays are ignored
+PENDING_STATUSES = (InvoiceStatus.SUBMITTED,)
+
+_invoices = Invoice.__table__
+_UPDATE_INVOICE = _invoices.update().where(
+    _invoices.c.id == bindparam("invoice_id"),
+    _invoices.c.submission_id == bindparam("expected_submission_id"),
+    # IN would expand its list per statement, which executemany does not allow
+    or_(*(_invoices.c.status == status for status in PENDING_STATUSES)),
+).values(
+    status=bindparam("status"),
+    gateway_response=bindparam("gateway_response"),
+    error_message=bindparam("error_message"),
+    next_attempt_at=bindparam("next_attempt_at"),
+    vat_reported=bindparam("vat_reported"),
+    updated_at=bindparam("updated_at"),
+)
+
+
+class Receipt(NamedTuple):
+    submission_id: str
+    outcome: str
+    code: Optional[str] = None
+    message: Optional[str] = None
+    received_at: Optional[str] = None
+    retriable: bool = False
+
+
+@dataclass
+class IngestStats:
+    received: int = 0
+    applied: int = 0
+    unmatched: int = 0
+    ignored: int = 0
+    invalid: int = 0
+    deferred: int = 0  # For tenants being moved between shards; the sender should redeliver
+
+    def add(self, other: "IngestStats") -> None:
+        for name in ("received", "applied", "unmatched", "ignored", "invalid", "deferred"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+def parse_receipt(line) -> Optional[Receipt]:
+    """A Receipt from one JSON line, or None if the line is malformed"""
+    try:
+        data = from_json(line)
+        outcome = str(data["outcome"]).lower()
+        if outcome not in OUTCOME_STATUSES or not data["submission_id"]:
+            return None
+        return Receipt(
+            str(data["submission_id"]), outcome,
+            None if data.get("code") is None else str(data["code"]),
+            data.get("message"), data.get("received_at"), data.get("retriable") is True
+        )
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def chunked(receipts: Iterable[Optional[Receipt]], size: int) -> Iterator[List[Optional[Receipt]]]:
+    iterator = iter(receipts)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Split a streamed body into lines without holding more than one partial line"""
+    pending = b""
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def apply_receipts(db: Session, parsed: List[Optional[Receipt]], gateway: str,
+                   shards: Optional[Dict[str, Session]] = None, placement: Optional[Placement] = None) -> IngestStats:
+    """Apply one chunk of parsed receipts (None for malformed lines) and commit
+
+    With `shards`, invoices not found in `db` are looked up there as well.
+    `placement` gives the (shard, moving_to) of a tenant as in app.sharding:
+    copies left behind by a tenant move are skipped, and receipts for a
+    tenant that is being moved are deferred.
+    """
+    stats = IngestStats(received=len(parsed))
+    latest: Dict[str, Receipt] = {}
+    for receipt in parsed:
+        if receipt is None:
+            stats.invalid += 1
+        else:
+            latest[receipt.submission_id] = receipt  # The last receipt for a submission wins
+    if not latest:
+        return stats
+
+    matched = set()
+    for shard, session in ((None, db), *(shards or {}).items()):
+        wanted = [submission_id for submission_id in latest if submission_id not in matched]
+        if not wanted:
+            break
+        while True:
+            found, deferred, updates, events = _pending_changes(session, shard, wanted, latest, gateway, placement)
+            if _write_changes(session, updates, events):
+                break
+            # Another writer settled an invoice since it was read
+            session.rollback()
+        session.commit()
+        matched.update(found)
+        stats.deferred += deferred
+        stats.applied += len(updates)
+
+    stats.unmatched = sum(1 for receipt in parsed if receipt is not None and receipt.submission_id not in matched)
+    # Replays, receipts for settled invoices and receipts superseded within the chunk
+    stats.ignored = stats.received - stats.invalid - stats.applied - stats.unmatched - stats.deferred
+    return stats
+
+
+def _pending_changes(session: Session, shard: Optional[str], wanted: List[str], latest: Dict[str, Receipt],
+                     gateway: str, placement: Optional[Placement]) -> Tuple[set, int, List[dict], List[dict]]:
+    """The submissions found on this database, how many were deferred, and the invoice updates and events"""
+    now = datetime.now(timezone.utc)
+    # Locked where the database supports it, so the statuses read here hold until commit
+    invoices = session.query(
+        Invoice.id, Invoice.tenant_id, Invoice.external_id, Invoice.submission_id,
+        Invoice.status, Invoice.gateway_response, Invoice.retry_count, Invoice.vat_reported
+    ).filter(Invoice.submission_id.in_(wanted)).with_for_update().all()
+
+    found, deferred, updates, events = set(), 0, [], []
+    for invoice in invoices:
+        if placement is not None:
+            home, moving_to = placement(invoice.tenant_id)
+            if home != shard:
+                continue
+            if moving_to is not None:
+                found.add(invoice.submission_id)
+                deferred += 1
+                continue
+        found.add(invoice.submission_id)
+        if invoice.status not in PENDING_STATUSES:
+            continue
+        receipt = latest[invoice.submission_id]
+        status = OUTCOME_STATUSES[receipt.outcome]
+        details = {"gateway": gateway, **receipt._asdict()}
+        updates.append({
+            "invoice_id": invoice.id,
+            "expected_submission_id": invoice.submission_id,
+            "status": status,
+            "gateway_response": {**(invoice.gateway_response or {}), "receipt": details},
+            "error_message": receipt.message if status == InvoiceStatus.REJECTED else None,
+            "next_attempt_at": next_attempt_time(
+                gateway, invoice.retry_count or 0, receipt.retriable and status == InvoiceStatus.REJECTED, now
+            ),
+            "vat_reported": bool(invoice.vat_reported) and status != InvoiceStatus.REJECTED,
+            "updated_at": now,
+        })
+        events.append(status_event_values(invoice.tenant_id, invoice.id, invoice.external_id, status, details))
+    return found, deferred, updates, events
+
+
+def _write_changes(session: Session, updates: List[dict], events: List[dict]) -> bool:
+    """Apply the updates and events; False if the guard skipped an invoice, leaving the transaction to roll back"""
+    if not updates:
+        return True
+    # A NACK takes a counted invoice back out of the VAT rollups
+    withdraw_invoices_from_rollups(session, [
+        update["invoice_id"] for update in updates if update["status"] == InvoiceStatus.REJECTED
+    ])
+    # Core statements: executemany without the ORM's per-row bookkeeping
+    result = session.execute(_UPDATE_INVOICE, updates)
+    if session.get_bind().dialect.supports_sane_multi_rowcount and result.rowcount != len(updates):
+        return False
+    session.execute(WebhookEvent.__table__.insert(), events)
+    invalidate_on_commit(session, [(event["tenant_id"], event["invoice_id"]) for event in events])
+    mark_written(session, [event["tenant_id"] for event in events])
+    return True
+
+
+def ingest_receipts(db: Session, lines: Iterable, gateway: str, batch_size: Optional[int] = None,
+                    **routing) -> IngestStats:
+    """Parse and apply a stream of JSON lines chunk by chunk; `routing` is passed to apply_receipts"""
+    stats = IngestStats()
+    parsed = (parse_receipt(line) for line in lines if line.strip())
+    for chunk in chunked(parsed, batch_size or settings.receipt_batch_size):
+        stats.add(apply_receipts(db, chunk, gateway, **routing))
+    return stats
+
+
+async def ingest_receipt_stream(db: Session, body: AsyncIterable[bytes], gateway: str,
+                                batch_size: Optional[int] = None, **routing) -> IngestStats:
+    """ingest_receipts for a streamed request body"""
+    batch_size = batch_size or settings.receipt_batch_size
+    stats = IngestStats()
+    chunk: List[Optional[Receipt]] = []
+    async for line in iter_lines(body):
+        if line.strip():
+            chunk.append(parse_receipt(line))
+        if len(chunk) >= batch_size:
+            # Database work runs on a worker thread so the event loop keeps serving other requests
+            stats.add(await asyncio.to_thread(apply_receipts, db, chunk, gateway, **routing))
+            chunk = []
+    if chunk:
+        stats.add(await asyncio.to_thread(apply_receipts, db, chunk, gateway, **routing))
+    return stats
+
+
+def main(argv=None):
+    from .database import SessionLocal
+    from .sharding import get_shard_router, shard_map
+
+    parser = argparse.ArgumentParser(description="Apply a gateway receipt file (JSON Lines, optionally gzipped)")
+    parser.add_argument("path")
+    parser.add_argument("--gateway", required=True)
+    parser.add_argument("--batch-size", type=int, default=settings.receipt_batch_size)
+    args = parser.parse_args(argv)
+
+    opener = gzip.open if args.path.endswith(".gz") else open
+    router = get_shard_router()
+    db = SessionLocal()
+    shards = {name: router.session(name) for name in router.names}
+    try:
+        with opener(args.path, "rb") as lines:
+            stats = ingest_receipts(db, lines, args.gateway, args.batch_size, shards=shards,
+                                    placement=lambda tenant_id: shard_map.lookup(db, tenant_id))
+    finally:
+        for session in shards.values():
+            session.close()
+        db.close()
+    print(f"{stats.received} receipts: {stats.applied} applied, {stats.ignored} ignored, "
+          f"{stats.unmatched} unmatched, {stats.invalid} invalid, {stats.deferred} deferred")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Invoice PDF rendering in a bounded pool of worker processes.
+
+PDF layout and compression are CPU-bound, so they run outside the event
+loop in spawned worker processes. Each worker loads the font and colour
+profile once, caps its own address space, and is replaced after a fixed
+number of renders so fragmentation cannot grow without bound. Submissions
+are bounded too: at most two renders per worker are queued at a time.
+Workers also run an idle profile sampler, so /admin/profile covers them.
+"""
+import asyncio
+import shutil
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from . import pdf
+from .config import settings
+from .facturx import generate_cii_xml
+from .models import Invoice, InvoiceStatus
+from .profiling import WorkerProfiling, get_profiler, phase, start_worker_sampler
+
+RENDERABLE_STATUSES = (InvoiceStatus.VALIDATED, InvoiceStatus.SUBMITTED, InvoiceStatus.ACCEPTED)
+
+_SNAPSHOT_FIELDS = (
+    "invoice_number", "issue_date", "due_date", "currency", "supplier_data", "customer_data",
+    "line_items", "subtotal", "tax_amount", "total_amount",
+)
+
+
+PROFILE_LABEL = "pdf-worker"
+
+
+def init_render_worker(font_path: Optional[str], memory_limit_mb: int, profiling: WorkerProfiling) -> None:
+    pdf.init_worker(font_path, memory_limit_mb)
+    start_worker_sampler(profiling, PROFILE_LABEL)
+
+
+class PdfRenderer:
+    """Renders invoice snapshots in worker processes, or in a thread when `workers` is 0"""
+
+    def __init__(self, workers: int, font_path: Optional[str] = None, memory_limit_mb: int = 0,
+                 max_tasks_per_worker: Optional[int] = None):
+        self.workers = workers
+        self.font_path = font_path
+        self.memory_limit_mb = memory_limit_mb
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._executor = None
+        self._profiling: Optional[WorkerProfiling] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            import multiprocessing
+            import tempfile
+            from concurrent.futures import ProcessPoolExecutor
+            # Forking a process with live threads and connections is unsafe
+            context = multiprocessing.get_context("spawn")
+            profiling = WorkerProfiling(context, tempfile.mkdtemp(prefix="vatevo-profile-"))
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=init_render_worker,
+                initargs=(self.font_path, self.memory_limit_mb, profiling),
+                max_tasks_per_child=self.max_tasks_per_worker or None,
+            )
+            get_profiler().workers[PROFILE_LABEL] = self._profiling = profiling
+        return self._executor
+
+    def start(self) -> None:
+        """Load the font, in each worker process when there are any, ahead of the first render"""
+        if self.workers <= 0:
+            if not pdf.worker_ready():
+                pdf.init_worker(self.font_path)
+            return
+        # Each submission finding no idle worker spawns one
+        for future in [self.executor.submit(pdf.worker_ready) for _ in range(self.workers)]:
+            future.result()
+
+    async def render(self, snapshot: dict, xml: bytes) -> bytes:
+        with phase("render"):
+            if self.workers <= 0:
+                if not pdf.worker_ready():
+                    pdf.init_worker(self.font_path)
+                return await asyncio.to_thread(pdf.render_in_worker, snapshot, xml)
+
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(2 * self.workers)
+            async with self._slots:
+                return await self.call(pdf.render_in_worker, snapshot, xml)
+
+    async def call(self, func, *args):
+        """Run a picklable function in a worker, e.g. pdf.peak_rss_kb"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            get_profiler().workers.pop(PROFILE_LABEL, None)
+            shutil.rmtree(self._profiling.directory, ignore_errors=True)
+            self._slots = None
+
+
+@lru_cache
+def get_pdf_renderer() -> PdfRenderer:
+    return PdfRenderer(
+        workers=settings.pdf_render_workers,
+        font_path=settings.pdf_font_path,
+        memory_limit_mb=settings.pdf_worker_memory_limit_mb,
+        max_tasks_per_worker=settings.pdf_render_max_tasks_per_worker,
+    )
+
+
+def invoice_snapshot(invoice: Invoice) -> dict:
+    """Plain, picklable copy of the fields the PDF layout reads"""
+    return {name: getattr(invoice, name) for name in _SNAPSHOT_FIELDS}
+
+
+def pdf_key(invoice: Invoice) -> str:
+    return f"invoices/tenant={invoice.tenant_id}/{invoice.issue_date:%Y-%m}/invoice-{invoice.id}.pdf"
+
+
+async def render_invoice(db: Session, invoice: Invoice, renderer: PdfRenderer, store) -> Invoice:
+    """Render the Factur-X PDF/A-3 for an invoice, store it and set pdf_url; caller commits"""
+    xml = generate_cii_xml(invoice).encode("utf-8")
+    document = await renderer.render(invoice_snapshot(invoice), xml)
+    invoice.pdf_url = await asyncio.to_thread(store.put, pdf_key(invoice), document, "application/pdf")
+    invoice.updated_at = datetime.now(timezone.utc)
+    return invoice
+
+
+async def render_invoice_job(bind, invoice_id: int, renderer: PdfRenderer, store) -> None:
+    """Background entry point; opens its own session on the request's engine"""
+    db = Session(bind=bind)
+    try:
+        invoice = db.get(Invoice, invoice_id)
+        if invoice is None or invoice.status not in RENDERABLE_STATUSES:
+            return
+        await render_invoice(db, invoice, renderer, store)
+        db.commit()
+    finally:
+        db.close()
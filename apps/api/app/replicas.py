@@ -0,0 +1,154 @@
+"""Routing safe reads to a read replica without losing read-your-writes.
+
+GET endpoints that only read take get_read_db instead of get_db. It returns
+a replica session unless the tenant committed a write within the last
+read_your_writes_seconds, in which case the replica may not have replayed
+it yet and the primary answers instead. Writes are noticed when a session
+flushes ORM objects carrying a tenant_id and then commits, so invoices,
+exports and status changes made by background jobs all open the window.
+Core and bulk statements, which the flush does not see, name the tenants
+they wrote with mark_written.
+
+Replicas serve the default database only; tenants placed on another shard
+(see app.sharding) read from their shard. With read_your_writes_backend
+"memory" the window is tracked per process; "redis" shares it between all
+API processes and background workers, so a write committed by one is seen
+by reads landing on another. Clients can also send X-Read-Consistency:
+strong to read from the primary regardless.
+"""
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Optional
+
+from fastapi import Depends, Header
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .auth import get_current_tenant
+from .config import settings
+from .database import get_db, get_replica_db
+from .models import Tenant
+from .sharding import get_tenant_db
+
+
+class RedisWriteMarks:
+    """Write windows shared by all processes: one key per tenant, expiring when its window closes"""
+
+    def __init__(self, url: str, prefix: str = "ryw:", client=None):
+        self.url = url
+        self.prefix = prefix
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def mark(self, tenant_id: int, seconds: float) -> None:
+        self.client.set(f"{self.prefix}{tenant_id}", b"1", px=max(int(seconds * 1000), 1))
+
+    def active(self, tenant_id: int) -> bool:
+        return bool(self.client.exists(f"{self.prefix}{tenant_id}"))
+
+
+@lru_cache
+def get_shared_write_marks() -> Optional[RedisWriteMarks]:
+    return RedisWriteMarks(settings.redis_url) if settings.read_your_writes_backend == "redis" else None
+
+
+class WriteWindow:
+    """Tenants that wrote recently, each until its read-your-writes window closes"""
+
+    def __init__(self, seconds: Callable[[], float] = lambda: settings.read_your_writes_seconds,
+                 clock: Callable[[], float] = time.monotonic,
+                 shared: Callable[[], Optional[RedisWriteMarks]] = get_shared_write_marks):
+        self.seconds = seconds
+        self.clock = clock
+        self.shared = shared
+        self._until: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, tenant_id: int) -> None:
+        seconds = self.seconds()
+        with self._lock:
+            self._until[tenant_id] = self.clock() + seconds
+        shared = self.shared()
+        if shared is not None:
+            try:
+                shared.mark(tenant_id, seconds)
+            except Exception:
+                pass  # Other processes fall back to their own window and X-Read-Consistency
+
+    def active(self, tenant_id: int) -> bool:
+        return self._active_locally(tenant_id) or self._active_elsewhere(tenant_id)
+
+    def _active_locally(self, tenant_id: int) -> bool:
+        until = self._until.get(tenant_id)
+        if until is None:
+            return False
+        if until > self.clock():
+            return True
+        with self._lock:
+            if self._until.get(tenant_id) == until:
+                del self._until[tenant_id]
+        return False
+
+    def _active_elsewhere(self, tenant_id: int) -> bool:
+        shared = self.shared()
+        if shared is None:
+            return False
+        try:
+            return shared.active(tenant_id)
+        except Exception:
+            return True  # Unknown; the primary is always safe
+
+    def clear(self) -> None:
+        with self._lock:
+            self._until.clear()
+
+
+recent_writes = WriteWindow()
+
+
+def mark_written(session: Session, tenant_ids: Iterable[int]) -> None:
+    """Open the tenants' write windows once `session` commits; for writes the flush does not see"""
+    session.info.setdefault("written_tenants", set()).update(tenant_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_written_tenants(session, flush_context):
+    tenants = {
+        tenant_id for obj in (*session.new, *session.dirty, *session.deleted)
+        if (tenant_id := getattr(obj, "tenant_id", None)) is not None
+    }
+    if tenants:
+        mark_written(session, tenants)
+
+
+@event.listens_for(Session, "after_commit")
+def _open_write_windows(session):
+    for tenant_id in session.info.pop("written_tenants", ()):
+        recent_writes.mark(tenant_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_written_tenants(session):
+    session.info.pop("written_tenants", None)
+
+
+def get_read_db(
+    current_tenant: Tenant = Depends(get_current_tenant),
+    x_read_consistency: Optional[str] = Header(None),
+    primary: Session = Depends(get_db),
+    db: Session = Depends(get_tenant_db),
+    replica: Optional[Session] = Depends(get_replica_db)
+) -> Session:
+    """Session for a read-only endpoint: the replica when it is safe, else the tenant's database"""
+    if replica is None or db is not primary:
+        return db
+    if x_read_consistency == "strong" or recent_writes.active(current_tenant.id):
+        return db
+    return replica
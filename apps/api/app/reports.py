@@ -0,0 +1,214 @@
+"""Incrementally maintained VAT rollups per tenant, country, month and rate.
+
+Invoices are folded into vat_rollups once, in the same transaction that
+moves them to a reportable status, so GET /reports/vat only reads a handful
+of pre-aggregated rows. An invoice that later fails or is rejected is taken
+back out, so the rollups always count the invoices a rebuild would.
+rebuild_vat_rollups recomputes everything from the invoices table.
+Archiving deletes invoices from it, so their contribution is first copied
+to archived_vat_rollups, which rebuilds add back in.
+"""
+import argparse
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func
+from sqlalchemy.orm import Session
+
+from .models import ArchivedVatRollup, Invoice, InvoiceStatus, VatRollup
+
+REPORTABLE_STATUSES = (InvoiceStatus.VALIDATED, InvoiceStatus.SUBMITTED, InvoiceStatus.ACCEPTED)
+
+RollupKey = Tuple[int, object, int, int, str, str]
+
+
+def to_cents(amount) -> int:
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> str:
+    return str((Decimal(cents) / 100).quantize(Decimal("0.01")))
+
+
+def normalize_rate(rate) -> str:
+    normalized = Decimal(str(rate)).normalize()
+    return format(normalized, "f")
+
+
+def invoice_buckets(tenant_id, country_code, issue_date, currency, line_items) -> Dict[RollupKey, List[int]]:
+    """Group an invoice's lines into rollup buckets of [taxable_cents, tax_cents]"""
+    buckets: Dict[RollupKey, List[int]] = {}
+    for item in line_items:
+        key = (tenant_id, country_code, issue_date.year, issue_date.month,
+               normalize_rate(item["tax_rate"]), currency)
+        bucket = buckets.setdefault(key, [0, 0])
+        bucket[0] += to_cents(item["line_total"])
+        bucket[1] += to_cents(item["tax_amount"])
+    return buckets
+
+
+def _upsert(db: Session, key: RollupKey, taxable_cents: int, tax_cents: int, invoices: int,
+            model=VatRollup) -> None:
+    tenant_id, country_code, year, month, rate, currency = key
+    dialect = db.get_bind().dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        raise NotImplementedError(f"VAT rollups are not supported on {dialect}")
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    table = model.__table__
+    statement = insert(table).values(
+        tenant_id=tenant_id, country_code=country_code, year=year, month=month,
+        tax_rate=rate, currency=currency,
+        taxable_base_cents=taxable_cents, tax_cents=tax_cents, invoice_count=invoices
+    )
+    db.execute(statement.on_conflict_do_update(
+        index_elements=["tenant_id", "year", "month", "country_code", "tax_rate", "currency"],
+        set_={
+            "taxable_base_cents": table.c.taxable_base_cents + statement.excluded.taxable_base_cents,
+            "tax_cents": table.c.tax_cents + statement.excluded.tax_cents,
+            "invoice_count": table.c.invoice_count + statement.excluded.invoice_count,
+        }
+    ))
+
+
+def apply_invoice_to_rollups(db: Session, invoice: Invoice) -> bool:
+    """Add a reportable invoice to the rollups exactly once; caller commits"""
+    if invoice.vat_reported or invoice.status not in REPORTABLE_STATUSES:
+        return False
+    buckets = invoice_buckets(invoice.tenant_id, invoice.country_code, invoice.issue_date,
+                              invoice.currency, invoice.line_items)
+    for key, (taxable_cents, tax_cents) in buckets.items():
+        _upsert(db, key, taxable_cents, tax_cents, 1)
+    invoice.vat_reported = True
+    return True
+
+
+def _withdraw(db: Session, tenant_id, country_code, issue_date, currency, line_items) -> None:
+    table = VatRollup.__table__
+    for key, (taxable_cents, tax_cents) in invoice_buckets(
+            tenant_id, country_code, issue_date, currency, line_items).items():
+        _upsert(db, key, -taxable_cents, -tax_cents, -1)
+        tenant_id, country_code, year, month, rate, currency = key
+        db.execute(delete(table).where(
+            table.c.tenant_id == tenant_id, table.c.country_code == country_code, table.c.year == year,
+            table.c.month == month, table.c.tax_rate == rate, table.c.currency == currency,
+            table.c.invoice_count == 0
+        ))
+
+
+def withdraw_invoice_from_rollups(db: Session, invoice: Invoice) -> bool:
+    """Take a counted invoice that failed or was rejected back out of the rollups; caller commits"""
+    if not invoice.vat_reported or invoice.status in REPORTABLE_STATUSES:
+        return False
+    _withdraw(db, invoice.tenant_id, invoice.country_code, invoice.issue_date, invoice.currency,
+              invoice.line_items)
+    invoice.vat_reported = False
+    return True
+
+
+def withdraw_invoices_from_rollups(db: Session, invoice_ids: List[int]) -> None:
+    """withdraw_invoice_from_rollups for invoices whose status was changed without the ORM
+
+    The caller clears their vat_reported flag in the same transaction.
+    """
+    if not invoice_ids:
+        return
+    rows = db.query(
+        Invoice.tenant_id, Invoice.country_code, Invoice.issue_date, Invoice.currency, Invoice.line_items
+    ).filter(Invoice.id.in_(invoice_ids), Invoice.vat_reported == True)
+    for row in rows.all():
+        _withdraw(db, *row)
+
+
+def update_invoice_rollups(db: Session, invoice: Invoice) -> None:
+    """Add or withdraw the invoice after a status change, so rollups follow the same rule as a rebuild"""
+    apply_invoice_to_rollups(db, invoice) or withdraw_invoice_from_rollups(db, invoice)
+
+
+def retain_archived_rollups(db: Session, invoice: Invoice) -> None:
+    """Keep a reported invoice's contribution before archiving deletes it; caller commits"""
+    if not invoice.vat_reported:
+        return
+    buckets = invoice_buckets(invoice.tenant_id, invoice.country_code, invoice.issue_date,
+                              invoice.currency, invoice.line_items)
+    for key, (taxable_cents, tax_cents) in buckets.items():
+        _upsert(db, key, taxable_cents, tax_cents, 1, ArchivedVatRollup)
+
+
+def rebuild_vat_rollups(db: Session, tenant_id: Optional[int] = None, fetch_size: int = 1000) -> int:
+    """Recompute rollups from scratch for one tenant or all tenants; archived invoices count as retained"""
+    rollups = db.query(VatRollup)
+    invoices = db.query(Invoice)
+    archived = db.query(ArchivedVatRollup)
+    if tenant_id is not None:
+        rollups = rollups.filter(VatRollup.tenant_id == tenant_id)
+        invoices = invoices.filter(Invoice.tenant_id == tenant_id)
+        archived = archived.filter(ArchivedVatRollup.tenant_id == tenant_id)
+    rollups.delete(synchronize_session=False)
+
+    totals: Dict[RollupKey, List[int]] = defaultdict(lambda: [0, 0, 0])
+    rows = invoices.with_entities(
+        Invoice.tenant_id, Invoice.country_code, Invoice.issue_date, Invoice.currency, Invoice.line_items
+    ).filter(Invoice.status.in_(REPORTABLE_STATUSES)).execution_options(yield_per=fetch_size)
+    count = 0
+    for row in rows:
+        for key, (taxable_cents, tax_cents) in invoice_buckets(*row).items():
+            total = totals[key]
+            total[0] += taxable_cents
+            total[1] += tax_cents
+            total[2] += 1
+        count += 1
+    for row in archived:
+        total = totals[(row.tenant_id, row.country_code, row.year, row.month, row.tax_rate, row.currency)]
+        total[0] += row.taxable_base_cents
+        total[1] += row.tax_cents
+        total[2] += row.invoice_count
+
+    for key, (taxable_cents, tax_cents, invoice_count) in totals.items():
+        _upsert(db, key, taxable_cents, tax_cents, invoice_count)
+
+    invoices.update(
+        {Invoice.vat_reported: Invoice.status.in_(REPORTABLE_STATUSES)},
+        synchronize_session=False
+    )
+    db.commit()
+    return count
+
+
+def vat_report(db: Session, tenant_id: int, year: int, months: List[int]) -> List[tuple]:
+    """Sum rollups over the given months, one row per country, rate and currency"""
+    return db.query(
+        VatRollup.country_code,
+        VatRollup.tax_rate,
+        VatRollup.currency,
+        func.sum(VatRollup.taxable_base_cents),
+        func.sum(VatRollup.tax_cents),
+        func.sum(VatRollup.invoice_count),
+    ).filter(
+        VatRollup.tenant_id == tenant_id,
+        VatRollup.year == year,
+        VatRollup.month.in_(months)
+    ).group_by(
+        VatRollup.country_code, VatRollup.tax_rate, VatRollup.currency
+    ).order_by(
+        VatRollup.country_code, VatRollup.currency, VatRollup.tax_rate
+    ).all()
+
+
+def main(argv=None):
+    from .sharding import fan_out
+
+    parser = argparse.ArgumentParser(description="Rebuild VAT rollups from invoices")
+    parser.add_argument("--tenant-id", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    counts = fan_out(lambda db: rebuild_vat_rollups(db, args.tenant_id))
+    print(f"Rebuilt VAT rollups from {sum(counts.values())} invoices")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Automatic retries of failed gateway submissions.
+
+A retriable failure sets Invoice.next_attempt_at using exponential backoff
+with jitter, based per gateway, until settings.retry_max_attempts is
+reached. Workers claim due invoices in batches through the index on
+next_attempt_at: one UPDATE ... RETURNING pushes the claimed rows' due time
+out by a lease, and on PostgreSQL the inner SELECT uses FOR UPDATE SKIP
+LOCKED so concurrent workers take disjoint batches. A worker that dies
+mid-batch leaves its invoices to fall due again when the lease expires.
+While a gateway's circuit breaker is open its invoices are deferred
+without using up an attempt.
+
+Run a worker with:  python -m app.retries
+"""
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from .canonical import CanonicalInvoice
+from .config import settings
+from .gateways import (
+    COUNTRY_GATEWAYS, DEFAULT_GATEWAY, GatewayClient, GatewayDocument, GatewayError, GatewayRegistry, SubmissionResult,
+    build_document, get_gateway_registry, record_submission, submit_invoice
+)
+from .models import Invoice, InvoiceStatus
+from .replicas import mark_written
+from .reports import update_invoice_rollups
+
+RETRIABLE_STATUSES = (InvoiceStatus.FAILED, InvoiceStatus.REJECTED)
+
+_invoices = Invoice.__table__
+
+
+def gateway_for(country_code: str) -> str:
+    return COUNTRY_GATEWAYS.get(country_code, DEFAULT_GATEWAY)
+
+
+def retry_delay(gateway: str, attempt: int, rng=random) -> timedelta:
+    """Exponential backoff from the gateway's base delay, capped, with jitter in [50%, 100%]"""
+    base = settings.retry_backoff_base_seconds.get(gateway, 60.0)
+    delay = min(settings.retry_backoff_max_seconds, base * 2 ** attempt)
+    return timedelta(seconds=delay * (0.5 + rng.random() / 2))
+
+
+def next_attempt_time(gateway: str, retry_count: int, retriable: bool,
+                      now: Optional[datetime] = None) -> Optional[datetime]:
+    """When to try again, or None once the failure is permanent or attempts are used up"""
+    if not retriable or retry_count >= settings.retry_max_attempts:
+        return None
+    return (now or datetime.now(timezone.utc)) + retry_delay(gateway, retry_count)
+
+
+def schedule_retry(invoice: Invoice, now: Optional[datetime] = None) -> Invoice:
+    """Set or clear next_attempt_at from the invoice's latest submission outcome"""
+    retriable = invoice.status == InvoiceStatus.FAILED and bool((invoice.gateway_response or {}).get("retriable"))
+    invoice.next_attempt_at = next_attempt_time(
+        gateway_for(invoice.country_code.value), invoice.retry_count or 0, retriable, now
+    )
+    return invoice
+
+
+async def submit_with_retry(db: Session, invoice: Invoice, registry: GatewayRegistry,
+                            canonical: Optional[CanonicalInvoice] = None) -> Invoice:
+    """submit_invoice, then schedule the next attempt if it failed retriably; caller commits"""
+    await submit_invoice(db, invoice, registry, canonical)
+    return schedule_retry(invoice)
+
+
+def claim_due_invoices(db: Session, batch_size: int, now: Optional[datetime] = None,
+                       lease: Optional[timedelta] = None) -> List[int]:
+    """Claim up to `batch_size` due invoices for this worker and commit the claim"""
+    now = now or datetime.now(timezone.utc)
+    lease = lease or timedelta(seconds=settings.retry_lease_seconds)
+    due = select(_invoices.c.id).where(
+        _invoices.c.next_attempt_at <= now
+    ).order_by(_invoices.c.next_attempt_at).limit(batch_size)
+    if db.get_bind().dialect.name == "postgresql":
+        due = due.with_for_update(skip_locked=True)
+    claimed = db.execute(
+        update(_invoices).where(_invoices.c.id.in_(due.scalar_subquery()))
+        .values(next_attempt_at=now + lease).returning(_invoices.c.id, _invoices.c.tenant_id)
+    ).all()
+    mark_written(db, {tenant_id for _, tenant_id in claimed})
+    db.commit()
+    return [invoice_id for invoice_id, _ in claimed]
+
+
+async def retry_invoices(db: Session, invoice_ids: List[int], registry: GatewayRegistry,
+                         now: Optional[datetime] = None) -> int:
+    """Resubmit claimed invoices; returns how many were sent to a gateway"""
+    now = now or datetime.now(timezone.utc)
+    attempts = []
+    for invoice in db.query(Invoice).filter(Invoice.id.in_(invoice_ids)):
+        if invoice.status not in RETRIABLE_STATUSES:
+            invoice.next_attempt_at = None  # Settled by other means since it was scheduled
+            continue
+        client = registry.for_country(invoice.country_code.value)
+        wait = client.breaker.retry_after()
+        if wait:
+            # The gateway is still down; come back after the breaker's probe, without using an attempt
+            invoice.next_attempt_at = now + timedelta(seconds=wait * (1 + random.random()))
+            continue
+        invoice.retry_count = (invoice.retry_count or 0) + 1
+        try:
+            document = build_document(invoice)
+        except Exception as e:
+            # The document itself could not be built; retrying will not help
+            invoice.status = InvoiceStatus.FAILED
+            invoice.error_message = str(e)
+            invoice.next_attempt_at = None
+            update_invoice_rollups(db, invoice)
+            continue
+        attempts.append(_send(invoice, client, document))
+    db.commit()  # Attempt counts and deferrals, before anything is sent
+
+    # The sends run concurrently, bounded per gateway by its client's adaptive limit, while their
+    # outcomes are applied one at a time. Each is committed as soon as it arrives, so a worker dying
+    # mid-batch cannot lose a submission_id and file the invoice twice, and since the session holds
+    # nothing else by then, the commit carries that one outcome only.
+    sends = [asyncio.ensure_future(attempt) for attempt in attempts]
+    try:
+        for send in asyncio.as_completed(sends):
+            invoice, client, result, error = await send
+            schedule_retry(record_submission(db, invoice, client.name, result, error))
+            db.commit()
+    finally:
+        for send in sends:
+            send.cancel()
+    return len(sends)
+
+
+async def _send(invoice: Invoice, client: GatewayClient, document: GatewayDocument
+                ) -> Tuple[Invoice, GatewayClient, Optional[SubmissionResult], Optional[GatewayError]]:
+    try:
+        return invoice, client, await client.submit(document), None
+    except GatewayError as e:
+        return invoice, client, None, e
+
+
+async def run_retry_batch(db: Session, registry: GatewayRegistry, batch_size: Optional[int] = None) -> int:
+    """Claim and retry one batch; returns the number claimed"""
+    claimed = claim_due_invoices(db, batch_size or settings.retry_batch_size)
+    if claimed:
+        await retry_invoices(db, claimed, registry)
+    return len(claimed)
+
+
+async def run_retry_worker(session_factory, registry: GatewayRegistry, batch_size: int,
+                           poll_interval: float, once: bool = False) -> int:
+    total = 0
+    while True:
+        db = session_factory()
+        try:
+            claimed = await run_retry_batch(db, registry, batch_size)
+        finally:
+            db.close()
+        total += claimed
+        if once and claimed < batch_size:
+            return total
+        if claimed < batch_size:
+            await asyncio.sleep(poll_interval)
+
+
+def main(argv=None):
+    from .database import SessionLocal
+    from .sharding import get_shard_router
+
+    parser = argparse.ArgumentParser(description="Retry failed gateway submissions as they fall due")
+    parser.add_argument("--batch-size", type=int, default=settings.retry_batch_size)
+    parser.add_argument("--interval", type=float, default=settings.retry_poll_interval_seconds)
+    parser.add_argument("--once", action="store_true", help="Exit once nothing more is due")
+    args = parser.parse_args(argv)
+
+    async def run():
+        registry = get_gateway_registry()
+        router = get_shard_router()
+        factories = [SessionLocal, *(partial(router.session, name) for name in router.names)]
+        try:
+            # One worker per tenant database, sharing the gateway clients and their limits
+            return sum(await asyncio.gather(*(
+                run_retry_worker(factory, registry, args.batch_size, args.interval, args.once)
+                for factory in factories
+            )))
+        finally:
+            await registry.close()
+
+    print(f"Processed {asyncio.run(run())} due invoices")
+
+
+if __name__ == "__main__":
+    main()
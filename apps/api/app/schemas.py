@@ -1,7 +1,8 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
+from typing_extensions import NotRequired, TypedDict
 from datetime import datetime
-from .models import InvoiceStatus, CountryCode
+from .models import InvoiceStatus, CountryCode, ExportStatus
 
 
 class SupplierData(BaseModel):
@@ -25,13 +26,16 @@ class CustomerData(BaseModel):
     email: Optional[str] = None
 
 
-class LineItem(BaseModel):
+class LineItem(TypedDict):
+    # Validated straight into the dict stored in Invoice.line_items
     description: str
     quantity: float
     unit_price: str  # String to avoid float precision issues
     tax_rate: float
     tax_amount: str
     line_total: str
+    tax_category: NotRequired[str]  # VAT category code; derived from the rate and parties when absent
+    tax_exemption_reason: NotRequired[str]  # Why a zero-rated line is exempt (category E)
 
 
 class InvoiceCreate(BaseModel):
@@ -68,6 +72,7 @@ class InvoiceResponse(BaseModel):
     
     submission_id: Optional[str] = None
     error_message: Optional[str] = None
+    duplicate_of: Optional[int] = None  # An earlier invoice with the same supplier, number, date and total
     
     created_at: datetime
     updated_at: Optional[datetime]
@@ -77,6 +82,22 @@ class InvoiceResponse(BaseModel):
         from_attributes = True
 
 
+class InvoiceSearchResponse(BaseModel):
+    invoices: List[InvoiceResponse]
+    next_cursor: Optional[int] = None  # Pass back as `cursor` for the next page; null on the last page
+
+
+class InvoiceImportError(BaseModel):
+    document: str  # ZIP member name; empty for a single document
+    index: int  # Position of the invoice within the document, from 0
+    errors: List[str]
+
+
+class InvoiceImportResponse(BaseModel):
+    invoice_ids: List[int]
+    errors: List[InvoiceImportError] = []
+
+
 class InvoiceValidateRequest(BaseModel):
     country_code: CountryCode
     supplier: SupplierData
@@ -90,6 +111,25 @@ class ValidationResult(BaseModel):
     warnings: List[str] = []
 
 
+class VatIdCheckResult(BaseModel):
+    vat_id: str
+    country_code: Optional[str] = None
+    valid: Optional[bool]  # None when the registry could not be reached
+    format_valid: bool
+    name: Optional[str] = None
+    address: Optional[str] = None
+    cached: bool = False
+    errors: List[str] = []
+
+
+class VatIdBulkRequest(BaseModel):
+    vat_ids: List[str] = Field(..., min_length=1, max_length=1000)
+
+
+class VatIdBulkResponse(BaseModel):
+    results: List[VatIdCheckResult]
+
+
 class WebhookPayload(BaseModel):
     event_type: str
     invoice_id: int
@@ -114,3 +154,90 @@ class TenantResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class ApiKeyRotateResponse(BaseModel):
+    api_key: str
+    previous_keys_expire_at: datetime
+
+
+class TokenResponse(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+
+class ReceiptIngestResponse(BaseModel):
+    received: int
+    applied: int
+    unmatched: int
+    ignored: int
+    invalid: int
+
+
+class ExportCreate(BaseModel):
+    issued_from: Optional[datetime] = None
+    issued_to: Optional[datetime] = None
+
+
+class ExportResponse(BaseModel):
+    id: int
+    status: ExportStatus
+    format: str
+    issued_from: Optional[datetime]
+    issued_to: Optional[datetime]
+    row_count: int
+    error_message: Optional[str] = None
+    download_url: Optional[str] = None
+    created_at: datetime
+    completed_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+
+class VatReportLine(BaseModel):
+    country_code: CountryCode
+    tax_rate: str
+    currency: str
+    taxable_base: str
+    tax_amount: str
+    invoice_count: int
+
+
+class VatReportResponse(BaseModel):
+    year: int
+    quarter: Optional[int] = None
+    month: Optional[int] = None
+    lines: List[VatReportLine]
+
+
+class EventResponse(BaseModel):
+    id: int
+    event_type: str
+    invoice_id: int
+    payload: WebhookPayload
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class EventFeedResponse(BaseModel):
+    events: List[EventResponse]
+    next_cursor: int
+
+
+class SlowRequestTrace(BaseModel):
+    method: str
+    path: str
+    status: Optional[int] = None  # None when the request failed before responding
+    at: datetime
+    duration_ms: float
+    phases_ms: Dict[str, float]  # Self time of auth, db, validation, render, commit, and other
+
+
+class SlowRequestLog(BaseModel):
+    tracing: bool
+    threshold_ms: Optional[float] = None
+    requests: List[SlowRequestTrace]  # Newest first
@@ -0,0 +1,177 @@
+"""Invoice search by invoice number, party name and VAT ID.
+
+invoice_search holds one row per invoice: its tenant and a lowercased
+document made of the invoice number, the supplier and customer names and
+their VAT IDs. A row is written in the same flush as its invoice and
+rewritten when the number or a party changes, so a committed invoice is
+searchable at once. Archiving deletes it together with the invoice.
+
+Substring matching uses a text index that depends on the dialect and is
+created next to the table rather than declared in the metadata: an FTS5
+table with the trigram tokenizer on SQLite, which indexes the tenant next
+to the document, and a pg_trgm GIN index on PostgreSQL. Both find terms of
+three or more characters anywhere in the document without a scan. Results
+are newest first and are paged with the last invoice id seen as the cursor.
+
+Invoices stored before the table existed are indexed by
+`python -m app.search reindex`.
+"""
+import argparse
+from typing import List, Optional, Sequence
+
+from sqlalchemy import DDL, delete, event, insert, inspect, select, text
+from sqlalchemy.orm import Session
+
+from .models import Invoice, InvoiceSearch
+from .serialization import invoice_response_query
+from .sharding import fan_out
+from .vat_ids import normalize_vat_id
+
+MIN_TERM_LENGTH = 3  # Shorter terms have no trigram to look up
+FTS_TABLE = "invoice_search_fts"
+TRIGRAM_INDEX = "ix_invoice_search_document_trgm"
+_MAX_ROWID = 2 ** 63 - 1
+
+# Columns that feed the document; status and amount changes leave it alone
+_SEARCHED_ATTRIBUTES = ("invoice_number", "supplier_id", "customer_id", "legacy_supplier_data", "legacy_customer_data")
+
+# Contentless, keyed by -id: FTS5 walks rowids fastest in ascending order, which is newest first here.
+# The tenant column holds one fixed-width token, so a tenant's matches are found in the index itself.
+_FTS_TENANT = "printf('t%%010d', {}.tenant_id)"  # DDL() formats with %
+_SQLITE_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(tenant, document, content='', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS invoice_search_ai AFTER INSERT ON invoice_search BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, tenant, document) VALUES (-new.id, {_FTS_TENANT.format('new')}, new.document); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS invoice_search_ad AFTER DELETE ON invoice_search BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, tenant, document) "
+    f"VALUES ('delete', -old.id, {_FTS_TENANT.format('old')}, old.document); END",
+    f"CREATE TRIGGER IF NOT EXISTS invoice_search_au AFTER UPDATE ON invoice_search BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, tenant, document) "
+    f"VALUES ('delete', -old.id, {_FTS_TENANT.format('old')}, old.document); "
+    f"INSERT INTO {FTS_TABLE}(rowid, tenant, document) VALUES (-new.id, {_FTS_TENANT.format('new')}, new.document); "
+    f"END",
+)
+_POSTGRES_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON invoice_search USING gin (document gin_trgm_ops)",
+)
+
+for statement in _SQLITE_DDL:
+    event.listen(InvoiceSearch.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+for statement in _POSTGRES_DDL:
+    event.listen(InvoiceSearch.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+event.listen(
+    InvoiceSearch.__table__, "before_drop", DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}").execute_if(dialect="sqlite")
+)
+
+
+def include_name(name: Optional[str], type_: str, parent_names: dict) -> bool:
+    """Alembic filter: the text index is created by the DDL above, not declared in the metadata"""
+    return not (name or "").startswith((FTS_TABLE, TRIGRAM_INDEX))
+
+
+def search_document(invoice_number: str, supplier: Optional[dict], customer: Optional[dict]) -> str:
+    parts = [invoice_number]
+    for party in (supplier or {}, customer or {}):
+        parts.append(party.get("name") or "")
+        if party.get("vat_id"):
+            parts.append(normalize_vat_id(party["vat_id"]))
+    return "\n".join(parts).lower()
+
+
+def search_row(invoice: Invoice) -> dict:
+    return {
+        "id": invoice.id,
+        "tenant_id": invoice.tenant_id,
+        "document": search_document(invoice.invoice_number, invoice.supplier_data, invoice.customer_data),
+    }
+
+
+def _search_fields_changed(invoice: Invoice) -> bool:
+    state = inspect(invoice)
+    return any(state.attrs[name].history.has_changes() for name in _SEARCHED_ATTRIBUTES)
+
+
+@event.listens_for(Session, "after_flush")
+def _index_flushed_invoices(session, flush_context):
+    created = [obj for obj in session.new if isinstance(obj, Invoice)]
+    changed = [obj for obj in session.dirty if isinstance(obj, Invoice) and _search_fields_changed(obj)]
+    removed = [obj.id for obj in session.deleted if isinstance(obj, Invoice)]
+    if not (created or changed or removed):
+        return
+    connection = session.connection()
+    stale = [invoice.id for invoice in changed] + removed
+    if stale:
+        connection.execute(delete(InvoiceSearch).where(InvoiceSearch.id.in_(stale)))
+    if created or changed:
+        connection.execute(insert(InvoiceSearch), [search_row(invoice) for invoice in created + changed])
+
+
+def _newest_matches(db: Session, tenant_id: int, term: str, before: int, count: int) -> List[int]:
+    # Stops after `count` matches rather than collecting every one
+    query = 'tenant : "t%010d" AND document : "%s"' % (tenant_id, term.replace('"', '""'))
+    return db.scalars(text(
+        f"SELECT -rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query AND rowid > :after "
+        "ORDER BY rowid LIMIT :count"
+    ), {"query": query, "after": -before, "count": count}).all()
+
+
+def search_invoices(db: Session, tenant_id: int, term: str, cursor: Optional[int] = None,
+                    limit: int = 50) -> List[Sequence]:
+    """InvoiceResponse rows of the tenant whose search document contains `term`, newest first
+
+    `cursor` is the id of the last invoice of the previous page.
+    """
+    term = term.strip().lower()
+    if len(term) < MIN_TERM_LENGTH:
+        raise ValueError(f"Search terms need at least {MIN_TERM_LENGTH} characters")
+
+    query = invoice_response_query(db).join(InvoiceSearch, InvoiceSearch.id == Invoice.id).filter(
+        InvoiceSearch.tenant_id == tenant_id,
+        Invoice.tenant_id == tenant_id
+    ).order_by(InvoiceSearch.id.desc())
+    if db.get_bind().dialect.name != "sqlite":
+        query = query.filter(InvoiceSearch.document.contains(term, autoescape=True))
+        if cursor is not None:
+            query = query.filter(InvoiceSearch.id < cursor)
+        return query.limit(limit).all()
+
+    # FTS5 matches only this tenant's rows, so one page of matches fills the page
+    ids = _newest_matches(db, tenant_id, term, cursor if cursor is not None else _MAX_ROWID, limit)
+    if not ids:
+        return []
+    return query.filter(InvoiceSearch.id.in_(ids)).all()
+
+
+def reindex(db: Session, batch_size: int = 1000) -> int:
+    """Index invoices that have no search row yet; returns how many were added"""
+    added = after = 0
+    while True:
+        invoices = db.scalars(
+            select(Invoice).where(
+                Invoice.id > after,
+                ~select(InvoiceSearch.id).where(InvoiceSearch.id == Invoice.id).exists()
+            ).order_by(Invoice.id).limit(batch_size)
+        ).all()
+        if not invoices:
+            return added
+        db.execute(insert(InvoiceSearch), [search_row(invoice) for invoice in invoices])
+        db.commit()
+        added += len(invoices)
+        after = invoices[-1].id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Invoice search index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("reindex", help="Index invoices stored before search existed")
+    rebuild.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    for name, added in fan_out(lambda db: reindex(db, args.batch_size)).items():
+        print(f"{name}: {added} invoices indexed")
+
+
+if __name__ == "__main__":
+    main()
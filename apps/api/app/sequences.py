@@ -0,0 +1,101 @@
+"""Per-tenant, per-country document sequences such as the FatturaPA ProgressivoInvio.
+
+Each sequence is one document_sequences row holding the next free number.
+Numbers are handed out in one of two modes:
+
+- Block mode (default): a process reserves a block of numbers with one
+  atomic upsert in its own short transaction, then serves the block from
+  memory. Blocks never overlap, so numbers are unique across processes.
+  They increase within a process but may interleave across processes, and
+  the unused part of a block is lost when the process exits.
+- Gap-free mode, for countries listed in settings.gap_free_sequence_countries:
+  every number is taken in the caller's transaction. The sequence row stays
+  locked until that transaction ends, and a rollback returns the number.
+  This serializes writers of the same sequence, which is the cost of having
+  no gaps.
+"""
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import CountryCode, DocumentSequence
+
+TRANSMISSION = "transmission"
+
+# Countries whose documents carry a transmission progressive
+SEQUENCED_COUNTRIES = ("IT",)
+
+_BASE36 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+SequenceKey = Tuple[int, CountryCode, str]
+
+
+def to_base36(number: int, width: int = 0) -> str:
+    """Upper-case base 36; with `width`, zero-padded and truncated to the last `width` digits"""
+    digits = ""
+    while number:
+        number, digit = divmod(number, 36)
+        digits = _BASE36[digit] + digits
+    digits = digits or "0"
+    return digits.rjust(width, "0")[-width:] if width else digits
+
+
+def reserve(db: Session, key: SequenceKey, count: int) -> int:
+    """Advance a sequence by `count` and return the first reserved number; caller commits"""
+    tenant_id, country_code, name = key
+    dialect = db.get_bind().dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        raise NotImplementedError(f"Document sequences are not supported on {dialect}")
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    table = DocumentSequence.__table__
+    statement = insert(table).values(
+        tenant_id=tenant_id, country_code=country_code, name=name, next_value=1 + count
+    )
+    next_value = db.execute(statement.on_conflict_do_update(
+        index_elements=["tenant_id", "country_code", "name"],
+        set_={"next_value": table.c.next_value + count},
+    ).returning(table.c.next_value)).scalar_one()
+    return next_value - count
+
+
+class SequenceAllocator:
+    def __init__(self, block_size: int, gap_free_countries: Iterable[str] = ()):
+        self.block_size = block_size
+        self.gap_free_countries = set(gap_free_countries)
+        self._blocks: Dict[SequenceKey, List[int]] = {}  # key -> [next, end)
+        self._lock = threading.Lock()
+        self.reservations = 0
+
+    def next_value(self, db: Session, tenant_id: int, country_code: CountryCode, name: str = TRANSMISSION) -> int:
+        key = (tenant_id, country_code, name)
+        if country_code.value in self.gap_free_countries:
+            return reserve(db, key, 1)
+
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] >= block[1]:
+                start = self._reserve_block(db.get_bind(), key)
+                block = self._blocks[key] = [start, start + self.block_size]
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def _reserve_block(self, bind, key: SequenceKey) -> int:
+        # Own transaction: the row lock is held only for the upsert, not the caller's request
+        with Session(bind=bind) as session:
+            start = reserve(session, key, self.block_size)
+            session.commit()
+        self.reservations += 1
+        return start
+
+
+@lru_cache
+def get_sequence_allocator() -> SequenceAllocator:
+    return SequenceAllocator(settings.sequence_block_size, settings.gap_free_sequence_countries)
@@ -0,0 +1,57 @@
+from typing import Any, Iterable, Optional, Sequence, Tuple
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+from sqlalchemy.orm import Query, Session
+
+from .models import Invoice
+from .schemas import InvoiceResponse
+
+
+# Every field of InvoiceResponse, in declaration order. Fields backed by an
+# Invoice column are selected directly; the rest keep their schema default.
+INVOICE_RESPONSE_FIELDS: Tuple[str, ...] = tuple(InvoiceResponse.model_fields)
+INVOICE_RESPONSE_COLUMNS: Tuple[str, ...] = tuple(
+    name for name in INVOICE_RESPONSE_FIELDS if hasattr(Invoice, name)
+)
+_ROW_LAYOUT = tuple(
+    (name, INVOICE_RESPONSE_COLUMNS.index(name) if name in INVOICE_RESPONSE_COLUMNS else None)
+    for name in INVOICE_RESPONSE_FIELDS
+)
+_DEFAULTS = {name: InvoiceResponse.model_fields[name].default for name in INVOICE_RESPONSE_FIELDS}
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with pydantic-core's native encoder"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return to_json(content)
+
+
+def invoice_response_query(db: Session) -> Query:
+    """Select only the columns exposed by InvoiceResponse, as plain tuples"""
+    return db.query(*(getattr(Invoice, name) for name in INVOICE_RESPONSE_COLUMNS))
+
+
+def invoice_row_to_dict(row: Sequence[Any]) -> dict:
+    return {
+        name: _DEFAULTS[name] if index is None else row[index]
+        for name, index in _ROW_LAYOUT
+    }
+
+
+def serialize_invoice_row(row: Sequence[Any]) -> bytes:
+    return to_json(invoice_row_to_dict(row))
+
+
+def serialize_invoice_rows(rows: Iterable[Sequence[Any]]) -> bytes:
+    """Encode InvoiceResponse-shaped rows straight to JSON bytes"""
+    return to_json([invoice_row_to_dict(row) for row in rows])
+
+
+def serialize_invoice_page(rows: Iterable[Sequence[Any]], next_cursor: Optional[int]) -> bytes:
+    """Encode an InvoiceSearchResponse-shaped page straight to JSON bytes"""
+    return to_json({"invoices": [invoice_row_to_dict(row) for row in rows], "next_cursor": next_cursor})
+
@@ -0,0 +1,424 @@
+"""Tenant sharding: each tenant's data lives in one of several databases.
+
+The default database (database_url) is also the tenant directory. Tenants,
+API keys and token versions always live there, so authentication never
+needs to know about shards. Tenant.shard names the database holding the
+tenant's invoices, parties, events, exports, sequences and rollups; NULL
+means the default database. Extra databases are configured by name in
+shard_urls, and each keeps a copy of its tenants' rows so foreign keys hold.
+
+Request handlers take get_tenant_db, which resolves the tenant's database
+from an in-process ShardMap reloaded every shard_map_refresh_seconds. Admin
+jobs that span tenants run against every database at once with fan_out.
+
+move_tenant moves a tenant between databases while it keeps working:
+
+1. Bulk-copy its rows to the target, ids included, while it writes as usual.
+2. Freeze it by setting moving_to, so its API writes get 503 and gateway
+   receipts for it are deferred. Then wait until every process has reloaded
+   the map and requests already running have finished.
+3. Copy what changed since step 1: new ids, rows with a newer updated_at,
+   deletions. Repeat until a pass finds nothing, which also catches
+   background jobs that finish late. Small mutable tables are then copied
+   whole.
+4. Point Tenant.shard at the target and unfreeze. Once every process has
+   reloaded the map, delete the source rows.
+
+Row ids are kept so invoice URLs and event cursors stay valid. A move fails
+cleanly, and the tenant stays where it was, if the target already uses one
+of the tenant's ids.
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import lru_cache, partial
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy import bindparam, create_engine, delete, func, or_, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .admission import READ_METHODS
+from .auth import get_current_tenant
+from .config import settings
+from .database import SessionLocal, get_db
+from .models import (
+    ArchivedInvoice, ArchivedVatRollup, DocumentSequence, ExportJob, Invoice, InvoiceSearch, Party, Tenant, VatRollup,
+    WebhookEvent
+)
+
+DEFAULT_SHARD = "default"
+
+T = TypeVar("T")
+
+# Tenant-owned tables in foreign-key order. Append-only tables catch up by
+# id, invoices also by updated_at; the small mutable ones are copied whole.
+_APPEND, _VERSIONED, _WHOLE = "append", "versioned", "whole"
+_MOVED_TABLES = (
+    (Party.__table__, _APPEND),
+    (Invoice.__table__, _VERSIONED),
+    (InvoiceSearch.__table__, _APPEND),
+    (WebhookEvent.__table__, _APPEND),
+    (ArchivedInvoice.__table__, _APPEND),
+    (ExportJob.__table__, _WHOLE),
+    (DocumentSequence.__table__, _WHOLE),
+    (VatRollup.__table__, _WHOLE),
+    (ArchivedVatRollup.__table__, _WHOLE),
+)
+
+
+class ShardRouter:
+    """Engines for the configured shards, created on first use"""
+
+    def __init__(self, urls: Dict[str, str]):
+        self.urls = dict(urls)
+        self._engines: Dict[str, Engine] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.urls)
+
+    def engine(self, name: str) -> Engine:
+        engine = self._engines.get(name)
+        if engine is None:
+            if name not in self.urls:
+                raise KeyError(f"Unknown shard {name!r}")
+            with self._lock:
+                engine = self._engines.get(name)
+                if engine is None:
+                    url = self.urls[name]
+                    engine = create_engine(
+                        url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {}
+                    )
+                    self._engines[name] = engine
+        return engine
+
+    @property
+    def engines(self) -> List[Engine]:
+        """Engines created so far; shards not yet used have no pool to inspect"""
+        return list(self._engines.values())
+
+    def session(self, name: str) -> Session:
+        return Session(bind=self.engine(name), autoflush=False)
+
+    def dispose(self) -> None:
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+
+
+@lru_cache
+def get_shard_router() -> ShardRouter:
+    return ShardRouter(settings.shard_urls)
+
+
+class ShardMap:
+    """In-process copy of where tenants live, reloaded every `ttl` seconds
+
+    Only tenants outside the default database or mid-move have a placement,
+    so the map stays small.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._placements: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def lookup(self, db: Session, tenant_id: int) -> Tuple[Optional[str], Optional[str]]:
+        """(shard, moving_to) for a tenant; shard is None for the default database"""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.refresh(db)
+        return self._placements.get(tenant_id, (None, None))
+
+    def refresh(self, db: Session) -> None:
+        rows = db.query(Tenant.id, Tenant.shard, Tenant.moving_to).filter(
+            or_(Tenant.shard.isnot(None), Tenant.moving_to.isnot(None))
+        ).all()
+        with self._lock:
+            self._placements = {tenant_id: (shard, moving_to) for tenant_id, shard, moving_to in rows}
+            self._loaded_at = time.monotonic()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._placements = {}
+            self._loaded_at = None
+
+
+shard_map = ShardMap(settings.shard_map_refresh_seconds)
+
+
+def get_tenant_db(
+    request: Request,
+    current_tenant: Tenant = Depends(get_current_tenant),
+    db: Session = Depends(get_db)
+):
+    """Session on the database holding the current tenant's data"""
+    shard, moving_to = shard_map.lookup(db, current_tenant.id)
+    if moving_to is not None and request.method not in READ_METHODS:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Tenant is being moved to another database, retry later",
+            headers={"Retry-After": str(settings.shard_map_refresh_seconds)}
+        )
+    if shard is None:
+        yield db
+        return
+    shard_db = get_shard_router().session(shard)
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+
+def get_shard_sessions():
+    """Sessions on every configured shard, for requests not tied to one tenant"""
+    router = get_shard_router()
+    sessions = {name: router.session(name) for name in router.names}
+    try:
+        yield sessions
+    finally:
+        for session in sessions.values():
+            session.close()
+
+
+def fan_out(fn: Callable[[Session], T], default_factory: Callable[[], Session] = SessionLocal,
+            router: Optional[ShardRouter] = None) -> Dict[str, T]:
+    """Run `fn` on every database at once, each in its own thread and session"""
+    router = router or get_shard_router()
+    factories = {DEFAULT_SHARD: default_factory, **{name: partial(router.session, name) for name in router.names}}
+
+    def run(factory):
+        db = factory()
+        try:
+            return fn(db)
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=len(factories)) as pool:
+        futures = {name: pool.submit(run, factory) for name, factory in factories.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def shard_usage(db: Session) -> Tuple[int, int]:
+    """Tenants with invoices in this database, and the number of invoices"""
+    return tuple(db.query(func.count(func.distinct(Invoice.tenant_id)), func.count(Invoice.id)).one())
+
+
+class ShardMoveError(Exception):
+    pass
+
+
+@dataclass
+class MoveStats:
+    copied: int = 0  # Rows copied while the tenant kept writing
+    caught_up: int = 0  # Rows inserted, updated or deleted while it was frozen
+    passes: int = 0
+
+
+def _batches(items: Iterable, size: int) -> Iterable[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _now(engine: Engine):
+    # Database time, comparable with updated_at; one second of slack for second-resolution clocks
+    with engine.connect() as conn:
+        return conn.scalar(select(func.now())) - timedelta(seconds=1)
+
+
+def _copy_all(src: Connection, dst: Connection, table, tenant_id: int, batch_size: int) -> int:
+    result = src.execute(
+        select(table).where(table.c.tenant_id == tenant_id),
+        execution_options={"stream_results": True, "yield_per": batch_size}
+    )
+    copied = 0
+    for rows in result.mappings().partitions():
+        dst.execute(table.insert(), [dict(row) for row in rows])
+        copied += len(rows)
+    return copied
+
+
+def _fetch(conn: Connection, table, ids: List[int]) -> Dict[int, dict]:
+    return {row["id"]: dict(row) for row in conn.execute(select(table).where(table.c.id.in_(ids))).mappings()}
+
+
+def _catch_up(src: Connection, dst: Connection, tenant_id: int, since, batch_size: int) -> int:
+    """One catch-up pass over the id-keyed tables; returns rows changed on the target"""
+    changed = 0
+    removed = []
+    for table, mode in _MOVED_TABLES:
+        if mode == _WHOLE:
+            continue
+        owned = table.c.tenant_id == tenant_id
+        source_ids = set(src.execute(select(table.c.id).where(owned)).scalars())
+        target_ids = set(dst.execute(select(table.c.id).where(owned)).scalars())
+        removed.append((table, sorted(target_ids - source_ids)))
+
+        for batch in _batches(sorted(source_ids - target_ids), batch_size):
+            dst.execute(table.insert(), list(_fetch(src, table, batch).values()))
+            changed += len(batch)
+
+        if mode == _VERSIONED:
+            recent = src.execute(select(table.c.id).where(owned, table.c.updated_at >= since)).scalars()
+            update_by_id = update(table).where(table.c.id == bindparam("b_id")).values(
+                {column: bindparam(f"b_{column.key}") for column in table.c if column.key != "id"}
+            )
+            for batch in _batches(sorted(target_ids.intersection(recent)), batch_size):
+                current, copied = _fetch(src, table, batch), _fetch(dst, table, batch)
+                stale = [row for row_id, row in current.items() if copied.get(row_id) != row]
+                if stale:
+                    dst.execute(update_by_id, [{f"b_{key}": value for key, value in row.items()} for row in stale])
+                    changed += len(stale)
+
+    # Children before parents, e.g. events before the invoices they point at
+    for table, ids in reversed(removed):
+        for batch in _batches(ids, batch_size):
+            dst.execute(delete(table).where(table.c.id.in_(batch)))
+            changed += len(batch)
+    return changed
+
+
+def _copy_mutable(src: Connection, dst: Connection, tenant_id: int) -> int:
+    copied = 0
+    for table, mode in _MOVED_TABLES:
+        if mode == _WHOLE:
+            rows = [dict(row) for row in src.execute(select(table).where(table.c.tenant_id == tenant_id)).mappings()]
+            dst.execute(delete(table).where(table.c.tenant_id == tenant_id))
+            if rows:
+                dst.execute(table.insert(), rows)
+            copied += len(rows)
+    return copied
+
+
+def _delete_tenant_rows(conn: Connection, tenant_id: int) -> None:
+    for table, _ in reversed(_MOVED_TABLES):
+        conn.execute(delete(table).where(table.c.tenant_id == tenant_id))
+
+
+def _advance_id_sequences(conn: Connection) -> None:
+    """Move PostgreSQL id sequences past the copied ids; SQLite continues from the highest id by itself"""
+    if conn.dialect.name != "postgresql":
+        return
+    for table, _ in _MOVED_TABLES:
+        if "id" in table.c:
+            sequence = conn.scalar(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table.name})
+            if sequence is None:  # Ids copied from another table, e.g. invoice_search
+                continue
+            conn.execute(text(
+                f"SELECT setval('{sequence}', GREATEST((SELECT COALESCE(MAX(id), 1) FROM {table.name}), "
+                f"(SELECT last_value FROM {sequence})))"
+            ))
+
+
+def move_tenant(directory: Session, tenant_id: int, target: str, router: Optional[ShardRouter] = None,
+                batch_size: int = 1000, max_passes: int = 10,
+                sleep: Callable[[float], None] = time.sleep) -> MoveStats:
+    """Move a tenant's rows to the `target` database while the tenant stays online
+
+    `directory` is a session on the default database. The tenant's writes
+    are refused only between the bulk copy and the switch-over.
+    """
+    router = router or get_shard_router()
+    tenant = directory.get(Tenant, tenant_id)
+    if tenant is None:
+        raise ShardMoveError(f"Tenant {tenant_id} not found")
+    source = tenant.shard or DEFAULT_SHARD
+    if tenant.moving_to is not None:
+        raise ShardMoveError(f"Tenant {tenant_id} is already moving to {tenant.moving_to}")
+    if source == target:
+        raise ShardMoveError(f"Tenant {tenant_id} is already on {target}")
+    source_engine, target_engine = (
+        directory.get_bind() if name == DEFAULT_SHARD else router.engine(name) for name in (source, target)
+    )
+    stats = MoveStats()
+
+    try:
+        tenant_row = dict(directory.execute(
+            select(Tenant.__table__).where(Tenant.id == tenant_id)
+        ).mappings().one())
+        with source_engine.connect() as src, target_engine.begin() as dst:
+            _delete_tenant_rows(dst, tenant_id)  # Leftovers from an interrupted move
+            if dst.scalar(select(Tenant.id).where(Tenant.id == tenant_id)) is None:
+                dst.execute(Tenant.__table__.insert(), tenant_row | {"shard": None, "moving_to": None})
+            since = _now(source_engine)
+            for table, _ in _MOVED_TABLES:
+                stats.copied += _copy_all(src, dst, table, tenant_id, batch_size)
+
+        tenant.moving_to = target
+        directory.commit()
+        sleep(settings.shard_map_refresh_seconds + settings.shard_move_drain_seconds)
+
+        while stats.passes < max_passes:
+            started = _now(source_engine)
+            with source_engine.connect() as src, target_engine.begin() as dst:
+                changed = _catch_up(src, dst, tenant_id, since, batch_size)
+            stats.passes += 1
+            stats.caught_up += changed
+            since = started
+            if not changed:
+                break
+        with source_engine.connect() as src, target_engine.begin() as dst:
+            stats.caught_up += _copy_mutable(src, dst, tenant_id)
+            _advance_id_sequences(dst)
+    except Exception as e:
+        directory.rollback()
+        tenant.moving_to = None
+        directory.commit()
+        with target_engine.begin() as dst:
+            _delete_tenant_rows(dst, tenant_id)
+        if isinstance(e, IntegrityError):
+            raise ShardMoveError(f"Target {target} already uses some of tenant {tenant_id}'s ids") from e
+        raise
+
+    tenant.shard = None if target == DEFAULT_SHARD else target
+    tenant.moving_to = None
+    directory.commit()
+    shard_map.clear()
+
+    with source_engine.begin() as src:
+        # The stale copy must never be picked up by the source's retry worker
+        src.execute(update(Invoice.__table__).where(Invoice.tenant_id == tenant_id).values(next_attempt_at=None))
+    sleep(settings.shard_map_refresh_seconds)  # Other processes may read the source until they reload the map
+    with source_engine.begin() as src:
+        _delete_tenant_rows(src, tenant_id)
+        if source != DEFAULT_SHARD:
+            src.execute(delete(Tenant.__table__).where(Tenant.id == tenant_id))
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect shards and move tenants between them")
+    commands = parser.add_subparsers(dest="command", required=True)
+    move = commands.add_parser("move", help="Move a tenant to another database while it stays online")
+    move.add_argument("tenant_id", type=int)
+    move.add_argument("target", help=f"Shard name from SHARD_URLS, or {DEFAULT_SHARD!r}")
+    move.add_argument("--batch-size", type=int, default=1000)
+    commands.add_parser("usage", help="Tenants and invoices per database")
+    args = parser.parse_args(argv)
+
+    if args.command == "usage":
+        for name, (tenants, invoices) in fan_out(shard_usage).items():
+            print(f"{name}: {tenants} tenants, {invoices} invoices")
+        return
+
+    directory = SessionLocal()
+    try:
+        stats = move_tenant(directory, args.tenant_id, args.target, batch_size=args.batch_size)
+    finally:
+        directory.close()
+    print(f"Moved tenant {args.tenant_id} to {args.target}: {stats.copied} rows copied online, "
+          f"{stats.caught_up} caught up in {stats.passes} passes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Explicit startup work for the API process.
+
+Importing app.main only defines routes: it opens no database connection,
+creates no tables and leaves heavy third-party clients unimported. Work
+that has to happen before the first request is done here, from the FastAPI
+lifespan hook, where it is timed and can be budgeted.
+"""
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from .config import settings
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+# What Base.metadata.create_all built before migrations existed
+BASELINE_REVISION = "0001"
+
+# Loaders run before the app accepts traffic; modules that need warming
+# (XML schemas, templates, crypto backends) register themselves here.
+PRELOADERS: List[Tuple[str, Callable[[], object]]] = []
+
+startup_timings: Dict[str, float] = {}
+
+
+def preloader(name: str):
+    def register(func: Callable[[], object]):
+        PRELOADERS.append((name, func))
+        return func
+    return register
+
+
+@preloader("jwt")
+def _preload_jwt():
+    # Every authenticated request tries the bearer token as a JWT first
+    from jose import jwt  # noqa: F401
+
+
+@preloader("lxml")
+def _preload_lxml():
+    # Parses every imported invoice document
+    from lxml import etree  # noqa: F401
+
+
+@preloader("pdf")
+def _preload_pdf():
+    # Spawning a worker and parsing the font would otherwise delay the first render
+    if settings.pdf_rendering_enabled:
+        from .rendering import get_pdf_renderer
+        get_pdf_renderer().start()
+
+
+def _upgrade(connection) -> None:
+    from alembic import command
+    from alembic.config import Config
+    from alembic.migration import MigrationContext
+    from sqlalchemy import inspect
+
+    config = Config(str(ALEMBIC_INI))
+    config.attributes["configure_logger"] = False
+    config.attributes["connection"] = connection
+    if MigrationContext.configure(connection).get_current_revision() is None and inspect(connection).has_table("tenants"):
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, "head")
+
+
+def run_migrations(connection=None) -> None:
+    """Upgrade the database to the latest Alembic revision; without `connection`, also every shard"""
+    if connection is not None:
+        _upgrade(connection)
+        return
+
+    from .database import engine
+    from .sharding import get_shard_router
+
+    router = get_shard_router()
+    for bind in [engine] + [router.engine(name) for name in router.names]:
+        with bind.begin() as connection:
+            _upgrade(connection)
+
+
+def preload() -> Dict[str, float]:
+    """Run startup work and record how long each step took, in seconds"""
+    steps: List[Tuple[str, Callable[[], object]]] = []
+    if settings.run_migrations_on_startup:
+        steps.append(("migrations", run_migrations))
+    steps.extend(PRELOADERS)
+
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        startup_timings[name] = time.perf_counter() - start
+    return startup_timings
+
+
+if __name__ == "__main__":
+    run_migrations()
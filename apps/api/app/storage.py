@@ -0,0 +1,122 @@
+import os
+import shutil
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+
+from .config import settings
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class LocalBlobStore:
+    """Blob store backed by a local directory, used in development and tests"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> str:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        return self.url(key)
+
+    def put_file(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> str:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as out:
+            shutil.copyfileobj(fileobj, out, 1024 * 1024)
+        os.replace(tmp, path)
+        return self.url(key)
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            return open(self._path(key), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def url(self, key: str) -> str:
+        return self._path(key).as_uri()
+
+
+class S3BlobStore:
+    """Blob store backed by S3 or any S3-compatible endpoint"""
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self._client = None
+
+    @property
+    def client(self):
+        # boto3 is slow to import, so it is only loaded once S3 is actually used
+        if self._client is None:
+            import boto3
+            self._client = boto3.client(
+                "s3",
+                region_name=settings.aws_region,
+                endpoint_url=self.endpoint_url,
+                aws_access_key_id=settings.aws_access_key_id,
+                aws_secret_access_key=settings.aws_secret_access_key,
+            )
+        return self._client
+
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> str:
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **extra)
+        return self.url(key)
+
+    def put_file(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> str:
+        # upload_fileobj streams large files as a multipart upload
+        extra = {"ExtraArgs": {"ContentType": content_type}} if content_type else {}
+        self.client.upload_fileobj(fileobj, self.bucket, key, **extra)
+        return self.url(key)
+
+    def get(self, key: str) -> bytes:
+        return self.open(key).read()
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+        except self.client.exceptions.NoSuchKey:
+            raise BlobNotFound(key)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def url(self, key: str) -> str:
+        return f"s3://{self.bucket}/{key}"
+
+
+@lru_cache
+def get_blob_store():
+    if settings.storage_backend == "s3":
+        return S3BlobStore(settings.s3_bucket, settings.s3_endpoint_url)
+    return LocalBlobStore(settings.local_storage_path)
+
+
+def iter_blob(store, key: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    with closing(store.open(key)) as fileobj:
+        while chunk := fileobj.read(chunk_size):
+            yield chunk
@@ -0,0 +1,344 @@
+"""VAT ID verification: format/checksum validation plus cached registry lookups.
+
+Format and checksum rules are compiled once at import. Registry lookups go
+through a pluggable client (VIES, or a local stand-in), are cached with
+separate positive and negative TTLs, and concurrent lookups of the same ID
+share a single in-flight request.
+"""
+import asyncio
+import json
+import re
+import time
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .config import settings
+from .schemas import VatIdCheckResult
+
+_SEPARATORS = re.compile(r"[\s.\-/]")
+
+# National number formats after the two-letter prefix (Greece uses EL)
+_FORMATS: Dict[str, re.Pattern] = {
+    country: re.compile(f"^(?:{pattern})$")
+    for country, pattern in {
+        "AT": r"U\d{8}",
+        "BE": r"[01]\d{9}",
+        "BG": r"\d{9,10}",
+        "CY": r"\d{8}[A-Z]",
+        "CZ": r"\d{8,10}",
+        "DE": r"\d{9}",
+        "DK": r"\d{8}",
+        "EE": r"\d{9}",
+        "EL": r"\d{9}",
+        "ES": r"[0-9A-Z]\d{7}[0-9A-Z]",
+        "FI": r"\d{8}",
+        "FR": r"[0-9A-HJ-NP-Z]{2}\d{9}",
+        "HR": r"\d{11}",
+        "HU": r"\d{8}",
+        "IE": r"\d{7}[A-W][A-I]?|\d[A-Z+*]\d{5}[A-W]",
+        "IT": r"\d{11}",
+        "LT": r"\d{9}|\d{12}",
+        "LU": r"\d{8}",
+        "LV": r"\d{11}",
+        "MT": r"\d{8}",
+        "NL": r"\d{9}B\d{2}",
+        "PL": r"\d{10}",
+        "PT": r"\d{9}",
+        "RO": r"\d{2,10}",
+        "SE": r"\d{10}01",
+        "SI": r"\d{8}",
+        "SK": r"\d{10}",
+        "XI": r"\d{9}|\d{12}|GD\d{3}|HA\d{3}",
+    }.items()
+}
+
+
+def _check_de(number: str) -> bool:
+    # ISO 7064 MOD 11,10
+    product = 10
+    for digit in number[:8]:
+        total = (int(digit) + product) % 10 or 10
+        product = (2 * total) % 11
+    return (11 - product) % 10 == int(number[8])
+
+
+def _check_it(number: str) -> bool:
+    total = 0
+    for i, digit in enumerate(number[:10]):
+        value = int(digit)
+        if i % 2:
+            value *= 2
+            value -= 9 if value > 9 else 0
+        total += value
+    return (10 - total % 10) % 10 == int(number[10])
+
+
+def _check_fr(number: str) -> bool:
+    if not number[:2].isdigit():
+        return True  # Alphabetic keys use a different, unpublished scheme
+    return int(number[:2]) == (12 + 3 * (int(number[2:]) % 97)) % 97
+
+
+def _check_nl(number: str) -> bool:
+    weighted = sum(int(d) * w for d, w in zip(number[:8], range(9, 1, -1))) - int(number[8])
+    if weighted % 11 == 0:
+        return True
+    # Sole-proprietor numbers issued since 2020 use MOD 97 over the full ID
+    converted = "".join(str(ord(c) - 55) if c.isalpha() else c for c in "NL" + number)
+    return int(converted) % 97 == 1
+
+
+def _check_be(number: str) -> bool:
+    return 97 - int(number[:8]) % 97 == int(number[8:])
+
+
+def _check_at(number: str) -> bool:
+    total = 0
+    for i, digit in enumerate(number[1:8]):
+        value = int(digit)
+        if i % 2:
+            value *= 2
+            value = value // 10 + value % 10
+        total += value
+    return (10 - (total + 4) % 10) % 10 == int(number[8])
+
+
+_CHECKSUMS: Dict[str, Callable[[str], bool]] = {
+    "AT": _check_at,
+    "BE": _check_be,
+    "DE": _check_de,
+    "FR": _check_fr,
+    "IT": _check_it,
+    "NL": _check_nl,
+}
+
+
+def normalize_vat_id(vat_id: str) -> str:
+    return _SEPARATORS.sub("", vat_id).upper()
+
+
+def split_vat_id(vat_id: str) -> Tuple[str, str]:
+    normalized = normalize_vat_id(vat_id)
+    return normalized[:2], normalized[2:]
+
+
+def vat_id_format_errors(vat_id: str) -> List[str]:
+    """Check a VAT ID's format and checksum without any network access"""
+    country, number = split_vat_id(vat_id)
+    pattern = _FORMATS.get(country)
+    if pattern is None:
+        return [f"Unknown VAT ID country prefix '{country}'"]
+    if not pattern.match(number):
+        return [f"Invalid {country} VAT ID format"]
+    checksum = _CHECKSUMS.get(country)
+    if checksum and not checksum(number):
+        return [f"Invalid {country} VAT ID checksum"]
+    return []
+
+
+class RegistryUnavailable(Exception):
+    pass
+
+
+class LocalVatRegistry:
+    """In-process stand-in for VIES, for development, tests and benchmarks.
+
+    With no `records`, every well-formed VAT ID is reported as registered.
+    """
+
+    def __init__(self, records: Optional[Dict[str, dict]] = None, latency: float = 0.0):
+        self.records = records
+        self.latency = latency
+        self.calls = 0
+
+    async def lookup(self, country: str, number: str) -> dict:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.records is None:
+            return {"valid": True, "name": None, "address": None}
+        record = self.records.get(country + number)
+        if record is None:
+            return {"valid": False, "name": None, "address": None}
+        return {"valid": True, "name": record.get("name"), "address": record.get("address")}
+
+
+class ViesRegistryClient:
+    """Client for the EU VIES REST API"""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+        return self._client
+
+    async def lookup(self, country: str, number: str) -> dict:
+        try:
+            response = await self.client.get(f"/ms/{country}/vat/{number}")
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            raise RegistryUnavailable(str(e))
+        if data.get("userError") not in (None, "VALID", "INVALID"):
+            raise RegistryUnavailable(data["userError"])
+        return {
+            "valid": bool(data.get("isValid")),
+            "name": data.get("name") if data.get("name") not in (None, "---") else None,
+            "address": data.get("address") if data.get("address") not in (None, "---") else None,
+        }
+
+
+class MemoryVatCache:
+    """Per-process cache evicting the least recently used ID when full"""
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict, ttl: int) -> None:
+        if key not in self._entries and len(self._entries) >= self.maxsize:
+            self._entries.popitem(last=False)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+
+class RedisVatCache:
+    """Cache shared by all workers through Redis"""
+
+    def __init__(self, url: str, prefix: str = "vatid:"):
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio
+            self._client = redis.asyncio.from_url(self.url)
+        return self._client
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = await self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: dict, ttl: int) -> None:
+        await self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+
+class VatIdService:
+    def __init__(self, registry, cache, positive_ttl: int, negative_ttl: int, max_concurrency: int):
+        self.registry = registry
+        self.cache = cache
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_concurrency = max_concurrency
+        # Semaphores and futures belong to one event loop, and the service outlives a loop in tests and scripts
+        self._per_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def _loop_state(self) -> Tuple[asyncio.Semaphore, Dict[str, asyncio.Future]]:
+        """Concurrency limit and in-flight lookups of the running loop"""
+        loop = asyncio.get_running_loop()
+        state = self._per_loop.get(loop)
+        if state is None:
+            state = self._per_loop[loop] = (asyncio.Semaphore(self.max_concurrency), {})
+        return state
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    async def verify(self, vat_id: str) -> VatIdCheckResult:
+        normalized = normalize_vat_id(vat_id)
+        country, number = normalized[:2], normalized[2:]
+        errors = vat_id_format_errors(normalized)
+        if errors:
+            return VatIdCheckResult(vat_id=normalized, country_code=country, valid=False,
+                                    format_valid=False, errors=errors)
+
+        record = await self.cache.get(normalized)
+        if record is not None:
+            self.hits += 1
+            return self._result(normalized, record, cached=True)
+
+        self.misses += 1
+        _, inflight = self._loop_state()
+        task = inflight.get(normalized)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup(normalized, country, number))
+            inflight[normalized] = task
+            task.add_done_callback(lambda _: inflight.pop(normalized, None))
+        record = await asyncio.shield(task)
+        if record is None:
+            return VatIdCheckResult(vat_id=normalized, country_code=country, valid=None,
+                                    format_valid=True, errors=["VAT registry unavailable"])
+        return self._result(normalized, record, cached=False)
+
+    async def verify_many(self, vat_ids: Iterable[str]) -> List[VatIdCheckResult]:
+        vat_ids = list(vat_ids)
+        unique = list(dict.fromkeys(normalize_vat_id(v) for v in vat_ids))
+        results = dict(zip(unique, await asyncio.gather(*(self.verify(v) for v in unique))))
+        return [results[normalize_vat_id(v)] for v in vat_ids]
+
+    async def _lookup(self, key: str, country: str, number: str) -> Optional[dict]:
+        semaphore, _ = self._loop_state()
+        async with semaphore:
+            try:
+                record = await self.registry.lookup(country, number)
+            except RegistryUnavailable:
+                return None  # Not cached, so the next request tries again
+        await self.cache.set(key, record, self.positive_ttl if record["valid"] else self.negative_ttl)
+        return record
+
+    @staticmethod
+    def _result(vat_id: str, record: dict, cached: bool) -> VatIdCheckResult:
+        return VatIdCheckResult(
+            vat_id=vat_id,
+            country_code=vat_id[:2],
+            valid=record["valid"],
+            format_valid=True,
+            name=record.get("name"),
+            address=record.get("address"),
+            cached=cached,
+            errors=[] if record["valid"] else ["VAT ID is not registered"],
+        )
+
+
+@lru_cache
+def get_vat_id_service() -> VatIdService:
+    if settings.vat_registry == "vies":
+        registry = ViesRegistryClient(settings.vies_base_url, settings.vies_timeout_seconds)
+    else:
+        registry = LocalVatRegistry()
+    if settings.vat_cache_backend == "redis":
+        cache = RedisVatCache(settings.redis_url)
+    else:
+        cache = MemoryVatCache()
+    return VatIdService(
+        registry,
+        cache,
+        positive_ttl=settings.vat_cache_positive_ttl_seconds,
+        negative_ttl=settings.vat_cache_negative_ttl_seconds,
+        max_concurrency=settings.vat_registry_max_concurrency,
+    )
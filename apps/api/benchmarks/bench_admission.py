@@ -0,0 +1,115 @@
+"""Read latency during a write storm, with and without admission control.
+
+Runs the app in-process behind httpx's ASGI transport on a scratch SQLite
+database with a fixed-size connection pool. Many writers post large
+invoices back to back while a few readers fetch single invoices. Reports
+read p50/p99 and the request outcomes for each mode. Every write keeps its
+connection until its background PDF render finishes, so without admission
+control the pool runs dry and requests stall until the pool timeout. Writers
+retry refused requests after a short pause, as an impatient client would.
+
+Run from apps/api:  python -m benchmarks.bench_admission
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import database
+from app.admission import get_admission_controller
+from app.auth import issue_api_key
+from app.config import settings
+from app.database import Base, get_db
+from app.main import app
+from app.models import Tenant
+
+WRITERS = 64
+READERS = 4
+LINES = 200
+DURATION = 5.0
+HEADERS = {}  # Authorization is added once the tenant has a key
+
+
+def invoice(n: int) -> dict:
+    party = {"name": "Lieferant GmbH", "vat_id": "DE123456789", "address": "Hauptstr. 1", "city": "Berlin",
+             "postal_code": "10115", "country": "DE"}
+    return {
+        "external_id": f"storm-{n}", "invoice_number": f"S-{n}", "country_code": "DE",
+        "issue_date": "2024-01-31T00:00:00Z", "supplier": party, "customer": party,
+        "line_items": [{"description": f"Position {i}", "quantity": 1.0, "unit_price": "100.00",
+                        "tax_rate": 19.0, "tax_amount": "19.00", "line_total": "100.00"} for i in range(LINES)],
+    }
+
+
+async def run(client: httpx.AsyncClient, invoice_id: int) -> None:
+    deadline = time.perf_counter() + DURATION
+    reads, outcomes = [], {"created": 0, "shed": 0, "failed": 0, "failed reads": 0}
+    counter = iter(range(10 ** 9))
+
+    async def writer():
+        while time.perf_counter() < deadline:
+            response = await client.post("/invoices", json=invoice(next(counter)), headers=HEADERS)
+            outcomes[{200: "created", 429: "shed"}.get(response.status_code, "failed")] += 1
+            if response.status_code != 200:
+                await asyncio.sleep(0.05)
+
+    async def reader():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(f"/invoices/{invoice_id}", headers=HEADERS)
+            if response.status_code == 200:
+                reads.append(time.perf_counter() - start)
+            else:
+                outcomes["failed reads"] += 1
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(writer() for _ in range(WRITERS)), *(reader() for _ in range(READERS)))
+    reads.sort()
+    print(f"  reads: {len(reads):5} p50 {reads[len(reads) // 2] * 1000:7.1f} ms, "
+          f"p99 {reads[int(len(reads) * 0.99)] * 1000:7.1f} ms | "
+          f"{outcomes['failed reads']} failed | writes: {outcomes['created']:4} created, "
+          f"{outcomes['shed']:5} shed, {outcomes['failed']} failed")
+
+
+async def main():
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'storm.db')}",
+                           connect_args={"check_same_thread": False, "timeout": 30},
+                           pool_size=10, max_overflow=10, pool_timeout=2)
+    database.engine = engine  # Admission reads pool saturation from here
+    Session = sessionmaker(bind=engine, autoflush=False)
+    Base.metadata.create_all(engine)
+    settings.pdf_render_workers = 0
+    settings.local_storage_path = tempfile.mkdtemp()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    with Session() as db:
+        tenant = Tenant(name="Bench")
+        db.add(tenant)
+        db.flush()
+        HEADERS["Authorization"] = f"Bearer {issue_api_key(db, tenant)}"
+        db.commit()
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        invoice_id = (await client.post("/invoices", json=invoice(-1), headers=HEADERS)).json()["id"]
+        for enabled in (False, True):
+            settings.admission_enabled = enabled
+            get_admission_controller.cache_clear()
+            print(f"admission control {'on' if enabled else 'off'}, {WRITERS} writers x {LINES} lines, "
+                  f"{READERS} readers, {DURATION:.0f} s")
+            await run(client, invoice_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
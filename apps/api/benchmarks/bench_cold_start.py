@@ -0,0 +1,40 @@
+"""Cold start: `import app.main` in fresh interpreters, then the lifespan preload.
+
+Run from apps/api:  python -m benchmarks.bench_cold_start
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+RUNS = 10
+
+_PROBE = """
+import time
+start = time.perf_counter()
+import app.main
+print(time.perf_counter() - start)
+"""
+
+
+def import_time() -> float:
+    result = subprocess.run([sys.executable, "-c", _PROBE], capture_output=True, text=True, check=True)
+    return float(result.stdout)
+
+
+def main():
+    samples = sorted(import_time() for _ in range(RUNS))
+    print(f"import app.main: median {statistics.median(samples) * 1000:.0f} ms, "
+          f"max {samples[-1] * 1000:.0f} ms over {RUNS} runs")
+
+    import app.main  # noqa: F401
+    from app.startup import preload
+    start = time.perf_counter()
+    timings = preload()
+    print(f"lifespan preload: {(time.perf_counter() - start) * 1000:.0f} ms")
+    for name, seconds in timings.items():
+        print(f"  {name:<20} {seconds * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
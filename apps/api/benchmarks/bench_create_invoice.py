@@ -0,0 +1,88 @@
+"""End-to-end POST /invoices latency for large invoices.
+
+Creates invoices of increasing line counts through the app with immediate
+submission to the fake gateways, so one request parses the lines, computes
+totals, renders UBL and the country XML, and submits. Lines alternate
+between two VAT rates. Reports the median latency per country and size.
+
+Run from apps/api:  python -m benchmarks.bench_create_invoice
+"""
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.auth import issue_api_key
+from app.config import settings
+from app.database import Base, get_db
+from app.main import app
+from app.models import Tenant
+
+ROUNDS = 20
+SIZES = (10, 200, 1000)
+COUNTRIES = ("DE", "IT", "FR")
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+Session = sessionmaker(bind=engine)
+
+
+def override_get_db():
+    db = Session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def payload(country: str, lines: int, number: int) -> dict:
+    party = {"address": "Via Roma 1", "city": "Milano", "postal_code": "20121", "country": country}
+    return {
+        "external_id": f"bench-{country}-{lines}-{number}",
+        "invoice_number": f"B-{number}",
+        "country_code": country,
+        "issue_date": "2024-01-15T00:00:00Z",
+        "supplier": {"name": "Fornitore & Figli", "vat_id": f"{country}12345678901", **party},
+        "customer": {"name": "Cliente SpA", "vat_id": f"{country}98765432109", **party},
+        "line_items": [
+            {"description": f"Item <{i}>", "quantity": 2.0, "unit_price": "50.00",
+             "tax_rate": 22.0 if i % 2 else 10.0, "tax_amount": "22.00" if i % 2 else "10.00",
+             "line_total": "100.00"}
+            for i in range(lines)
+        ],
+        "submit_immediately": True,
+    }
+
+
+def main():
+    settings.pdf_render_workers = 0
+    settings.local_storage_path = "/tmp/vatevo-bench-storage"
+    Base.metadata.create_all(bind=engine)
+    with Session() as db:
+        tenant = Tenant(name="Bench")
+        db.add(tenant)
+        db.flush()
+        headers = {"Authorization": f"Bearer {issue_api_key(db, tenant)}"}
+        db.commit()
+    app.dependency_overrides[get_db] = override_get_db
+
+    number = 0
+    with TestClient(app) as client:
+        for country in COUNTRIES:
+            for lines in SIZES:
+                timings = []
+                for _ in range(ROUNDS):
+                    number += 1
+                    body = payload(country, lines, number)
+                    start = time.perf_counter()
+                    response = client.post("/invoices", json=body, headers=headers)
+                    timings.append(time.perf_counter() - start)
+                    assert response.json()["status"] == "submitted", response.text
+                timings.sort()
+                print(f"{country} {lines:5} lines: p50 {timings[len(timings) // 2] * 1000:7.1f} ms, "
+                      f"max {timings[-1] * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Duplicate check per new invoice: index probe every time vs. Bloom filter first.
+
+Run from apps/api:  python -m benchmarks.bench_duplicates
+"""
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.duplicates import DuplicateDetector, invoice_fingerprint
+from app.models import CountryCode, Invoice, InvoiceStatus, Tenant
+
+STORED = 500_000
+CHECKS = 20_000
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+Session = sessionmaker(bind=engine)
+issued = datetime(2024, 1, 15, tzinfo=timezone.utc)
+
+
+def fingerprint(n: int) -> str:
+    return invoice_fingerprint("IT01234567897", f"INV-{n}", issued, Decimal("122.00"))
+
+
+def seed(db):
+    tenant = Tenant(name="Bench")
+    db.add(tenant)
+    db.commit()
+    for start in range(0, STORED, 50_000):
+        db.execute(insert(Invoice), [
+            {
+                "external_id": f"ext-{n}", "tenant_id": tenant.id, "status": InvoiceStatus.SUBMITTED,
+                "country_code": CountryCode.IT, "invoice_number": f"INV-{n}", "issue_date": issued,
+                "subtotal": "100.00", "tax_amount": "22.00", "total_amount": "122.00",
+                "line_items": [], "fingerprint": fingerprint(n),
+            }
+            for n in range(start, start + 50_000)
+        ])
+    db.commit()
+    return tenant.id
+
+
+def probe(db, tenant_id, value):
+    return db.scalar(select(Invoice.id).where(
+        Invoice.tenant_id == tenant_id, Invoice.fingerprint == value
+    ).limit(1))
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = Session()
+    tenant_id = seed(db)
+    new = [fingerprint(STORED + n) for n in range(CHECKS)]
+
+    start = time.perf_counter()
+    for value in new:
+        probe(db, tenant_id, value)
+    before = (time.perf_counter() - start) / CHECKS * 1e6
+
+    detector = DuplicateDetector(0.01, refresh_seconds=3600, background=False)
+    start = time.perf_counter()
+    detector.find(db, tenant_id, new[0])
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    for value in new:
+        detector.find(db, tenant_id, value)
+    after = (time.perf_counter() - start) / CHECKS * 1e6
+    assert detector.find(db, tenant_id, fingerprint(0)) is not None
+    db.close()
+
+    print(f"{CHECKS} new invoices checked against {STORED} stored for one tenant")
+    print(f"  index probe each time: {before:8.1f} us/invoice")
+    print(f"  Bloom filter first:    {after:8.1f} us/invoice, {detector.probes - 1} probes")
+    print(f"  filter load:           {load * 1000:8.1f} ms once per process, off the request path, "
+          f"{len(detector._filters[tenant_id].bloom._bits) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
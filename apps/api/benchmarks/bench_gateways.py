@@ -0,0 +1,95 @@
+"""Gateway submission throughput against the fake gateway.
+
+Compares a fixed high concurrency with the adaptive limit on a gateway that
+slows down once overloaded, shows how batching cuts the number of calls to
+a batching gateway, and how quickly the circuit breaker stops traffic to a
+gateway that is down.
+
+Run from apps/api:  python -m benchmarks.bench_gateways
+"""
+import asyncio
+import statistics
+import time
+
+from app.gateways import AdaptiveLimit, CircuitBreaker, CircuitOpen, FakeGateway, GatewayClient, GatewayDocument, GatewayError
+
+SUBMISSIONS = 2000
+CALLERS = 200
+LATENCY = 0.02
+CAPACITY = 16
+
+
+def documents(count: int):
+    return [GatewayDocument(invoice_id=i, filename=f"INV-{i}.xml", content=b"<Invoice/>") for i in range(count)]
+
+
+async def run(client: GatewayClient, count: int = SUBMISSIONS):
+    queue = list(documents(count))
+    latencies = []
+    failures = 0
+
+    async def caller():
+        nonlocal failures
+        while queue:
+            document = queue.pop()
+            start = time.perf_counter()
+            try:
+                await client.submit(document)
+            except GatewayError:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(CALLERS)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return elapsed, latencies, failures
+
+
+def report(label: str, gateway: FakeGateway, elapsed: float, latencies, failures: int) -> None:
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{label:28} {len(latencies) / elapsed:7.0f}/s  p50 {statistics.median(latencies) * 1000:6.1f} ms  "
+          f"p99 {p99 * 1000:6.1f} ms  calls {gateway.calls:5}  peak in flight {gateway.peak_inflight:3}  "
+          f"failed {failures}")
+
+
+def main():
+    breaker = lambda: CircuitBreaker(failure_threshold=5, reset_timeout=1.0)
+
+    gateway = FakeGateway(latency=LATENCY, capacity=CAPACITY, seed=1)
+    fixed = GatewayClient(gateway, AdaptiveLimit(CALLERS, minimum=CALLERS, maximum=CALLERS), breaker())
+    report(f"fixed concurrency {CALLERS}", gateway, *asyncio.run(run(fixed)))
+
+    gateway = FakeGateway(latency=LATENCY, capacity=CAPACITY, seed=1)
+    adaptive = GatewayClient(gateway, AdaptiveLimit(8, maximum=CALLERS), breaker())
+    elapsed, latencies, failures = asyncio.run(run(adaptive))
+    report("adaptive concurrency", gateway, elapsed, latencies, failures)
+    print(f"{'':28} settled at a limit of {adaptive.limit.limit:.1f}")
+
+    gateway = FakeGateway(latency=LATENCY, capacity=CAPACITY, batch_size=50, seed=1)
+    batched = GatewayClient(gateway, AdaptiveLimit(8, maximum=CALLERS), breaker(), linger=0.01)
+    report("batched (50 per call)", gateway, *asyncio.run(run(batched)))
+
+    gateway = FakeGateway(latency=LATENCY, seed=1)
+    gateway.down = True
+    tripped = GatewayClient(gateway, AdaptiveLimit(8, maximum=CALLERS), breaker())
+
+    async def outage():
+        attempts = rejected = 0
+        for document in documents(SUBMISSIONS):
+            attempts += 1
+            try:
+                await tripped.submit(document)
+            except CircuitOpen:
+                rejected += 1
+            except GatewayError:
+                pass
+        return attempts, rejected
+
+    attempts, rejected = asyncio.run(outage())
+    print(f"{'gateway down':28} {attempts} attempts, {gateway.calls} reached the gateway, "
+          f"{rejected} failed fast on the open circuit")
+
+
+if __name__ == "__main__":
+    main()
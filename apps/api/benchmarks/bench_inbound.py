@@ -0,0 +1,139 @@
+"""Throughput and peak RSS of inbound parsing: whole tree vs. iterparse, serial vs. parallel archives.
+
+Each run happens in a fresh process so its peak RSS is its own; for the
+parallel run that is the parent's, and each worker stays near the serial figure.
+
+Run from apps/api:  python -m benchmarks.bench_inbound
+"""
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import zipfile
+
+from app.inbound import _child, _fatturapa_invoice, _fatturapa_line, _fatturapa_party, iter_document, iter_upload
+
+BODIES = 20_000
+LINES = 20
+MEMBERS = 400
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<p:FatturaElettronica xmlns:p="http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2" versione="FPR12">
+    <FatturaElettronicaHeader>
+        <CedentePrestatore>
+            <DatiAnagrafici>
+                <IdFiscaleIVA><IdPaese>IT</IdPaese><IdCodice>01234567897</IdCodice></IdFiscaleIVA>
+                <Anagrafica><Denominazione>Fornitore Srl</Denominazione></Anagrafica>
+            </DatiAnagrafici>
+            <Sede><Indirizzo>Via Roma 1</Indirizzo><CAP>00100</CAP><Comune>Roma</Comune><Nazione>IT</Nazione></Sede>
+        </CedentePrestatore>
+        <CessionarioCommittente>
+            <DatiAnagrafici>
+                <IdFiscaleIVA><IdPaese>IT</IdPaese><IdCodice>12345670017</IdCodice></IdFiscaleIVA>
+                <Anagrafica><Denominazione>Cliente Spa</Denominazione></Anagrafica>
+            </DatiAnagrafici>
+            <Sede><Indirizzo>Via Milano 2</Indirizzo><CAP>20100</CAP><Comune>Milano</Comune><Nazione>IT</Nazione></Sede>
+        </CessionarioCommittente>
+    </FatturaElettronicaHeader>"""
+
+LINE = """
+            <DettaglioLinee>
+                <NumeroLinea>{n}</NumeroLinea>
+                <Descrizione>Servizio di consulenza informatica, riga {n}</Descrizione>
+                <Quantita>2.00</Quantita>
+                <PrezzoUnitario>50.00</PrezzoUnitario>
+                <PrezzoTotale>100.00</PrezzoTotale>
+                <AliquotaIVA>22.00</AliquotaIVA>
+            </DettaglioLinee>"""
+
+BODY = """
+    <FatturaElettronicaBody>
+        <DatiGenerali>
+            <DatiGeneraliDocumento>
+                <TipoDocumento>TD01</TipoDocumento><Divisa>EUR</Divisa>
+                <Data>2024-01-15</Data><Numero>{number}</Numero>
+            </DatiGeneraliDocumento>
+        </DatiGenerali>
+        <DatiBeniServizi>{lines}
+        </DatiBeniServizi>
+    </FatturaElettronicaBody>"""
+
+
+def write_batch(path, bodies):
+    lines = "".join(LINE.format(n=n) for n in range(1, LINES + 1))
+    with open(path, "w") as f:
+        f.write(HEADER)
+        for number in range(bodies):
+            f.write(BODY.format(number=f"FPA-{number}", lines=lines))
+        f.write("\n</p:FatturaElettronica>")
+
+
+def whole_tree(path):
+    from lxml import etree
+    root = etree.parse(path).getroot()
+    header = _child(root, "FatturaElettronicaHeader")
+    parties = {"supplier": _fatturapa_party(_child(header, "CedentePrestatore")),
+               "customer": _fatturapa_party(_child(header, "CessionarioCommittente"))}
+    invoices = 0
+    for body in root.iterfind("FatturaElettronicaBody"):
+        lines = [_fatturapa_line(line) for line in body.iterfind("DatiBeniServizi/DettaglioLinee")]
+        _fatturapa_invoice(parties, body, lines)
+        invoices += 1
+    return invoices
+
+
+def streamed(path):
+    return sum(1 for _ in iter_document(path))
+
+
+def archive(path, workers):
+    return sum(1 for _ in iter_upload(path, workers))
+
+
+def run(results, target, *args):
+    start = time.perf_counter()
+    invoices = target(*args)
+    elapsed = time.perf_counter() - start
+    results.put((invoices, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def measure(context, target, *args):
+    # A fresh process per run, so peak RSS is not inherited; archive workers are its children
+    results = context.Queue()
+    process = context.Process(target=run, args=(results, target, *args))
+    process.start()
+    measured = results.get()
+    process.join()
+    return measured
+
+
+def main():
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        batch = os.path.join(tmp, "batch.xml")
+        write_batch(batch, BODIES)
+        member = os.path.join(tmp, "member.xml")
+        write_batch(member, BODIES // MEMBERS)
+        zipped = os.path.join(tmp, "batch.zip")
+        with zipfile.ZipFile(zipped, "w", zipfile.ZIP_DEFLATED) as zf:
+            for n in range(MEMBERS):
+                zf.write(member, f"{n}.xml")
+
+        batch_mb = os.path.getsize(batch) / 1e6
+        print(f"FatturaPA batch: {BODIES} invoices of {LINES} lines, {batch_mb:.0f} MB; "
+              f"the same invoices as a ZIP of {MEMBERS} files")
+        print(f"  {'':28} {'invoices':>9} {'MB/s':>7} {'peak RSS MB':>12}")
+        runs = [
+            ("whole tree (etree.parse)", whole_tree, batch),
+            ("iterparse, freed as read", streamed, batch),
+            ("ZIP, serial", archive, zipped, 0),
+            ("ZIP, 4 worker processes", archive, zipped, 4),
+        ]
+        for name, target, *args in runs:
+            invoices, elapsed, peak_kb = measure(context, target, *args)
+            print(f"  {name:28} {invoices:9} {batch_mb / elapsed:7.1f} {peak_kb / 1024:12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Hit rate and latency of polled GET /invoices/{id} renders, without and with the response cache.
+
+Four workers poll 200 invoices at random while 1% of polls follow a status
+change committed by one of them. The shared layer is an in-process stand-in
+for Redis that adds a fixed round trip to every call.
+
+Run from apps/api:  python -m benchmarks.bench_invoice_cache
+"""
+import random
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.invoice_cache import InvoiceResponseCache, RedisResponseStore
+from app.models import CountryCode, Invoice, InvoiceStatus, Tenant
+from app.serialization import invoice_response_query, serialize_invoice_row
+
+INVOICES = 200
+WORKERS = 4
+POLLS = 20000
+CHANGE_RATE = 0.01
+REDIS_ROUND_TRIP = 0.0002
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+Session = sessionmaker(bind=engine)
+
+
+class StandInRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, name):
+        time.sleep(REDIS_ROUND_TRIP)
+        return self.values.get(name)
+
+    def set(self, name, value, ex=None):
+        time.sleep(REDIS_ROUND_TRIP)
+        self.values[name] = value
+
+    def delete(self, *names):
+        time.sleep(REDIS_ROUND_TRIP)
+        for name in names:
+            self.values.pop(name, None)
+
+    def eval(self, script, numkeys, *args):
+        time.sleep(REDIS_ROUND_TRIP)
+        keys, argv = args[:numkeys], args[numkeys:]
+        if script == RedisResponseStore.SET_IF_CURRENT:
+            if self.values.get(keys[1], b"0").decode() != argv[0]:
+                return 0
+            self.values[keys[0]] = argv[1]
+            return 1
+        for name, version in zip(keys[::2], keys[1::2]):  # INVALIDATE
+            self.values.pop(name, None)
+            self.values[version] = str(int(self.values.get(version, b"0")) + 1).encode()
+        return len(keys) // 2
+
+
+def seed(db):
+    tenant = Tenant(name="Bench")
+    db.add(tenant)
+    db.flush()
+    db.add_all(
+        Invoice(
+            external_id=f"EXT-{i}",
+            tenant_id=tenant.id,
+            invoice_number=f"INV-{i}",
+            country_code=CountryCode.IT,
+            status=InvoiceStatus.SUBMITTED,
+            issue_date=datetime(2024, 1, 15, tzinfo=timezone.utc),
+            subtotal="100.00",
+            tax_amount="22.00",
+            total_amount="122.00",
+            supplier_data={"name": "Supplier"},
+            customer_data={"name": "Customer"},
+            line_items=[{"description": "Item", "line_total": "100.00"}],
+        )
+        for i in range(INVOICES)
+    )
+    db.commit()
+    return tenant.id, [invoice.id for invoice in db.query(Invoice)]
+
+
+def run(workers, tenant_id, invoice_ids):
+    rng = random.Random(7)
+    statuses = [InvoiceStatus.SUBMITTED, InvoiceStatus.ACCEPTED]
+    timings = []
+    for poll in range(POLLS):
+        worker = workers[poll % WORKERS] if workers else None
+        invoice_id = rng.choice(invoice_ids)
+        db = Session()
+        if rng.random() < CHANGE_RATE:
+            invoice = db.get(Invoice, invoice_id)
+            invoice.status = statuses[invoice.status == InvoiceStatus.SUBMITTED]
+            db.commit()
+            if worker is not None:
+                worker.invalidate([(tenant_id, invoice_id)])  # What the after_commit hook does
+
+        def render():
+            row = invoice_response_query(db).filter(Invoice.id == invoice_id, Invoice.tenant_id == tenant_id).first()
+            return serialize_invoice_row(row)
+
+        start = time.perf_counter()
+        if worker is None:
+            render()
+        else:
+            worker.load((tenant_id, invoice_id), render)
+        timings.append(time.perf_counter() - start)
+        db.close()
+    timings.sort()
+    hits = sum(worker.local_hits + worker.shared_hits for worker in workers)
+    misses = sum(worker.misses for worker in workers)
+    hit_rate = hits / (hits + misses) if workers else 0.0
+    return hit_rate, timings[len(timings) // 2] * 1e6, timings[int(len(timings) * 0.99)] * 1e6
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = Session()
+    tenant_id, invoice_ids = seed(db)
+    db.close()
+
+    redis = StandInRedis()
+    setups = [
+        ("no cache", []),
+        ("local LRU", [InvoiceResponseCache(10000, local_ttl=1.0) for _ in range(WORKERS)]),
+        ("local LRU + Redis", [
+            InvoiceResponseCache(10000, local_ttl=1.0, shared=RedisResponseStore("redis://", client=redis))
+            for _ in range(WORKERS)
+        ]),
+    ]
+    print(f"{POLLS} polls of {INVOICES} invoices across {WORKERS} workers, "
+          f"{REDIS_ROUND_TRIP * 1e3:.1f} ms Redis round trip")
+    print(f"  {'':20} {'hit rate':>9} {'p50 us':>9} {'p99 us':>9}")
+    for name, workers in setups:
+        hit_rate, p50, p99 = run(workers, tenant_id, invoice_ids)
+        print(f"  {name:20} {hit_rate:9.1%} {p50:9.1f} {p99:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Parse and validation cost of large POST /invoices bodies.
+
+Compares the default FastAPI body handling, where json.loads builds Python
+objects that are validated into nested LineItem models and converted back
+to dicts for storage, with parsing the raw bytes in pydantic-core, where
+line items validate straight into storable dicts. Parse, validate and
+conversion times are reported separately; the last column is the one-pass
+InvoiceCreate.model_validate_json that POST /invoices uses.
+
+Run from apps/api:  python -m benchmarks.bench_invoice_parsing
+"""
+import json
+import time
+from typing import List
+
+from pydantic import BaseModel
+from pydantic_core import from_json
+
+from app.schemas import InvoiceCreate
+
+SIZES = (1000, 5000, 20000)
+ROUNDS = 10
+
+
+class ModelLineItem(BaseModel):
+    description: str
+    quantity: float
+    unit_price: str
+    tax_rate: float
+    tax_amount: str
+    line_total: str
+
+
+class ModelInvoiceCreate(InvoiceCreate):
+    line_items: List[ModelLineItem]
+
+
+def body(lines: int) -> bytes:
+    party = {"name": "Lieferant GmbH", "vat_id": "DE123456789", "address": "Hauptstr. 1", "city": "Berlin",
+             "postal_code": "10115", "country": "DE"}
+    return json.dumps({
+        "external_id": "bench", "invoice_number": "B-1", "country_code": "DE",
+        "issue_date": "2024-01-15T00:00:00Z", "supplier": party, "customer": party,
+        "line_items": [
+            {"description": f"Position {i}", "quantity": 2, "unit_price": "50.00", "tax_rate": 19.0,
+             "tax_amount": "19.00", "line_total": "100.00"}
+            for i in range(lines)
+        ],
+    }).encode()
+
+
+def best(fn, *args) -> float:
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    print(f"{'lines':>6} | {'json.loads':>10} {'models':>8} {'.dict()':>8} {'total':>8} | "
+          f"{'from_json':>9} {'dicts':>8} {'total':>8} | {'one pass':>8}  (ms, best of {ROUNDS})")
+    for lines in SIZES:
+        raw = body(lines)
+        data = json.loads(raw)
+        model = ModelInvoiceCreate.model_validate(data)
+
+        loads = best(json.loads, raw)
+        models = best(ModelInvoiceCreate.model_validate, data)
+        dicts = best(lambda: [item.model_dump() for item in model.line_items])
+
+        parse = best(from_json, raw)
+        validate = best(InvoiceCreate.model_validate, data)
+        one_pass = best(InvoiceCreate.model_validate_json, raw)
+
+        print(f"{lines:>6} | {loads:10.2f} {models:8.2f} {dicts:8.2f} {loads + models + dicts:8.2f} | "
+              f"{parse:9.2f} {validate:8.2f} {parse + validate:8.2f} | {one_pass:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Before/after benchmark for serializing a 1,000-row GET /invoices page.
+
+Run from apps/api:  python -m benchmarks.bench_list_invoices
+"""
+import json
+import time
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import Tenant, Invoice, CountryCode, InvoiceStatus
+from app.schemas import InvoiceResponse
+from app.serialization import invoice_response_query, serialize_invoice_rows
+
+ROWS = 1000
+ROUNDS = 20
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+Session = sessionmaker(bind=engine)
+invoice_list = TypeAdapter(List[InvoiceResponse])
+
+
+def seed(db):
+    tenant = Tenant(name="Bench")
+    db.add(tenant)
+    db.flush()
+    db.add_all(
+        Invoice(
+            external_id=f"EXT-{i}",
+            tenant_id=tenant.id,
+            invoice_number=f"INV-{i}",
+            country_code=CountryCode.DE,
+            status=InvoiceStatus.VALIDATED,
+            issue_date=datetime(2024, 1, 15, tzinfo=timezone.utc),
+            subtotal="100.00",
+            tax_amount="19.00",
+            total_amount="119.00",
+            supplier_data={"name": "Supplier"},
+            customer_data={"name": "Customer"},
+            line_items=[{"description": "Item", "line_total": "100.00"}],
+        )
+        for i in range(ROWS)
+    )
+    db.commit()
+    return tenant.id
+
+
+def orm_page(db, tenant_id) -> bytes:
+    # Mirrors the previous handler: ORM objects -> response_model -> JSONResponse.
+    invoices = db.query(Invoice).filter(Invoice.tenant_id == tenant_id).limit(ROWS).all()
+    content = jsonable_encoder(invoice_list.dump_python(invoice_list.validate_python(invoices), mode="json"))
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_page(db, tenant_id) -> bytes:
+    rows = invoice_response_query(db).filter(Invoice.tenant_id == tenant_id).limit(ROWS).all()
+    return serialize_invoice_rows(rows)
+
+
+def measure(fn, tenant_id) -> float:
+    timings = []
+    for _ in range(ROUNDS):
+        db = Session()
+        start = time.perf_counter()
+        fn(db, tenant_id)
+        timings.append(time.perf_counter() - start)
+        db.close()
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = Session()
+    tenant_id = seed(db)
+    assert json.loads(orm_page(db, tenant_id)) == json.loads(fast_page(db, tenant_id))
+    db.close()
+
+    before = measure(orm_page, tenant_id)
+    after = measure(fast_page, tenant_id)
+    print(f"{ROWS}-row page, median of {ROUNDS} rounds")
+    print(f"  ORM + response_model: {before:8.2f} ms")
+    print(f"  tuples + to_json:     {after:8.2f} ms")
+    print(f"  speedup:              {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
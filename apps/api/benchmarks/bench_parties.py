@@ -0,0 +1,82 @@
+"""Storage and UBL rendering cost of inline versus deduplicated parties.
+
+Loads the same invoices, one supplier and a few hundred recurring
+customers, into two scratch SQLite databases: one with the party JSON
+inline on every invoice (the legacy layout) and one referencing rows of
+the parties table. Reports the database sizes, then times generate_ubl_xml
+over invoices from each, where only stored parties use the fragment cache.
+
+Run from apps/api:  python -m benchmarks.bench_parties
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session, selectinload
+
+from app.compliance import generate_ubl_xml
+from app.database import Base
+from app.models import CountryCode, Invoice, Tenant
+from app.parties import fragment_cache, get_or_create_party
+
+INVOICES = 100_000
+CUSTOMERS = 300
+RENDERS = 5000
+
+
+def party(name: str, vat_id: str) -> dict:
+    return {"name": name, "vat_id": vat_id, "address": "Hauptstraße 1", "city": "Berlin",
+            "postal_code": "10115", "country": "DE", "email": f"billing@{name.lower()}.example", "phone": None}
+
+
+def invoice_rows(tenant_id: int, party_columns):
+    line = {"description": "Consulting", "quantity": 1.0, "unit_price": "100.00", "tax_rate": 19.0,
+            "tax_amount": "19.00", "line_total": "100.00"}
+    for i in range(INVOICES):
+        yield {"external_id": f"ext-{i}", "tenant_id": tenant_id, "country_code": CountryCode.DE,
+               "invoice_number": f"INV-{i}", "issue_date": datetime(2024, 1, 15, tzinfo=timezone.utc),
+               "subtotal": "100.00", "tax_amount": "19.00", "total_amount": "119.00", "line_items": [line],
+               **party_columns(i)}
+
+
+def load(path: str, deduplicate: bool) -> float:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    supplier = party("Lieferant", "DE123456789")
+    customers = [party(f"Kunde{n}", f"DE{n:09d}") for n in range(CUSTOMERS)]
+    with Session(engine) as db:
+        tenant = Tenant(name="Bench")
+        db.add(tenant)
+        db.commit()
+        if deduplicate:
+            supplier_id = get_or_create_party(db, tenant.id, supplier).id
+            customer_ids = [get_or_create_party(db, tenant.id, customer).id for customer in customers]
+            columns = lambda i: {"supplier_id": supplier_id, "customer_id": customer_ids[i % CUSTOMERS]}
+        else:
+            columns = lambda i: {"legacy_supplier_data": supplier, "legacy_customer_data": customers[i % CUSTOMERS]}
+        db.execute(insert(Invoice), list(invoice_rows(tenant.id, columns)))
+        db.commit()
+
+        invoices = db.query(Invoice).options(
+            selectinload(Invoice.supplier), selectinload(Invoice.customer)
+        ).limit(RENDERS).all()
+        fragment_cache.clear()
+        start = time.perf_counter()
+        for invoice in invoices:
+            generate_ubl_xml(invoice)
+        return time.perf_counter() - start
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    for label, deduplicate in (("inline parties", False), ("parties table", True)):
+        path = os.path.join(directory, f"{label.replace(' ', '-')}.db")
+        elapsed = load(path, deduplicate)
+        print(f"{label:15}: {os.path.getsize(path) / 2 ** 20:6.1f} MiB for {INVOICES:,} invoices, "
+              f"UBL {RENDERS / elapsed:8,.0f} invoices/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Factur-X PDF/A-3 rendering throughput and per-worker memory.
+
+Reports PDFs per second on one core (in-process), through the worker pool,
+and the peak resident memory of a pool worker. Set PDF_FONT_PATH to include
+TrueType embedding and subsetting in the measurement.
+
+Run from apps/api:  python -m benchmarks.bench_pdf_render
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from app import pdf
+from app.config import settings
+from app.facturx import generate_cii_xml
+from app.rendering import PdfRenderer
+
+RENDERS = 300
+LINES = 25
+
+
+def sample_invoice(lines: int) -> dict:
+    return {
+        "invoice_number": "BENCH-0001",
+        "country_code": "FR",
+        "issue_date": datetime(2024, 3, 1, tzinfo=timezone.utc),
+        "due_date": datetime(2024, 3, 31, tzinfo=timezone.utc),
+        "currency": "EUR",
+        "supplier_data": {"name": "Fournisseur SARL", "vat_id": "FR40303265045", "address": "1 rue de la Paix",
+                          "city": "Paris", "postal_code": "75002", "country": "FR"},
+        "customer_data": {"name": "Client SA", "vat_id": "FR83404833048", "address": "2 avenue Foch",
+                          "city": "Lyon", "postal_code": "69006", "country": "FR"},
+        "line_items": [
+            {"description": f"Consulting day {i}", "quantity": 1.0, "unit_price": "650.00",
+             "tax_rate": 20.0, "tax_amount": "130.00", "line_total": "650.00"}
+            for i in range(lines)
+        ],
+        "subtotal": f"{650 * lines}.00",
+        "tax_amount": f"{130 * lines}.00",
+        "total_amount": f"{780 * lines}.00",
+    }
+
+
+async def run_pool(renderer: PdfRenderer, invoice: dict, xml: bytes) -> float:
+    await renderer.render(invoice, xml)  # Start the workers outside the measurement
+    start = time.perf_counter()
+    await asyncio.gather(*(renderer.render(invoice, xml) for _ in range(RENDERS)))
+    return time.perf_counter() - start
+
+
+def main():
+    font_path = os.environ.get("PDF_FONT_PATH", settings.pdf_font_path)
+    invoice = sample_invoice(LINES)
+    xml = generate_cii_xml(SimpleNamespace(**invoice)).encode()
+
+    pdf.init_worker(font_path)
+    size = len(pdf.render_in_worker(invoice, xml))
+    start = time.perf_counter()
+    for _ in range(RENDERS):
+        pdf.render_in_worker(invoice, xml)
+    inline = time.perf_counter() - start
+    print(f"{LINES}-line invoice, {size / 1024:.1f} KiB, font: {font_path or 'Courier (not embedded)'}")
+    print(f"in-process:  {RENDERS / inline:7.0f} PDFs/s on one core ({inline / RENDERS * 1000:.2f} ms each)")
+
+    workers = max(1, settings.pdf_render_workers)
+    renderer = PdfRenderer(workers, font_path, settings.pdf_worker_memory_limit_mb,
+                           settings.pdf_render_max_tasks_per_worker)
+    try:
+        elapsed = asyncio.run(run_pool(renderer, invoice, xml))
+
+        async def peak():
+            return await renderer.call(pdf.peak_rss_kb)
+
+        peak_kb = asyncio.run(peak())
+    finally:
+        renderer.shutdown()
+    cores = min(workers, os.cpu_count() or 1)
+    print(f"pool ({workers} workers on {os.cpu_count()} cores): {RENDERS / elapsed:7.0f} PDFs/s, "
+          f"{RENDERS / elapsed / cores:.0f} PDFs/s per core")
+    print(f"worker peak RSS: {peak_kb / 1024:.1f} MiB (address-space cap {settings.pdf_worker_memory_limit_mb} MiB)")
+
+
+if __name__ == "__main__":
+    main()
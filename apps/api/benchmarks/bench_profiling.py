@@ -0,0 +1,103 @@
+"""Cost of the live profiling hooks on POST /invoices: off, tracing, and while a profile is sampled.
+
+"off" is the normal state, where phase() and the middleware only check
+whether tracing is on. "tracing" times every phase and SQL statement of
+every request; the threshold is high enough that none are logged. The
+last run takes a sampling profile at the default 10 ms interval
+throughout.
+
+Run from apps/api:  python -m benchmarks.bench_profiling
+"""
+import statistics
+import threading
+import time
+import timeit
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.auth import issue_api_key
+from app.config import settings
+from app.database import Base, get_db
+from app.main import app
+from app.models import Tenant
+from app.profiling import get_profiler, get_slow_request_tracer, phase
+
+ROUNDS = 300
+CALLS = 1_000_000
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+Session = sessionmaker(bind=engine)
+
+
+def override_get_db():
+    db = Session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def payload(number: int) -> dict:
+    party = {"address": "Via Roma 1", "city": "Milano", "postal_code": "20121", "country": "IT"}
+    return {
+        "external_id": f"bench-{number}",
+        "invoice_number": f"B-{number}",
+        "country_code": "DE",
+        "issue_date": "2024-01-15T00:00:00Z",
+        "supplier": {"name": "Fornitore & Figli", "vat_id": "DE123456789", **party},
+        "customer": {"name": "Cliente SpA", "vat_id": "DE987654321", **party},
+        "line_items": [
+            {"description": f"Item {i}", "quantity": 2.0, "unit_price": "50.00", "tax_rate": 19.0,
+             "tax_amount": "19.00", "line_total": "100.00"}
+            for i in range(10)
+        ],
+    }
+
+
+def p50_ms(client, headers, first: int) -> float:
+    timings = []
+    for number in range(first, first + ROUNDS):
+        start = time.perf_counter()
+        client.post("/invoices", json=payload(number), headers=headers)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    settings.pdf_rendering_enabled = False
+    settings.duplicate_filter_load_in_background = False
+    Base.metadata.create_all(bind=engine)
+    with Session() as db:
+        tenant = Tenant(name="Bench")
+        db.add(tenant)
+        db.flush()
+        headers = {"Authorization": f"Bearer {issue_api_key(db, tenant)}"}
+        db.commit()
+    app.dependency_overrides[get_db] = override_get_db
+
+    per_call = timeit.timeit(lambda: phase("db").__enter__(), number=CALLS) / CALLS * 1e9
+    print(f"phase() outside a traced request: {per_call:.0f} ns")
+
+    tracer = get_slow_request_tracer()
+    with TestClient(app) as client:
+        p50_ms(client, headers, 0)  # Warm up
+        off = p50_ms(client, headers, ROUNDS)
+        tracer.start(threshold_ms=60_000)
+        tracing = p50_ms(client, headers, 2 * ROUNDS)
+        tracer.stop()
+        profile = threading.Thread(target=get_profiler().capture, args=(3600, 0.01))
+        profile.daemon = True
+        profile.start()
+        sampled = p50_ms(client, headers, 3 * ROUNDS)
+
+    print(f"POST /invoices, 10 lines, p50 of {ROUNDS}:")
+    print(f"  hooks off:          {off:6.2f} ms")
+    print(f"  tracing phases:     {tracing:6.2f} ms ({(tracing / off - 1) * 100:+.1f}%)")
+    print(f"  profile sampling:   {sampled:6.2f} ms ({(sampled / off - 1) * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
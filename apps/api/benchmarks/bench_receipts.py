@@ -0,0 +1,64 @@
+"""Bulk ACK/NACK receipt ingestion.
+
+Loads 100k submitted invoices into a scratch SQLite database, writes a
+receipt file with one receipt per invoice (10% NACKs), and times
+ingest_receipts over it.
+
+Run from apps/api:  python -m benchmarks.bench_receipts
+"""
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import Base
+from app.models import CountryCode, Invoice, InvoiceStatus, Tenant, WebhookEvent
+from app.receipts import ingest_receipts
+
+RECEIPTS = 100_000
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'receipts.db')}")
+    Base.metadata.create_all(engine)
+    issue_date = datetime(2024, 1, 15, tzinfo=timezone.utc)
+    with Session(engine) as db:
+        tenant = Tenant(name="Bench")
+        db.add(tenant)
+        db.commit()
+        for start in range(0, RECEIPTS, 10_000):
+            db.execute(insert(Invoice), [
+                {"external_id": f"ext-{i}", "tenant_id": tenant.id, "status": InvoiceStatus.SUBMITTED,
+                 "country_code": CountryCode.IT, "invoice_number": f"INV-{i}", "issue_date": issue_date,
+                 "subtotal": "100.00", "tax_amount": "22.00", "total_amount": "122.00",
+                 "legacy_supplier_data": {}, "legacy_customer_data": {}, "line_items": [],
+                 "submission_id": f"sdi-{i:08d}", "gateway_response": {"gateway": "sdi"}}
+                for i in range(start, min(start + 10_000, RECEIPTS))
+            ])
+        db.commit()
+
+    path = os.path.join(workdir, "receipts.jsonl")
+    with open(path, "w") as f:
+        for i in range(RECEIPTS):
+            outcome = "nack" if i % 10 == 0 else "ack"
+            f.write(json.dumps({"submission_id": f"sdi-{i:08d}", "outcome": outcome, "code": "RC"}) + "\n")
+
+    with Session(engine) as db, open(path, "rb") as lines:
+        start = time.perf_counter()
+        stats = ingest_receipts(db, lines, "sdi")
+        elapsed = time.perf_counter() - start
+        events = db.query(WebhookEvent).count()
+
+    print(f"{stats.received} receipts in {elapsed:.2f}s ({stats.received / elapsed:,.0f}/s), "
+          f"batch size {settings.receipt_batch_size}")
+    print(f"applied {stats.applied}, events written {events}, unmatched {stats.unmatched}")
+
+
+if __name__ == "__main__":
+    main()
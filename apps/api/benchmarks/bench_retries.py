@@ -0,0 +1,66 @@
+"""Claiming due retries after a large gateway outage.
+
+Loads 200k failed invoices awaiting a retry alongside 300k settled ones
+into a scratch SQLite database, then times claim_due_invoices batches and
+prints the query plan of the due-invoice lookup.
+
+Run from apps/api:  python -m benchmarks.bench_retries
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.models import CountryCode, Invoice, InvoiceStatus, Tenant
+from app.retries import claim_due_invoices
+
+FAILED = 200_000
+SETTLED = 300_000
+BATCH = 500
+BATCHES = 50
+
+
+def main():
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'retries.db')}")
+    Base.metadata.create_all(engine)
+    now = datetime.now(timezone.utc)
+    issue_date = datetime(2024, 1, 15, tzinfo=timezone.utc)
+    with Session(engine) as db:
+        tenant = Tenant(name="Bench")
+        db.add(tenant)
+        db.commit()
+        for start in range(0, FAILED + SETTLED, 20_000):
+            db.execute(insert(Invoice), [
+                {"external_id": f"ext-{i}", "tenant_id": tenant.id, "country_code": CountryCode.DE,
+                 "invoice_number": f"INV-{i}", "issue_date": issue_date,
+                 "subtotal": "100.00", "tax_amount": "19.00", "total_amount": "119.00",
+                 "legacy_supplier_data": {}, "legacy_customer_data": {}, "line_items": [],
+                 **({"status": InvoiceStatus.FAILED, "next_attempt_at": now - timedelta(seconds=i % 3600)}
+                    if i < FAILED else {"status": InvoiceStatus.ACCEPTED})}
+                for i in range(start, min(start + 20_000, FAILED + SETTLED))
+            ])
+        db.commit()
+
+        plan = db.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM invoices WHERE next_attempt_at <= :now "
+            "ORDER BY next_attempt_at LIMIT :n"
+        ), {"now": now, "n": BATCH}).all()
+        print("plan:", "; ".join(row[-1] for row in plan))
+
+        timings = []
+        for _ in range(BATCHES):
+            start = time.perf_counter()
+            claimed = claim_due_invoices(db, BATCH, now=now)
+            timings.append(time.perf_counter() - start)
+            assert len(claimed) == BATCH
+        timings.sort()
+    print(f"{FAILED:,} due of {FAILED + SETTLED:,} invoices: claim {BATCH} in "
+          f"p50 {timings[len(timings) // 2] * 1000:.1f} ms, max {timings[-1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
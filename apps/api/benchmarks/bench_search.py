@@ -0,0 +1,106 @@
+"""Invoice search latency: scanning invoice numbers and party JSON vs. the trigram index.
+
+Run from apps/api:  python -m benchmarks.bench_search
+"""
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import String, cast, create_engine, insert, or_
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models import CountryCode, Invoice, InvoiceSearch, InvoiceStatus, Tenant
+from app.search import search_document, search_invoices
+from app.serialization import invoice_response_query
+
+STORED = 1_000_000
+QUERIES = 200
+SUPPLIERS = 20_000
+BATCH = 50_000
+
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+Session = sessionmaker(bind=engine)
+issued = datetime(2024, 1, 15, tzinfo=timezone.utc)
+
+
+def supplier(n: int) -> dict:
+    return {"name": f"Supplier {n:05d} Handels GmbH", "vat_id": f"DE{100000000 + n * 37}"}
+
+
+def seed(db):
+    tenant = Tenant(name="Bench")
+    db.add(tenant)
+    db.commit()
+    customer = {"name": "Bench Customer SpA", "vat_id": "IT01234567897"}
+    for start in range(0, STORED, BATCH):
+        invoices = [
+            {
+                "id": n + 1, "external_id": f"ext-{n}", "tenant_id": tenant.id, "status": InvoiceStatus.SUBMITTED,
+                "country_code": CountryCode.DE, "invoice_number": f"INV-{n:07d}", "issue_date": issued,
+                "subtotal": "100.00", "tax_amount": "19.00", "total_amount": "119.00", "line_items": [],
+                "legacy_supplier_data": supplier(n % SUPPLIERS), "legacy_customer_data": customer,
+            }
+            for n in range(start, start + BATCH)
+        ]
+        db.execute(insert(Invoice), invoices)
+        db.execute(insert(InvoiceSearch), [
+            {"id": row["id"], "tenant_id": tenant.id, "document": search_document(
+                row["invoice_number"], row["legacy_supplier_data"], row["legacy_customer_data"]
+            )}
+            for row in invoices
+        ])
+    db.commit()
+    return tenant.id
+
+
+def scan(db, tenant_id, term):
+    # What a search looked like before: LIKE over the number and the serialized party JSON
+    pattern = f"%{term}%"
+    return invoice_response_query(db).filter(Invoice.tenant_id == tenant_id, or_(
+        Invoice.invoice_number.ilike(pattern), cast(Invoice.legacy_supplier_data, String).ilike(pattern)
+    )).order_by(Invoice.id.desc()).limit(50).all()
+
+
+def timed(search, db, tenant_id, terms):
+    latencies = []
+    for term in terms:
+        start = time.perf_counter()
+        search(db, tenant_id, term)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), statistics.quantiles(latencies, n=100)[98]
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = Session()
+    start = time.perf_counter()
+    tenant_id = seed(db)
+    print(f"{STORED} invoices of {SUPPLIERS} suppliers indexed in {time.perf_counter() - start:.0f} s")
+
+    rng = random.Random(7)
+    terms = []
+    for _ in range(QUERIES):
+        n = rng.randrange(STORED)
+        terms.append(rng.choice([
+            f"inv-{n:07d}",  # An exact number: one hit
+            f"{n % SUPPLIERS:05d} handels",  # A supplier name: about 50 hits
+            supplier(n % SUPPLIERS)["vat_id"][2:],  # A VAT ID without its prefix
+        ]))
+
+    print(f"  {'':24} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, search in (("LIKE scan", scan), ("trigram index", search_invoices)):
+        p50, p99 = timed(search, db, tenant_id, terms[:20] if search is scan else terms)
+        print(f"  {name:24} {p50:8.2f} {p99:8.2f}")
+
+    first = search_invoices(db, tenant_id, "bench customer", limit=51)
+    start = time.perf_counter()
+    search_invoices(db, tenant_id, "bench customer", cursor=first[-1].id, limit=51)
+    print(f"  next page of a term matching every invoice: {(time.perf_counter() - start) * 1000:.2f} ms")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Initial schema
+
+The tables Base.metadata.create_all created at import time before
+migrations existed. Databases created that way are stamped with this
+revision by app.startup.run_migrations and upgraded from here.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 17:23:01.179087
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('tenants',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('api_key', sa.String(length=255), nullable=False),
+    sa.Column('webhook_url', sa.String(length=500), nullable=True),
+    sa.Column('webhook_secret', sa.String(length=255), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_tenants_api_key'), ['api_key'], unique=True)
+        batch_op.create_index(batch_op.f('ix_tenants_id'), ['id'], unique=False)
+
+    op.create_table('invoices',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('external_id', sa.String(length=255), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('DRAFT', 'VALIDATED', 'SUBMITTED', 'ACCEPTED', 'REJECTED', 'FAILED', name='invoicestatus'), nullable=True),
+    sa.Column('country_code', sa.Enum('DE', 'IT', 'FR', 'ES', 'NL', 'BE', 'AT', name='countrycode'), nullable=False),
+    sa.Column('invoice_number', sa.String(length=100), nullable=False),
+    sa.Column('issue_date', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('due_date', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('subtotal', sa.String(length=20), nullable=False),
+    sa.Column('tax_amount', sa.String(length=20), nullable=False),
+    sa.Column('total_amount', sa.String(length=20), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=True),
+    sa.Column('supplier_data', sa.JSON(), nullable=False),
+    sa.Column('customer_data', sa.JSON(), nullable=False),
+    sa.Column('line_items', sa.JSON(), nullable=False),
+    sa.Column('ubl_xml', sa.Text(), nullable=True),
+    sa.Column('country_xml', sa.Text(), nullable=True),
+    sa.Column('pdf_url', sa.String(length=500), nullable=True),
+    sa.Column('submission_id', sa.String(length=255), nullable=True),
+    sa.Column('gateway_response', sa.JSON(), nullable=True),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('retry_count', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('submitted_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('invoices', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_invoices_id'), ['id'], unique=False)
+
+    op.create_table('webhook_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('invoice_id', sa.Integer(), nullable=False),
+    sa.Column('event_type', sa.String(length=50), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('delivered', sa.Boolean(), nullable=True),
+    sa.Column('delivery_attempts', sa.Integer(), nullable=True),
+    sa.Column('last_attempt_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['invoice_id'], ['invoices.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_webhook_events_id'), ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_webhook_events_id'))
+
+    op.drop_table('webhook_events')
+    with op.batch_alter_table('invoices', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_invoices_id'))
+
+    op.drop_table('invoices')
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tenants_id'))
+        batch_op.drop_index(batch_op.f('ix_tenants_api_key'))
+
+    op.drop_table('tenants')
+
+    # Native enum types outlive their tables on PostgreSQL
+    for name in ('countrycode', 'invoicestatus'):
+        sa.Enum(name=name).drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,157 @@
+"""Tenant keys, exports and VAT rollups
+
+What was added to the schema between the baseline and the first
+migration: hashed API keys and token versions, archived invoices, export
+jobs, VAT rollups, and the tenant of each webhook event. Invoice ids are
+never reused on SQLite from here on, so archived ids stay unique. The
+rollups start empty; fill them with `python -m app.reports`.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 19:24:51.203114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.alter_column('api_key', existing_type=sa.String(length=255), nullable=True)
+
+    op.create_table('api_keys',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('prefix', sa.String(length=16), nullable=False),
+    sa.Column('key_hash', sa.String(length=64), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key_hash')
+    )
+    with op.batch_alter_table('api_keys', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_api_keys_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_api_keys_prefix'), ['prefix'], unique=False)
+
+    op.create_table('tenant_token_versions',
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('tenant_id')
+    )
+    op.create_table('archived_invoices',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('issue_date', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('object_key', sa.String(length=500), nullable=False),
+    sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('archived_invoices', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_archived_invoices_tenant_id'), ['tenant_id'], unique=False)
+
+    op.create_table('export_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('PENDING', 'RUNNING', 'COMPLETED', 'FAILED', name='exportstatus'), nullable=True),
+    sa.Column('format', sa.String(length=20), nullable=False),
+    sa.Column('issued_from', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('issued_to', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('object_key', sa.String(length=500), nullable=True),
+    sa.Column('row_count', sa.Integer(), nullable=True),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('export_jobs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_export_jobs_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_export_jobs_tenant_id'), ['tenant_id'], unique=False)
+
+    op.create_table('vat_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    # The countrycode type was already created with invoices
+    sa.Column('country_code', postgresql.ENUM('DE', 'IT', 'FR', 'ES', 'NL', 'BE', 'AT', name='countrycode', create_type=False), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('tax_rate', sa.String(length=10), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('taxable_base_cents', sa.BigInteger(), nullable=False),
+    sa.Column('tax_cents', sa.BigInteger(), nullable=False),
+    sa.Column('invoice_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tenant_id', 'year', 'month', 'country_code', 'tax_rate', 'currency', name='uq_vat_rollups_bucket')
+    )
+    with op.batch_alter_table('vat_rollups', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_vat_rollups_id'), ['id'], unique=False)
+
+    # AUTOINCREMENT is a table option on SQLite, so the table is rebuilt there
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    with op.batch_alter_table('invoices', schema=None, recreate='always' if sqlite else 'auto',
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.add_column(sa.Column('vat_reported', sa.Boolean(), nullable=True))
+        batch_op.create_index('ix_invoices_tenant_issue_date', ['tenant_id', 'issue_date'], unique=False)
+
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('webhook_events_tenant_id_fkey', 'tenants', ['tenant_id'], ['id'])
+        batch_op.create_index('ix_webhook_events_tenant_id_id', ['tenant_id', 'id'], unique=False)
+    op.execute(
+        "UPDATE webhook_events SET tenant_id = "
+        "(SELECT invoices.tenant_id FROM invoices WHERE invoices.id = webhook_events.invoice_id)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhook_events_tenant_id_id')
+        batch_op.drop_constraint('webhook_events_tenant_id_fkey', type_='foreignkey')
+        batch_op.drop_column('tenant_id')
+
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    with op.batch_alter_table('invoices', schema=None, recreate='always' if sqlite else 'auto',
+                              table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        batch_op.drop_index('ix_invoices_tenant_issue_date')
+        batch_op.drop_column('vat_reported')
+
+    with op.batch_alter_table('vat_rollups', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_vat_rollups_id'))
+
+    op.drop_table('vat_rollups')
+    with op.batch_alter_table('export_jobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_export_jobs_tenant_id'))
+        batch_op.drop_index(batch_op.f('ix_export_jobs_id'))
+
+    op.drop_table('export_jobs')
+    with op.batch_alter_table('archived_invoices', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_archived_invoices_tenant_id'))
+
+    op.drop_table('archived_invoices')
+    op.drop_table('tenant_token_versions')
+    with op.batch_alter_table('api_keys', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_api_keys_prefix'))
+        batch_op.drop_index(batch_op.f('ix_api_keys_id'))
+
+    op.drop_table('api_keys')
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.alter_column('api_key', existing_type=sa.String(length=255), nullable=False)
+
+    sa.Enum(name='exportstatus').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,44 @@
+"""Document sequences
+
+Per-tenant, per-country number sequences and the invoice transmission number.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 17:47:11.931904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('document_sequences',
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    # The countrycode type was already created with invoices
+    sa.Column('country_code', postgresql.ENUM('DE', 'IT', 'FR', 'ES', 'NL', 'BE', 'AT', name='countrycode', create_type=False), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('next_value', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('tenant_id', 'country_code', 'name')
+    )
+    with op.batch_alter_table('invoices', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('transmission_number', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('invoices', schema=None, table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_column('transmission_number')
+
+    op.drop_table('document_sequences')
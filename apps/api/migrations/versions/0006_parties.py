@@ -0,0 +1,134 @@
+"""Parties
+
+Deduplicated supplier and customer records referenced by invoices; moves
+existing inline party JSON into the new table.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 17:52:32.395522
+
+"""
+import hashlib
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+
+parties = sa.table(
+    'parties',
+    sa.column('id', sa.Integer()), sa.column('tenant_id', sa.Integer()),
+    sa.column('content_hash', sa.String()), sa.column('data', sa.JSON()),
+)
+invoices = sa.table(
+    'invoices',
+    sa.column('id', sa.Integer()), sa.column('tenant_id', sa.Integer()),
+    sa.column('supplier_id', sa.Integer()), sa.column('customer_id', sa.Integer()),
+    sa.column('supplier_data', sa.JSON()), sa.column('customer_data', sa.JSON()),
+)
+
+
+def _party_hash(data) -> str:
+    # Frozen copy of app.parties.party_hash
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _move_inline_parties() -> None:
+    connection = op.get_bind()
+    party_ids = {}
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(invoices.c.id, invoices.c.tenant_id, invoices.c.supplier_data, invoices.c.customer_data)
+            .where(invoices.c.id > last_id, invoices.c.supplier_id.is_(None))
+            .order_by(invoices.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        updates = []
+        for invoice_id, tenant_id, supplier, customer in rows:
+            ids = []
+            for data in (supplier, customer):
+                key = (tenant_id, _party_hash(data))
+                if key not in party_ids:
+                    party_ids[key] = connection.execute(
+                        parties.insert().values(tenant_id=tenant_id, content_hash=key[1], data=data)
+                        .returning(parties.c.id)
+                    ).scalar_one()
+                ids.append(party_ids[key])
+            updates.append({"invoice_id": invoice_id, "supplier": ids[0], "customer": ids[1]})
+        connection.execute(
+            invoices.update().where(invoices.c.id == sa.bindparam("invoice_id")).values(
+                supplier_id=sa.bindparam("supplier"), customer_id=sa.bindparam("customer"),
+                supplier_data=sa.null(), customer_data=sa.null(),
+            ),
+            updates,
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('parties',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('data', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tenant_id', 'content_hash', name='uq_parties_tenant_hash')
+    )
+    with op.batch_alter_table('parties', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_parties_id'), ['id'], unique=False)
+
+    # SQLite rebuilds the table here, and would otherwise drop AUTOINCREMENT
+    with op.batch_alter_table('invoices', schema=None, table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.add_column(sa.Column('supplier_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('customer_id', sa.Integer(), nullable=True))
+        batch_op.alter_column('supplier_data',
+               existing_type=sa.JSON(),
+               nullable=True)
+        batch_op.alter_column('customer_data',
+               existing_type=sa.JSON(),
+               nullable=True)
+        batch_op.create_foreign_key('fk_invoices_supplier_id_parties', 'parties', ['supplier_id'], ['id'])
+        batch_op.create_foreign_key('fk_invoices_customer_id_parties', 'parties', ['customer_id'], ['id'])
+
+    _move_inline_parties()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for role in ('supplier', 'customer'):
+        op.execute(
+            f"UPDATE invoices SET {role}_data = (SELECT data FROM parties WHERE parties.id = invoices.{role}_id) "
+            f"WHERE {role}_id IS NOT NULL"
+        )
+
+    with op.batch_alter_table('invoices', schema=None, table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_constraint('fk_invoices_customer_id_parties', type_='foreignkey')
+        batch_op.drop_constraint('fk_invoices_supplier_id_parties', type_='foreignkey')
+        batch_op.alter_column('customer_data',
+               existing_type=sa.JSON(),
+               nullable=False)
+        batch_op.alter_column('supplier_data',
+               existing_type=sa.JSON(),
+               nullable=False)
+        batch_op.drop_column('customer_id')
+        batch_op.drop_column('supplier_id')
+
+    with op.batch_alter_table('parties', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_parties_id'))
+
+    op.drop_table('parties')
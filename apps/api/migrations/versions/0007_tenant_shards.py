@@ -0,0 +1,34 @@
+"""Tenant shards
+
+Which database holds each tenant's data, and whether it is being moved.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 18:22:11.328748
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('shard', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('moving_to', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.drop_column('moving_to')
+        batch_op.drop_column('shard')
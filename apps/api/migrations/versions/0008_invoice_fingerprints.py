@@ -0,0 +1,37 @@
+"""Invoice fingerprints
+
+Duplicate detection on ingestion. Existing invoices stay NULL until
+`python -m app.duplicates backfill` fingerprints them.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 18:29:36.998247
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, Sequence[str], None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('invoices', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fingerprint', sa.String(length=32), nullable=True))
+        batch_op.add_column(sa.Column('duplicate_of', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_invoices_tenant_fingerprint', ['tenant_id', 'fingerprint'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('invoices', schema=None, table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_index('ix_invoices_tenant_fingerprint')
+        batch_op.drop_column('duplicate_of')
+        batch_op.drop_column('fingerprint')
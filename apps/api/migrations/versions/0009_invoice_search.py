@@ -0,0 +1,70 @@
+"""Invoice search
+
+One row per invoice with its number, party names and VAT IDs, plus a
+trigram text index over it: FTS5 on SQLite, pg_trgm GIN on PostgreSQL.
+Existing invoices are not searchable until `python -m app.search reindex`
+has indexed them.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 18:42:09.629914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, Sequence[str], None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SQLITE_UPGRADE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search_fts USING fts5(document, content='', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS invoice_search_ai AFTER INSERT ON invoice_search BEGIN "
+    "INSERT INTO invoice_search_fts(rowid, document) VALUES (-new.id, new.document); END",
+    "CREATE TRIGGER IF NOT EXISTS invoice_search_ad AFTER DELETE ON invoice_search BEGIN "
+    "INSERT INTO invoice_search_fts(invoice_search_fts, rowid, document) "
+    "VALUES ('delete', -old.id, old.document); END",
+    "CREATE TRIGGER IF NOT EXISTS invoice_search_au AFTER UPDATE ON invoice_search BEGIN "
+    "INSERT INTO invoice_search_fts(invoice_search_fts, rowid, document) "
+    "VALUES ('delete', -old.id, old.document); "
+    "INSERT INTO invoice_search_fts(rowid, document) VALUES (-new.id, new.document); END",
+)
+POSTGRES_UPGRADE = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_invoice_search_document_trgm ON invoice_search USING gin (document gin_trgm_ops)",
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('invoice_search',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('document', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('invoice_search', schema=None) as batch_op:
+        batch_op.create_index('ix_invoice_search_tenant_id_id', ['tenant_id', 'id'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    statements = {"sqlite": SQLITE_UPGRADE, "postgresql": POSTGRES_UPGRADE}.get(dialect, ())
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == "sqlite":
+        # Dropping invoice_search drops its triggers with it
+        op.execute("DROP TABLE IF EXISTS invoice_search_fts")
+
+    with op.batch_alter_table('invoice_search', schema=None) as batch_op:
+        batch_op.drop_index('ix_invoice_search_tenant_id_id')
+
+    op.drop_table('invoice_search')
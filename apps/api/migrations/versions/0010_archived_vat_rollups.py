@@ -0,0 +1,48 @@
+"""Archived VAT rollups
+
+What archived invoices contributed to vat_rollups, so rebuilding the
+rollups from the invoices table keeps it. Invoices archived before this
+revision are not included.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 19:18:50.909159
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, Sequence[str], None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('archived_vat_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    # The countrycode type was already created with invoices
+    sa.Column('country_code', postgresql.ENUM('DE', 'IT', 'FR', 'ES', 'NL', 'BE', 'AT', name='countrycode', create_type=False), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('tax_rate', sa.String(length=10), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('taxable_base_cents', sa.BigInteger(), nullable=False),
+    sa.Column('tax_cents', sa.BigInteger(), nullable=False),
+    sa.Column('invoice_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tenant_id', 'year', 'month', 'country_code', 'tax_rate', 'currency', name='uq_archived_vat_rollups_bucket')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('archived_vat_rollups')
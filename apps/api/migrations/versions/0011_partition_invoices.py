@@ -0,0 +1,151 @@
+"""Partition invoices by issue month
+
+PostgreSQL only; other databases keep a plain invoices table. The table is
+rebuilt as one partitioned by range of issue_date, with a partition per
+month from the oldest invoice to three months ahead and a default partition
+for anything outside. Every index and foreign key of the old table is
+recreated on the new one.
+
+PostgreSQL requires the partition key in every unique constraint, so the
+primary key becomes (id, issue_date), and webhook_events can no longer
+reference invoices.id with a foreign key. Triggers enforce that reference
+instead. The whole table is copied under an exclusive lock, so schedule the
+upgrade with that in mind.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19 19:31:04.118233
+
+"""
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0011'
+down_revision: Union[str, Sequence[str], None] = '0010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+REFERENCE_TRIGGERS = (
+    """
+    CREATE FUNCTION webhook_events_invoice_exists() RETURNS trigger AS $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM invoices WHERE id = NEW.invoice_id) THEN
+            RAISE foreign_key_violation USING MESSAGE = format(
+                'webhook_events.invoice_id %s is not in invoices', NEW.invoice_id);
+        END IF;
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER webhook_events_invoice_fk AFTER INSERT OR UPDATE OF invoice_id ON webhook_events "
+    "FOR EACH ROW EXECUTE FUNCTION webhook_events_invoice_exists()",
+    # An update moving a row to another partition deletes it from the old one; the id still exists then
+    """
+    CREATE FUNCTION invoices_without_webhook_events() RETURNS trigger AS $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM webhook_events WHERE invoice_id = OLD.id)
+                AND NOT EXISTS (SELECT 1 FROM invoices WHERE id = OLD.id) THEN
+            RAISE foreign_key_violation USING MESSAGE = format(
+                'invoice %s is still referenced from webhook_events', OLD.id);
+        END IF;
+        RETURN OLD;
+    END $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER invoices_webhook_events_fk AFTER DELETE ON invoices "
+    "FOR EACH ROW EXECUTE FUNCTION invoices_without_webhook_events()",
+)
+DROP_REFERENCE_TRIGGERS = (
+    "DROP TRIGGER IF EXISTS invoices_webhook_events_fk ON invoices",
+    "DROP FUNCTION IF EXISTS invoices_without_webhook_events()",
+    "DROP TRIGGER IF EXISTS webhook_events_invoice_fk ON webhook_events",
+    "DROP FUNCTION IF EXISTS webhook_events_invoice_exists()",
+)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_ddl(month: date) -> str:
+    end = add_months(month, 1)
+    return (
+        f"CREATE TABLE invoices_y{month.year:04d}m{month.month:02d} PARTITION OF invoices "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+def is_partitioned(bind) -> bool:
+    return bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('invoices')"
+    )).first() is not None
+
+
+def rebuild_invoices(bind, partition_by: str, primary_key: str) -> None:
+    """Recreate invoices with a new layout, keeping its rows, defaults, indexes and foreign keys"""
+    indexes = bind.execute(sa.text(
+        "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+        "WHERE x.indrelid = 'invoices'::regclass AND NOT x.indisprimary"
+    )).all()
+    foreign_keys = bind.execute(sa.text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = 'invoices'::regclass AND contype = 'f'"
+    )).all()
+
+    op.execute("ALTER TABLE invoices RENAME TO invoices_old")
+    op.execute("ALTER TABLE invoices_old RENAME CONSTRAINT invoices_pkey TO invoices_old_pkey")
+    for name, _ in indexes:
+        op.execute(f'DROP INDEX "{name}"')  # Frees the name; the old table is dropped below
+    op.execute(f"CREATE TABLE invoices (LIKE invoices_old INCLUDING ALL EXCLUDING INDEXES) {partition_by}")
+    op.execute(f"ALTER TABLE invoices ADD CONSTRAINT invoices_pkey PRIMARY KEY ({primary_key})")
+
+    if partition_by:
+        bounds = bind.execute(sa.text("SELECT min(issue_date), max(issue_date) FROM invoices_old")).first()
+        today = datetime.now(timezone.utc).date().replace(day=1)
+        month = bounds[0].date().replace(day=1) if bounds[0] else today
+        last = add_months(max(bounds[1].date().replace(day=1) if bounds[1] else today, today), MONTHS_AHEAD)
+        while month <= last:
+            op.execute(partition_ddl(month))
+            month = add_months(month, 1)
+        op.execute("CREATE TABLE invoices_default PARTITION OF invoices DEFAULT")
+
+    op.execute("INSERT INTO invoices SELECT * FROM invoices_old")
+    # Indexes after the copy: building them once is faster than maintaining them row by row
+    for _, definition in indexes:
+        op.execute(definition)
+    for name, definition in foreign_keys:
+        op.execute(f'ALTER TABLE invoices ADD CONSTRAINT "{name}" {definition}')
+    # The id sequence belongs to the old table and would be dropped with it
+    op.execute("ALTER SEQUENCE invoices_id_seq OWNED BY invoices.id")
+    op.execute("DROP TABLE invoices_old")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql" or is_partitioned(bind):
+        return
+    op.execute("ALTER TABLE webhook_events DROP CONSTRAINT IF EXISTS webhook_events_invoice_id_fkey")
+    rebuild_invoices(bind, "PARTITION BY RANGE (issue_date)", "id, issue_date")
+    for statement in REFERENCE_TRIGGERS:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql" or not is_partitioned(bind):
+        return
+    for statement in DROP_REFERENCE_TRIGGERS:
+        op.execute(statement)
+    rebuild_invoices(bind, "", "id")
+    op.execute(
+        "ALTER TABLE webhook_events ADD CONSTRAINT webhook_events_invoice_id_fkey "
+        "FOREIGN KEY (invoice_id) REFERENCES invoices (id)"
+    )
@@ -0,0 +1,64 @@
+"""Hash legacy API keys
+
+Moves the plaintext keys still in tenants.api_key into api_keys, hashed
+the way app.auth.hash_api_key does with the configured API_KEY_PEPPER, and
+drops the column. The keys keep working; a downgrade restores the column
+but not the plaintext.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19 19:30:13.660811
+
+"""
+import hashlib
+import hmac
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0012'
+down_revision: Union[str, Sequence[str], None] = '0011'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PREFIX_LENGTH = 12
+
+tenants = sa.table('tenants', sa.column('id', sa.Integer()), sa.column('api_key', sa.String()))
+api_keys = sa.table(
+    'api_keys',
+    sa.column('tenant_id', sa.Integer()), sa.column('prefix', sa.String()), sa.column('key_hash', sa.String()),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The hash has to match what the running app computes, so it is keyed with the app's own setting
+    from app.config import settings
+
+    pepper = settings.api_key_pepper.encode()
+    legacy = op.get_bind().execute(
+        sa.select(tenants.c.id, tenants.c.api_key).where(tenants.c.api_key.isnot(None))
+    ).all()
+    if legacy:
+        op.bulk_insert(api_keys, [
+            {
+                'tenant_id': tenant_id,
+                'prefix': api_key[:PREFIX_LENGTH],
+                'key_hash': hmac.new(pepper, api_key.encode(), hashlib.sha256).hexdigest(),
+            }
+            for tenant_id, api_key in legacy
+        ])
+
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tenants_api_key'))
+        batch_op.drop_column('api_key')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('api_key', sa.String(length=255), nullable=True))
+        batch_op.create_index(batch_op.f('ix_tenants_api_key'), ['api_key'], unique=True)
@@ -0,0 +1,72 @@
+"""Tenant scoped search
+
+Rebuilds the SQLite FTS5 search table with a tenant column next to the
+document, so a search matches only the tenant's rows in the index, and
+refills it from invoice_search. PostgreSQL filters by tenant in SQL and is
+unchanged.
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-19 21:05:41.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0013'
+down_revision: Union[str, Sequence[str], None] = '0012'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DROP = (
+    "DROP TRIGGER IF EXISTS invoice_search_ai",
+    "DROP TRIGGER IF EXISTS invoice_search_ad",
+    "DROP TRIGGER IF EXISTS invoice_search_au",
+    "DROP TABLE IF EXISTS invoice_search_fts",
+)
+UPGRADE = (
+    "CREATE VIRTUAL TABLE invoice_search_fts USING fts5(tenant, document, content='', tokenize='trigram')",
+    "CREATE TRIGGER invoice_search_ai AFTER INSERT ON invoice_search BEGIN "
+    "INSERT INTO invoice_search_fts(rowid, tenant, document) "
+    "VALUES (-new.id, printf('t%010d', new.tenant_id), new.document); END",
+    "CREATE TRIGGER invoice_search_ad AFTER DELETE ON invoice_search BEGIN "
+    "INSERT INTO invoice_search_fts(invoice_search_fts, rowid, tenant, document) "
+    "VALUES ('delete', -old.id, printf('t%010d', old.tenant_id), old.document); END",
+    "CREATE TRIGGER invoice_search_au AFTER UPDATE ON invoice_search BEGIN "
+    "INSERT INTO invoice_search_fts(invoice_search_fts, rowid, tenant, document) "
+    "VALUES ('delete', -old.id, printf('t%010d', old.tenant_id), old.document); "
+    "INSERT INTO invoice_search_fts(rowid, tenant, document) "
+    "VALUES (-new.id, printf('t%010d', new.tenant_id), new.document); END",
+    "INSERT INTO invoice_search_fts(rowid, tenant, document) "
+    "SELECT -id, printf('t%010d', tenant_id), document FROM invoice_search",
+)
+DOWNGRADE = (
+    "CREATE VIRTUAL TABLE invoice_search_fts USING fts5(document, content='', tokenize='trigram')",
+    "CREATE TRIGGER invoice_search_ai AFTER INSERT ON invoice_search BEGIN "
+    "INSERT INTO invoice_search_fts(rowid, document) VALUES (-new.id, new.document); END",
+    "CREATE TRIGGER invoice_search_ad AFTER DELETE ON invoice_search BEGIN "
+    "INSERT INTO invoice_search_fts(invoice_search_fts, rowid, document) "
+    "VALUES ('delete', -old.id, old.document); END",
+    "CREATE TRIGGER invoice_search_au AFTER UPDATE ON invoice_search BEGIN "
+    "INSERT INTO invoice_search_fts(invoice_search_fts, rowid, document) "
+    "VALUES ('delete', -old.id, old.document); "
+    "INSERT INTO invoice_search_fts(rowid, document) VALUES (-new.id, new.document); END",
+    "INSERT INTO invoice_search_fts(rowid, document) SELECT -id, document FROM invoice_search",
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == "sqlite":
+        for statement in DROP + UPGRADE:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == "sqlite":
+        for statement in DROP + DOWNGRADE:
+            op.execute(statement)
@@ -7,7 +7,19 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from app.main import app
+from app.admission import get_admission_controller
 from app.database import Base, get_db
+from app.auth import issue_api_key, token_cache, token_versions
+from app.config import settings
+from app.duplicates import get_duplicate_detector
+from app.gateways import get_gateway_registry
+from app.invoice_cache import get_invoice_cache
+from app.profiling import get_profiler, get_slow_request_tracer
+from app.rendering import get_pdf_renderer
+from app.replicas import get_shared_write_marks, recent_writes
+from app.sequences import get_sequence_allocator
+from app.sharding import get_shard_router, shard_map
+from app.storage import get_blob_store
 from app.models import Tenant, Invoice
 
 
@@ -36,9 +48,37 @@ def event_loop() -> Generator[asyncio.AbstractEventLoop, None, None]:
     loop.close()
 
 
+@pytest.fixture(autouse=True)
+def isolated_blob_store(tmp_path, monkeypatch):
+    # Invoices render PDFs in the background; keep them out of the working tree
+    monkeypatch.setattr(settings, "local_storage_path", str(tmp_path / "storage"))
+    monkeypatch.setattr(settings, "pdf_render_workers", 0)
+    monkeypatch.setattr(settings, "duplicate_filter_load_in_background", False)
+    monkeypatch.setattr(settings, "inbound_parse_workers", 0)
+    get_blob_store.cache_clear()
+    get_pdf_renderer.cache_clear()
+    get_gateway_registry.cache_clear()
+    get_sequence_allocator.cache_clear()
+    get_admission_controller.cache_clear()
+    get_shard_router.cache_clear()
+    get_invoice_cache.cache_clear()
+    get_duplicate_detector.cache_clear()
+    get_profiler.cache_clear()
+    get_slow_request_tracer.cache_clear()
+    get_shared_write_marks.cache_clear()
+    yield
+    get_slow_request_tracer().stop()  # Detaches its SQLAlchemy listeners
+    get_blob_store.cache_clear()
+    get_pdf_renderer.cache_clear()
+
+
 @pytest.fixture(scope="function")
 def db_session():
     Base.metadata.create_all(bind=engine)
+    token_cache.clear()
+    token_versions.clear()
+    recent_writes.clear()
+    shard_map.clear()
     db = TestingSessionLocal()
     try:
         yield db
@@ -59,7 +99,6 @@ def client(db_session):
 def sample_tenant(db_session) -> Tenant:
     tenant = Tenant(
         name="Test Company",
-        api_key="test_api_key_123",
         webhook_url="https://example.com/webhook",
         is_active=True
     )
@@ -70,8 +109,15 @@ def sample_tenant(db_session) -> Tenant:
 
 
 @pytest.fixture
-def auth_headers(sample_tenant):
-    return {"Authorization": f"Bearer {sample_tenant.api_key}"}
+def sample_api_key(db_session, sample_tenant) -> str:
+    api_key = issue_api_key(db_session, sample_tenant)
+    db_session.commit()
+    return api_key
+
+
+@pytest.fixture
+def auth_headers(sample_api_key):
+    return {"Authorization": f"Bearer {sample_api_key}"}
 
 
 @pytest.fixture
@@ -0,0 +1,142 @@
+import asyncio
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from app import database
+from app.admission import (
+    AdmissionController, database_pressure, get_admission_controller, is_long_poll, pool_saturation
+)
+from app.config import settings
+from app.sharding import get_shard_router
+
+
+def controller(**overrides):
+    options = dict(max_reads=2, max_writes=1, max_queued_writes=2, queue_timeout=1.0)
+    return AdmissionController(**(options | overrides))
+
+
+class TestAdmissionController:
+    def test_reads_are_capped_without_queueing(self):
+        admission = controller()
+        assert admission.try_read() and admission.try_read()
+        assert not admission.try_read() and admission.shed_reads == 1
+        admission.release_read()
+        assert admission.try_read()
+
+    def test_queued_writes_are_admitted_in_order(self):
+        async def scenario():
+            admission = controller()
+            assert await admission.acquire_write()
+            order = []
+
+            async def write(name):
+                assert await admission.acquire_write()
+                order.append(name)
+                admission.release_write()
+
+            tasks = [asyncio.create_task(write(name)) for name in ("first", "second")]
+            await asyncio.sleep(0)
+            assert admission.queued_writes == 2
+            assert not await admission.acquire_write()  # Queue full
+            admission.release_write()
+            await asyncio.gather(*tasks)
+            return order, admission
+
+        order, admission = asyncio.run(scenario())
+        assert order == ["first", "second"]
+        assert admission.writes == 0 and admission.shed_writes == 1
+
+    def test_waiting_too_long_sheds_the_write(self):
+        async def scenario():
+            admission = controller(queue_timeout=0.01)
+            await admission.acquire_write()
+            return await admission.acquire_write(), admission
+
+        admitted, admission = asyncio.run(scenario())
+        assert not admitted and admission.queued_writes == 0 and admission.writes == 1
+
+    def test_pool_pressure_sheds_writes_but_not_reads(self):
+        admission = controller(pool_threshold=0.8, pressure=lambda: 0.9)
+        assert not asyncio.run(admission.acquire_write())
+        assert admission.try_read()
+
+    def test_retry_after_follows_the_backlog(self):
+        admission = controller(max_writes=2)
+        admission.write_seconds = 1.5
+        admission.writes = 2
+        assert admission.retry_after() == 3
+
+    def test_pool_saturation(self):
+        engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=2, max_overflow=2)
+        connection = engine.connect()
+        assert pool_saturation(engine) == 0.25
+        connection.close()
+        assert pool_saturation(engine) == 0.0
+
+    def test_pressure_includes_shard_engines(self, monkeypatch):
+        shard = create_engine("sqlite://", poolclass=QueuePool, pool_size=1, max_overflow=1)
+        monkeypatch.setattr(database, "engine", create_engine("sqlite://", poolclass=QueuePool, pool_size=4))
+        monkeypatch.setattr(get_shard_router(), "_engines", {"eu-1": shard})
+        with shard.connect():
+            assert database_pressure() == 0.5
+        assert database_pressure() == 0.0
+
+    def test_long_polls_have_their_own_cap(self):
+        admission = controller(max_long_polls=1)
+        assert admission.try_long_poll() and not admission.try_long_poll()
+        assert admission.try_read() and admission.try_read()
+        admission.release_long_poll()
+        assert admission.try_long_poll()
+
+    def test_long_polls_are_recognised(self):
+        def scope(path, query=b""):
+            return {"path": path, "query_string": query}
+
+        assert is_long_poll(scope("/events", b"after=3&wait=20"))
+        assert is_long_poll(scope("/admin/profile", b"seconds=5"))
+        assert not is_long_poll(scope("/events", b"after=3&wait=0"))
+        assert not is_long_poll(scope("/events"))
+        assert not is_long_poll(scope("/invoices", b"wait=20"))
+
+
+class TestAdmissionMiddleware:
+    def test_writes_are_shed_with_retry_after(self, client, auth_headers, sample_invoice_data, monkeypatch):
+        monkeypatch.setattr(settings, "admission_max_inflight_writes", 1)
+        monkeypatch.setattr(settings, "admission_max_queued_writes", 0)
+        get_admission_controller.cache_clear()
+        get_admission_controller().writes = 1  # A long-running write holds the only slot
+
+        response = client.post("/invoices", json=sample_invoice_data, headers=auth_headers)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+        # Reads and health checks are still served
+        assert client.get("/healthz").status_code == 200
+        assert client.get("/invoices/1", headers=auth_headers).status_code == 404
+
+    def test_long_polls_do_not_take_read_slots(self, client, auth_headers, monkeypatch):
+        monkeypatch.setattr(settings, "admission_max_inflight_reads", 1)
+        get_admission_controller.cache_clear()
+        admission = get_admission_controller()
+        admission.reads = 1  # Ordinary reads are saturated
+
+        assert client.get("/invoices", headers=auth_headers).status_code == 429
+        assert client.get("/events", params={"wait": 1}, headers=auth_headers).status_code == 200
+        admission.long_polls = admission.max_long_polls
+        assert client.get("/events", params={"wait": 1}, headers=auth_headers).status_code == 429
+
+    def test_slots_are_released_after_each_request(self, client, auth_headers, sample_invoice_data):
+        for n in range(3):
+            response = client.post("/invoices", json=dict(sample_invoice_data, external_id=f"x-{n}"),
+                                   headers=auth_headers)
+            assert response.status_code == 200
+        client.get("/invoices", headers=auth_headers)
+        admission = get_admission_controller()
+        assert admission.writes == 0 and admission.reads == 0
+
+    def test_disabled(self, client, monkeypatch):
+        monkeypatch.setattr(settings, "admission_enabled", False)
+        get_admission_controller.cache_clear()
+        assert get_admission_controller() is None
+        assert client.get("/healthz").status_code == 200
@@ -0,0 +1,255 @@
+import gzip
+import json
+import os
+import pytest
+from datetime import date, datetime, timezone
+from sqlalchemy import create_engine, insert, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from app.archive import archive_invoices, load_archived_invoice, retention_cutoff
+from app.config import settings
+from app.models import ArchivedInvoice, Invoice, InvoiceStatus, CountryCode, Tenant, WebhookEvent
+from app.partitioning import add_months, is_partitioned, partition_ddl, partition_name, ensure_invoice_partitions
+from app.reports import apply_invoice_to_rollups, rebuild_vat_rollups, vat_report
+from app.startup import ALEMBIC_INI
+from app.storage import LocalBlobStore, BlobNotFound, get_blob_store
+
+# A disposable PostgreSQL database; its public schema is dropped
+POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "local_storage_path", str(tmp_path))
+    get_blob_store.cache_clear()
+    yield get_blob_store()
+    get_blob_store.cache_clear()
+
+
+def add_invoice(db_session, tenant, issue_date, status=InvoiceStatus.ACCEPTED):
+    invoice = Invoice(
+        external_id=f"EXT-{issue_date:%Y%m%d}",
+        tenant_id=tenant.id,
+        invoice_number=f"INV-{issue_date:%Y%m%d}",
+        country_code=CountryCode.IT,
+        status=status,
+        issue_date=issue_date,
+        subtotal="100.00",
+        tax_amount="22.00",
+        total_amount="122.00",
+        supplier_data={"name": "Supplier"},
+        customer_data={"name": "Customer"},
+        line_items=[{"description": "Item"}]
+    )
+    db_session.add(invoice)
+    db_session.commit()
+    return invoice
+
+
+class TestArchiveInvoices:
+    def test_archives_only_invoices_before_cutoff(self, db_session, sample_tenant, store):
+        old = add_invoice(db_session, sample_tenant, datetime(2020, 3, 1, tzinfo=timezone.utc))
+        recent = add_invoice(db_session, sample_tenant, datetime(2024, 3, 1, tzinfo=timezone.utc))
+        old_id, recent_id = old.id, recent.id
+
+        cutoff = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        assert archive_invoices(db_session, store, cutoff) == 1
+
+        assert db_session.query(Invoice).filter(Invoice.id == old_id).count() == 0
+        assert db_session.query(Invoice).filter(Invoice.id == recent_id).count() == 1
+        entry = db_session.query(ArchivedInvoice).one()
+        assert entry.id == old_id
+        assert entry.object_key.endswith(".jsonl.gz")
+        assert f"tenant={sample_tenant.id}/2020-03/" in entry.object_key
+
+    def test_archived_invoice_retrievable_by_id(self, db_session, sample_tenant, store):
+        invoice = add_invoice(db_session, sample_tenant, datetime(2020, 3, 1, tzinfo=timezone.utc))
+        db_session.add(WebhookEvent(invoice_id=invoice.id, event_type="invoice.accepted", payload={}))
+        db_session.commit()
+        invoice_id = invoice.id
+
+        archive_invoices(db_session, store, datetime(2022, 1, 1, tzinfo=timezone.utc))
+
+        record = load_archived_invoice(db_session, store, sample_tenant.id, invoice_id)
+        assert record["invoice_number"] == "INV-20200301"
+        assert record["status"] == "accepted"
+        assert record["webhook_events"][0]["event_type"] == "invoice.accepted"
+        assert load_archived_invoice(db_session, store, sample_tenant.id + 1, invoice_id) is None
+
+    def test_submitted_invoices_stay_hot(self, db_session, sample_tenant, store):
+        add_invoice(db_session, sample_tenant, datetime(2020, 3, 1, tzinfo=timezone.utc), InvoiceStatus.SUBMITTED)
+        assert archive_invoices(db_session, store, datetime(2022, 1, 1, tzinfo=timezone.utc)) == 0
+
+    def test_archives_in_batches(self, db_session, sample_tenant, store):
+        for day in range(1, 6):
+            add_invoice(db_session, sample_tenant, datetime(2020, 3, day, tzinfo=timezone.utc))
+
+        assert archive_invoices(db_session, store, datetime(2022, 1, 1, tzinfo=timezone.utc), batch_size=2) == 5
+        keys = {entry.object_key for entry in db_session.query(ArchivedInvoice)}
+        assert len(keys) == 3
+        lines = gzip.decompress(store.get(sorted(keys)[0])).splitlines()
+        assert all(json.loads(line)["tenant_id"] == sample_tenant.id for line in lines)
+
+    def test_rebuilt_rollups_keep_archived_invoices(self, db_session, sample_tenant, store):
+        invoice = add_invoice(db_session, sample_tenant, datetime(2020, 3, 1, tzinfo=timezone.utc))
+        invoice.line_items = [{"description": "Item", "quantity": 1.0, "unit_price": "100.00", "tax_rate": 22.0,
+                               "tax_amount": "22.00", "line_total": "100.00"}]
+        apply_invoice_to_rollups(db_session, invoice)
+        db_session.commit()
+        reported = vat_report(db_session, sample_tenant.id, 2020, [3])
+
+        archive_invoices(db_session, store, datetime(2022, 1, 1, tzinfo=timezone.utc))
+        assert rebuild_vat_rollups(db_session, sample_tenant.id) == 0  # No live invoices left
+        assert vat_report(db_session, sample_tenant.id, 2020, [3]) == reported == [(CountryCode.IT, "22", "EUR",
+                                                                                    10000, 2200, 1)]
+
+    def test_get_invoice_falls_back_to_archive(self, client, db_session, sample_tenant, auth_headers, store):
+        invoice = add_invoice(db_session, sample_tenant, datetime(2020, 3, 1, tzinfo=timezone.utc))
+        invoice_id = invoice.id
+        archive_invoices(db_session, store, datetime(2022, 1, 1, tzinfo=timezone.utc))
+
+        response = client.get(f"/invoices/{invoice_id}", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["invoice_number"] == "INV-20200301"
+
+    def test_retention_cutoff(self):
+        assert retention_cutoff(0) <= datetime.now(timezone.utc)
+        assert (datetime.now(timezone.utc) - retention_cutoff(30)).days in (29, 30)
+
+
+class TestListInvoicesByIssueDate:
+    def test_issue_date_range_filter(self, client, db_session, sample_tenant, auth_headers):
+        add_invoice(db_session, sample_tenant, datetime(2024, 1, 15, tzinfo=timezone.utc))
+        add_invoice(db_session, sample_tenant, datetime(2024, 2, 15, tzinfo=timezone.utc))
+
+        response = client.get(
+            "/invoices?issued_from=2024-02-01T00:00:00Z&issued_to=2024-03-01T00:00:00Z",
+            headers=auth_headers
+        )
+        assert [invoice["invoice_number"] for invoice in response.json()] == ["INV-20240215"]
+
+
+class TestPartitioning:
+    def test_partition_ddl(self):
+        assert partition_name(date(2024, 2, 1)) == "invoices_y2024m02"
+        assert partition_ddl(date(2024, 12, 9)) == (
+            "CREATE TABLE IF NOT EXISTS invoices_y2024m12 PARTITION OF invoices "
+            "FOR VALUES FROM ('2024-12-01') TO ('2025-01-01')"
+        )
+
+    def test_add_months(self):
+        assert add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+        assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+
+    def test_noop_on_sqlite(self, db_session):
+        assert ensure_invoice_partitions(db_session.get_bind()) == []
+
+    @pytest.mark.skipif(POSTGRES_URL is None, reason="TEST_POSTGRES_URL is not set")
+    def test_migration_partitions_invoices_keeping_indexes_and_references(self):
+        from alembic import command
+        from alembic.config import Config
+
+        engine = create_engine(POSTGRES_URL)
+        with engine.begin() as conn:
+            conn.execute(text("DROP SCHEMA public CASCADE"))
+            conn.execute(text("CREATE SCHEMA public"))
+        config = Config(str(ALEMBIC_INI))
+        config.attributes["configure_logger"] = False
+
+        def shape(conn):
+            inspector = inspect(conn)
+            return ({index["name"] for index in inspector.get_indexes("invoices")},
+                    {key["name"] for key in inspector.get_foreign_keys("invoices")})
+
+        with engine.begin() as conn:
+            config.attributes["connection"] = conn
+            command.upgrade(config, "0010")
+            tenant_id = conn.execute(insert(Tenant.__table__).values(name="T")).inserted_primary_key[0]
+            invoice_id = conn.execute(insert(Invoice.__table__).values(
+                external_id="E", tenant_id=tenant_id, invoice_number="N", country_code=CountryCode.IT,
+                issue_date=datetime(2020, 3, 1, tzinfo=timezone.utc), subtotal="1", tax_amount="0",
+                total_amount="1", line_items=[]
+            )).inserted_primary_key[0]
+            conn.execute(insert(WebhookEvent.__table__).values(invoice_id=invoice_id, event_type="e", payload={}))
+            before = shape(conn)
+
+            command.upgrade(config, "0011")
+            assert is_partitioned(conn)
+            assert shape(conn) == before
+            assert "invoices_y2020m03" in inspect(conn).get_table_names()
+            assert conn.execute(text("SELECT count(*) FROM invoices_y2020m03")).scalar() == 1
+            for statement in (insert(WebhookEvent.__table__).values(invoice_id=invoice_id + 1, event_type="e",
+                                                                    payload={}),
+                              text(f"DELETE FROM invoices WHERE id = {invoice_id}")):
+                with pytest.raises(IntegrityError), conn.begin_nested():
+                    conn.execute(statement)
+
+            command.downgrade(config, "0010")
+            assert not is_partitioned(conn)
+            assert shape(conn) == before
+            assert [key["referred_table"] for key in inspect(conn).get_foreign_keys("webhook_events")
+                    if key["constrained_columns"] == ["invoice_id"]] == ["invoices"]
+        engine.dispose()
+
+    @pytest.mark.skipif(POSTGRES_URL is None, reason="TEST_POSTGRES_URL is not set")
+    def test_new_partition_takes_its_rows_from_the_default_partition(self):
+        from alembic import command
+        from alembic.config import Config
+
+        engine = create_engine(POSTGRES_URL)
+        with engine.begin() as conn:
+            conn.execute(text("DROP SCHEMA public CASCADE"))
+            conn.execute(text("CREATE SCHEMA public"))
+            config = Config(str(ALEMBIC_INI))
+            config.attributes["configure_logger"] = False
+            config.attributes["connection"] = conn
+            command.upgrade(config, "head")
+            tenant_id = conn.execute(insert(Tenant.__table__).values(name="T")).inserted_primary_key[0]
+            conn.execute(insert(Invoice.__table__).values(
+                external_id="E", tenant_id=tenant_id, invoice_number="N", country_code=CountryCode.IT,
+                issue_date=datetime(2099, 5, 10, tzinfo=timezone.utc), subtotal="1", tax_amount="0",
+                total_amount="1", line_items=[]
+            ))
+            assert conn.execute(text("SELECT count(*) FROM invoices_default")).scalar() == 1
+
+        assert ensure_invoice_partitions(engine, months_ahead=1, start=date(2099, 5, 1)) == [
+            "invoices_y2099m05", "invoices_y2099m06"
+        ]
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM invoices_y2099m05")).scalar() == 1
+            assert conn.execute(text("SELECT count(*) FROM invoices_default")).scalar() == 0
+            assert conn.execute(text("SELECT count(*) FROM invoices")).scalar() == 1
+        assert ensure_invoice_partitions(engine, months_ahead=1, start=date(2099, 5, 1)) == []
+        engine.dispose()
+
+    def test_a_failing_month_does_not_stop_the_others(self, monkeypatch, caplog):
+        import app.partitioning as partitioning
+        from sqlalchemy.exc import ProgrammingError
+
+        def create_partition(conn, month):
+            if month == date(2024, 2, 1):
+                raise ProgrammingError("CREATE TABLE", {}, Exception("overlaps default partition"))
+
+        engine = create_engine("sqlite://")
+        monkeypatch.setattr(partitioning, "is_partitioned", lambda conn: True)
+        monkeypatch.setattr(partitioning, "list_partitions", lambda conn: [date(2024, 1, 1)])
+        monkeypatch.setattr(partitioning, "create_partition", create_partition)
+
+        assert ensure_invoice_partitions(engine, months_ahead=3, start=date(2024, 1, 1)) == [
+            "invoices_y2024m03", "invoices_y2024m04"
+        ]
+        assert "invoices_y2024m02" in caplog.text
+
+
+class TestLocalBlobStore:
+    def test_roundtrip(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        store.put("a/b.txt", b"data")
+        assert store.get("a/b.txt") == b"data"
+        store.delete("a/b.txt")
+        with pytest.raises(BlobNotFound):
+            store.get("a/b.txt")
+
+    def test_rejects_keys_outside_root(self, tmp_path):
+        with pytest.raises(ValueError):
+            LocalBlobStore(str(tmp_path)).put("../escape.txt", b"data")
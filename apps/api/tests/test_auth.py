@@ -1,7 +1,15 @@
 import pytest
-from app.auth import get_current_tenant, create_api_key
-from app.models import Tenant
+import time
+from datetime import datetime, timedelta
+from app.auth import (
+    get_current_tenant, create_api_key, hash_api_key, api_key_prefix, issue_api_key,
+    rotate_api_key, authenticate_api_key, create_access_token,
+    create_tenant_access_token, revoke_tenant_tokens, decode_token, token_cache, token_versions, TokenCache
+)
+from sqlalchemy import event
+from app.models import Tenant, ApiKey, TenantTokenVersion
 from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
 
 
 class TestAuthFunctions:
@@ -15,13 +23,12 @@ class TestAuthFunctions:
         key2 = create_api_key()
         assert key1 != key2
 
-    def test_get_current_tenant_success(self, db_session, sample_tenant):
+    def test_get_current_tenant_success(self, db_session, sample_tenant, sample_api_key):
         from fastapi.security import HTTPAuthorizationCredentials
-        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=sample_tenant.api_key)
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=sample_api_key)
         tenant = get_current_tenant(credentials, db_session)
         assert tenant.id == sample_tenant.id
         assert tenant.name == sample_tenant.name
-        assert tenant.api_key == sample_tenant.api_key
 
     def test_get_current_tenant_invalid_key(self, db_session):
         from fastapi.security import HTTPAuthorizationCredentials
@@ -35,14 +42,178 @@ class TestAuthFunctions:
         from fastapi.security import HTTPAuthorizationCredentials
         inactive_tenant = Tenant(
             name="Inactive Company",
-            api_key="inactive_key_123",
             is_active=False
         )
         db_session.add(inactive_tenant)
+        db_session.flush()
+        api_key = issue_api_key(db_session, inactive_tenant)
         db_session.commit()
         
-        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=inactive_tenant.api_key)
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=api_key)
         with pytest.raises(HTTPException) as exc_info:
             get_current_tenant(credentials, db_session)
         assert exc_info.value.status_code == 401
         assert "Invalid authentication credentials" in str(exc_info.value.detail)
+
+
+class TestHashedApiKeys:
+    def test_hash_is_keyed_and_deterministic(self):
+        api_key = create_api_key()
+        assert hash_api_key(api_key) == hash_api_key(api_key)
+        assert hash_api_key(api_key) != hash_api_key(create_api_key())
+        assert len(hash_api_key(api_key)) == 64
+        assert api_key not in hash_api_key(api_key)
+
+    def test_issued_key_is_stored_hashed(self, db_session, sample_tenant):
+        api_key = issue_api_key(db_session, sample_tenant)
+        db_session.commit()
+
+        stored = db_session.query(ApiKey).filter(ApiKey.tenant_id == sample_tenant.id).one()
+        assert stored.prefix == api_key_prefix(api_key)
+        assert stored.key_hash == hash_api_key(api_key)
+        assert stored.key_hash != api_key
+
+    def test_get_current_tenant_with_hashed_key(self, db_session, sample_tenant):
+        api_key = issue_api_key(db_session, sample_tenant)
+        db_session.commit()
+
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=api_key)
+        assert get_current_tenant(credentials, db_session).id == sample_tenant.id
+
+    def test_same_prefix_wrong_secret_rejected(self, db_session, sample_tenant):
+        api_key = issue_api_key(db_session, sample_tenant)
+        db_session.commit()
+
+        forged = api_key_prefix(api_key) + "0" * (len(api_key) - len(api_key_prefix(api_key)))
+        assert authenticate_api_key(db_session, forged) is None
+
+    def test_inactive_tenant_hashed_key_rejected(self, db_session, sample_tenant):
+        api_key = issue_api_key(db_session, sample_tenant)
+        sample_tenant.is_active = False
+        db_session.commit()
+
+        assert authenticate_api_key(db_session, api_key) is None
+
+    def test_rotation_keeps_old_key_valid_during_overlap(self, db_session, sample_tenant):
+        old_key = issue_api_key(db_session, sample_tenant)
+        db_session.commit()
+
+        new_key, expires_at = rotate_api_key(db_session, sample_tenant, timedelta(hours=1))
+        db_session.commit()
+
+        assert expires_at > datetime.utcnow()
+        assert authenticate_api_key(db_session, old_key).id == sample_tenant.id
+        assert authenticate_api_key(db_session, new_key).id == sample_tenant.id
+
+    def test_rotation_without_overlap_expires_old_key(self, db_session, sample_tenant):
+        old_key = issue_api_key(db_session, sample_tenant)
+        db_session.commit()
+
+        new_key, _ = rotate_api_key(db_session, sample_tenant, timedelta(0))
+        db_session.commit()
+
+        assert authenticate_api_key(db_session, old_key) is None
+        assert authenticate_api_key(db_session, new_key).id == sample_tenant.id
+
+
+class TestTokenCache:
+    def test_evicts_least_recently_used(self):
+        cache = TokenCache(maxsize=2)
+        exp = time.time() + 60
+        cache.put("a", {"exp": exp})
+        cache.put("b", {"exp": exp})
+        cache.get("a")
+        cache.put("c", {"exp": exp})
+
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+
+    def test_expired_entries_are_not_served(self):
+        cache = TokenCache(maxsize=2)
+        cache.put("a", {"exp": time.time() - 1})
+        assert cache.get("a") is None
+
+    def test_decode_token_caches_verified_payload(self):
+        token = create_access_token({"sub": "1"})
+        payload = decode_token(token)
+        assert token_cache.get(token) == payload
+
+    def test_invalid_token_not_cached(self):
+        with pytest.raises(HTTPException):
+            decode_token("not-a-jwt")
+        assert token_cache.get("not-a-jwt") is None
+
+
+class TestStatelessJwt:
+    def test_token_carries_tenant_claims(self, db_session, sample_tenant):
+        token = create_tenant_access_token(db_session, sample_tenant)
+        payload = decode_token(token)
+        assert payload["sub"] == str(sample_tenant.id)
+        assert payload["act"] is True
+        assert payload["kv"] == 0
+
+    def test_cached_token_skips_database(self, db_session, sample_tenant):
+        token = create_tenant_access_token(db_session, sample_tenant)
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        get_current_tenant(credentials, db_session)  # The first request loads the token version cache
+        db_session.expunge_all()
+
+        statements = []
+        record = lambda *args: statements.append(args[2])
+        event.listen(db_session.get_bind(), "before_cursor_execute", record)
+        try:
+            tenant = get_current_tenant(credentials, db_session)
+        finally:
+            event.remove(db_session.get_bind(), "before_cursor_execute", record)
+        assert tenant.id == sample_tenant.id
+        assert statements == []
+
+        assert tenant.name == sample_tenant.name  # lazily loaded on demand
+
+    def test_revoked_token_rejected(self, db_session, sample_tenant):
+        token = create_tenant_access_token(db_session, sample_tenant)
+        revoke_tenant_tokens(db_session, sample_tenant.id)
+        db_session.commit()
+
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        with pytest.raises(HTTPException) as exc_info:
+            get_current_tenant(credentials, db_session)
+        assert exc_info.value.status_code == 401
+
+        fresh = create_tenant_access_token(db_session, sample_tenant)
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=fresh)
+        assert get_current_tenant(credentials, db_session).id == sample_tenant.id
+
+    def test_issued_token_carries_version_from_database(self, db_session, sample_tenant):
+        assert token_versions.current(db_session, sample_tenant.id) == 0
+        # Revoked by another process: this one's cache still holds version 0
+        db_session.add(TenantTokenVersion(tenant_id=sample_tenant.id, version=3))
+        db_session.commit()
+
+        token = create_tenant_access_token(db_session, sample_tenant)
+        assert decode_token(token)["kv"] == 3
+
+    def test_revocation_reaches_the_cache_only_on_commit(self, db_session, sample_tenant):
+        assert token_versions.current(db_session, sample_tenant.id) == 0
+        revoke_tenant_tokens(db_session, sample_tenant.id)
+        assert token_versions.current(db_session, sample_tenant.id) == 0
+        db_session.rollback()
+        assert token_versions.current(db_session, sample_tenant.id) == 0
+
+        revoke_tenant_tokens(db_session, sample_tenant.id)
+        db_session.commit()
+        assert token_versions.current(db_session, sample_tenant.id) == 1
+
+    def test_inactive_claim_rejected(self, db_session, sample_tenant):
+        sample_tenant.is_active = False
+        token = create_tenant_access_token(db_session, sample_tenant)
+
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        with pytest.raises(HTTPException):
+            get_current_tenant(credentials, db_session)
+
+    def test_token_without_claims_checks_database(self, db_session, sample_tenant):
+        token = create_access_token({"sub": str(sample_tenant.id)})
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        assert get_current_tenant(credentials, db_session).id == sample_tenant.id
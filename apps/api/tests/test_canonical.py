@@ -0,0 +1,129 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from lxml import etree
+
+from app.canonical import canonicalize
+from app.compliance import generate_fatturapa_xml, generate_ubl_xml, validate_invoice_data
+from app.facturx import generate_cii_xml
+from app.schemas import InvoiceValidateRequest
+
+CII = {"ram": "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100"}
+UBL = {"cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+       "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"}
+PARTY = {"name": "Rossi & Figli", "vat_id": "IT12345678901", "address": "Via Roma 1", "city": "Milano",
+         "postal_code": "20121", "country": "IT"}
+LINES = [
+    {"description": "Consulenza <base>", "quantity": 2.0, "unit_price": "50.00", "tax_rate": 22.0,
+     "tax_amount": "22.00", "line_total": "100.00"},
+    {"description": "Libri", "quantity": 1.0, "unit_price": "30.00", "tax_rate": 4, "tax_amount": "1.20",
+     "line_total": "30.00"},
+    {"description": "Supporto", "quantity": 1.0, "unit_price": "10.00", "tax_rate": 22, "tax_amount": "2.20",
+     "line_total": "10.00"},
+]
+
+
+def invoice(**overrides):
+    fields = dict(
+        invoice_number="FT-1", issue_date=datetime(2024, 5, 2, tzinfo=timezone.utc), currency="EUR",
+        supplier_data=PARTY, customer_data=PARTY, line_items=LINES, country_code="IT",
+        subtotal="140.00", tax_amount="25.40", total_amount="165.40", transmission_number=1, id=1,
+    )
+    return SimpleNamespace(**(fields | overrides))
+
+
+class TestCanonicalize:
+    def test_totals_and_subtotals_per_rate(self):
+        canonical = canonicalize(LINES)
+        assert (canonical.subtotal, canonical.tax_total, canonical.total) == (
+            Decimal("140.00"), Decimal("25.40"), Decimal("165.40")
+        )
+        assert [(s.rate, s.taxable_amount, s.tax_amount) for s in canonical.tax_subtotals] == [
+            ("22", Decimal("110.00"), Decimal("24.20")), ("4", Decimal("30.00"), Decimal("1.20"))
+        ]
+
+    def test_lines_are_parsed_and_escaped_once(self):
+        line = canonicalize(LINES).lines[0]
+        assert line.description == "Consulenza &lt;base&gt;"
+        assert (line.quantity, line.unit_price, line.rate) == (Decimal("2.0"), Decimal("50.00"), "22")
+        assert not hasattr(line, "__dict__")
+
+    def test_validation_reads_the_canonical_lines(self):
+        request = InvoiceValidateRequest(
+            country_code="IT", supplier=PARTY, customer=PARTY,
+            line_items=[LINES[0] | {"tax_amount": "5.00"}, LINES[1] | {"unit_price": "0"}]
+        )
+        result = validate_invoice_data(request)
+        assert result.errors == ["Line item 2: Unit price must be positive"]
+        assert "Line item 1: Tax amount calculation may be incorrect" in result.warnings
+
+
+class TestRenderedTaxSubtotals:
+    def test_ubl_groups_tax_by_rate(self):
+        root = etree.fromstring(generate_ubl_xml(invoice(country_code="DE")).encode())
+        subtotals = [
+            (s.findtext("cbc:TaxableAmount", namespaces=UBL), s.findtext("cac:TaxCategory/cbc:Percent", namespaces=UBL))
+            for s in root.findall("cac:TaxTotal/cac:TaxSubtotal", UBL)
+        ]
+        assert subtotals == [("110.00", "22"), ("30.00", "4")]
+        line = root.find("cac:InvoiceLine", UBL)
+        assert line.findtext("cac:Item/cbc:Description", namespaces=UBL) == "Consulenza <base>"
+        assert line.findtext("cac:Item/cac:ClassifiedTaxCategory/cbc:Percent", namespaces=UBL) == "22"
+
+    def test_fatturapa_summarises_each_rate(self):
+        root = etree.fromstring(generate_fatturapa_xml(invoice()).encode())
+        summaries = [(r.findtext("AliquotaIVA"), r.findtext("Imposta")) for r in root.iter("DatiRiepilogo")]
+        assert summaries == [("22.00", "24.20"), ("4.00", "1.20")]
+        assert [d.findtext("AliquotaIVA") for d in root.iter("DettaglioLinee")] == ["22.00", "4.00", "22.00"]
+
+
+class TestVatCategories:
+    ZERO_RATED = {"description": "Export", "quantity": 1.0, "unit_price": "50.00", "tax_rate": 0,
+                  "tax_amount": "0.00", "line_total": "50.00"}
+
+    def test_zero_rate_is_never_standard_rated(self):
+        lines = [LINES[0], self.ZERO_RATED, self.ZERO_RATED | {"tax_exemption_reason": "Art. 10 DPR 633/72"}]
+        assert [line.category for line in canonicalize(lines).lines] == ["S", "Z", "E"]
+        assert [(s.category, s.rate) for s in canonicalize(lines).tax_subtotals] == [
+            ("S", "22"), ("Z", "0"), ("E", "0")
+        ]
+
+        reverse = canonicalize([self.ZERO_RATED], reverse_charge=True).tax_subtotals
+        assert [(s.category, s.exemption_reason) for s in reverse] == [("AE", "Reverse charge")]
+        assert canonicalize([self.ZERO_RATED | {"tax_category": "k"}]).lines[0].category == "K"
+
+    def test_cross_border_zero_rate_is_reverse_charge_in_ubl_and_cii(self):
+        customer = PARTY | {"vat_id": "DE123456789", "country": "DE"}
+        sample = invoice(customer_data=customer, line_items=[LINES[0], self.ZERO_RATED], due_date=None,
+                         subtotal="150.00", tax_amount="22.00", total_amount="172.00")
+
+        ubl = etree.fromstring(generate_ubl_xml(sample).encode())
+        categories = [
+            (c.findtext("cbc:ID", namespaces=UBL), c.findtext("cbc:TaxExemptionReason", namespaces=UBL))
+            for c in ubl.findall("cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory", UBL)
+        ]
+        assert categories == [("S", None), ("AE", "Reverse charge")]
+        assert [c.findtext("cbc:ID", namespaces=UBL) for c in ubl.iter(f"{{{UBL['cac']}}}ClassifiedTaxCategory")] == [
+            "S", "AE"
+        ]
+
+        cii = etree.fromstring(generate_cii_xml(sample).encode())
+        header = cii.findall(".//ram:ApplicableHeaderTradeSettlement/ram:ApplicableTradeTax", CII)
+        assert [(t.findtext("ram:CategoryCode", namespaces=CII), t.findtext("ram:ExemptionReason", namespaces=CII))
+                for t in header] == [("S", None), ("AE", "Reverse charge")]
+        assert [t.findtext("ram:CategoryCode", namespaces=CII)
+                for t in cii.findall(".//ram:SpecifiedLineTradeSettlement/ram:ApplicableTradeTax", CII)] == ["S", "AE"]
+
+    def test_validation_checks_category_against_rate(self):
+        request = InvoiceValidateRequest(
+            country_code="IT", supplier=PARTY, customer=PARTY,
+            line_items=[self.ZERO_RATED | {"tax_category": "S"}, self.ZERO_RATED | {"tax_category": "E"},
+                        LINES[0] | {"tax_category": "Z"}, self.ZERO_RATED | {"tax_category": "X"}]
+        )
+        assert validate_invoice_data(request).errors == [
+            "Line item 1: Standard rated VAT needs a rate above zero",
+            "Line item 2: VAT exempt lines need a tax_exemption_reason",
+            "Line item 3: VAT category Z needs a zero rate",
+            "Line item 4: Unknown VAT category X",
+        ]
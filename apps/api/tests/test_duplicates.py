@@ -0,0 +1,106 @@
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.duplicates import BloomFilter, DuplicateDetector, backfill_fingerprints, invoice_fingerprint
+from app.models import CountryCode, Invoice, InvoiceStatus
+
+
+def post(client, auth_headers, data, **changes):
+    return client.post("/invoices", json=data | changes, headers=auth_headers).json()
+
+
+class TestIngestion:
+    def test_resent_invoice_points_at_the_original(self, client, auth_headers, sample_invoice_data):
+        original = post(client, auth_headers, sample_invoice_data)
+        resent = post(client, auth_headers, sample_invoice_data, external_id="TEST-INV-002")
+        other = post(client, auth_headers, sample_invoice_data, external_id="TEST-INV-003", invoice_number="INV-2")
+
+        assert original["duplicate_of"] is None
+        assert resent["duplicate_of"] == original["id"]
+        assert other["duplicate_of"] is None
+        assert client.get(f"/invoices/{resent['id']}", headers=auth_headers).json()["duplicate_of"] == original["id"]
+
+    def test_failed_original_may_be_sent_again(self, client, db_session, auth_headers, sample_invoice_data):
+        original = post(client, auth_headers, sample_invoice_data)
+        db_session.get(Invoice, original["id"]).status = InvoiceStatus.FAILED
+        db_session.commit()
+
+        assert post(client, auth_headers, sample_invoice_data, external_id="TEST-INV-002")["duplicate_of"] is None
+
+    def test_fingerprint_ignores_formatting(self):
+        issued = datetime(2024, 1, 15, 9, 30, tzinfo=timezone.utc)
+        assert invoice_fingerprint("DE 123 456 789", " inv-1", issued, Decimal("119")) == invoice_fingerprint(
+            "de123456789", "INV-1", issued.replace(hour=0), Decimal("119.00")
+        )
+
+
+class TestDuplicateDetector:
+    def test_filter_skips_the_index_and_catches_up_with_other_processes(self, db_session, sample_tenant):
+        now = [0.0]
+        detector = DuplicateDetector(0.01, refresh_seconds=30, background=False, clock=lambda: now[0])
+        fingerprint = invoice_fingerprint("DE123456789", "INV-1", datetime(2024, 1, 15), Decimal("10"))
+        assert detector.find(db_session, sample_tenant.id, fingerprint) is None
+        assert detector.probes == 0
+
+        # Committed by another process, so not added to this detector
+        invoice = Invoice(
+            external_id="ext-1", tenant_id=sample_tenant.id, country_code=CountryCode.DE, invoice_number="INV-1",
+            issue_date=datetime(2024, 1, 15), subtotal="10.00", tax_amount="0.00", total_amount="10.00",
+            line_items=[], fingerprint=fingerprint, status=InvoiceStatus.SUBMITTED,
+        )
+        db_session.add(invoice)
+        db_session.commit()
+        assert detector.find(db_session, sample_tenant.id, fingerprint) is None
+
+        now[0] = 30
+        assert detector.find(db_session, sample_tenant.id, fingerprint) == invoice.id
+        assert detector.probes == 1
+
+    def test_filter_loads_in_the_background(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'invoices.db'}")
+        Base.metadata.create_all(engine)
+        detector = DuplicateDetector(0.01, refresh_seconds=30)
+        with Session(engine) as db:
+            assert detector.find(db, 1, "0" * 32) is None  # Answered from the index if the filter is not ready
+            deadline = time.monotonic() + 5
+            while 1 not in detector._filters and time.monotonic() < deadline:
+                time.sleep(0.01)
+            probes = detector.probes
+            assert detector.find(db, 1, "0" * 32) is None
+            assert detector.probes == probes
+        engine.dispose()
+
+    def test_bloom_filter_error_rate(self):
+        bloom = BloomFilter(10000, 0.01)
+        added = [invoice_fingerprint("DE1", f"INV-{i}", datetime(2024, 1, 1), Decimal(i)) for i in range(10000)]
+        for fingerprint in added:
+            bloom.add(fingerprint)
+
+        assert all(fingerprint in bloom for fingerprint in added)
+        others = [invoice_fingerprint("DE2", f"INV-{i}", datetime(2024, 1, 1), Decimal(i)) for i in range(10000)]
+        assert sum(fingerprint in bloom for fingerprint in others) < 200
+
+    def test_backfill(self, db_session, sample_tenant):
+        issued = datetime(2024, 1, 15)
+        db_session.add_all(
+            Invoice(
+                external_id=f"ext-{i}", tenant_id=sample_tenant.id, country_code=CountryCode.DE,
+                invoice_number=f"INV-{i}", issue_date=issued, subtotal="10.00", tax_amount="0.00",
+                total_amount="10.00", line_items=[], legacy_supplier_data=supplier,
+            )
+            for i, supplier in enumerate([{"vat_id": "DE123456789"}, {}, {"vat_id": "DE123456789"}])
+        )
+        db_session.commit()
+
+        assert backfill_fingerprints(db_session, batch_size=2) == 2
+        assert [invoice.fingerprint for invoice in db_session.query(Invoice).order_by(Invoice.id)] == [
+            invoice_fingerprint("DE123456789", "INV-0", issued, Decimal("10")),
+            None,
+            invoice_fingerprint("DE123456789", "INV-2", issued, Decimal("10")),
+        ]
+        assert backfill_fingerprints(db_session) == 0
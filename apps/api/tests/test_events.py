@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import time
+
+from app.events import ChangeFeed, EventHorizon, Subscription, format_sse, record_status_change, sse_events
+from app.models import Invoice, InvoiceStatus, WebhookEvent
+from app.profiling import RequestTrace, _trace
+from app.schemas import EventResponse
+
+
+def create_invoice(client, auth_headers, sample_invoice_data):
+    return client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+
+
+class TestOutbox:
+    def test_create_invoice_writes_status_event(self, client, auth_headers, sample_invoice_data, db_session,
+                                                sample_tenant):
+        invoice = create_invoice(client, auth_headers, sample_invoice_data)
+
+        event = db_session.query(WebhookEvent).one()
+        assert event.invoice_id == invoice["id"]
+        assert event.tenant_id == sample_tenant.id
+        assert event.event_type == "invoice.validated"
+        assert event.payload["status"] == "validated"
+        assert event.payload["external_id"] == sample_invoice_data["external_id"]
+
+    def test_record_status_change_uses_webhook_payload_shape(self, db_session, client, auth_headers,
+                                                            sample_invoice_data):
+        invoice = db_session.get(Invoice, create_invoice(client, auth_headers, sample_invoice_data)["id"])
+        invoice.status = InvoiceStatus.ACCEPTED
+        event = record_status_change(db_session, invoice, {"submission_id": "SDI-1"})
+        db_session.commit()
+
+        response = EventResponse.model_validate(event)
+        assert response.payload.event_type == "invoice.accepted"
+        assert response.payload.data == {"submission_id": "SDI-1"}
+
+
+class TestEventHorizon:
+    def test_readers_stop_below_a_gap_until_it_fills_or_times_out(self, db_session, client, auth_headers,
+                                                                  sample_invoice_data):
+        invoice_id = create_invoice(client, auth_headers, sample_invoice_data)["id"]
+        [first] = db_session.query(WebhookEvent.id).all()
+        first_id = first.id
+        db_session.add(WebhookEvent(id=first_id + 2, invoice_id=invoice_id, event_type="invoice.accepted",
+                                    payload={}))
+        db_session.commit()
+        now = [0.0]
+        horizon = EventHorizon(grace=lambda: 5.0, clock=lambda: now[0])
+
+        assert horizon.safe_id(db_session) == first_id  # id + 1 may still commit
+        now[0] = 5.0
+        assert horizon.safe_id(db_session) == first_id + 2  # Rolled back after all
+
+        db_session.add(WebhookEvent(id=first_id + 4, invoice_id=invoice_id, event_type="invoice.accepted",
+                                    payload={}))
+        db_session.commit()
+        assert horizon.safe_id(db_session) == first_id + 2
+        db_session.add(WebhookEvent(id=first_id + 3, invoice_id=invoice_id, event_type="invoice.accepted",
+                                    payload={}))
+        db_session.commit()
+        assert horizon.safe_id(db_session) == first_id + 4  # Filled by the late commit
+
+
+class TestEventsEndpoint:
+    def test_cursor_pagination(self, client, auth_headers, sample_invoice_data):
+        for _ in range(3):
+            create_invoice(client, auth_headers, sample_invoice_data)
+
+        first = client.get("/events?limit=2", headers=auth_headers).json()
+        assert len(first["events"]) == 2
+        second = client.get(f"/events?after={first['next_cursor']}", headers=auth_headers).json()
+        assert len(second["events"]) == 1
+        assert second["events"][0]["id"] > first["next_cursor"]
+
+        empty = client.get(f"/events?after={second['next_cursor']}", headers=auth_headers).json()
+        assert empty == {"events": [], "next_cursor": second["next_cursor"]}
+
+    def test_long_poll_times_out_empty(self, client, auth_headers):
+        start = time.monotonic()
+        response = client.get("/events?after=0&wait=1", headers=auth_headers)
+        assert response.json() == {"events": [], "next_cursor": 0}
+        assert time.monotonic() - start >= 0.9
+
+    def test_events_are_tenant_scoped(self, client, auth_headers, sample_invoice_data):
+        create_invoice(client, auth_headers, sample_invoice_data)
+        other_key = client.post("/tenants", json={"name": "Other"}).json()["api_key"]
+        response = client.get("/events", headers={"Authorization": f"Bearer {other_key}"})
+        assert response.json()["events"] == []
+
+
+class TestChangeFeed:
+    def test_poller_fans_out_to_tenant_subscribers(self, db_session, client, auth_headers,
+                                                   sample_invoice_data, sample_tenant):
+        bind = db_session.get_bind()
+
+        async def scenario():
+            feed = ChangeFeed(poll_interval=60)
+            feed.ensure_started(bind)
+            mine = feed.subscribe(sample_tenant.id)
+            other = feed.subscribe(sample_tenant.id + 1)
+
+            invoice = db_session.get(Invoice, create_invoice(client, auth_headers, sample_invoice_data)["id"])
+            assert await feed.poll_once() == 1
+            event = mine.get_nowait()
+            assert event.invoice_id == invoice.id
+            assert other.empty()
+
+            feed.unsubscribe(sample_tenant.id, mine)
+            feed.unsubscribe(sample_tenant.id + 1, other)
+            await feed.stop()
+
+        asyncio.run(scenario())
+
+    def test_poller_does_not_inherit_the_request_trace(self, db_session):
+        bind = db_session.get_bind()
+
+        async def scenario():
+            feed = ChangeFeed(poll_interval=60)
+            seen = []
+
+            async def run():
+                seen.append(_trace.get())
+
+            feed._run = run
+            _trace.set(RequestTrace())  # As in the traced request that first long-polls
+            feed.ensure_started(bind)
+            await feed._task
+            return seen
+
+        assert asyncio.run(scenario()) == [None]
+
+    def test_notify_wakes_poller(self, db_session, client, auth_headers, sample_invoice_data, sample_tenant):
+        bind = db_session.get_bind()
+
+        async def scenario():
+            feed = ChangeFeed(poll_interval=60)
+            feed.ensure_started(bind)
+            queue = feed.subscribe(sample_tenant.id)
+            await asyncio.sleep(0.05)
+
+            await asyncio.to_thread(create_invoice, client, auth_headers, sample_invoice_data)
+            feed.notify()
+            event = await asyncio.wait_for(queue.get(), timeout=2)
+            assert event.event_type == "invoice.validated"
+            await feed.stop()
+
+        asyncio.run(scenario())
+
+    def test_full_queue_marks_subscriber_lagging(self, db_session, client, auth_headers, sample_invoice_data,
+                                                 sample_tenant):
+        bind = db_session.get_bind()
+
+        async def scenario():
+            feed = ChangeFeed(poll_interval=60)
+            feed.ensure_started(bind)
+            queue = feed.subscribe(sample_tenant.id)
+            while not queue.full():
+                queue.put_nowait(None)
+            create_invoice(client, auth_headers, sample_invoice_data)
+            await feed.poll_once()
+            await feed.stop()
+            return queue.lagging
+
+        assert asyncio.run(scenario())
+
+    def test_lagging_sse_stream_catches_up_from_outbox(self, db_session, client, auth_headers, sample_invoice_data,
+                                                       sample_tenant):
+        for _ in range(2):
+            create_invoice(client, auth_headers, sample_invoice_data)
+        missed = [EventResponse.model_validate(e) for e in db_session.query(WebhookEvent).order_by(WebhookEvent.id)]
+
+        async def scenario():
+            queue = Subscription()
+            queue.lagging = True
+            queue.put_nowait(missed[0])  # Queued before the overflow; must not repeat
+            stream = sse_events(ChangeFeed(poll_interval=60), sample_tenant.id, queue, [], 0, heartbeat=0.05,
+                                bind=db_session.get_bind())
+            sent = [await stream.__anext__() for _ in range(3)]
+            await stream.aclose()
+            return sent
+
+        assert asyncio.run(scenario()) == [format_sse(event) for event in missed] + [b": keep-alive\n\n"]
+
+    def test_poll_errors_are_logged(self, caplog):
+        async def scenario():
+            feed = ChangeFeed(poll_interval=0.01)
+
+            async def broken():
+                raise RuntimeError("database is down")
+
+            feed.poll_once = broken
+            feed._wakeup = asyncio.Event()
+            task = asyncio.create_task(feed._run())
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        with caplog.at_level(logging.ERROR, logger="app.events"):
+            asyncio.run(scenario())
+        assert "Change feed poll failed" in caplog.text
+        assert "database is down" in caplog.text
+
+    def test_sse_stream_sends_backlog_then_live_without_duplicates(self, db_session, client, auth_headers,
+                                                                   sample_invoice_data, sample_tenant):
+        create_invoice(client, auth_headers, sample_invoice_data)
+        backlog = [EventResponse.model_validate(e) for e in db_session.query(WebhookEvent)]
+
+        async def scenario():
+            feed = ChangeFeed(poll_interval=60)
+            queue = Subscription()
+            queue.put_nowait(backlog[0])  # Also delivered live; must not repeat
+            stream = sse_events(feed, sample_tenant.id, queue, backlog, 0, heartbeat=0.05)
+            first = await stream.__anext__()
+            heartbeat = await stream.__anext__()
+            await stream.aclose()
+            return first, heartbeat
+
+        first, heartbeat = asyncio.run(scenario())
+        assert first == format_sse(backlog[0])
+        assert first.startswith(f"id: {backlog[0].id}\nevent: invoice.validated\ndata: ".encode())
+        assert heartbeat == b": keep-alive\n\n"
@@ -0,0 +1,124 @@
+import csv
+import gzip
+import io
+import pytest
+from datetime import datetime, timezone
+
+from app.config import settings
+from app.exports import EXPORT_HEADER, export_lines, run_export, stream_invoice_rows, write_csv_gz
+from app.models import ExportJob, ExportStatus, Invoice, CountryCode
+from app.storage import LocalBlobStore, get_blob_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "local_storage_path", str(tmp_path))
+    get_blob_store.cache_clear()
+    yield get_blob_store()
+    get_blob_store.cache_clear()
+
+
+def add_invoice(db_session, tenant, number, lines=2, issue_date=datetime(2024, 1, 15, tzinfo=timezone.utc)):
+    db_session.add(Invoice(
+        external_id=f"EXT-{number}",
+        tenant_id=tenant.id,
+        invoice_number=f"INV-{number}",
+        country_code=CountryCode.DE,
+        issue_date=issue_date,
+        subtotal="200.00",
+        tax_amount="38.00",
+        total_amount="238.00",
+        supplier_data={"name": "Supplier", "vat_id": "DE123"},
+        customer_data={"name": "Customer"},
+        line_items=[
+            {"description": f"Item {i}", "quantity": 1.0, "unit_price": "100.00",
+             "tax_rate": 19.0, "tax_amount": "19.00", "line_total": "100.00"}
+            for i in range(lines)
+        ]
+    ))
+    db_session.commit()
+
+
+def read_csv(data: bytes):
+    return list(csv.reader(io.StringIO(gzip.decompress(data).decode("utf-8"))))
+
+
+class TestExportWriter:
+    def test_one_record_per_line_item(self, db_session, sample_tenant, store):
+        add_invoice(db_session, sample_tenant, 1, lines=3)
+        add_invoice(db_session, sample_tenant, 2, lines=1)
+        job = ExportJob(tenant_id=sample_tenant.id)
+        db_session.add(job)
+        db_session.commit()
+
+        job = run_export(db_session, job.id, store)
+        assert job.status == ExportStatus.COMPLETED
+        assert job.row_count == 4
+
+        rows = read_csv(store.get(job.object_key))
+        assert tuple(rows[0]) == EXPORT_HEADER
+        record = dict(zip(EXPORT_HEADER, rows[1]))
+        assert record["invoice_number"] == "INV-1"
+        assert record["supplier_vat_id"] == "DE123"
+        assert record["customer_vat_id"] == ""
+        assert record["line_number"] == "1"
+        assert record["description"] == "Item 0"
+        assert [row[EXPORT_HEADER.index("invoice_number")] for row in rows[1:]] == ["INV-1"] * 3 + ["INV-2"]
+
+    def test_issue_date_range(self, db_session, sample_tenant, store):
+        add_invoice(db_session, sample_tenant, 1, issue_date=datetime(2024, 1, 15, tzinfo=timezone.utc))
+        add_invoice(db_session, sample_tenant, 2, issue_date=datetime(2024, 2, 15, tzinfo=timezone.utc))
+        job = ExportJob(
+            tenant_id=sample_tenant.id,
+            issued_from=datetime(2024, 2, 1, tzinfo=timezone.utc),
+            issued_to=datetime(2024, 3, 1, tzinfo=timezone.utc)
+        )
+        db_session.add(job)
+        db_session.commit()
+
+        rows = [row for row in stream_invoice_rows(db_session, job)]
+        assert [row.invoice_number for row in rows] == ["INV-2"]
+
+    def test_write_consumes_lines_lazily(self):
+        def lines():
+            for i in range(10000):
+                yield (i,) + ("x",) * (len(EXPORT_HEADER) - 1)
+
+        buffer = io.BytesIO()
+        assert write_csv_gz(lines(), buffer) == 10000
+        assert len(read_csv(buffer.getvalue())) == 10001
+
+    def test_failure_is_recorded(self, db_session, sample_tenant):
+        add_invoice(db_session, sample_tenant, 1)
+        job = ExportJob(tenant_id=sample_tenant.id)
+        db_session.add(job)
+        db_session.commit()
+
+        class BrokenStore:
+            def put_file(self, *args, **kwargs):
+                raise IOError("disk full")
+
+        job = run_export(db_session, job.id, BrokenStore())
+        assert job.status == ExportStatus.FAILED
+        assert job.error_message == "disk full"
+
+
+class TestExportEndpoints:
+    def test_export_lifecycle(self, client, db_session, sample_tenant, auth_headers, store):
+        add_invoice(db_session, sample_tenant, 1, lines=2)
+
+        response = client.post("/exports", json={}, headers=auth_headers)
+        assert response.status_code == 202
+        export_id = response.json()["id"]
+
+        response = client.get(f"/exports/{export_id}", headers=auth_headers)
+        assert response.json()["status"] == "completed"
+        assert response.json()["row_count"] == 2
+        assert response.json()["download_url"] == f"/exports/{export_id}/download"
+
+        response = client.get(f"/exports/{export_id}/download", headers=auth_headers)
+        assert response.status_code == 200
+        assert len(read_csv(response.content)) == 3
+
+    def test_export_not_found(self, client, auth_headers):
+        assert client.get("/exports/999", headers=auth_headers).status_code == 404
@@ -0,0 +1,190 @@
+import asyncio
+import base64
+import io
+import json
+import zipfile
+
+import httpx
+import pytest
+
+from app.gateways import (
+    AdaptiveLimit, CircuitBreaker, CircuitOpen, FakeGateway, GatewayClient, GatewayDocument, GatewayError,
+    SdiGateway, build_document, get_gateway_registry
+)
+from app.models import Invoice, WebhookEvent
+
+
+def documents(count: int):
+    return [GatewayDocument(invoice_id=i, filename=f"INV-{i}.xml", content=b"<Invoice/>") for i in range(count)]
+
+
+def gateway_client(gateway, **kwargs):
+    return GatewayClient(gateway, AdaptiveLimit(4, maximum=16),
+                         CircuitBreaker(failure_threshold=3, reset_timeout=60), **kwargs)
+
+
+class TestConcurrencyControl:
+    def test_limit_grows_on_fast_calls_and_backs_off_on_errors_and_slow_calls(self):
+        limit = AdaptiveLimit(4, maximum=16)
+        for _ in range(40):
+            limit.update(0.01, ok=True)
+        grown = limit.limit
+        assert grown > 6
+
+        limit.update(0.01, ok=False)
+        assert limit.limit == pytest.approx(grown * 0.7)
+        limit.update(0.05, ok=True)  # Five times the baseline
+        assert limit.limit == pytest.approx(grown * 0.7 * 0.7)
+
+    def test_limit_caps_calls_in_flight(self):
+        gateway = FakeGateway(latency=0.01)
+        client = gateway_client(gateway)
+        client.limit = AdaptiveLimit(3, minimum=3, maximum=3)
+
+        async def scenario():
+            return await asyncio.gather(*(client.submit(document) for document in documents(12)))
+
+        results = asyncio.run(scenario())
+        assert all(result.accepted for result in results)
+        assert gateway.peak_inflight == 3
+
+    def test_breaker_opens_then_probes(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+        now[0] = 10
+        assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+        assert not breaker.allow()  # One probe at a time
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+        now[0] = 20
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+    def test_cancelled_probe_lets_the_next_request_probe(self):
+        gateway = FakeGateway(latency=10)
+        client = gateway_client(gateway)
+        client.breaker.state = CircuitBreaker.OPEN  # Opened long enough ago to probe
+
+        async def scenario():
+            probe = asyncio.create_task(client.submit(documents(1)[0]))
+            await asyncio.sleep(0.01)
+            assert client.breaker.state == CircuitBreaker.HALF_OPEN
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+
+        asyncio.run(scenario())
+        assert client.breaker.state == CircuitBreaker.OPEN and client.breaker.allow()
+
+    def test_outage_fails_fast_once_open(self):
+        gateway = FakeGateway()
+        gateway.down = True
+        client = gateway_client(gateway)
+
+        async def scenario():
+            outcomes = []
+            for document in documents(10):
+                try:
+                    await client.submit(document)
+                except GatewayError as e:
+                    outcomes.append(type(e))
+            return outcomes
+
+        outcomes = asyncio.run(scenario())
+        assert outcomes == [GatewayError] * 3 + [CircuitOpen] * 7
+        assert gateway.calls == 3
+
+
+class TestBatching:
+    def test_submissions_are_coalesced_into_batches(self):
+        gateway = FakeGateway(batch_size=10)
+        client = gateway_client(gateway, linger=0.01)
+
+        async def scenario():
+            return await asyncio.gather(*(client.submit(document) for document in documents(25)))
+
+        results = asyncio.run(scenario())
+        assert [result.invoice_id for result in results] == list(range(25))
+        assert len({result.submission_id for result in results}) == 25
+        assert gateway.calls == 3
+
+    def test_sdi_sends_a_zip_and_maps_outcomes_per_file(self):
+        received = []
+
+        def handler(request):
+            body = json.loads(request.content)
+            received.append(body)
+            with zipfile.ZipFile(io.BytesIO(base64.b64decode(body["file"]))) as archive:
+                names = archive.namelist()
+            esiti = [{"nomeFile": name, "identificativoSdI": str(100 + i)} for i, name in enumerate(names[:-1])]
+            esiti.append({"nomeFile": names[-1], "errore": "00404 Fattura duplicata"})
+            return httpx.Response(200, json={"esiti": esiti})
+
+        adapter = SdiGateway("https://sdi.test", "key", timeout=5, pool_size=4, batch_size=3,
+                             transport=httpx.MockTransport(handler))
+
+        async def scenario():
+            try:
+                return await adapter.submit_batch(documents(3))
+            finally:
+                await adapter.close()
+
+        results = asyncio.run(scenario())
+        assert received[0]["nomeFile"].endswith(".zip")
+        assert [result.submission_id for result in results] == ["100", "101", None]
+        assert results[2].error == "00404 Fattura duplicata"
+
+    def test_http_errors_classify_retriable(self):
+        statuses = iter([503, 400])
+        adapter = SdiGateway("https://sdi.test", None, timeout=5, pool_size=1,
+                             transport=httpx.MockTransport(lambda request: httpx.Response(next(statuses))))
+
+        async def submit():
+            try:
+                await adapter.submit_batch(documents(1))
+            except GatewayError as e:
+                return e.retriable
+
+        assert asyncio.run(submit()) is True
+        assert asyncio.run(submit()) is False
+
+
+class TestSubmitImmediately:
+    def test_invoice_is_sent_to_its_gateway(self, client, auth_headers, sample_invoice_data, db_session):
+        sample_invoice_data["submit_immediately"] = True
+        response = client.post("/invoices", json=sample_invoice_data, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+
+        assert data["status"] == "submitted"
+        invoice = db_session.get(Invoice, data["id"])
+        assert invoice.submission_id.startswith("peppol-")
+        assert invoice.submitted_at is not None
+        assert invoice.gateway_response["gateway"] == "peppol"
+        events = db_session.query(WebhookEvent).filter(WebhookEvent.invoice_id == invoice.id).all()
+        assert [event.event_type for event in events] == ["invoice.validated", "invoice.submitted"]
+
+    def test_gateway_outage_marks_invoice_failed(self, client, auth_headers, sample_invoice_data):
+        get_gateway_registry().for_country("DE").adapter.down = True
+        sample_invoice_data["submit_immediately"] = True
+        data = client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+
+        assert data["status"] == "failed"
+        assert data["error_message"] == "peppol unavailable"
+
+    def test_italian_file_name_follows_sdi_convention(self, client, auth_headers, sample_invoice_data,
+                                                       db_session):
+        sample_invoice_data.update(country_code="IT")
+        sample_invoice_data["supplier"]["vat_id"] = "IT01234567890"
+        data = client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+
+        document = build_document(db_session.get(Invoice, data["id"]))
+        assert document.filename == f"IT01234567890_{data['id']:05d}.xml"
+        assert document.content.startswith(b"<?xml")
@@ -0,0 +1,125 @@
+import io
+import zipfile
+
+import pytest
+
+from app.compliance import generate_fatturapa_xml, generate_ubl_xml, generate_xrechnung_xml
+from app.inbound import InboundDocumentError, iter_document, iter_upload
+from app.models import Invoice
+
+
+def italian_invoice_data(sample_invoice_data, **changes):
+    supplier = sample_invoice_data["supplier"] | {"vat_id": "IT01234567897", "country": "IT"}
+    customer = sample_invoice_data["customer"] | {"vat_id": "IT12345670017", "country": "IT"}
+    lines = [
+        {"description": "Consulenza", "quantity": 2.0, "unit_price": "50.00", "tax_rate": 22.0,
+         "tax_amount": "22.00", "line_total": "100.00"},
+        {"description": "Libri", "quantity": 1.0, "unit_price": "10.00", "tax_rate": 4.0,
+         "tax_amount": "0.40", "line_total": "10.00"},
+    ]
+    return sample_invoice_data | {
+        "country_code": "IT", "supplier": supplier, "customer": customer, "line_items": lines,
+    } | changes
+
+
+def stored_invoice(client, db_session, auth_headers, data):
+    invoice_id = client.post("/invoices", json=data, headers=auth_headers).json()["id"]
+    return db_session.get(Invoice, invoice_id)
+
+
+def fatturapa_batch(documents):
+    """Join FatturaPA files sharing one header into a single file with one body per invoice"""
+    first = documents[0]
+    bodies = [document[document.index("<FatturaElettronicaBody>"):document.index("</p:FatturaElettronica>")]
+              for document in documents]
+    return first[:first.index("<FatturaElettronicaBody>")] + "".join(bodies) + "</p:FatturaElettronica>"
+
+
+class TestParsing:
+    def test_fatturapa_round_trip(self, client, db_session, auth_headers, sample_invoice_data):
+        invoice = stored_invoice(client, db_session, auth_headers, italian_invoice_data(sample_invoice_data))
+
+        [parsed] = iter_document(io.BytesIO(generate_fatturapa_xml(invoice).encode()))
+        assert parsed["country_code"] == "IT"
+        assert parsed["invoice_number"] == parsed["external_id"] == "INV-2024-001"
+        assert parsed["issue_date"] == "2024-01-15"
+        assert parsed["supplier"]["vat_id"] == "IT01234567897"
+        assert parsed["customer"]["city"] == "Munich"
+        assert [(line["description"], line["tax_rate"], line["tax_amount"]) for line in parsed["line_items"]] == [
+            ("Consulenza", "22.00", "22.00"), ("Libri", "4.00", "0.40")
+        ]
+
+    def test_ubl_and_xrechnung(self, client, db_session, auth_headers, sample_invoice_data):
+        data = italian_invoice_data(sample_invoice_data)
+        invoice = stored_invoice(client, db_session, auth_headers, data)
+
+        [ubl] = iter_document(io.BytesIO(generate_ubl_xml(invoice).encode()))
+        [xrechnung] = iter_document(io.BytesIO(generate_xrechnung_xml(invoice).encode()))
+        assert ubl["country_code"] == "IT"
+        assert xrechnung["country_code"] == "DE"
+        assert ubl["supplier"] == data["supplier"] | {"email": None, "phone": None}
+        assert ubl["line_items"] == [
+            {"description": "Consulenza", "quantity": "2.0", "unit_price": "50.00", "tax_rate": "22",
+             "tax_amount": "22.00", "line_total": "100.00"},
+            {"description": "Libri", "quantity": "1.0", "unit_price": "10.00", "tax_rate": "4",
+             "tax_amount": "0.40", "line_total": "10.00"},
+        ]
+
+    def test_batch_yields_one_invoice_per_body(self, client, db_session, auth_headers, sample_invoice_data):
+        invoice = stored_invoice(client, db_session, auth_headers, italian_invoice_data(sample_invoice_data))
+        documents = [generate_fatturapa_xml(invoice).replace("INV-2024-001", f"INV-{n}") for n in range(3)]
+
+        parsed = list(iter_document(io.BytesIO(fatturapa_batch(documents).encode())))
+        assert parsed == [next(iter_document(io.BytesIO(document.encode()))) for document in documents]
+
+    def test_unknown_and_malformed_documents(self):
+        with pytest.raises(InboundDocumentError, match="No UBL"):
+            list(iter_document(io.BytesIO(b"<CreditNote/>")))
+        with pytest.raises(InboundDocumentError, match="Malformed"):
+            list(iter_document(io.BytesIO(b"<Invoice>")))
+
+    def test_archive_members_parse_in_parallel_and_in_order(self, tmp_path, client, db_session, auth_headers,
+                                                            sample_invoice_data):
+        invoice = stored_invoice(client, db_session, auth_headers, italian_invoice_data(sample_invoice_data))
+        path = tmp_path / "batch.zip"
+        with zipfile.ZipFile(path, "w") as archive:
+            for n in range(4):
+                archive.writestr(f"{n}.xml", generate_fatturapa_xml(invoice).replace("INV-2024-001", f"INV-{n}"))
+            archive.writestr("broken.xml", "<p:FatturaElettronica")
+
+        parsed = list(iter_upload(str(path), workers=2))
+        assert [(item.document, item.data["invoice_number"]) for item in parsed[:4]] == [
+            (f"{n}.xml", f"INV-{n}") for n in range(4)
+        ]
+        assert parsed[4].document == "broken.xml" and parsed[4].error.startswith("Malformed XML")
+
+
+class TestImportEndpoint:
+    def test_imports_archive_through_normal_validation(self, client, db_session, auth_headers, sample_invoice_data):
+        invoice = stored_invoice(client, db_session, auth_headers, italian_invoice_data(sample_invoice_data))
+        document = generate_fatturapa_xml(invoice)
+        batch = fatturapa_batch([document.replace("INV-2024-001", f"INV-{n}") for n in range(2)])
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zipped:
+            zipped.writestr("batch.xml", batch)
+            zipped.writestr("no-number.xml", generate_ubl_xml(invoice).replace("<cbc:ID>INV-2024-001</cbc:ID>", ""))
+
+        response = client.post("/invoices/import", content=archive.getvalue(), headers=auth_headers)
+        assert response.status_code == 200
+        body = response.json()
+        assert len(body["invoice_ids"]) == 2
+        assert body["errors"] == [{"document": "no-number.xml", "index": 0, "errors": [
+            "external_id: Input should be a valid string", "invoice_number: Input should be a valid string"
+        ]}]
+
+        imported = client.get(f"/invoices/{body['invoice_ids'][1]}", headers=auth_headers).json()
+        assert (imported["invoice_number"], imported["status"], imported["total_amount"]) == (
+            "INV-1", "validated", "132.40"
+        )
+
+    def test_single_document(self, client, db_session, auth_headers, sample_invoice_data):
+        invoice = stored_invoice(client, db_session, auth_headers, italian_invoice_data(sample_invoice_data))
+
+        response = client.post("/invoices/import", content=generate_xrechnung_xml(invoice), headers=auth_headers)
+        [invoice_id] = response.json()["invoice_ids"]
+        assert db_session.get(Invoice, invoice_id).duplicate_of == invoice.id  # The same document, resent
@@ -0,0 +1,158 @@
+from datetime import datetime, timezone
+
+from app.archive import archive_invoices
+from app.invoice_cache import InvoiceResponseCache, RedisResponseStore, etag_matches, get_invoice_cache
+from app.models import Invoice, InvoiceStatus
+from app.receipts import ingest_receipts
+from app.storage import LocalBlobStore
+
+
+class StandInRedis:
+    """The slice of the redis client the shared layer uses"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def set(self, name, value, ex=None):
+        self.values[name] = value
+
+    def delete(self, *names):
+        for name in names:
+            self.values.pop(name, None)
+
+    def eval(self, script, numkeys, *args):
+        keys, argv = args[:numkeys], args[numkeys:]
+        if script == RedisResponseStore.SET_IF_CURRENT:
+            if self.values.get(keys[1], b"0").decode() != argv[0]:
+                return 0
+            self.values[keys[0]] = argv[1]
+            return 1
+        for name, version in zip(keys[::2], keys[1::2]):  # INVALIDATE
+            self.values.pop(name, None)
+            self.values[version] = str(int(self.values.get(version, b"0")) + 1).encode()
+        return len(keys) // 2
+
+
+def create_invoice(client, auth_headers, sample_invoice_data):
+    return client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+
+
+class TestInvoiceEndpointCaching:
+    def test_etag_revalidation(self, client, auth_headers, sample_invoice_data):
+        invoice_id = create_invoice(client, auth_headers, sample_invoice_data)["id"]
+
+        first = client.get(f"/invoices/{invoice_id}", headers=auth_headers)
+        etag = first.headers["ETag"]
+        assert first.headers["Cache-Control"] == "private, no-cache"
+
+        unchanged = client.get(f"/invoices/{invoice_id}", headers=auth_headers | {"If-None-Match": f"W/{etag}"})
+        assert unchanged.status_code == 304
+        assert unchanged.content == b""
+        assert unchanged.headers["ETag"] == etag
+
+        stale = client.get(f"/invoices/{invoice_id}", headers=auth_headers | {"If-None-Match": '"other"'})
+        assert stale.status_code == 200
+        assert stale.json() == first.json()
+        assert get_invoice_cache().local_hits == 2
+
+    def test_committed_changes_invalidate(self, client, db_session, auth_headers, sample_invoice_data):
+        invoice_id = create_invoice(client, auth_headers, sample_invoice_data)["id"]
+        before = client.get(f"/invoices/{invoice_id}", headers=auth_headers)
+
+        invoice = db_session.get(Invoice, invoice_id)
+        invoice.status = InvoiceStatus.FAILED
+        db_session.commit()
+        failed = client.get(f"/invoices/{invoice_id}", headers=auth_headers | {"If-None-Match": before.headers["ETag"]})
+        assert failed.status_code == 200
+        assert failed.json()["status"] == "failed"
+
+        client.post(f"/invoices/{invoice_id}/retry", headers=auth_headers)
+        assert client.get(f"/invoices/{invoice_id}", headers=auth_headers).json()["status"] == "validated"
+
+    def test_receipts_invalidate(self, client, db_session, auth_headers, sample_invoice_data):
+        invoice_id = create_invoice(client, auth_headers, sample_invoice_data)["id"]
+        invoice = db_session.get(Invoice, invoice_id)
+        invoice.status, invoice.submission_id = InvoiceStatus.SUBMITTED, "peppol-1"
+        db_session.commit()
+        assert client.get(f"/invoices/{invoice_id}", headers=auth_headers).json()["status"] == "submitted"
+
+        ingest_receipts(db_session, [b'{"submission_id": "peppol-1", "outcome": "ack"}'], "peppol")
+        assert client.get(f"/invoices/{invoice_id}", headers=auth_headers).json()["status"] == "accepted"
+
+    def test_archiving_invalidates(self, client, db_session, auth_headers, sample_invoice_data, tmp_path):
+        invoice_id = create_invoice(client, auth_headers, sample_invoice_data)["id"]
+        client.get(f"/invoices/{invoice_id}", headers=auth_headers)
+        tenant_id = db_session.get(Invoice, invoice_id).tenant_id
+        assert get_invoice_cache().get((tenant_id, invoice_id)) is not None
+
+        archive_invoices(db_session, LocalBlobStore(str(tmp_path)), datetime(2030, 1, 1, tzinfo=timezone.utc))
+        assert get_invoice_cache().get((tenant_id, invoice_id)) is None
+
+    def test_other_tenants_cannot_read_cached_invoice(self, client, auth_headers, sample_invoice_data):
+        invoice_id = create_invoice(client, auth_headers, sample_invoice_data)["id"]
+        client.get(f"/invoices/{invoice_id}", headers=auth_headers)
+
+        other_key = client.post("/tenants", json={"name": "Other"}).json()["api_key"]
+        response = client.get(f"/invoices/{invoice_id}", headers={"Authorization": f"Bearer {other_key}"})
+        assert response.status_code == 404
+
+
+class TestInvoiceResponseCache:
+    def test_workers_share_the_redis_layer(self):
+        now = [0.0]
+        redis = StandInRedis()
+        workers = [
+            InvoiceResponseCache(10, local_ttl=1.0, shared=RedisResponseStore("redis://", client=redis),
+                                 clock=lambda: now[0])
+            for _ in range(2)
+        ]
+        first = workers[0].load((1, 7), lambda: b'{"status": "submitted"}')
+        assert workers[1].load((1, 7), lambda: b"unused") == first
+        assert workers[1].shared_hits == 1
+
+        workers[0].invalidate([(1, 7)])
+        assert "invoice:1:7" not in redis.values
+        assert workers[1].get((1, 7)) == first  # Still fresh in the other worker's local layer
+        now[0] = 1.0
+        assert workers[1].load((1, 7), lambda: b'{"status": "accepted"}').body == b'{"status": "accepted"}'
+
+    def test_response_loaded_across_an_invalidation_is_not_cached(self):
+        cache = InvoiceResponseCache(10, local_ttl=60)
+
+        def slow_read():
+            cache.invalidate([(1, 7)])  # A commit lands while the old row is being rendered
+            return b"old"
+
+        assert cache.load((1, 7), slow_read).body == b"old"
+        assert cache.get((1, 7)) is None
+
+    def test_response_loaded_across_another_workers_invalidation_is_not_cached(self):
+        redis = StandInRedis()
+        workers = [InvoiceResponseCache(10, local_ttl=60, shared=RedisResponseStore("redis://", client=redis))
+                   for _ in range(2)]
+
+        def slow_read():
+            workers[1].invalidate([(1, 7)])  # Another worker commits while the old row is being rendered
+            return b"old"
+
+        assert workers[0].load((1, 7), slow_read).body == b"old"
+        assert "invoice:1:7" not in redis.values
+        assert workers[0].get((1, 7)) is None
+        assert workers[0].load((1, 7), lambda: b"new").body == b"new"
+        assert workers[1].load((1, 7), lambda: b"unused").body == b"new"
+
+    def test_local_layer_is_bounded(self):
+        cache = InvoiceResponseCache(2, local_ttl=60)
+        for invoice_id in range(3):
+            cache.load((1, invoice_id), lambda: b"{}")
+        assert cache.get((1, 0)) is None
+        assert cache.get((1, 2)) is not None
+
+    def test_etag_matching(self):
+        assert etag_matches('"a", W/"b"', '"b"')
+        assert etag_matches("*", '"b"')
+        assert not etag_matches(None, '"b"')
+        assert not etag_matches('"a"', '"b"')
@@ -1,6 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
-from app.models import Tenant, Invoice, InvoiceStatus
+from app.config import settings
+from app.models import ApiKey, Tenant, Invoice, InvoiceStatus
 
 
 class TestHealthCheck:
@@ -39,6 +40,43 @@ class TestTenantEndpoints:
         assert data["name"] == tenant_data["name"]
         assert data["webhook_url"] is None
 
+    def test_created_tenant_key_authenticates(self, client: TestClient, db_session, sample_invoice_data: dict):
+        api_key = client.post("/tenants", json={"name": "Hashed Key Company"}).json()["api_key"]
+        
+        tenant = db_session.query(Tenant).filter(Tenant.name == "Hashed Key Company").one()
+        assert db_session.query(ApiKey).filter(ApiKey.tenant_id == tenant.id).count() == 1
+        
+        response = client.post("/invoices", json=sample_invoice_data, headers={"Authorization": f"Bearer {api_key}"})
+        assert response.status_code == 200
+
+    def test_rotate_api_key(self, client: TestClient):
+        old_key = client.post("/tenants", json={"name": "Rotating Company"}).json()["api_key"]
+        
+        response = client.post("/tenants/api-keys/rotate", headers={"Authorization": f"Bearer {old_key}"})
+        assert response.status_code == 200
+        new_key = response.json()["api_key"]
+        assert new_key != old_key
+        assert "previous_keys_expire_at" in response.json()
+        
+        for key in (old_key, new_key):
+            assert client.get("/invoices", headers={"Authorization": f"Bearer {key}"}).status_code == 200
+
+    def test_rotation_overlap_is_bounded(self, client: TestClient, auth_headers: dict):
+        for overlap_hours in (settings.api_key_rotation_max_overlap_hours + 1, 10 ** 12):
+            response = client.post("/tenants/api-keys/rotate", params={"overlap_hours": overlap_hours},
+                                   headers=auth_headers)
+            assert response.status_code == 422
+
+    def test_issue_and_revoke_access_token(self, client: TestClient, auth_headers: dict):
+        response = client.post("/auth/token", headers=auth_headers)
+        assert response.status_code == 200
+        token = response.json()["access_token"]
+        jwt_headers = {"Authorization": f"Bearer {token}"}
+        
+        assert client.get("/invoices", headers=jwt_headers).status_code == 200
+        assert client.post("/auth/revoke", headers=jwt_headers).status_code == 204
+        assert client.get("/invoices", headers=jwt_headers).status_code == 401
+
     def test_create_tenant_missing_name(self, client: TestClient):
         tenant_data = {"webhook_url": "https://example.com/webhook"}
         response = client.post("/tenants", json=tenant_data)
@@ -7,7 +7,6 @@ class TestTenantModel:
     def test_create_tenant(self, db_session):
         tenant = Tenant(
             name="Test Company",
-            api_key="test_key_123",
             webhook_url="https://example.com/webhook"
         )
         db_session.add(tenant)
@@ -16,15 +15,13 @@ class TestTenantModel:
         
         assert tenant.id is not None
         assert tenant.name == "Test Company"
-        assert tenant.api_key == "test_key_123"
         assert tenant.webhook_url == "https://example.com/webhook"
         assert tenant.is_active is True
         assert tenant.created_at is not None
 
     def test_tenant_without_webhook(self, db_session):
         tenant = Tenant(
-            name="Simple Company",
-            api_key="simple_key_123"
+            name="Simple Company"
         )
         db_session.add(tenant)
         db_session.commit()
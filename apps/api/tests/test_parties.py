@@ -0,0 +1,105 @@
+from datetime import datetime, timezone
+
+from lxml import etree
+
+from app.archive import archive_record
+from app.compliance import generate_fatturapa_xml, generate_ubl_xml
+from app.exports import export_lines, stream_invoice_rows
+from app.facturx import generate_cii_xml
+from app.models import CountryCode, ExportJob, Invoice, Party, Tenant
+from app.parties import FragmentCache, fragment_cache, get_or_create_party, party_hash
+
+UBL = {"cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+       "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"}
+
+
+def create(client, auth_headers, data, external_id):
+    response = client.post("/invoices", json=dict(data, external_id=external_id), headers=auth_headers)
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+class TestPartyStorage:
+    def test_invoices_share_one_row_per_distinct_party(self, client, auth_headers, sample_invoice_data,
+                                                       db_session):
+        first = create(client, auth_headers, sample_invoice_data, "a")
+        second = create(client, auth_headers, sample_invoice_data, "b")
+        sample_invoice_data["customer"]["name"] = "Renamed Customer GmbH"
+        third = create(client, auth_headers, sample_invoice_data, "c")
+
+        invoices = [db_session.get(Invoice, invoice_id) for invoice_id in (first, second, third)]
+        assert db_session.query(Party).count() == 3
+        assert len({invoice.supplier_id for invoice in invoices}) == 1
+        assert invoices[0].customer_id == invoices[1].customer_id != invoices[2].customer_id
+        # Earlier invoices keep the details they were issued with
+        assert invoices[0].customer_data["name"] == "Test Customer GmbH"
+        assert invoices[2].customer_data["name"] == "Renamed Customer GmbH"
+        assert invoices[0].legacy_supplier_data is None
+
+    def test_parties_are_per_tenant(self, db_session, sample_tenant):
+        other = Tenant(name="Other")
+        db_session.add(other)
+        db_session.commit()
+        data = {"name": "Shared", "vat_id": "DE123456789"}
+
+        party = get_or_create_party(db_session, sample_tenant.id, data)
+        assert get_or_create_party(db_session, sample_tenant.id, dict(reversed(data.items()))).id == party.id
+        assert get_or_create_party(db_session, other.id, data).id != party.id
+        assert party.content_hash == party_hash(data)
+
+    def test_legacy_inline_parties_are_still_read(self, db_session, sample_tenant):
+        invoice = Invoice(
+            external_id="legacy", tenant_id=sample_tenant.id, country_code=CountryCode.DE, invoice_number="L-1",
+            issue_date=datetime(2024, 1, 15, tzinfo=timezone.utc), subtotal="100.00", tax_amount="19.00",
+            total_amount="119.00", supplier_data={"name": "Inline", "vat_id": "DE1"},
+            customer_data={"name": "Buyer"}, line_items=[{"description": "x"}]
+        )
+        db_session.add(invoice)
+        db_session.commit()
+
+        assert invoice.supplier_id is None and invoice.supplier_data["name"] == "Inline"
+        assert archive_record(invoice)["supplier_data"] == {"name": "Inline", "vat_id": "DE1"}
+
+    def test_exports_and_archive_resolve_stored_parties(self, client, auth_headers, sample_invoice_data,
+                                                        db_session, sample_tenant):
+        invoice = db_session.get(Invoice, create(client, auth_headers, sample_invoice_data, "a"))
+        record = archive_record(invoice)
+        assert record["customer_data"]["name"] == "Test Customer GmbH"
+        assert "supplier_id" not in record and "legacy_supplier_data" not in record
+
+        job = ExportJob(tenant_id=sample_tenant.id)
+        db_session.add(job)
+        db_session.commit()
+        (line,) = export_lines(stream_invoice_rows(db_session, job))
+        assert line[8:12] == ("Test Supplier Ltd", "DE123456789", "Test Customer GmbH", "DE987654321")
+
+
+class TestPartyFragments:
+    def test_fragments_are_rendered_once_per_party(self, client, auth_headers, sample_invoice_data, db_session):
+        ids = [create(client, auth_headers, sample_invoice_data, f"inv-{n}") for n in range(3)]
+        fragment_cache.clear()
+
+        documents = [generate_ubl_xml(db_session.get(Invoice, invoice_id)) for invoice_id in ids]
+        assert fragment_cache.misses == 2 and fragment_cache.hits == 4
+        assert documents[0].replace("inv-0", "") == documents[1].replace("inv-1", "")
+
+    def test_party_values_are_escaped(self, client, auth_headers, sample_invoice_data, db_session):
+        sample_invoice_data["supplier"]["name"] = "Dupont & <Fils>"
+        invoice = db_session.get(Invoice, create(client, auth_headers, sample_invoice_data, "a"))
+
+        root = etree.fromstring(generate_ubl_xml(invoice).encode())
+        assert root.findtext("cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name",
+                             namespaces=UBL) == "Dupont & <Fils>"
+        fattura = etree.fromstring(generate_fatturapa_xml(invoice).encode())
+        assert fattura.findtext(".//CedentePrestatore//Denominazione") == "Dupont & <Fils>"
+        assert b"Dupont &amp; &lt;Fils&gt;" in generate_cii_xml(invoice).encode()
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = FragmentCache(maxsize=2)
+        cache.get(("a", "ubl"), lambda: "A")
+        cache.get(("b", "ubl"), lambda: "B")
+        cache.get(("a", "ubl"), lambda: "stale")
+        cache.get(("c", "ubl"), lambda: "C")
+
+        assert cache.get(("a", "ubl"), lambda: "new") == "A"
+        assert cache.get(("b", "ubl"), lambda: "B2") == "B2"
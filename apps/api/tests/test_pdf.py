@@ -0,0 +1,204 @@
+import asyncio
+import glob
+import os
+import re
+import zlib
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from lxml import etree
+
+from app import pdf
+from app.canonical import canonicalize
+from app.config import settings
+from app.facturx import generate_cii_xml
+from app.models import Invoice
+from app.pdf import FACTURX_FILENAME, PdfAssets, TrueTypeFont, render_invoice_pdf, srgb_icc_profile
+from app.rendering import PdfRenderer, invoice_snapshot
+from app.storage import get_blob_store
+
+CII = {
+    "rsm": "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100",
+    "ram": "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100",
+}
+
+
+def find_font():
+    candidates = [os.environ.get("PDF_TEST_FONT")] + sorted(glob.glob("/usr/share/fonts/**/*.ttf", recursive=True))
+    return next((path for path in candidates if path), None)
+
+
+def snapshot(lines=2, **overrides):
+    data = {
+        "invoice_number": "FX-2024-001",
+        "country_code": "FR",
+        "issue_date": datetime(2024, 3, 1, tzinfo=timezone.utc),
+        "due_date": datetime(2024, 3, 31, tzinfo=timezone.utc),
+        "currency": "EUR",
+        "supplier_data": {"name": "Dupont & Fils", "vat_id": "FR40303265045", "address": "1 rue de la Paix",
+                          "city": "Paris", "postal_code": "75002", "country": "France"},
+        "customer_data": {"name": "Käufer GmbH", "vat_id": None, "address": "Hauptstr. 1",
+                          "city": "Berlin", "postal_code": "10115", "country": "DE"},
+        "line_items": [
+            {"description": f"Service {i}", "quantity": 1.0, "unit_price": "100.00",
+             "tax_rate": 20.0 if i % 2 == 0 else 5.5, "tax_amount": "20.00" if i % 2 == 0 else "5.50",
+             "line_total": "100.00"}
+            for i in range(lines)
+        ],
+        "subtotal": f"{100 * lines}.00",
+        "tax_amount": "25.50",
+        "total_amount": f"{100 * lines + 25.5:.2f}",
+    }
+    data.update(overrides)
+    return data
+
+
+def xref_objects(document: bytes):
+    """Map object numbers to their bodies using the cross-reference table"""
+    start = int(document.rsplit(b"startxref", 1)[1].split()[0])
+    lines = document[start:].split(b"\n")
+    assert lines[0] == b"xref"
+    count = int(lines[1].split()[1])
+    objects = {}
+    for number, entry in enumerate(lines[3:3 + count - 1], 1):
+        offset = int(entry[:10])
+        assert document[offset:].startswith(b"%d 0 obj\n" % number)
+        objects[number] = document[offset:document.index(b"\nendobj", offset)]
+    return objects
+
+
+def stream_data(body: bytes) -> bytes:
+    data = body.split(b"stream\n", 1)[1].rsplit(b"\nendstream", 1)[0]
+    return zlib.decompress(data) if b"/FlateDecode" in body else data
+
+
+class TestFacturxXml:
+    def test_cii_document_structure_and_totals(self):
+        invoice = SimpleNamespace(**snapshot(lines=3))
+        root = etree.fromstring(generate_cii_xml(invoice).encode())
+
+        assert root.tag == f"{{{CII['rsm']}}}CrossIndustryInvoice"
+        assert root.findtext(".//rsm:ExchangedDocument/ram:ID", namespaces=CII) == "FX-2024-001"
+        assert len(root.findall(".//ram:IncludedSupplyChainTradeLineItem", CII)) == 3
+        summary = root.find(".//ram:SpecifiedTradeSettlementHeaderMonetarySummation", CII)
+        assert summary.findtext("ram:TaxBasisTotalAmount", namespaces=CII) == "300.00"
+        assert summary.findtext("ram:GrandTotalAmount", namespaces=CII) == "325.50"
+        assert summary.find("ram:TaxTotalAmount", CII).get("currencyID") == "EUR"
+
+    def test_tax_breakdown_per_rate(self):
+        items = snapshot(lines=3)["line_items"]
+        subtotals = canonicalize(items).tax_subtotals
+        assert [(s.rate, str(s.taxable_amount), str(s.tax_amount)) for s in subtotals] == [
+            ("20", "200.00", "40.00"), ("5.5", "100.00", "5.50")
+        ]
+        root = etree.fromstring(generate_cii_xml(SimpleNamespace(**snapshot(lines=3))).encode())
+        header_taxes = root.findall(".//ram:ApplicableHeaderTradeSettlement/ram:ApplicableTradeTax", CII)
+        assert [t.findtext("ram:RateApplicablePercent", namespaces=CII) for t in header_taxes] == ["20", "5.5"]
+
+    def test_party_text_is_escaped_and_countries_are_iso_codes(self):
+        root = etree.fromstring(generate_cii_xml(SimpleNamespace(**snapshot())).encode())
+        seller = root.find(".//ram:SellerTradeParty", CII)
+        assert seller.findtext("ram:Name", namespaces=CII) == "Dupont & Fils"
+        # "France" is free text, so the VAT ID prefix decides
+        assert seller.findtext(".//ram:CountryID", namespaces=CII) == "FR"
+        buyer = root.find(".//ram:BuyerTradeParty", CII)
+        assert buyer.findtext(".//ram:CountryID", namespaces=CII) == "DE"
+        assert buyer.find("ram:SpecifiedTaxRegistration", CII) is None
+
+
+class TestPdfWriter:
+    def test_pdfa3_structure_with_embedded_xml(self):
+        xml = generate_cii_xml(SimpleNamespace(**snapshot())).encode()
+        document = render_invoice_pdf(snapshot(), xml, PdfAssets())
+
+        assert document.startswith(b"%PDF-1.7\n%")
+        assert document.endswith(b"%%EOF\n")
+        objects = xref_objects(document)
+        catalog = next(body for body in objects.values() if b"/Type /Catalog" in body)
+        for key in (b"/OutputIntents", b"/GTS_PDFA1", b"/AF [", b"/EmbeddedFiles", b"/Metadata"):
+            assert key in catalog
+
+        embedded = next(body for body in objects.values() if b"/Type /EmbeddedFile" in body)
+        assert b"/Subtype /text#2Fxml" in embedded
+        assert stream_data(embedded) == xml
+        filespec = next(body for body in objects.values() if b"/Type /Filespec" in body)
+        assert b"/AFRelationship /Data" in filespec and FACTURX_FILENAME.encode() in filespec
+
+        metadata = stream_data(next(body for body in objects.values() if b"/Subtype /XML" in body))
+        assert b"<pdfaid:part>3</pdfaid:part>" in metadata
+        assert b"<fx:ConformanceLevel>EN 16931</fx:ConformanceLevel>" in metadata
+
+    def test_long_invoices_paginate(self):
+        document = render_invoice_pdf(snapshot(lines=120), b"<xml/>", PdfAssets())
+        objects = xref_objects(document)
+        pages = next(body for body in objects.values() if b"/Type /Pages" in body)
+        count = int(re.search(rb"/Count (\d+)", pages).group(1))
+        contents = [stream_data(objects[int(number)])
+                    for number in re.findall(rb"/Contents (\d+) 0 R", b"".join(objects.values()))]
+
+        assert count >= 3 and len(contents) == count
+        assert b"Page %d of %d" % (count, count) in contents[-1]
+
+    def test_icc_profile_header(self):
+        profile = srgb_icc_profile()
+        assert int.from_bytes(profile[:4], "big") == len(profile)
+        assert profile[12:24] == b"mntrRGB XYZ " and profile[36:40] == b"acsp"
+
+    @pytest.mark.skipif(find_font() is None, reason="no TrueType font available; set PDF_TEST_FONT")
+    def test_embedded_font_is_subset(self):
+        font = TrueTypeFont.load(find_font())
+        document = render_invoice_pdf(snapshot(), b"<xml/>", PdfAssets(font))
+        objects = xref_objects(document)
+
+        font_file = next(body for body in objects.values() if b"/Length1" in body)
+        program = stream_data(font_file)
+        subset = TrueTypeFont(program)
+        assert subset.widths == font.widths
+        assert len(program) < len(font.subset(range(32, 256)))
+        descriptor = next(body for body in objects.values() if b"/FontFile2" in body)
+        assert re.search(rb"/FontName /[A-Z]{6}\+", descriptor)
+
+
+class TestRendering:
+    def test_created_invoice_gets_pdf(self, client, auth_headers, sample_invoice_data, sample_tenant):
+        created = client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+
+        invoice = client.get(f"/invoices/{created['id']}", headers=auth_headers).json()
+        assert invoice["pdf_url"].endswith(f"invoice-{created['id']}.pdf")
+
+        response = client.get(f"/invoices/{created['id']}/pdf", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/pdf"
+        assert response.content.startswith(b"%PDF-1.7")
+        key = f"invoices/tenant={sample_tenant.id}/2024-01/invoice-{created['id']}.pdf"
+        assert get_blob_store().get(key) == response.content
+
+    def test_pdf_missing_when_rendering_disabled(self, client, auth_headers, sample_invoice_data, monkeypatch):
+        monkeypatch.setattr(settings, "pdf_rendering_enabled", False)
+        created = client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+        assert created["pdf_url"] is None
+
+        response = client.get(f"/invoices/{created['id']}/pdf", headers=auth_headers)
+        assert response.status_code == 404
+
+    def test_process_pool_renders_with_memory_ceiling(self):
+        renderer = PdfRenderer(workers=1, memory_limit_mb=settings.pdf_worker_memory_limit_mb,
+                               max_tasks_per_worker=10)
+
+        async def scenario():
+            documents = await asyncio.gather(*(renderer.render(snapshot(), b"<xml/>") for _ in range(4)))
+            return documents, await renderer.call(pdf.peak_rss_kb)
+
+        try:
+            documents, peak_kb = asyncio.run(scenario())
+        finally:
+            renderer.shutdown()
+        assert all(document.startswith(b"%PDF-1.7") for document in documents)
+        assert peak_kb < settings.pdf_worker_memory_limit_mb * 1024
+
+    def test_snapshot_is_plain_data(self, db_session, client, auth_headers, sample_invoice_data):
+        created = client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+        data = invoice_snapshot(db_session.get(Invoice, created["id"]))
+        assert data["invoice_number"] == sample_invoice_data["invoice_number"]
+        assert isinstance(data["line_items"], list)
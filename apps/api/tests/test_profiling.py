@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import event
+
+from app.config import settings
+from app.profiling import (
+    _LISTENERS, Profiler, ProfilerBusy, RequestTrace, SlowRequestTracer, format_folded, get_profiler, parse_folded,
+    phase
+)
+from app.rendering import PdfRenderer
+
+ADMIN = {"X-Admin-Token": "admin-secret"}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "admin-secret")
+    return ADMIN
+
+
+def listening() -> bool:
+    return any(event.contains(target, name, listener) for target, name, listener in _LISTENERS)
+
+
+class TestRequestTrace:
+    def test_phases_count_self_time_and_the_rest_is_other(self):
+        clock = FakeClock()
+        trace = RequestTrace(clock)
+        clock.now = 1.0
+        trace.enter("auth")
+        clock.now = 1.5
+        trace.enter("db")
+        clock.now = 3.5
+        trace.exit("db")
+        clock.now = 4.0
+        trace.exit("auth")
+        trace.exit("commit")  # Never entered: ignored
+        trace.enter("commit")
+        clock.now = 5.0
+
+        assert trace.finish() == 5.0
+        assert trace.phases == {"auth": 1.0, "db": 2.0, "validation": 0.0, "render": 0.0, "commit": 1.0,
+                                "other": 1.0}
+
+    def test_phase_is_a_no_op_outside_a_traced_request(self):
+        assert phase("auth") is phase("db")
+
+
+class TestSlowRequestTracer:
+    def test_listeners_attach_only_while_tracing(self):
+        clock = FakeClock()
+        tracer = SlowRequestTracer(10, clock)
+        assert not tracer.active and not listening()
+
+        tracer.start(threshold_ms=100, seconds=60)
+        assert tracer.active and listening()
+        clock.now = 60.0
+        assert not tracer.active and not listening()
+
+    def test_only_requests_over_the_threshold_are_kept(self):
+        clock = FakeClock()
+        tracer = SlowRequestTracer(1)
+        tracer.start(threshold_ms=1000)
+        scope = {"method": "GET", "path": "/invoices"}
+        for duration in (0.5, 2.0, 3.0):
+            trace = RequestTrace(clock)
+            clock.now += duration
+            tracer.record(scope, 200, trace)
+        assert [entry["duration_ms"] for entry in tracer.requests] == [3000.0]
+        tracer.stop()
+
+
+class TestSlowRequestEndpoints:
+    def test_traces_phases_of_slow_requests(self, client, auth_headers, sample_invoice_data, admin):
+        response = client.post("/admin/slow-requests/trace", params={"threshold_ms": 0, "seconds": 60},
+                               headers=admin)
+        assert response.json() == {"tracing": True, "threshold_ms": 0.0, "requests": []}
+
+        client.post("/invoices", json=sample_invoice_data, headers=auth_headers)
+        [created] = client.get("/admin/slow-requests", headers=admin).json()["requests"]
+        assert (created["method"], created["path"], created["status"]) == ("POST", "/invoices", 200)
+        for name in ("auth", "db", "validation", "render", "commit"):
+            assert created["phases_ms"][name] > 0, name
+        assert sum(created["phases_ms"].values()) == pytest.approx(created["duration_ms"], abs=0.01)
+
+        stopped = client.delete("/admin/slow-requests/trace", headers=admin).json()
+        assert not stopped["tracing"]
+        assert [entry["path"] for entry in stopped["requests"]] == ["/admin/slow-requests", "/invoices"]
+        assert not listening()
+
+    def test_admin_endpoints_need_the_admin_token(self, client, monkeypatch):
+        assert client.get("/admin/slow-requests", headers=ADMIN).status_code == 404  # No token configured
+        monkeypatch.setattr(settings, "admin_token", "admin-secret")
+        assert client.get("/admin/slow-requests").status_code == 401
+        assert client.get("/admin/slow-requests", headers={"X-Admin-Token": "guess"}).status_code == 401
+        assert client.get("/admin/slow-requests", headers=ADMIN).status_code == 200
+
+
+class TestSamplingProfiler:
+    def test_profile_is_folded_stacks_rooted_at_thread_names(self, client, admin):
+        stop = threading.Event()
+        busy = threading.Thread(target=stop.wait, name="busy-thread")
+        busy.start()
+        try:
+            response = client.get("/admin/profile", params={"seconds": 0.2, "interval_ms": 5}, headers=admin)
+        finally:
+            stop.set()
+            busy.join()
+
+        assert response.headers["content-type"].startswith("text/plain")
+        stacks = parse_folded(response.text)
+        assert format_folded(stacks) == response.text
+        roots = {stack.split(";")[0] for stack in stacks}
+        assert {"event-loop", "busy-thread"} <= roots
+        assert any(stack.startswith("busy-thread;") and "wait (threading.py" in stack for stack in stacks)
+
+    def test_one_profile_at_a_time(self):
+        profiler = Profiler()
+        started = threading.Thread(target=profiler.capture, args=(0.3, 0.01))
+        started.start()
+        time.sleep(0.05)
+        with pytest.raises(ProfilerBusy):
+            profiler.capture(0.1, 0.01)
+        started.join()
+
+    def test_rendering_workers_are_sampled(self):
+        profiler = get_profiler()
+        renderer = PdfRenderer(workers=1)
+        try:
+            renderer.executor.submit(time.sleep, 0).result()  # Worker started and its sampler running
+            renderer.executor.submit(time.sleep, 1.0)
+            stacks = profiler.capture(0.5, 0.01)
+        finally:
+            renderer.shutdown()
+
+        worker_stacks = [stack for stack in stacks if stack.startswith("pdf-worker-")]
+        assert worker_stacks and all("_process_worker" in stack for stack in worker_stacks)
+        assert "pdf-worker" not in profiler.workers
@@ -0,0 +1,165 @@
+import asyncio
+import gzip
+import json
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, insert, update
+from sqlalchemy.orm import sessionmaker
+
+from app import receipts
+from app.config import settings
+from app.database import Base
+from app.models import CountryCode, Invoice, InvoiceStatus, Tenant, WebhookEvent
+from app.receipts import ingest_receipt_stream, ingest_receipts, iter_lines, parse_receipt
+
+
+def submitted_invoices(db, tenant, count, status=InvoiceStatus.SUBMITTED):
+    db.execute(insert(Invoice), [
+        {
+            "external_id": f"ext-{i}", "tenant_id": tenant.id, "status": status,
+            "country_code": CountryCode.IT, "invoice_number": f"INV-{i}",
+            "issue_date": datetime(2024, 1, 15, tzinfo=timezone.utc),
+            "subtotal": "100.00", "tax_amount": "22.00", "total_amount": "122.00",
+            "legacy_supplier_data": {}, "legacy_customer_data": {}, "line_items": [],
+            "submission_id": f"sdi-{i}", "gateway_response": {"gateway": "sdi"},
+        }
+        for i in range(count)
+    ])
+    db.commit()
+
+
+def lines(*records):
+    return [json.dumps(record).encode() for record in records]
+
+
+class TestParsing:
+    def test_parse_receipt(self):
+        assert parse_receipt(b'{"submission_id": 42, "outcome": "ACK", "code": 0}') == (
+            "42", "ack", "0", None, None, False
+        )
+        assert parse_receipt(b'{"submission_id": "1", "outcome": "maybe"}') is None
+        assert parse_receipt(b'{"outcome": "ack"}') is None
+        assert parse_receipt(b"not json") is None
+
+    def test_iter_lines_rejoins_split_chunks(self):
+        async def body():
+            for chunk in (b'{"a": 1}\n{"b"', b': 2}\n', b'{"c": 3}'):
+                yield chunk
+
+        async def collect():
+            return [line async for line in iter_lines(body())]
+
+        assert asyncio.run(collect()) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+class TestIngestion:
+    def test_acks_and_nacks_update_invoices_and_emit_events(self, db_session, sample_tenant):
+        submitted_invoices(db_session, sample_tenant, 5)
+        stats = ingest_receipts(db_session, lines(
+            {"submission_id": "sdi-0", "outcome": "ack", "code": "RC"},
+            {"submission_id": "sdi-1", "outcome": "nack", "code": "NS", "message": "00404 Fattura duplicata"},
+            {"submission_id": "sdi-2", "outcome": "nack"},
+            {"submission_id": "sdi-2", "outcome": "ack"},
+            {"submission_id": "unknown", "outcome": "ack"},
+        ) + [b"{broken", b""], "sdi", batch_size=100)
+
+        assert vars(stats) == {"received": 6, "applied": 3, "unmatched": 1, "ignored": 1, "invalid": 1, "deferred": 0}
+        invoices = {i.submission_id: i for i in db_session.query(Invoice)}
+        assert invoices["sdi-0"].status == InvoiceStatus.ACCEPTED
+        assert invoices["sdi-0"].gateway_response["receipt"]["code"] == "RC"
+        assert invoices["sdi-0"].gateway_response["gateway"] == "sdi"
+        assert invoices["sdi-1"].status == InvoiceStatus.REJECTED
+        assert invoices["sdi-1"].error_message == "00404 Fattura duplicata"
+        assert invoices["sdi-2"].status == InvoiceStatus.ACCEPTED
+        assert invoices["sdi-3"].status == InvoiceStatus.SUBMITTED
+
+        events = db_session.query(WebhookEvent).order_by(WebhookEvent.id).all()
+        assert sorted(e.event_type for e in events) == ["invoice.accepted", "invoice.accepted", "invoice.rejected"]
+        assert all(e.tenant_id == sample_tenant.id for e in events)
+        assert events[0].payload["data"]["submission_id"] == "sdi-0"
+
+    def test_replayed_receipts_are_ignored(self, db_session, sample_tenant):
+        submitted_invoices(db_session, sample_tenant, 3)
+        batch = lines(*({"submission_id": f"sdi-{i}", "outcome": "ack"} for i in range(3)))
+        assert ingest_receipts(db_session, batch, "sdi", batch_size=2).applied == 3
+
+        replay = ingest_receipts(db_session, batch, "sdi", batch_size=2)
+        assert (replay.applied, replay.ignored) == (0, 3)
+        assert db_session.query(WebhookEvent).count() == 3
+
+    def test_invoice_settled_concurrently_is_ignored(self, tmp_path, monkeypatch):
+        engine = create_engine(f"sqlite:///{tmp_path / 'receipts.db'}")
+        Base.metadata.create_all(engine)
+        Sessions = sessionmaker(bind=engine, autoflush=False)
+        with Sessions() as db:
+            tenant = Tenant(name="Test Company")
+            db.add(tenant)
+            db.commit()
+            submitted_invoices(db, tenant, 1)
+
+        withdraw = receipts.withdraw_invoices_from_rollups
+
+        def accepted_meanwhile(session, invoice_ids):
+            # Another process applies an ACK after this chunk read the invoice as submitted
+            with Sessions() as other:
+                other.execute(update(Invoice).values(status=InvoiceStatus.ACCEPTED))
+                other.commit()
+            monkeypatch.setattr(receipts, "withdraw_invoices_from_rollups", withdraw)
+            withdraw(session, invoice_ids)
+
+        monkeypatch.setattr(receipts, "withdraw_invoices_from_rollups", accepted_meanwhile)
+        with Sessions() as db:
+            stats = ingest_receipts(db, lines({"submission_id": "sdi-0", "outcome": "nack"}), "sdi")
+            assert (stats.applied, stats.ignored) == (0, 1)
+            assert db.query(Invoice.status).scalar() == InvoiceStatus.ACCEPTED
+            assert db.query(WebhookEvent).count() == 0
+        engine.dispose()
+
+    def test_streamed_chunks_are_applied_off_the_event_loop(self, db_session, sample_tenant, monkeypatch):
+        submitted_invoices(db_session, sample_tenant, 3)
+        apply = receipts.apply_receipts
+        threads = []
+
+        def recording(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return apply(*args, **kwargs)
+
+        async def body():
+            yield b"\n".join(lines(*({"submission_id": f"sdi-{i}", "outcome": "ack"} for i in range(3))))
+
+        monkeypatch.setattr(receipts, "apply_receipts", recording)
+        stats = asyncio.run(ingest_receipt_stream(db_session, body(), "sdi", batch_size=2))
+        assert stats.applied == 3
+        assert len(threads) == 2 and threading.main_thread() not in threads
+
+    def test_file_cli_reads_gzip(self, db_session, sample_tenant, tmp_path, capsys, monkeypatch):
+        submitted_invoices(db_session, sample_tenant, 2)
+        path = tmp_path / "receipts.jsonl.gz"
+        with gzip.open(path, "wb") as f:
+            f.write(b"\n".join(lines({"submission_id": "sdi-0", "outcome": "ack"},
+                                     {"submission_id": "sdi-1", "outcome": "nack"})))
+        from tests.conftest import TestingSessionLocal
+        monkeypatch.setattr("app.database.SessionLocal", TestingSessionLocal)
+
+        receipts.main([str(path), "--gateway", "sdi"])
+        assert "2 receipts: 2 applied" in capsys.readouterr().out
+
+
+class TestCallbackEndpoint:
+    def test_streamed_body_is_applied(self, client, db_session, sample_tenant):
+        submitted_invoices(db_session, sample_tenant, 3)
+        body = b"\n".join(lines(*({"submission_id": f"sdi-{i}", "outcome": "ack"} for i in range(3))))
+        response = client.post("/gateways/sdi/receipts", content=body,
+                               headers={"X-Gateway-Token": settings.gateway_callback_token})
+
+        assert response.status_code == 200
+        assert response.json()["applied"] == 3
+        assert db_session.query(Invoice).filter(Invoice.status == InvoiceStatus.ACCEPTED).count() == 3
+
+    def test_requires_token_and_known_gateway(self, client):
+        response = client.post("/gateways/sdi/receipts", content=b"", headers={"X-Gateway-Token": "wrong"})
+        assert response.status_code == 401
+        response = client.post("/gateways/nowhere/receipts", content=b"",
+                               headers={"X-Gateway-Token": settings.gateway_callback_token})
+        assert response.status_code == 404
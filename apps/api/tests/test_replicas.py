@@ -0,0 +1,142 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, get_replica_db
+from app.main import app
+from app.exports import run_export
+from app.models import ExportJob, Invoice, InvoiceStatus, Tenant
+from app.receipts import ingest_receipts
+from app.replicas import RedisWriteMarks, WriteWindow, recent_writes
+from app.storage import LocalBlobStore
+from tests.test_exports import add_invoice, read_csv
+
+
+@pytest.fixture
+def replica_session(tmp_path, client, sample_tenant):
+    """A second SQLite database standing in for a replica that has not caught up"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    ReplicaSession = sessionmaker(bind=engine, autoflush=False)
+    with ReplicaSession() as db:
+        db.add(Tenant(id=sample_tenant.id, name=sample_tenant.name))
+        db.commit()
+
+    def override_get_replica_db():
+        db = ReplicaSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_replica_db] = override_get_replica_db
+    recent_writes.clear()
+    db = ReplicaSession()
+    yield db
+    db.close()
+    engine.dispose()
+
+
+class TestWriteWindow:
+    def test_window_closes_after_configured_seconds(self):
+        now = [100.0]
+        window = WriteWindow(seconds=lambda: 5.0, clock=lambda: now[0])
+        window.mark(7)
+        assert window.active(7) and not window.active(8)
+        now[0] = 105.0
+        assert not window.active(7)
+
+    def test_redis_shares_the_window_between_processes(self):
+        keys = {}
+
+        class StandInRedis:
+            def set(self, name, value, px=None):
+                keys[name] = px
+
+            def exists(self, name):
+                return int(name in keys)
+
+        shared = RedisWriteMarks("redis://", client=StandInRedis())
+        writer, reader = (WriteWindow(seconds=lambda: 5.0, shared=lambda: shared) for _ in range(2))
+        writer.mark(7)
+        assert keys == {"ryw:7": 5000}
+        assert reader.active(7) and not reader.active(8)
+
+    def test_unreachable_redis_reads_from_primary(self):
+        window = WriteWindow(shared=lambda: RedisWriteMarks("redis://", client=object()))
+        window.mark(7)  # Still opens the local window
+        assert window.active(7) and window.active(8)
+
+    def test_receipts_open_window(self, db_session, sample_tenant):
+        add_invoice(db_session, sample_tenant, 1)
+        invoice = db_session.query(Invoice).one()
+        invoice.status, invoice.submission_id = InvoiceStatus.SUBMITTED, "peppol-1"
+        db_session.commit()
+        recent_writes.clear()
+
+        ingest_receipts(db_session, [b'{"submission_id": "peppol-1", "outcome": "ack"}'], "peppol")
+        assert recent_writes.active(sample_tenant.id)
+
+    def test_commit_opens_window_and_rollback_does_not(self, db_session, sample_tenant):
+        recent_writes.clear()
+        add_invoice(db_session, sample_tenant, 1)
+        assert recent_writes.active(sample_tenant.id)
+
+        recent_writes.clear()
+        db_session.add(ExportJob(tenant_id=sample_tenant.id))
+        db_session.flush()
+        db_session.rollback()
+        assert not recent_writes.active(sample_tenant.id)
+
+
+class TestReadRouting:
+    def test_reads_go_to_replica_outside_write_window(self, client, db_session, sample_tenant, auth_headers,
+                                                      replica_session):
+        add_invoice(replica_session, sample_tenant, "R")
+        add_invoice(db_session, sample_tenant, "P")
+        recent_writes.clear()
+
+        listed = client.get("/invoices", headers=auth_headers).json()
+        assert [invoice["invoice_number"] for invoice in listed] == ["INV-R"]
+
+    def test_tenant_reads_its_own_writes_from_primary(self, client, sample_tenant, auth_headers,
+                                                      sample_invoice_data, replica_session):
+        created = client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+
+        response = client.get(f"/invoices/{created['id']}", headers=auth_headers)
+        assert response.status_code == 200
+
+        recent_writes.clear()  # Window elapsed; the lagging replica has not seen the invoice
+        assert client.get("/invoices", headers=auth_headers).json() == []
+
+    def test_invoice_cache_is_filled_from_primary(self, client, db_session, sample_tenant, auth_headers,
+                                                  replica_session):
+        add_invoice(replica_session, sample_tenant, "P")  # The replica has not replayed the outcome yet
+        add_invoice(db_session, sample_tenant, "P")
+        invoice = db_session.query(Invoice).one()
+        invoice.status = InvoiceStatus.ACCEPTED
+        db_session.commit()
+        recent_writes.clear()
+
+        for _ in range(2):
+            response = client.get(f"/invoices/{invoice.id}", headers=auth_headers)
+            assert response.json()["status"] == "accepted"
+
+    def test_strong_consistency_header_forces_primary(self, client, db_session, sample_tenant, auth_headers,
+                                                     replica_session):
+        add_invoice(db_session, sample_tenant, "P")
+        recent_writes.clear()
+
+        listed = client.get("/invoices", headers=auth_headers | {"X-Read-Consistency": "strong"}).json()
+        assert [invoice["invoice_number"] for invoice in listed] == ["INV-P"]
+
+    def test_export_rows_stream_from_replica(self, db_session, sample_tenant, replica_session, tmp_path):
+        store = LocalBlobStore(str(tmp_path / "exports"))
+        add_invoice(replica_session, sample_tenant, "R", lines=3)
+        job = ExportJob(tenant_id=sample_tenant.id)
+        db_session.add(job)
+        db_session.commit()
+
+        job = run_export(db_session, job.id, store, replica_session)
+        assert job.row_count == 3
+        assert {row[2] for row in read_csv(store.get(job.object_key))[1:]} == {"INV-R"}
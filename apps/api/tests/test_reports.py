@@ -0,0 +1,175 @@
+import asyncio
+from datetime import datetime, timezone
+
+from app.models import Invoice, InvoiceStatus, CountryCode, VatRollup
+from app.gateways import get_gateway_registry, submit_invoice
+from app.receipts import ingest_receipts
+from app.reports import (
+    apply_invoice_to_rollups, normalize_rate, rebuild_vat_rollups, to_cents, from_cents, withdraw_invoice_from_rollups
+)
+
+
+def make_invoice(tenant, status=InvoiceStatus.VALIDATED, issue_date=datetime(2024, 2, 10, tzinfo=timezone.utc)):
+    return Invoice(
+        external_id="EXT-1",
+        tenant_id=tenant.id,
+        invoice_number="INV-1",
+        country_code=CountryCode.IT,
+        status=status,
+        issue_date=issue_date,
+        subtotal="150.00",
+        tax_amount="27.00",
+        total_amount="177.00",
+        supplier_data={},
+        customer_data={},
+        line_items=[
+            {"description": "A", "quantity": 1, "unit_price": "100.00", "tax_rate": 22.0,
+             "tax_amount": "22.00", "line_total": "100.00"},
+            {"description": "B", "quantity": 1, "unit_price": "50.00", "tax_rate": 10,
+             "tax_amount": "5.00", "line_total": "50.00"},
+        ]
+    )
+
+
+def rollups(db_session):
+    return {
+        (r.year, r.month, r.tax_rate): (r.taxable_base_cents, r.tax_cents, r.invoice_count)
+        for r in db_session.query(VatRollup)
+    }
+
+
+class TestRollupHelpers:
+    def test_cents_roundtrip(self):
+        assert to_cents("19.995") == 2000
+        assert from_cents(to_cents("1234.5")) == "1234.50"
+
+    def test_normalize_rate(self):
+        assert normalize_rate(22.0) == "22"
+        assert normalize_rate(0.19) == "0.19"
+        assert normalize_rate("10.50") == "10.5"
+
+
+class TestIncrementalRollups:
+    def test_applies_once_per_invoice(self, db_session, sample_tenant):
+        invoice = make_invoice(sample_tenant)
+        db_session.add(invoice)
+        db_session.flush()
+
+        assert apply_invoice_to_rollups(db_session, invoice) is True
+        assert apply_invoice_to_rollups(db_session, invoice) is False
+        db_session.commit()
+
+        assert rollups(db_session) == {
+            (2024, 2, "22"): (10000, 2200, 1),
+            (2024, 2, "10"): (5000, 500, 1),
+        }
+
+    def test_accumulates_across_invoices(self, db_session, sample_tenant):
+        for _ in range(3):
+            invoice = make_invoice(sample_tenant)
+            db_session.add(invoice)
+            db_session.flush()
+            apply_invoice_to_rollups(db_session, invoice)
+        db_session.commit()
+
+        assert rollups(db_session)[(2024, 2, "22")] == (30000, 6600, 3)
+
+    def test_skips_non_reportable_status(self, db_session, sample_tenant):
+        invoice = make_invoice(sample_tenant, status=InvoiceStatus.FAILED)
+        db_session.add(invoice)
+        db_session.flush()
+        assert apply_invoice_to_rollups(db_session, invoice) is False
+
+    def test_rebuild_matches_incremental(self, db_session, sample_tenant):
+        for status in (InvoiceStatus.VALIDATED, InvoiceStatus.ACCEPTED, InvoiceStatus.REJECTED):
+            invoice = make_invoice(sample_tenant, status=status)
+            db_session.add(invoice)
+            db_session.flush()
+            apply_invoice_to_rollups(db_session, invoice)
+        db_session.commit()
+        incremental = rollups(db_session)
+
+        assert rebuild_vat_rollups(db_session, sample_tenant.id) == 2
+        assert rollups(db_session) == incremental
+        flags = {inv.status: inv.vat_reported for inv in db_session.query(Invoice)}
+        assert flags[InvoiceStatus.REJECTED] is False
+        assert flags[InvoiceStatus.ACCEPTED] is True
+
+    def test_nack_withdraws_and_matches_rebuild(self, db_session, sample_tenant):
+        for number in range(2):
+            invoice = make_invoice(sample_tenant, status=InvoiceStatus.SUBMITTED)
+            invoice.submission_id = f"peppol-{number}"
+            db_session.add(invoice)
+            db_session.flush()
+            apply_invoice_to_rollups(db_session, invoice)
+        db_session.commit()
+
+        ingest_receipts(db_session, [b'{"submission_id": "peppol-0", "outcome": "nack"}'], "peppol")
+        incremental = rollups(db_session)
+        assert incremental[(2024, 2, "22")] == (10000, 2200, 1)
+
+        rebuild_vat_rollups(db_session, sample_tenant.id)
+        assert rollups(db_session) == incremental
+        flags = {inv.submission_id: inv.vat_reported for inv in db_session.query(Invoice)}
+        assert flags == {"peppol-0": False, "peppol-1": True}
+
+    def test_failed_submission_withdraws_and_resubmission_counts_again(self, db_session, sample_tenant):
+        invoice = make_invoice(sample_tenant)
+        invoice.country_code = CountryCode.DE
+        party = {"address": "Hauptstr. 1", "city": "Berlin", "postal_code": "10115", "country": "DE"}
+        invoice.supplier_data = party | {"name": "S", "vat_id": "DE123456789"}
+        invoice.customer_data = party | {"name": "C", "vat_id": "DE987654321"}
+        db_session.add(invoice)
+        db_session.flush()
+        apply_invoice_to_rollups(db_session, invoice)
+        db_session.commit()
+        registry = get_gateway_registry()
+
+        registry.for_country("DE").adapter.down = True
+        asyncio.run(submit_invoice(db_session, invoice, registry))
+        db_session.commit()
+        assert invoice.status == InvoiceStatus.FAILED and rollups(db_session) == {}
+        assert withdraw_invoice_from_rollups(db_session, invoice) is False  # Only once
+
+        registry.for_country("DE").adapter.down = False
+        asyncio.run(submit_invoice(db_session, invoice, registry))
+        db_session.commit()
+        assert invoice.status == InvoiceStatus.SUBMITTED
+        assert rollups(db_session)[(2024, 2, "22")] == (10000, 2200, 1)
+
+
+class TestVatReportEndpoint:
+    def test_report_from_created_invoices(self, client, auth_headers, sample_invoice_data):
+        client.post("/invoices", json=sample_invoice_data, headers=auth_headers)
+        client.post("/invoices", json=sample_invoice_data, headers=auth_headers)
+
+        response = client.get("/reports/vat?year=2024&quarter=1", headers=auth_headers)
+        assert response.status_code == 200
+        lines = response.json()["lines"]
+        assert lines == [{
+            "country_code": "DE",
+            "tax_rate": "0.19",
+            "currency": "EUR",
+            "taxable_base": "238.00",
+            "tax_amount": "38.00",
+            "invoice_count": 2,
+        }]
+
+    def test_report_other_period_is_empty(self, client, auth_headers, sample_invoice_data):
+        client.post("/invoices", json=sample_invoice_data, headers=auth_headers)
+        response = client.get("/reports/vat?year=2024&month=2", headers=auth_headers)
+        assert response.json()["lines"] == []
+
+    def test_report_rejects_quarter_and_month(self, client, auth_headers):
+        response = client.get("/reports/vat?year=2024&quarter=1&month=2", headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_retry_counts_invoice_once(self, client, auth_headers, sample_invoice_data, db_session):
+        invoice_id = client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()["id"]
+        invoice = db_session.get(Invoice, invoice_id)
+        invoice.status = InvoiceStatus.REJECTED
+        db_session.commit()
+
+        client.post(f"/invoices/{invoice_id}/retry", headers=auth_headers)
+        lines = client.get("/reports/vat?year=2024", headers=auth_headers).json()["lines"]
+        assert lines[0]["invoice_count"] == 1
@@ -0,0 +1,163 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, insert, text
+
+from app.config import settings
+from app.gateways import get_gateway_registry
+from app.models import CountryCode, Invoice, InvoiceStatus
+from app.receipts import ingest_receipts
+from app.retries import claim_due_invoices, next_attempt_time, retry_delay, retry_invoices, run_retry_batch
+
+NOW = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+PARTY = {"address": "Hauptstr. 1", "city": "Berlin", "postal_code": "10115", "country": "DE"}
+
+
+def failed_invoices(db, tenant, count, due=NOW, country=CountryCode.DE, retry_count=0):
+    db.execute(insert(Invoice), [
+        {
+            "external_id": f"ext-{i}", "tenant_id": tenant.id, "status": InvoiceStatus.FAILED,
+            "country_code": country, "invoice_number": f"INV-{i}",
+            "issue_date": datetime(2024, 1, 15, tzinfo=timezone.utc),
+            "subtotal": "100.00", "tax_amount": "19.00", "total_amount": "119.00",
+            "legacy_supplier_data": PARTY | {"name": "S", "vat_id": "DE123456789"},
+            "legacy_customer_data": PARTY | {"name": "C", "vat_id": "DE987654321"},
+            "line_items": [{"description": "x", "quantity": 1.0, "unit_price": "100.00", "tax_rate": 19.0,
+                            "tax_amount": "19.00", "line_total": "100.00"}],
+            "gateway_response": {"gateway": "peppol", "retriable": True},
+            "retry_count": retry_count, "next_attempt_at": due - timedelta(seconds=i),
+        }
+        for i in range(count)
+    ])
+    db.commit()
+
+
+class TestBackoff:
+    def test_delay_grows_per_gateway_and_is_capped(self):
+        rng = random.Random(0)
+        peppol = [retry_delay("peppol", n, rng).total_seconds() for n in range(3)]
+        assert 30 <= peppol[0] <= 60 and 60 <= peppol[1] <= 120 and 120 <= peppol[2] <= 240
+        assert retry_delay("sdi", 0, rng) >= timedelta(seconds=300)
+        assert retry_delay("sdi", 30, rng).total_seconds() <= settings.retry_backoff_max_seconds
+
+    def test_no_retry_when_permanent_or_exhausted(self):
+        assert next_attempt_time("peppol", 0, retriable=False, now=NOW) is None
+        assert next_attempt_time("peppol", settings.retry_max_attempts, retriable=True, now=NOW) is None
+        assert next_attempt_time("peppol", 1, retriable=True, now=NOW) > NOW
+
+
+class TestClaiming:
+    def test_claims_due_invoices_oldest_first_and_leases_them(self, db_session, sample_tenant):
+        failed_invoices(db_session, sample_tenant, 5)
+        failed_invoices(db_session, sample_tenant, 1, due=NOW + timedelta(hours=1))
+
+        first = claim_due_invoices(db_session, 3, now=NOW)
+        second = claim_due_invoices(db_session, 3, now=NOW)
+        assert len(first) == 3 and len(second) == 2 and not set(first) & set(second)
+        assert claim_due_invoices(db_session, 3, now=NOW) == []
+        # An expired lease makes the invoices due again
+        assert len(claim_due_invoices(db_session, 10, now=NOW + timedelta(hours=2))) == 6
+
+    def test_due_query_uses_the_index(self, db_session):
+        plan = db_session.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM invoices WHERE next_attempt_at <= :now "
+            "ORDER BY next_attempt_at LIMIT 10"
+        ), {"now": NOW}).all()
+        assert "ix_invoices_next_attempt_at" in " ".join(row[-1] for row in plan)
+
+
+class TestRetrying:
+    def test_successful_retry_submits_and_counts_the_attempt(self, db_session, sample_tenant):
+        failed_invoices(db_session, sample_tenant, 3, due=datetime.now(timezone.utc))
+        claimed = asyncio.run(run_retry_batch(db_session, get_gateway_registry(), batch_size=10))
+
+        assert claimed == 3
+        for invoice in db_session.query(Invoice):
+            assert invoice.status == InvoiceStatus.SUBMITTED
+            assert invoice.retry_count == 1 and invoice.next_attempt_at is None
+
+    def test_each_outcome_is_committed_as_soon_as_it_arrives(self, db_session, sample_tenant, monkeypatch):
+        failed_invoices(db_session, sample_tenant, 1)
+        failed_invoices(db_session, sample_tenant, 1, country=CountryCode.IT)
+        ids = [invoice.id for invoice in db_session.query(Invoice).order_by(Invoice.id)]
+
+        async def hang(document):
+            await asyncio.Event().wait()
+
+        registry = get_gateway_registry()
+        monkeypatch.setattr(registry.for_country("IT"), "submit", hang)
+
+        async def worker_dies():
+            try:
+                await asyncio.wait_for(retry_invoices(db_session, ids, registry, now=NOW), 0.5)
+            except asyncio.TimeoutError:
+                pass
+
+        asyncio.run(worker_dies())
+        db_session.rollback()  # Whatever was not committed is lost with the worker
+        done, pending = db_session.query(Invoice).order_by(Invoice.id).all()
+        assert done.status == InvoiceStatus.SUBMITTED and done.submission_id is not None
+        assert pending.status == InvoiceStatus.FAILED
+
+    def test_each_commit_carries_only_its_own_outcome(self, db_session, sample_tenant):
+        failed_invoices(db_session, sample_tenant, 3)
+        ids = [invoice.id for invoice in db_session.query(Invoice)]
+        flushed = []
+
+        @event.listens_for(db_session, "before_flush")
+        def record(session, flush_context, instances):
+            flushed.append({obj.id for obj in session.dirty if isinstance(obj, Invoice)})
+
+        asyncio.run(retry_invoices(db_session, ids, get_gateway_registry(), now=NOW))
+        assert flushed[0] == set(ids)  # The attempt counts, before any send
+        assert sorted(flushed[1:]) == [{invoice_id} for invoice_id in sorted(ids)]
+
+    def test_failed_retry_is_rescheduled_until_the_limit(self, db_session, sample_tenant, monkeypatch):
+        monkeypatch.setattr(settings, "gateway_breaker_failure_threshold", 100)
+        get_gateway_registry().for_country("DE").adapter.down = True
+        failed_invoices(db_session, sample_tenant, 1, retry_count=0)
+        failed_invoices(db_session, sample_tenant, 1, retry_count=settings.retry_max_attempts - 1)
+        ids = [invoice.id for invoice in db_session.query(Invoice).order_by(Invoice.id)]
+
+        asyncio.run(retry_invoices(db_session, ids, get_gateway_registry(), now=NOW))
+        fresh, last = db_session.query(Invoice).order_by(Invoice.id).all()
+        assert fresh.status == InvoiceStatus.FAILED and fresh.retry_count == 1
+        assert fresh.next_attempt_at is not None
+        assert last.retry_count == settings.retry_max_attempts and last.next_attempt_at is None
+
+    def test_open_circuit_defers_without_using_an_attempt(self, db_session, sample_tenant):
+        client = get_gateway_registry().for_country("DE")
+        for _ in range(client.breaker.failure_threshold):
+            client.breaker.record_failure()
+        failed_invoices(db_session, sample_tenant, 2)
+        ids = [invoice.id for invoice in db_session.query(Invoice)]
+
+        assert asyncio.run(retry_invoices(db_session, ids, get_gateway_registry(), now=NOW)) == 0
+        assert client.adapter.calls == 0
+        for invoice in db_session.query(Invoice):
+            assert invoice.retry_count == 0
+            assert invoice.next_attempt_at.replace(tzinfo=timezone.utc) > NOW
+
+    def test_retriable_nack_is_scheduled(self, db_session, sample_tenant):
+        failed_invoices(db_session, sample_tenant, 2)
+        db_session.query(Invoice).update({
+            Invoice.status: InvoiceStatus.SUBMITTED, Invoice.next_attempt_at: None,
+            Invoice.submission_id: "sub-" + Invoice.external_id
+        }, synchronize_session=False)
+        db_session.commit()
+
+        ingest_receipts(db_session, [
+            b'{"submission_id": "sub-ext-0", "outcome": "nack", "retriable": true}',
+            b'{"submission_id": "sub-ext-1", "outcome": "nack"}',
+        ], "peppol")
+        scheduled = {i.external_id: i.next_attempt_at for i in db_session.query(Invoice)}
+        assert scheduled["ext-0"] is not None and scheduled["ext-1"] is None
+
+    def test_manual_retry_counts_and_clears_schedule(self, client, auth_headers, db_session, sample_tenant):
+        failed_invoices(db_session, sample_tenant, 1)
+        invoice = db_session.query(Invoice).one()
+        client.post(f"/invoices/{invoice.id}/retry", headers=auth_headers)
+
+        db_session.refresh(invoice)
+        assert invoice.retry_count == 1 and invoice.next_attempt_at is None
@@ -0,0 +1,135 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import delete
+
+from app.archive import archive_invoices
+from app.auth import issue_api_key
+from app.models import CountryCode, Invoice, InvoiceSearch, InvoiceStatus, Tenant
+from app.search import _newest_matches, reindex, search_document, search_invoices
+from app.storage import get_blob_store
+
+
+def post_invoice(client, auth_headers, sample_invoice_data, number, supplier="Test Supplier Ltd"):
+    data = sample_invoice_data | {
+        "external_id": f"EXT-{number}",
+        "invoice_number": number,
+        "supplier": sample_invoice_data["supplier"] | {"name": supplier},
+    }
+    return client.post("/invoices", json=data, headers=auth_headers).json()["id"]
+
+
+def search(client, auth_headers, q, **params):
+    response = client.get("/invoices/search", params={"q": q, **params}, headers=auth_headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+class TestSearchDocument:
+    def test_lowercases_number_names_and_normalized_vat_ids(self):
+        document = search_document("INV-7", {"name": "Acme GmbH", "vat_id": "de 123 456 789"}, {"name": "Bob"})
+        assert document == "inv-7\nacme gmbh\nde123456789\nbob"
+
+
+class TestSearchEndpoint:
+    def test_matches_substrings_of_number_name_and_vat_id(self, client, auth_headers, sample_invoice_data):
+        acme = post_invoice(client, auth_headers, sample_invoice_data, "INV-2024-001", supplier="Acme Widgets AG")
+        other = post_invoice(client, auth_headers, sample_invoice_data, "INV-2024-002")
+
+        assert [i["id"] for i in search(client, auth_headers, "widget")["invoices"]] == [acme]
+        assert [i["id"] for i in search(client, auth_headers, "24-002")["invoices"]] == [other]
+        assert [i["id"] for i in search(client, auth_headers, "987654")["invoices"]] == [other, acme]
+        hit = search(client, auth_headers, "ACME")["invoices"][0]
+        assert (hit["invoice_number"], hit["status"]) == ("INV-2024-001", "validated")
+        assert search(client, auth_headers, "nothing like it") == {"invoices": [], "next_cursor": None}
+
+    def test_cursor_pages_newest_first(self, client, auth_headers, sample_invoice_data):
+        ids = [post_invoice(client, auth_headers, sample_invoice_data, f"INV-{n}") for n in range(5)]
+
+        first = search(client, auth_headers, "inv-", limit=2)
+        second = search(client, auth_headers, "inv-", limit=2, cursor=first["next_cursor"])
+        last = search(client, auth_headers, "inv-", limit=2, cursor=second["next_cursor"])
+        pages = [first, second, last]
+        assert [i["id"] for page in pages for i in page["invoices"]] == ids[::-1]
+        assert last["next_cursor"] is None
+
+    def test_other_tenants_invoices_are_not_found(self, client, db_session, auth_headers, sample_invoice_data):
+        post_invoice(client, auth_headers, sample_invoice_data, "INV-1")
+        other = Tenant(name="Other")
+        db_session.add(other)
+        db_session.flush()
+        other_headers = {"Authorization": f"Bearer {issue_api_key(db_session, other)}"}
+        db_session.commit()
+
+        assert search(client, other_headers, "inv-1")["invoices"] == []
+
+    def test_pages_fill_past_newer_matches_of_other_tenants(self, client, db_session, auth_headers,
+                                                            sample_invoice_data):
+        ours = [post_invoice(client, auth_headers, sample_invoice_data, f"INV-{n}") for n in range(2)]
+        other = Tenant(name="Other")
+        db_session.add(other)
+        db_session.flush()
+        other_headers = {"Authorization": f"Bearer {issue_api_key(db_session, other)}"}
+        db_session.commit()
+        for n in range(6):
+            post_invoice(client, other_headers, sample_invoice_data, f"INV-{n}")
+
+        page = search(client, auth_headers, "inv-", limit=1)
+        assert [i["id"] for i in page["invoices"]] == [ours[1]]
+        assert [i["id"] for i in search(client, auth_headers, "inv-", cursor=page["next_cursor"])["invoices"]] == [
+            ours[0]
+        ]
+
+    def test_text_index_matches_only_the_tenant(self, client, db_session, auth_headers, sample_invoice_data,
+                                                sample_tenant):
+        ours = post_invoice(client, auth_headers, sample_invoice_data, "INV-1")
+        other = Tenant(name="Other")
+        db_session.add(other)
+        db_session.flush()
+        other_headers = {"Authorization": f"Bearer {issue_api_key(db_session, other)}"}
+        db_session.commit()
+        theirs = post_invoice(client, other_headers, sample_invoice_data, "INV-1")
+
+        assert _newest_matches(db_session, sample_tenant.id, "inv-1", 2 ** 63 - 1, 10) == [ours]
+        assert _newest_matches(db_session, other.id, "inv-1", 2 ** 63 - 1, 10) == [theirs]
+
+    def test_short_terms_are_rejected(self, client, auth_headers):
+        assert client.get("/invoices/search", params={"q": "ab"}, headers=auth_headers).status_code == 422
+        assert client.get("/invoices/search", params={"q": " ab "}, headers=auth_headers).status_code == 422
+
+
+class TestIndexMaintenance:
+    def test_rewritten_when_searched_fields_change(self, client, db_session, auth_headers, sample_invoice_data):
+        invoice_id = post_invoice(client, auth_headers, sample_invoice_data, "INV-1")
+        invoice = db_session.get(Invoice, invoice_id)
+        invoice.invoice_number = "RENUMBERED-1"
+        db_session.commit()
+
+        tenant_id = invoice.tenant_id
+        assert [row.id for row in search_invoices(db_session, tenant_id, "renumbered")] == [invoice_id]
+        assert search_invoices(db_session, tenant_id, "inv-1") == []
+
+    def test_archived_invoices_leave_the_index(self, client, db_session, auth_headers, sample_invoice_data):
+        invoice_id = post_invoice(client, auth_headers, sample_invoice_data, "INV-1")
+        db_session.get(Invoice, invoice_id).status = InvoiceStatus.ACCEPTED
+        db_session.commit()
+
+        assert archive_invoices(db_session, get_blob_store(), datetime(2025, 1, 1, tzinfo=timezone.utc)) == 1
+        assert db_session.query(InvoiceSearch).count() == 0
+        assert search(client, auth_headers, "inv-1")["invoices"] == []
+
+    def test_reindex_adds_missing_rows(self, db_session, sample_tenant):
+        for n in range(3):
+            db_session.add(Invoice(
+                external_id=f"EXT-{n}", tenant_id=sample_tenant.id, invoice_number=f"OLD-{n}",
+                country_code=CountryCode.DE, issue_date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+                subtotal="100.00", tax_amount="19.00", total_amount="119.00",
+                supplier_data={"name": "Legacy Supplier"}, customer_data={"name": "Legacy Customer"},
+                line_items=[]
+            ))
+        db_session.commit()
+        db_session.execute(delete(InvoiceSearch))  # As if stored before the index existed
+        db_session.commit()
+
+        assert reindex(db_session, batch_size=2) == 3
+        assert reindex(db_session) == 0
+        assert len(search_invoices(db_session, sample_tenant.id, "legacy supp")) == 3
@@ -0,0 +1,70 @@
+from lxml import etree
+
+from app.compliance import generate_fatturapa_xml
+from app.models import CountryCode, DocumentSequence, Invoice
+from app.sequences import SequenceAllocator, reserve, to_base36
+
+
+class TestAllocator:
+    def test_blocks_are_disjoint_across_processes(self, db_session, sample_tenant):
+        # Two allocators stand in for two worker processes sharing the database
+        first = SequenceAllocator(block_size=10)
+        second = SequenceAllocator(block_size=10)
+        values = []
+        for _ in range(25):
+            values.append(first.next_value(db_session, sample_tenant.id, CountryCode.IT))
+            values.append(second.next_value(db_session, sample_tenant.id, CountryCode.IT))
+
+        assert len(set(values)) == 50
+        assert values[:4] == [1, 11, 2, 12]
+        assert first.reservations == 3 and second.reservations == 3
+        row = db_session.query(DocumentSequence).one()
+        assert row.next_value == 61
+
+    def test_sequences_are_per_tenant_and_country(self, db_session, sample_tenant):
+        allocator = SequenceAllocator(block_size=5)
+        assert allocator.next_value(db_session, sample_tenant.id, CountryCode.IT) == 1
+        assert allocator.next_value(db_session, sample_tenant.id, CountryCode.FR) == 1
+        assert allocator.next_value(db_session, sample_tenant.id, CountryCode.IT, "invoice") == 1
+        assert allocator.next_value(db_session, sample_tenant.id, CountryCode.IT) == 2
+
+    def test_gap_free_numbers_follow_the_callers_transaction(self, db_session, sample_tenant):
+        allocator = SequenceAllocator(block_size=100, gap_free_countries=["IT"])
+        assert allocator.next_value(db_session, sample_tenant.id, CountryCode.IT) == 1
+        db_session.commit()
+        assert allocator.next_value(db_session, sample_tenant.id, CountryCode.IT) == 2
+        db_session.rollback()  # The invoice that took 2 was never stored
+
+        assert allocator.next_value(db_session, sample_tenant.id, CountryCode.IT) == 2
+        db_session.commit()
+        assert allocator.reservations == 0
+
+    def test_reserve_returns_first_of_block(self, db_session, sample_tenant):
+        key = (sample_tenant.id, CountryCode.DE, "invoice")
+        assert reserve(db_session, key, 1000) == 1
+        assert reserve(db_session, key, 1) == 1001
+
+    def test_base36(self):
+        assert to_base36(0) == "0"
+        assert to_base36(36 ** 2 + 35) == "10Z"
+        assert to_base36(7, 5) == "00007"
+        assert to_base36(36 ** 5 + 1, 5) == "00001"
+
+
+class TestTransmissionNumbers:
+    def test_italian_invoices_get_increasing_progressives(self, client, auth_headers, sample_invoice_data,
+                                                          db_session):
+        sample_invoice_data.update(country_code="IT")
+        sample_invoice_data["customer"]["country"] = "IT"
+        ids = [client.post("/invoices", json=dict(sample_invoice_data, external_id=f"it-{n}"),
+                           headers=auth_headers).json()["id"] for n in range(3)]
+
+        invoices = [db_session.get(Invoice, invoice_id) for invoice_id in ids]
+        assert [invoice.transmission_number for invoice in invoices] == [1, 2, 3]
+
+        root = etree.fromstring(generate_fatturapa_xml(invoices[2]).encode())
+        assert root.findtext(".//ProgressivoInvio") == "3"
+
+    def test_other_countries_are_not_numbered(self, client, auth_headers, sample_invoice_data, db_session):
+        created = client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+        assert db_session.get(Invoice, created["id"]).transmission_number is None
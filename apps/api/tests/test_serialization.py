@@ -0,0 +1,102 @@
+import json
+from datetime import datetime, timezone
+
+from app.models import Invoice, InvoiceStatus, CountryCode
+from app.schemas import InvoiceResponse
+from app.serialization import (
+    FastJSONResponse, INVOICE_RESPONSE_FIELDS, invoice_response_query, serialize_invoice_rows
+)
+
+
+def make_invoice(tenant_id, number, **overrides):
+    fields = dict(
+        external_id=f"EXT-{number}",
+        tenant_id=tenant_id,
+        invoice_number=f"INV-{number}",
+        country_code=CountryCode.DE,
+        issue_date=datetime(2024, 1, 15, tzinfo=timezone.utc),
+        subtotal="100.00",
+        tax_amount="19.00",
+        total_amount="119.00",
+        supplier_data={},
+        customer_data={},
+        line_items=[],
+    )
+    fields.update(overrides)
+    return Invoice(**fields)
+
+
+class TestInvoiceSerialization:
+    def test_matches_pydantic_response_model(self, db_session, sample_tenant):
+        db_session.add_all([
+            make_invoice(sample_tenant.id, 1),
+            make_invoice(sample_tenant.id, 2, status=InvoiceStatus.FAILED, error_message="boom",
+                         due_date=datetime(2024, 2, 15, tzinfo=timezone.utc)),
+        ])
+        db_session.commit()
+
+        invoices = db_session.query(Invoice).order_by(Invoice.id).all()
+        expected = [InvoiceResponse.model_validate(inv).model_dump(mode="json") for inv in invoices]
+
+        rows = invoice_response_query(db_session).order_by(Invoice.id).all()
+        assert json.loads(serialize_invoice_rows(rows)) == expected
+
+    def test_preserves_field_order(self, db_session, sample_tenant):
+        db_session.add(make_invoice(sample_tenant.id, 1))
+        db_session.commit()
+
+        rows = invoice_response_query(db_session).all()
+        data = json.loads(serialize_invoice_rows(rows))
+        assert tuple(data[0]) == INVOICE_RESPONSE_FIELDS
+
+    def test_empty_page(self):
+        assert serialize_invoice_rows([]) == b"[]"
+
+    def test_response_passes_bytes_through(self):
+        response = FastJSONResponse(b'[{"id":1}]')
+        assert response.body == b'[{"id":1}]'
+        assert response.headers["content-type"] == "application/json"
+
+
+class TestListInvoicesContract:
+    def test_openapi_still_documents_invoice_list(self, client):
+        schema = client.get("/openapi.json").json()
+        response = schema["paths"]["/invoices"]["get"]["responses"]["200"]
+        items = response["content"]["application/json"]["schema"]["items"]
+        assert items["$ref"] == "#/components/schemas/InvoiceResponse"
+
+
+class TestCreateInvoiceParsing:
+    def test_line_items_are_stored_as_validated(self, client, auth_headers, sample_invoice_data, db_session):
+        sample_invoice_data["line_items"][0].update(quantity=3, unknown="dropped")
+        created = client.post("/invoices", json=sample_invoice_data, headers=auth_headers).json()
+
+        (item,) = db_session.get(Invoice, created["id"]).line_items
+        assert item["quantity"] == 3.0 and "unknown" not in item
+        assert set(item) == {"description", "quantity", "unit_price", "tax_rate", "tax_amount", "line_total"}
+
+    def test_errors_keep_the_fastapi_shape(self, client, auth_headers, sample_invoice_data):
+        del sample_invoice_data["line_items"][0]["unit_price"]
+        response = client.post("/invoices", json=sample_invoice_data, headers=auth_headers)
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["body", "line_items", 0, "unit_price"]
+
+        response = client.post("/invoices", content=b'{"external_id": ', headers=auth_headers)
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["type"] == "json_invalid"
+
+    def test_authentication_is_checked_before_the_body(self, client):
+        assert client.post("/invoices", content=b"not json").status_code == 403
+
+    def test_openapi_documents_the_request_body(self, client):
+        schema = client.get("/openapi.json").json()
+        body = schema["paths"]["/invoices"]["post"]["requestBody"]["content"]["application/json"]["schema"]
+        assert body["$ref"] == "#/components/schemas/InvoiceCreate"
+        line_items = schema["components"]["schemas"]["InvoiceCreate"]["properties"]["line_items"]
+        assert line_items["items"]["$ref"] == "#/components/schemas/LineItem"
+
+    def test_openapi_documents_the_validation_error(self, client):
+        schema = client.get("/openapi.json").json()
+        invalid = schema["paths"]["/invoices"]["post"]["responses"]["422"]
+        assert invalid["content"]["application/json"]["schema"]["$ref"] == "#/components/schemas/HTTPValidationError"
+        assert "HTTPValidationError" in schema["components"]["schemas"]
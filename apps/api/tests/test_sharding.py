@@ -0,0 +1,177 @@
+import threading
+
+import pytest
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import Base
+from app.models import Invoice, InvoiceStatus, Tenant, WebhookEvent
+from app.sharding import ShardMoveError, fan_out, get_shard_router, move_tenant, shard_map, shard_usage
+from tests.conftest import TestingSessionLocal
+from tests.test_receipts import submitted_invoices
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    """Two SQLite files standing in for extra tenant databases"""
+    monkeypatch.setattr(settings, "shard_urls", {name: f"sqlite:///{tmp_path / name}.db" for name in ("a", "b")})
+    get_shard_router.cache_clear()
+    router = get_shard_router()
+    for name in router.names:
+        Base.metadata.create_all(router.engine(name))
+    yield router
+    router.dispose()
+    get_shard_router.cache_clear()
+
+
+def place(db_session, tenant, shard, moving_to=None):
+    """Put a tenant on a shard directly, as a finished move would"""
+    with get_shard_router().session(shard) as db:
+        db.add(Tenant(id=tenant.id, name=tenant.name))
+        db.commit()
+    tenant.shard, tenant.moving_to = shard, moving_to
+    db_session.commit()
+    shard_map.clear()
+
+
+def invoice_ids(router, shard, tenant_id):
+    with router.session(shard) as db:
+        return db.scalars(select(Invoice.id).where(Invoice.tenant_id == tenant_id).order_by(Invoice.id)).all()
+
+
+def create_invoices(client, auth_headers, sample_invoice_data, count):
+    return [
+        client.post("/invoices", json=sample_invoice_data | {"external_id": f"EXT-{i}"}, headers=auth_headers).json()
+        for i in range(count)
+    ]
+
+
+class TestRouting:
+    def test_tenant_reads_and_writes_on_its_shard(self, client, db_session, sample_tenant, auth_headers,
+                                                  sample_invoice_data, shards):
+        place(db_session, sample_tenant, "a")
+        created = create_invoices(client, auth_headers, sample_invoice_data, 1)[0]
+
+        assert invoice_ids(shards, "a", sample_tenant.id) == [created["id"]]
+        assert db_session.query(Invoice).count() == 0
+        assert client.get(f"/invoices/{created['id']}", headers=auth_headers).status_code == 200
+        assert [event["invoice_id"] for event in client.get("/events", headers=auth_headers).json()["events"]] == [
+            created["id"]
+        ]
+
+    def test_moving_tenant_can_read_but_not_write(self, client, db_session, sample_tenant, auth_headers,
+                                                 sample_invoice_data, shards):
+        place(db_session, sample_tenant, "a", moving_to="b")
+
+        response = client.post("/invoices", json=sample_invoice_data, headers=auth_headers)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == str(settings.shard_map_refresh_seconds)
+        assert client.get("/invoices", headers=auth_headers).status_code == 200
+
+
+class TestMoveTenant:
+    def test_round_trip_keeps_ids_and_cleans_up(self, client, db_session, sample_tenant, auth_headers,
+                                                sample_invoice_data, shards):
+        created = [invoice["id"] for invoice in create_invoices(client, auth_headers, sample_invoice_data, 3)]
+        events_before = client.get("/events", headers=auth_headers).json()["events"]
+
+        stats = move_tenant(db_session, sample_tenant.id, "a", sleep=lambda seconds: None)
+        assert stats.copied >= 6 and stats.passes == 1
+        db_session.refresh(sample_tenant)
+        assert (sample_tenant.shard, sample_tenant.moving_to) == ("a", None)
+        assert invoice_ids(shards, "a", sample_tenant.id) == created
+        assert db_session.query(Invoice).count() == db_session.query(WebhookEvent).count() == 0
+        assert client.get("/events", headers=auth_headers).json()["events"] == events_before
+
+        move_tenant(db_session, sample_tenant.id, "default", sleep=lambda seconds: None)
+        db_session.refresh(sample_tenant)
+        assert sample_tenant.shard is None
+        assert [invoice.id for invoice in db_session.query(Invoice).order_by(Invoice.id)] == created
+        assert invoice_ids(shards, "a", sample_tenant.id) == []
+        with shards.session("a") as db:
+            assert db.get(Tenant, sample_tenant.id) is None
+
+    def test_writes_during_bulk_copy_are_caught_up(self, client, db_session, sample_tenant, auth_headers,
+                                                   sample_invoice_data, shards):
+        first, second = [invoice["id"] for invoice in create_invoices(client, auth_headers, sample_invoice_data, 2)]
+        waits = []
+
+        def late_writes(seconds):
+            # Requests that were already running when the tenant was frozen
+            if not waits:
+                db_session.get(Invoice, first).status = InvoiceStatus.ACCEPTED
+                db_session.delete(db_session.get(Invoice, second))
+                db_session.query(WebhookEvent).filter(WebhookEvent.invoice_id == second).delete()
+                db_session.commit()
+                submitted_invoices(db_session, sample_tenant, 1)
+            waits.append(seconds)
+
+        stats = move_tenant(db_session, sample_tenant.id, "b", sleep=late_writes)
+        assert waits == [settings.shard_map_refresh_seconds + settings.shard_move_drain_seconds,
+                         settings.shard_map_refresh_seconds]
+        assert stats.caught_up >= 3 and stats.passes == 2
+
+        with shards.session("b") as db:
+            moved = {invoice.id: invoice for invoice in db.query(Invoice)}
+            assert moved[first].status == InvoiceStatus.ACCEPTED
+            assert second not in moved
+            assert [invoice.submission_id for invoice in moved.values()] == [None, "sdi-0"]
+
+    def test_id_collision_leaves_tenant_in_place(self, client, db_session, sample_tenant, auth_headers,
+                                                 sample_invoice_data, shards):
+        created = create_invoices(client, auth_headers, sample_invoice_data, 1)[0]
+        other = Tenant(name="Other")
+        db_session.add(other)
+        db_session.commit()
+        place(db_session, other, "a")
+        with shards.session("a") as db:
+            submitted_invoices(db, other, 1)  # Takes id 1 on the shard
+
+        with pytest.raises(ShardMoveError):
+            move_tenant(db_session, sample_tenant.id, "a", sleep=lambda seconds: None)
+        db_session.refresh(sample_tenant)
+        assert (sample_tenant.shard, sample_tenant.moving_to) == (None, None)
+        assert invoice_ids(shards, "a", sample_tenant.id) == []
+        assert client.get(f"/invoices/{created['id']}", headers=auth_headers).status_code == 200
+
+    def test_refuses_pointless_moves(self, db_session, sample_tenant, shards):
+        with pytest.raises(ShardMoveError):
+            move_tenant(db_session, sample_tenant.id, "default")
+        with pytest.raises(ShardMoveError):
+            move_tenant(db_session, sample_tenant.id + 1, "a")
+
+
+class TestCrossShard:
+    def test_fan_out_queries_every_database_in_parallel(self, db_session, sample_tenant, shards):
+        submitted_invoices(db_session, sample_tenant, 2)
+        place(db_session, sample_tenant, "b")
+        with shards.session("b") as db:
+            submitted_invoices(db, sample_tenant, 3)
+        all_running = threading.Barrier(3, timeout=5)  # Breaks unless the three queries run at once
+
+        def usage(db):
+            all_running.wait()
+            return shard_usage(db)
+
+        assert fan_out(usage, TestingSessionLocal) == {"default": (1, 2), "a": (0, 0), "b": (1, 3)}
+
+    def test_receipts_find_invoices_on_shards(self, client, db_session, sample_tenant, shards):
+        place(db_session, sample_tenant, "a")
+        with shards.session("a") as db:
+            submitted_invoices(db, sample_tenant, 2)
+        headers = {"X-Gateway-Token": settings.gateway_callback_token}
+        body = b'{"submission_id": "sdi-0", "outcome": "ack"}\n{"submission_id": "sdi-1", "outcome": "ack"}'
+
+        response = client.post("/gateways/sdi/receipts", content=body, headers=headers)
+        assert response.json()["applied"] == 2
+
+        sample_tenant.moving_to = "b"
+        db_session.commit()
+        shard_map.clear()
+        with shards.session("a") as db:
+            db.query(Invoice).update({Invoice.status: InvoiceStatus.SUBMITTED})
+            db.commit()
+        response = client.post("/gateways/sdi/receipts", content=body, headers=headers)
+        assert response.status_code == 503
+        with shards.session("a") as db:
+            assert {invoice.status for invoice in db.query(Invoice)} == {InvoiceStatus.SUBMITTED}
@@ -0,0 +1,125 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect, text
+
+from app import database
+from app.auth import hash_api_key
+from app.config import settings
+from app.database import Base
+from app.main import app
+from app.search import include_name
+from app.sharding import get_shard_router
+from app.startup import ALEMBIC_INI, BASELINE_REVISION, run_migrations, startup_timings
+
+API_ROOT = Path(__file__).resolve().parent.parent
+
+# Wall-clock budget for `import app.main` in a fresh interpreter. Autoscaled
+# workers pay this before they can serve; raise it deliberately, not casually.
+IMPORT_TIME_BUDGET_SECONDS = 1.5
+
+# Clients that must only be imported when first used
+LAZY_MODULES = ("boto3", "httpx", "redis", "lxml", "xmlschema", "stripe", "celery",
+                "jose", "passlib", "alembic", "sqlalchemy.dialects.postgresql")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def cold_import(cwd):
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE], cwd=cwd, capture_output=True, text=True, check=True,
+        env={"PYTHONPATH": str(API_ROOT), "PATH": ""}
+    )
+    return json.loads(result.stdout)
+
+
+class TestColdStart:
+    def test_import_stays_within_budget(self, tmp_path):
+        # Best of three to keep scheduler noise out of the measurement
+        elapsed = min(cold_import(tmp_path)["elapsed"] for _ in range(3))
+        assert elapsed < IMPORT_TIME_BUDGET_SECONDS, f"import app.main took {elapsed:.2f}s"
+
+    def test_import_defers_heavy_modules_and_database_work(self, tmp_path):
+        probe = cold_import(tmp_path)
+        assert probe["loaded"] == []
+        assert not (tmp_path / "vatevo.db").exists()
+
+    def test_lifespan_preloads_deferred_modules(self, db_session):
+        startup_timings.clear()
+        with TestClient(app):
+            pass
+        assert {"jwt", "lxml", "pdf"} <= set(startup_timings)
+        assert "migrations" not in startup_timings
+
+
+def schema_diff(connection) -> list:
+    context = MigrationContext.configure(connection, opts={"include_name": include_name})
+    return compare_metadata(context, Base.metadata)
+
+
+class TestMigrations:
+    def test_head_matches_models(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'migrated.db'}")
+        with engine.begin() as connection:
+            run_migrations(connection)
+
+        with engine.connect() as connection:
+            assert "alembic_version" in inspect(connection).get_table_names()
+            diff = schema_diff(connection)
+        assert diff == [], "models changed without a migration: run alembic revision --autogenerate"
+
+    def test_database_created_before_migrations_is_upgraded(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+        with engine.begin() as connection:
+            # The baseline schema, as create_all left it: no alembic_version table
+            config = Config(str(ALEMBIC_INI))
+            config.attributes.update(configure_logger=False, connection=connection)
+            command.upgrade(config, BASELINE_REVISION)
+            connection.execute(text("DROP TABLE alembic_version"))
+            connection.execute(text("INSERT INTO tenants (id, name, api_key) VALUES (7, 'Acme', 'legacy_key')"))
+            connection.execute(text(
+                "INSERT INTO invoices (id, external_id, tenant_id, country_code, invoice_number, issue_date, "
+                "subtotal, tax_amount, total_amount, supplier_data, customer_data, line_items) "
+                "VALUES (1, 'e1', 7, 'DE', 'INV-1', '2024-01-15', '100.00', '19.00', '119.00', '{}', '{}', '[]')"
+            ))
+            connection.execute(text(
+                "INSERT INTO webhook_events (invoice_id, event_type, payload) VALUES (1, 'invoice.accepted', '{}')"
+            ))
+
+        with engine.begin() as connection:
+            run_migrations(connection)
+
+        with engine.connect() as connection:
+            assert schema_diff(connection) == []
+            assert connection.execute(text("SELECT tenant_id FROM webhook_events")).scalar() == 7
+            assert connection.execute(text("SELECT invoice_number FROM invoices")).scalar() == "INV-1"
+            # Plaintext keys from before hashing keep working
+            stored = text("SELECT tenant_id FROM api_keys WHERE key_hash = :key_hash")
+            assert connection.execute(stored, {"key_hash": hash_api_key("legacy_key")}).scalar() == 7
+
+    def test_every_shard_is_upgraded(self, tmp_path, monkeypatch):
+        main = create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+        monkeypatch.setattr(database, "engine", main)
+        monkeypatch.setattr(settings, "shard_urls", {"eu2": f"sqlite:///{tmp_path / 'eu2.db'}"})
+        get_shard_router.cache_clear()
+        try:
+            run_migrations()
+            for engine in (main, get_shard_router().engine("eu2")):
+                with engine.connect() as connection:
+                    assert schema_diff(connection) == []
+        finally:
+            get_shard_router().dispose()
+            main.dispose()
@@ -0,0 +1,156 @@
+import asyncio
+import pytest
+
+from app.main import app
+from app.vat_ids import (
+    LocalVatRegistry, MemoryVatCache, RegistryUnavailable, VatIdService,
+    get_vat_id_service, normalize_vat_id, vat_id_format_errors
+)
+
+
+def make_service(registry=None, **overrides):
+    options = dict(positive_ttl=3600, negative_ttl=60, max_concurrency=4)
+    options.update(overrides)
+    return VatIdService(registry or LocalVatRegistry(), MemoryVatCache(), **options)
+
+
+class TestVatIdFormat:
+    @pytest.mark.parametrize("vat_id", [
+        "DE136695976", "IT00743110157", "FR40303265045", "NL004495445B01",
+        "NL000099998B57", "BE0403019261", "ATU13585627", "ESB12345678",
+    ])
+    def test_valid_ids(self, vat_id):
+        assert vat_id_format_errors(vat_id) == []
+
+    @pytest.mark.parametrize("vat_id,error", [
+        ("DE136695977", "Invalid DE VAT ID checksum"),
+        ("IT00743110158", "Invalid IT VAT ID checksum"),
+        ("DE12345", "Invalid DE VAT ID format"),
+        ("XX123456789", "Unknown VAT ID country prefix 'XX'"),
+    ])
+    def test_invalid_ids(self, vat_id, error):
+        assert vat_id_format_errors(vat_id) == [error]
+
+    def test_normalize(self):
+        assert normalize_vat_id("de 136.695-976") == "DE136695976"
+
+
+class TestVatIdService:
+    def test_result_is_cached(self):
+        registry = LocalVatRegistry({"DE136695976": {"name": "ACME GmbH"}})
+        service = make_service(registry)
+
+        first = asyncio.run(service.verify("DE136695976"))
+        second = asyncio.run(service.verify("DE 136 695 976"))
+
+        assert first.valid is True and first.name == "ACME GmbH" and not first.cached
+        assert second.cached is True
+        assert registry.calls == 1
+        assert service.hit_rate == 0.5
+
+    def test_unregistered_id_negatively_cached(self):
+        registry = LocalVatRegistry({})
+        service = make_service(registry)
+
+        result = asyncio.run(service.verify("DE136695976"))
+        assert result.valid is False
+        assert result.errors == ["VAT ID is not registered"]
+        assert asyncio.run(service.verify("DE136695976")).cached is True
+        assert registry.calls == 1
+
+    def test_malformed_id_skips_registry(self):
+        registry = LocalVatRegistry()
+        result = asyncio.run(make_service(registry).verify("DE123"))
+        assert result.format_valid is False
+        assert registry.calls == 0
+
+    def test_concurrent_lookups_coalesce(self):
+        registry = LocalVatRegistry(latency=0.05)
+        service = make_service(registry)
+
+        async def burst():
+            return await asyncio.gather(*(service.verify("DE136695976") for _ in range(20)))
+
+        results = asyncio.run(burst())
+        assert all(result.valid for result in results)
+        assert registry.calls == 1
+
+    def test_service_outlives_an_event_loop(self):
+        registry = LocalVatRegistry(latency=0.01)
+        service = make_service(registry, max_concurrency=1)
+
+        async def burst(vat_ids):
+            return await asyncio.gather(*(service.verify(vat_id) for vat_id in vat_ids))
+
+        assert all(result.valid for result in asyncio.run(burst(["DE136695976", "IT00743110157"])))
+        assert all(result.valid for result in asyncio.run(burst(["FR40303265045", "BE0403019261"])))
+        assert registry.calls == 4
+
+    def test_registry_outage_is_not_cached(self):
+        class DownRegistry:
+            calls = 0
+
+            async def lookup(self, country, number):
+                self.calls += 1
+                raise RegistryUnavailable("MS_UNAVAILABLE")
+
+        registry = DownRegistry()
+        service = make_service(registry)
+        for _ in range(2):
+            result = asyncio.run(service.verify("DE136695976"))
+            assert result.valid is None
+        assert registry.calls == 2
+
+    def test_verify_many_deduplicates(self):
+        registry = LocalVatRegistry()
+        results = asyncio.run(make_service(registry).verify_many(
+            ["DE136695976", "de136695976", "IT00743110157"]
+        ))
+        assert [r.vat_id for r in results] == ["DE136695976", "DE136695976", "IT00743110157"]
+        assert registry.calls == 2
+
+
+class TestMemoryVatCache:
+    def test_least_recently_used_entry_is_evicted(self):
+        async def scenario():
+            cache = MemoryVatCache(maxsize=2)
+            await cache.set("DE1", {"valid": True}, ttl=60)
+            await cache.set("DE2", {"valid": True}, ttl=60)
+            await cache.get("DE1")
+            await cache.set("DE3", {"valid": True}, ttl=60)
+            return [await cache.get(key) is not None for key in ("DE1", "DE2", "DE3")]
+
+        assert asyncio.run(scenario()) == [True, False, True]
+
+
+class TestVatIdEndpoints:
+    @pytest.fixture(autouse=True)
+    def service(self):
+        service = make_service(LocalVatRegistry({"DE136695976": {"name": "ACME GmbH"}}))
+        app.dependency_overrides[get_vat_id_service] = lambda: service
+        yield service
+        app.dependency_overrides.pop(get_vat_id_service, None)
+
+    def test_verify_single(self, client, auth_headers):
+        response = client.get("/vat-ids/DE136695976", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["valid"] is True
+        assert response.json()["name"] == "ACME GmbH"
+
+    def test_verify_bulk(self, client, auth_headers):
+        response = client.post(
+            "/vat-ids/verify",
+            json={"vat_ids": ["DE136695976", "IT00743110157", "DE123"]},
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        assert [r["valid"] for r in response.json()["results"]] == [True, False, False]
+
+    def test_bulk_requires_ids(self, client, auth_headers):
+        response = client.post("/vat-ids/verify", json={"vat_ids": []}, headers=auth_headers)
+        assert response.status_code == 422
+
+    def test_validate_warns_on_bad_checksum(self, client, auth_headers, sample_invoice_data):
+        response = client.post("/validate", json=sample_invoice_data, headers=auth_headers)
+        assert response.json()["valid"] is True
+        assert "Supplier VAT ID: Invalid DE VAT ID checksum" in response.json()["warnings"]